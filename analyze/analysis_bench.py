@@ -0,0 +1,209 @@
+#! /usr/bin/env python3.3
+# Virtual memory analysis scripts.
+# Developed 2012-2014 by Peter Hornyack, pjh@cs.washington.edu
+# Copyright (c) 2012-2014 Peter Hornyack and University of Washington
+
+# End-to-end benchmark of the analysis on synthetic traces (see
+# synth_trace_class.py): for each trace size, writes a measurement dir
+# with one or more synthetic apps, then times analyze_trace.py on the
+# first app and generate_plots.py on the whole dir, each in its own
+# process, and prints the lines per second and the peak memory of each
+# run. The trace-processing rate comes from the process_trace record in
+# the stage report that analyze_trace.py writes (see
+# stage_report_class.py). Run it from the top-level dir, e.g.:
+#	python3 -m analyze.analysis_bench --sizes 10000,100000,1000000
+# Run it with python3 -O to run the analysis with -O too.
+
+from util.pjh_utils import *
+from analyze.stage_report_class import STAGE_REPORT_FNAME
+from trace.run_common import targetpidsfile
+from trace.synth_trace_class import write_synth_app
+from trace.traceinfo_class import tracefilename
+import argparse
+import json
+import shutil
+import subprocess
+import tempfile
+import time
+
+BENCH_RESULTS_FNAME = 'analysis-bench.json'
+BENCH_APP_PREFIX = 'synthapp'
+BENCH_LOG_FNAME = 'bench.log'
+
+##############################################################################
+
+# Runs cmd in a child process with its output appended to logfname.
+# Returns: a tuple (exit status, wall seconds, peak rss in KB) for the
+# child (and the processes that it waited for).
+def run_timed(cmd, logfname):
+	tag = 'run_timed'
+
+	print_debug(tag, ("running {}").format(' '.join(cmd)))
+	log = open(logfname, 'a')
+	log.write("$ {}\n".format(' '.join(cmd)))
+	log.flush()
+	begin = time.perf_counter()
+	child = subprocess.Popen(cmd, stdout=log, stderr=subprocess.STDOUT)
+	(pid, status, rusage) = os.wait4(child.pid, 0)
+	wall_s = time.perf_counter() - begin
+	child.returncode = status   # so that Popen doesn't wait for it again
+	log.close()
+
+	return (os.WEXITSTATUS(status) if os.WIFEXITED(status) else -1,
+		wall_s, rusage.ru_maxrss)
+
+# Returns: the json stage report in dirname, or None.
+def read_stage_report(dirname):
+	try:
+		f = open("{}/{}".format(dirname, STAGE_REPORT_FNAME), 'r')
+		report = json.load(f)
+		f.close()
+	except (OSError, ValueError):
+		return None
+	return report
+
+# Returns: the sum of the lines in the process_trace records of the
+# stage report, and the sum of their wall times.
+def process_trace_totals(report):
+	lines = 0
+	wall_s = 0.0
+	if report:
+		for record in report['stages']:
+			if record['stage'] == 'process_trace' and 'lines' in record:
+				lines += record['lines']
+				wall_s += record['wall_s']
+	return (lines, wall_s)
+
+# Writes the synthetic apps for one trace size into measdir.
+# Returns: the total number of lines in their traces.
+def generate_apps(measdir, size, args):
+	tag = 'generate_apps'
+
+	totallines = 0
+	for i in range(args.apps):
+		appdir = "{}/{}{}".format(measdir, BENCH_APP_PREFIX, i)
+		synth = write_synth_app(appdir, procs=args.procs, vmas=args.vmas,
+				events=size, cpus=args.cpus, threads=args.threads,
+				userstacks=args.userstacks, seed=args.seed + i)
+		totallines += synth.nlines
+	print(("wrote {} synthetic apps with {} events each ({} lines) "
+		"into {}").format(args.apps, size, totallines, measdir))
+
+	return totallines
+
+# Benchmarks one trace size.
+# Returns: a list of result dicts, one for each timed run.
+def bench_size(measdir, size, args):
+	tag = 'bench_size'
+
+	topdir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+	python = [sys.executable] + ([] if __debug__ else ['-O'])
+	logfname = "{}/{}".format(measdir, BENCH_LOG_FNAME)
+	results = []
+
+	appdir = "{}/{}0".format(measdir, BENCH_APP_PREFIX)
+	cmd = python + ["{}/analyze_trace.py".format(topdir),
+		"{}/{}".format(appdir, tracefilename), appdir,
+		'-a', os.path.basename(appdir),
+		'-p', "{}/{}".format(appdir, targetpidsfile)]
+	if args.userstacks:
+		cmd.append('-u')
+	(status, wall_s, peak_rss_kb) = run_timed(cmd, logfname)
+	(lines, trace_s) = process_trace_totals(read_stage_report(appdir))
+	results.append({'size': size, 'run': 'analyze_trace',
+		'status': status, 'lines': lines, 'wall_s': wall_s,
+		'process_trace_s': trace_s, 'peak_rss_kb': peak_rss_kb})
+
+	cmd = python + ["{}/generate_plots.py".format(topdir), '-p',
+		'--force', '-j', str(args.jobs), measdir]
+	(status, wall_s, peak_rss_kb) = run_timed(cmd, logfname)
+	(lines, trace_s) = process_trace_totals(read_stage_report(measdir))
+	results.append({'size': size, 'run': 'generate_plots',
+		'status': status, 'lines': lines, 'wall_s': wall_s,
+		'process_trace_s': trace_s, 'peak_rss_kb': peak_rss_kb})
+
+	for result in results:
+		if result['status'] != 0:
+			print_error(tag, ("{} exited with status {}, see "
+				"{}").format(result['run'], result['status'], logfname))
+
+	return results
+
+def print_results(results):
+	print(("{:>10} {:>15} {:>10} {:>9} {:>11} {:>13} {:>9}").format(
+		'events', 'run', 'lines', 'wall s', 'lines/s', 'trace lines/s',
+		'peak MB'))
+	for r in results:
+		print(("{:>10} {:>15} {:>10} {:>9.2f} {:>11.0f} {:>13} "
+			"{:>9.1f}{}").format(r['size'], r['run'], r['lines'],
+			r['wall_s'], r['lines'] / r['wall_s'],
+			"{:.0f}".format(r['lines'] / r['process_trace_s']) if
+				r['process_trace_s'] else '-',
+			r['peak_rss_kb'] / 1024,
+			'' if r['status'] == 0 else '  (failed)'))
+	return
+
+def handle_args():
+	parser = argparse.ArgumentParser(
+		description=("benchmark analyze_trace.py and generate_plots.py "
+			"on synthetic traces"))
+	parser.add_argument('--sizes', default='10000,100000',
+		help=("comma-separated numbers of trace events per app "
+			"(default: %(default)s)"))
+	parser.add_argument('--apps', type=int, default=1,
+		help="number of apps in each measurement dir")
+	parser.add_argument('--procs', type=int, default=4,
+		help="number of processes in each app")
+	parser.add_argument('--vmas', type=int, default=64,
+		help="number of vmas that each process keeps mapped")
+	parser.add_argument('--cpus', type=int, default=4)
+	parser.add_argument('--threads', type=int, default=2,
+		help="number of threads in each process")
+	parser.add_argument('--userstacks', action='store_true',
+		default=False, help=("write a user stack trace after every event "
+			"and analyze them with -u"))
+	parser.add_argument('--seed', type=int, default=0)
+	parser.add_argument('-j', '--jobs', type=int, default=1,
+		help="processes for generate_plots.py")
+	parser.add_argument('-o', '--outputdir', default=None,
+		help=("keep the measurement dirs and results here (default: a "
+			"temporary dir that is removed afterwards)"))
+	parser.add_argument('--generate-only', action='store_true',
+		default=False, dest='generate_only',
+		help="just write the synthetic measurement dirs")
+	args = parser.parse_args()
+	args.sizes = [int(size) for size in args.sizes.split(',')]
+	return args
+
+# Main:
+if __name__ == '__main__':
+	tag = 'main'
+
+	args = handle_args()
+	if args.outputdir:
+		outputdir = args.outputdir
+		if not os.path.exists(outputdir):
+			os.makedirs(outputdir)
+	else:
+		outputdir = tempfile.mkdtemp(prefix='analysis-bench-')
+
+	results = []
+	for size in args.sizes:
+		measdir = "{}/events-{}".format(outputdir, size)
+		if os.path.exists(measdir):
+			shutil.rmtree(measdir)
+		generate_apps(measdir, size, args)
+		if not args.generate_only:
+			results += bench_size(measdir, size, args)
+
+	if results:
+		print_results(results)
+		if args.outputdir:
+			f = open("{}/{}".format(outputdir, BENCH_RESULTS_FNAME), 'w')
+			json.dump(results, f, indent=1, sort_keys=True)
+			f.write("\n")
+			f.close()
+	if not args.outputdir:
+		shutil.rmtree(outputdir)
+
+	sys.exit(0)
@@ -0,0 +1,119 @@
+# Virtual memory analysis scripts.
+# Developed 2012-2014 by Peter Hornyack, pjh@cs.washington.edu
+# Copyright (c) 2012-2014 Peter Hornyack and University of Washington
+
+# Debug logging with a level for each tag and lazy formatting: instead
+# of
+#	print_debug(tag, ("vma [{}, {}]").format(hex(start), hex(end)))
+# which formats the message even when debug output is off, use
+#	log_debug(tag, "vma [{}, {}]", start, end)
+# which only checks the tag's level (one dict lookup) and formats the
+# message if it's actually going to be printed. Messages are still
+# printed with print_debug(), so debug output must be enabled in
+# pjh_utils too.
+#
+# In hot loops (e.g. once per trace line), even the call to log_debug()
+# costs something, so check the level once before the loop and guard
+# each call with __debug__:
+#	trace_lines = log_enabled(tag, LOG_TRACE)
+#	while ...:
+#		if __debug__ and trace_lines:
+#			log_trace(tag, "line #:\t{}", linenum)
+# When python is run with -O, __debug__ is False and the compiler
+# removes the whole if statement, so the call costs nothing at all;
+# otherwise the check is just a local variable test.
+#
+# The levels can be set with set_log_level(), or with the VM_LOG_LEVELS
+# environment variable: a comma-separated list of levels for tags, and
+# optionally a default level for all other tags, e.g.:
+#	VM_LOG_LEVELS=warning,process_trace_file=trace,ip_to_fn=debug
+
+import util.pjh_utils as pjh_utils
+from util.pjh_utils import *
+
+LOG_OFF = 0
+LOG_ERROR = 1
+LOG_WARNING = 2
+LOG_DEBUG = 3
+LOG_TRACE = 4
+  # For messages that are emitted for (almost) every trace line or event.
+LOG_LEVEL_NAMES = {
+		'off'     : LOG_OFF,
+		'error'   : LOG_ERROR,
+		'warning' : LOG_WARNING,
+		'debug'   : LOG_DEBUG,
+		'trace'   : LOG_TRACE,
+	}
+LOG_LEVELS_ENV = 'VM_LOG_LEVELS'
+
+# Globals:
+default_level = LOG_DEBUG
+tag_levels = dict()
+  # Levels for specific tags, which override default_level.
+
+##############################################################################
+
+# Sets the level for the tag, or the default level for all tags that
+# don't have their own level if tag is None. level is one of the LOG_*
+# constants or its name in LOG_LEVEL_NAMES.
+def set_log_level(level, tag=None):
+	global default_level
+
+	if type(level) is str:
+		level = LOG_LEVEL_NAMES[level.lower()]
+	if tag is None:
+		default_level = level
+	else:
+		tag_levels[tag] = level
+	return
+
+# Sets the levels from a string in the VM_LOG_LEVELS format (see the
+# comments at the top of this file).
+def parse_log_levels(levels):
+	tag = 'parse_log_levels'
+
+	for item in levels.split(','):
+		item = item.strip()
+		if not item:
+			continue
+		(tagname, sep, level) = item.rpartition('=')
+		try:
+			set_log_level(level, tagname if sep else None)
+		except KeyError:
+			print_warning(tag, ("ignoring unknown log level {} in "
+				"{}").format(level, levels))
+	return
+
+def log_enabled(tag, level=LOG_DEBUG):
+	return tag_levels.get(tag, default_level) >= level
+
+def log_debug(tag, msg, *args):
+	if tag_levels.get(tag, default_level) >= LOG_DEBUG:
+		if args:
+			msg = msg.format(*args)
+		print_debug(tag, msg)
+	return
+
+def log_trace(tag, msg, *args):
+	if tag_levels.get(tag, default_level) >= LOG_TRACE:
+		if args:
+			msg = msg.format(*args)
+		print_debug(tag, msg)
+	return
+
+def log_warning(tag, msg, *args):
+	if tag_levels.get(tag, default_level) >= LOG_WARNING:
+		if args:
+			msg = msg.format(*args)
+		print_warning(tag, msg)
+	return
+
+# pjh_utils may turn all debug output off itself; in that case, don't
+# bother formatting any debug messages unless a level is set for them
+# explicitly.
+if not getattr(pjh_utils, 'DEBUG', True):
+	default_level = LOG_WARNING
+parse_log_levels(os.environ.get(LOG_LEVELS_ENV, ''))
+
+if __name__ == '__main__':
+	print_error_exit("not an executable module")
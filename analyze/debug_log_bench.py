@@ -0,0 +1,74 @@
+#! /usr/bin/env python3.3
+# Virtual memory analysis scripts.
+# Developed 2012-2014 by Peter Hornyack, pjh@cs.washington.edu
+# Copyright (c) 2012-2014 Peter Hornyack and University of Washington
+
+# Measures the per-line overhead of the debug messages in a hot loop
+# like the one in process_trace_file(), with debug output turned off:
+# the old eager print_debug(tag, msg.format(...)), a lazy log_trace()
+# call, and log_trace() guarded by a flag that was checked before the
+# loop (see debug_log.py). Run it from the top-level dir:
+#	python3 -m analyze.debug_log_bench
+# and again with python3 -O to see the guarded call compiled out.
+
+from util.pjh_utils import *
+from analyze.debug_log import *
+import timeit
+
+BENCH_LINES = 1000000
+BENCH_REPEAT = 5
+BENCH_TAG = 'debug_log_bench'
+
+def loop_baseline(n):
+	linenum = 0
+	while linenum < n:
+		linenum += 1
+	return
+
+def loop_eager(n):
+	linenum = 0
+	while linenum < n:
+		linenum += 1
+		print_debug(BENCH_TAG, "line #:\t{0}".format(linenum))
+	return
+
+def loop_lazy(n):
+	linenum = 0
+	while linenum < n:
+		linenum += 1
+		log_trace(BENCH_TAG, "line #:\t{0}", linenum)
+	return
+
+def loop_guarded(n):
+	trace_lines = log_enabled(BENCH_TAG, LOG_TRACE)
+	linenum = 0
+	while linenum < n:
+		linenum += 1
+		if __debug__ and trace_lines:
+			log_trace(BENCH_TAG, "line #:\t{0}", linenum)
+	return
+
+# Returns: the best time of BENCH_REPEAT runs of loopfn over BENCH_LINES
+# lines, in seconds.
+def time_loop(loopfn):
+	return min(timeit.repeat(lambda: loopfn(BENCH_LINES),
+		number=1, repeat=BENCH_REPEAT))
+
+# Main:
+if __name__ == '__main__':
+	tag = 'main'
+
+	set_log_level(LOG_OFF)
+	print(("per-line overhead with debug logging off, over {} lines "
+		"(__debug__={}):").format(BENCH_LINES, __debug__))
+	baseline = time_loop(loop_baseline)
+	for (name, loopfn) in [
+			('print_debug(tag, msg.format())', loop_eager),
+			('log_trace(tag, msg, args)', loop_lazy),
+			('if __debug__ and flag: log_trace()', loop_guarded),
+		]:
+		elapsed = time_loop(loopfn)
+		print("  {:38} {:8.1f} ns/line".format(name,
+			(elapsed - baseline) * 1e9 / BENCH_LINES))
+
+	sys.exit(0)
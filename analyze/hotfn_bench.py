@@ -0,0 +1,434 @@
+#! /usr/bin/env python3.3
+# Virtual memory analysis scripts.
+# Developed 2012-2014 by Peter Hornyack, pjh@cs.washington.edu
+# Copyright (c) 2012-2014 Peter Hornyack and University of Washington
+
+# Microbenchmarks for the functions that the analysis spends most of its
+# time in, to see which of them got slower between two versions of the
+# scripts (analysis_bench.py only shows the end-to-end time). The
+# fixtures come from a synthetic trace (see synth_trace_class.py) that
+# is run through process_trace_file(), so that the process tracker, the
+# vmatables and the plots are in the same state as they are partway
+# through a real analysis; its processes are still running at the end of
+# the trace, so their vmas are still mapped.
+#
+# Each benchmark is timed with timeit and reported in nanoseconds per
+# operation (e.g. per trace line or per vma). The results can be written
+# to a JSON file with -o, and compared against the results of an earlier
+# run with -b; a benchmark that is more than its tolerance slower than
+# in the baseline is a regression, and makes this script exit with
+# status 1. Run it from the top-level dir, e.g.:
+#	python3 -m analyze.hotfn_bench -o before.json
+#	(change the code)
+#	python3 -m analyze.hotfn_bench -b before.json -t 0.1 -t txln=0.25
+
+from util.pjh_utils import *
+from analyze.simulate_segments_lib import *
+from analyze.stage_report_class import source_version
+from analyze.vm_mapping_class import *
+from plotting.multiapp_plot_class import plot_routing_table, series
+from plotting.PlotEvent import PlotEvent
+from plotting.plots_common import datapoint
+from trace.run_common import read_target_pids
+from trace.synth_trace_class import write_synth_app
+from trace.traceinfo_class import tracefilename
+from trace.vm_regex import *
+import trace.vm_common as vm
+import conf.PlotList as PlotList
+import argparse
+import importlib
+import json
+import platform
+import shutil
+import tempfile
+import time
+import timeit
+
+BENCH_VERSION = 1
+BENCH_REPEAT = 5
+BENCH_MIN_TIME = 0.2
+  # Each benchmark is run enough times in a row that the runs take at
+  # least this many seconds, and the best of BENCH_REPEAT of those is
+  # reported.
+DEFAULT_TOLERANCE = 0.15
+  # A benchmark regresses if it's more than this fraction slower than
+  # in the baseline.
+FIXTURE_APPNAME = 'hotfnbench'
+FIXTURE_KNOBS = {
+		'procs'  : 4,
+		'vmas'   : 256,
+		'events' : 20000,
+		'exits'  : False,
+		'seed'   : 0,
+	}
+FIXTURE_SERIES_POINTS = 100000
+FIXTURE_SCRATCH_PID = 99999
+TXLN_SIZES = [vm.PAGE_SIZE_4KB, vm.PAGE_SIZE_2MB, vm.PAGE_SIZE_1GB]
+
+'''
+The state that the benchmarks run against: a synthetic trace, and the
+process tracker and plots after the trace has been processed.
+'''
+class bench_fixtures:
+	tag = 'bench_fixtures'
+
+	tmpdir = None
+	analyze_trace = None
+	appname = None
+	target_pids = None
+	proc_tracker = None
+	plotlist = None
+	lines = None
+	root = None
+	vmas = None
+	  # The vmas in the root process' vmatable, sorted by start_addr.
+	active_vmas = None
+	  # The vmas in every process' vmatable (including the ones that
+	  # forked children copied from their parents).
+
+	def __init__(self, tmpdir):
+		tag = "{}.__init__".format(self.tag)
+
+		# analyze_trace.py is a top-level script, not part of a package.
+		self.analyze_trace = importlib.import_module('analyze_trace')
+		self.tmpdir = tmpdir
+		self.appname = FIXTURE_APPNAME
+		appdir = "{}/{}".format(tmpdir, self.appname)
+		write_synth_app(appdir, **FIXTURE_KNOBS)
+		self.target_pids = read_target_pids(appdir)
+		trace_fname = "{}/{}".format(appdir, tracefilename)
+
+		f = open(trace_fname, 'r')
+		self.lines = [line for line in f if line[0] != '#']
+		f.close()
+
+		analysisdir = "{}/{}".format(appdir, 'generate-analysis')
+		os.makedirs(analysisdir)
+		self.analyze_trace.setup_multiapp_plots(analysisdir, self.appname)
+		self.plotlist = PlotList.get_analysis_plotlist()
+		self.proc_tracker = processes_tracker()
+		trace_f = open(trace_fname, 'r')
+		self.analyze_trace.process_trace_file(trace_f, self.proc_tracker,
+			analysisdir, True, False, False, self.target_pids,
+			self.plotlist, self.appname, False)
+		trace_f.close()
+
+		self.root = self.proc_tracker.get_process_info(self.target_pids[0])
+		vmatable = self.root.get_vmatable()
+		self.vmas = [vmatable[addr] for addr in sorted(vmatable.keys())]
+		self.active_vmas = []
+		for proc_info in self.proc_tracker.get_all_process_infos():
+			self.active_vmas += list(proc_info.get_vmatable().values())
+		print_debug(tag, ("fixtures: {} trace lines, {} processes, {} "
+			"root vmas, {} active vmas").format(len(self.lines),
+			self.proc_tracker.num_tracked(), len(self.vmas),
+			len(self.active_vmas)))
+
+		return
+
+##############################################################################
+# The benchmarks: each one takes the fixtures and returns a tuple (fn,
+# nops), where fn is a no-argument function to time and nops is the
+# number of operations that each call of fn performs.
+
+def bench_trace_event_re(fx):
+	lines = fx.lines
+	def fn():
+		for line in lines:
+			trace_event_re.match(line)
+	return (fn, len(lines))
+
+def bench_find_vm_mapping_start(fx):
+	root = fx.root
+	addrs = [vma.start_addr for vma in fx.vmas]
+	def fn():
+		for addr in addrs:
+			find_vm_mapping(root, addr, True)
+	return (fn, len(addrs))
+
+def bench_find_vm_mapping_inside(fx):
+	root = fx.root
+	addrs = [vma.start_addr + vma.length // 2 for vma in fx.vmas
+			if vma.length >= 2 * vm.PAGE_SIZE_BYTES]
+	def fn():
+		for addr in addrs:
+			find_vm_mapping(root, addr, False)
+	return (fn, len(addrs))
+
+def bench_split_vm_mapping(fx):
+	root = fx.root
+	to_seg_size = fx.analyze_trace.vmasize_to_segsize
+	addrs = [vma.start_addr + vm.PAGE_SIZE_BYTES for vma in fx.vmas
+			if vma.length >= 3 * vm.PAGE_SIZE_BYTES]
+	def fn():
+		for addr in addrs:
+			split_vm_mapping(root, addr, vm.PAGE_SIZE_BYTES, True,
+				to_seg_size)
+	return (fn, len(addrs))
+
+# Maps copies of the root process' vmas into a scratch process, then
+# unmaps them again.
+def bench_map_unmap_vma(fx):
+	at = fx.analyze_trace
+	proc_tracker = fx.proc_tracker
+	scratch = at.new_proc_info(FIXTURE_SCRATCH_PID, proc_tracker)
+	scratch.set_progname(fx.root.get_progname())
+	scratch.set_is_rootproc(True)
+	msg = "pid={0} tgid={0} ptgid={1} [{2}]: {3:x} @ {4}"
+	pairs = []
+	for vma in fx.vmas:
+		pairs.append(tuple(vma_event_re.match(msg.format(
+			FIXTURE_SCRATCH_PID, fx.root.get_pid(), fn, id(vma),
+			vma.to_str_maps_format())) for fn in
+			['mmap_region', 'remove_vma_list -> remove_vma']))
+	def fn():
+		for (map_match, unmap_match) in pairs:
+			at.map_unmap_vma('map', map_match, scratch, 'alloc', 1.0,
+				'', '', proc_tracker)
+		for (map_match, unmap_match) in pairs:
+			at.map_unmap_vma('unmap', unmap_match, scratch, 'free', 2.0,
+				'', '', proc_tracker)
+	return (fn, 2 * len(pairs))
+
+def bench_is_relevant(fx):
+	at = fx.analyze_trace
+	proc_tracker = fx.proc_tracker
+	target_pids = fx.target_pids
+	tgids = [proc_info.get_pid() for proc_info in
+			proc_tracker.get_all_process_infos()] * 100
+	def fn():
+		for tgid in tgids:
+			at.is_relevant(proc_tracker, True, target_pids, tgid, 'mmap',
+				FIXTURE_APPNAME)
+	return (fn, len(tgids))
+
+# Passes a PlotEvent for each of the root process' allocated vmas to
+# the plots that consume it, like process_trace_file() does.
+def bench_handle_plot_event(fx):
+	at = fx.analyze_trace
+	routes = plot_routing_table(fx.plotlist)
+	root = fx.root
+	events = [PlotEvent(vma=vma) for vma in fx.vmas
+			if vma.vma_op == 'alloc']
+	def fn():
+		for plot_event in events:
+			eventplots = routes.plots_for(plot_event)
+			if eventplots:
+				at.handle_plot_event(plot_event, eventplots,
+					root.get_pid(), fx.target_pids, fx.proc_tracker, True,
+					fx.appname, root.tgid_for_stats, True)
+	return (fn, len(events))
+
+def bench_vm_mapping(fx):
+	args = [(vma.start_addr, vma.length, vma.perms_key, vma.seg_size,
+		'alloc', vma.offset, vma.dev_major, vma.dev_minor, vma.inode,
+		vma.filename, vma.timestamp) for vma in fx.vmas]
+	def fn():
+		for a in args:
+			vm_mapping(*a)
+	return (fn, len(args))
+
+def new_bench_series(fx):
+	s = series('bench-series', fx.appname)
+	for i in range(FIXTURE_SERIES_POINTS):
+		point = datapoint()
+		point.timestamp = 1000.0 + i * 0.001
+		point.count = i % 4096
+		s.append_datapoint(point)
+	return s
+
+def bench_series_serialize(fx):
+	s = new_bench_series(fx)
+	fname = "{}/series-serialize".format(fx.tmpdir)
+	def fn():
+		s.serialize(fname)
+	return (fn, FIXTURE_SERIES_POINTS)
+
+def bench_series_deserialize(fx):
+	fname = "{}/series-deserialize".format(fx.tmpdir)
+	new_bench_series(fx).serialize(fname)
+	def fn():
+		s = series('bench-series', fx.appname)
+		s.deserialize(fname)
+		s.data   # builds the datapoints
+	return (fn, FIXTURE_SERIES_POINTS)
+
+def bench_txln_entries_needed(fx):
+	vmas = fx.active_vmas
+	def fn():
+		for vma in vmas:
+			vm.txln_entries_needed(TXLN_SIZES, vma)
+	return (fn, len(vmas))
+
+def bench_deduplicate_active_vmas(fx):
+	vmas = fx.active_vmas
+	def fn():
+		deduplicate_active_vmas(vmas)
+	return (fn, len(vmas))
+
+BENCHMARKS = [
+		('trace_event_re',          bench_trace_event_re),
+		('find_vm_mapping_start',   bench_find_vm_mapping_start),
+		('find_vm_mapping_inside',  bench_find_vm_mapping_inside),
+		('split_vm_mapping',        bench_split_vm_mapping),
+		('map_unmap_vma',           bench_map_unmap_vma),
+		('is_relevant',             bench_is_relevant),
+		('handle_plot_event',       bench_handle_plot_event),
+		('vm_mapping',              bench_vm_mapping),
+		('series_serialize',        bench_series_serialize),
+		('series_deserialize',      bench_series_deserialize),
+		('txln_entries_needed',     bench_txln_entries_needed),
+		('deduplicate_active_vmas', bench_deduplicate_active_vmas),
+	]
+
+##############################################################################
+
+# Returns: a dict with the best time per operation of fn, in ns, and
+# how it was measured.
+def time_per_op(fn, nops, repeat):
+	number = 1
+	while timeit.timeit(fn, number=number) < BENCH_MIN_TIME:
+		number *= 2
+	best = min(timeit.repeat(fn, number=number, repeat=repeat))
+	return {'ns_per_op': best * 1e9 / (number * nops), 'ops': nops,
+		'loops': number}
+
+# Runs the benchmarks whose names are in names (or all of them, if
+# names is empty).
+# Returns: a results dict that can be written out as json.
+def run_benchmarks(names, repeat):
+	tag = 'run_benchmarks'
+
+	results = dict()
+	results['bench_version'] = BENCH_VERSION
+	results['created'] = time.strftime('%Y-%m-%dT%H:%M:%S%z')
+	results['source_version'] = source_version()
+	results['python'] = platform.python_version()
+	results['optimized'] = not __debug__
+	results['host'] = platform.node()
+	results['fixture'] = FIXTURE_KNOBS
+	results['benchmarks'] = dict()
+
+	tmpdir = tempfile.mkdtemp(prefix='hotfn-bench-')
+	try:
+		fx = bench_fixtures(tmpdir)
+		for (name, benchfn) in BENCHMARKS:
+			if names and name not in names:
+				continue
+			(fn, nops) = benchfn(fx)
+			result = time_per_op(fn, nops, repeat)
+			results['benchmarks'][name] = result
+			print("  {:26} {:12.1f} ns/op  ({} ops x {} loops)".format(
+				name, result['ns_per_op'], nops, result['loops']))
+	finally:
+		shutil.rmtree(tmpdir)
+
+	return results
+
+# Parses the -t args: each is either a default tolerance, or
+# name=tolerance for one benchmark.
+# Returns: a tuple (default tolerance, dict of per-benchmark tolerances).
+def parse_tolerances(args):
+	tag = 'parse_tolerances'
+
+	default = DEFAULT_TOLERANCE
+	tolerances = dict()
+	for arg in args:
+		(name, sep, value) = arg.rpartition('=')
+		try:
+			value = float(value)
+		except ValueError:
+			print_error_exit(tag, ("invalid tolerance {}").format(arg))
+		if sep:
+			tolerances[name] = value
+		else:
+			default = value
+	return (default, tolerances)
+
+# Compares the results against the baseline results.
+# Returns: the names of the benchmarks that regressed.
+def compare_results(results, baseline, default_tolerance, tolerances):
+	tag = 'compare_results'
+
+	if baseline.get('bench_version') != results['bench_version']:
+		print_warning(tag, ("baseline is from bench version {}, this "
+			"is version {}; the fixtures may differ").format(
+			baseline.get('bench_version'), results['bench_version']))
+	print(("compared to baseline from {} (source version {}):").format(
+		baseline.get('created'), baseline.get('source_version')))
+	print("  {:26} {:>12} {:>12} {:>8}".format('benchmark',
+		'baseline ns', 'now ns', 'change'))
+	regressed = []
+	for name in sorted(results['benchmarks'].keys()):
+		try:
+			before = baseline['benchmarks'][name]['ns_per_op']
+		except KeyError:
+			print("  {:26} {:>12} {:12.1f}".format(name, '-',
+				results['benchmarks'][name]['ns_per_op']))
+			continue
+		now = results['benchmarks'][name]['ns_per_op']
+		change = (now - before) / before
+		tolerance = tolerances.get(name, default_tolerance)
+		if change > tolerance:
+			status = "REGRESSED (tolerance {:+.0%})".format(tolerance)
+			regressed.append(name)
+		elif change < -tolerance:
+			status = 'improved'
+		else:
+			status = 'ok'
+		print("  {:26} {:12.1f} {:12.1f} {:+8.1%}  {}".format(name,
+			before, now, change, status))
+
+	return regressed
+
+def handle_args():
+	parser = argparse.ArgumentParser(
+		description="microbenchmarks for the analysis' hot functions")
+	parser.add_argument('-o', '--output', metavar='JSON', default=None,
+		help="write the results to this file")
+	parser.add_argument('-b', '--baseline', metavar='JSON', default=None,
+		help=("compare the results to the results of an earlier run, "
+			"and exit with status 1 if any benchmark regressed"))
+	parser.add_argument('-t', '--tolerance', metavar='[NAME=]FRACTION',
+		action='append', default=[],
+		help=("how much slower than the baseline a benchmark may get "
+			"before it counts as a regression, for all benchmarks or "
+			"just for NAME (default: {})").format(DEFAULT_TOLERANCE))
+	parser.add_argument('-r', '--repeat', type=int, default=BENCH_REPEAT)
+	parser.add_argument('names', nargs='*', metavar='NAME',
+		help=("benchmarks to run (default: all of them: {})").format(
+			', '.join(name for (name, benchfn) in BENCHMARKS)))
+	return parser.parse_args()
+
+# Main:
+if __name__ == '__main__':
+	tag = 'main'
+
+	args = handle_args()
+	known = [name for (name, benchfn) in BENCHMARKS]
+	for name in args.names:
+		if name not in known:
+			print_error_exit(tag, ("unknown benchmark {}").format(name))
+	(default_tolerance, tolerances) = parse_tolerances(args.tolerance)
+	if args.baseline:
+		f = open(args.baseline, 'r')
+		baseline = json.load(f)
+		f.close()
+
+	print(("hot function microbenchmarks (__debug__={}):").format(
+		__debug__))
+	results = run_benchmarks(args.names, args.repeat)
+	if args.output:
+		f = open(args.output, 'w')
+		json.dump(results, f, indent=1, sort_keys=True)
+		f.write("\n")
+		f.close()
+
+	if args.baseline:
+		regressed = compare_results(results, baseline, default_tolerance,
+				tolerances)
+		if regressed:
+			print("regressed: {}".format(', '.join(regressed)))
+			sys.exit(1)
+
+	sys.exit(0)
@@ -12,6 +12,7 @@
 # enormous binaries like firefox's libxul.so.
 
 from util.pjh_utils import *
+from analyze.debug_log import log_debug
 from analyze.vm_mapping_class import UNKNOWN_FN
 import fcntl
 import os
@@ -63,7 +64,7 @@ def is_objfile_relocatable(name):
 		"-e elf -e tar -bn {}").format(file_prog, name)
 	  # don't use -p flag, so that output will *always* have two lines
 	fileargs = shlex.split(filecmd)
-	print_debug(tag, ("fileargs: {}").format(fileargs))
+	log_debug(tag, ("fileargs: {}"), fileargs)
 
 	p = subprocess.Popen(fileargs, stdout=subprocess.PIPE,
 			stderr=subprocess.STDOUT)
@@ -98,8 +99,8 @@ def is_objfile_relocatable(name):
 		err = err.decode('utf-8').strip()
 	else:
 		err = ''
-	print_debug(tag, ("call to file subprocess succeeded, got stdout "
-		"{} and stderr {}").format(out, err))
+	log_debug(tag, ("call to file subprocess succeeded, got stdout "
+		"{} and stderr {}"), out, err)
 
 	# It's probably not necessary to define the expected output strings
 	# so strictly here, but this will cause an error if we ever e.g.
@@ -110,10 +111,10 @@ def is_objfile_relocatable(name):
 	reloc_str = 'ELF 64-bit LSB shared object, x86-64, version 1'
 	nonreloc_str = 'ELF 64-bit LSB executable, x86-64, version 1'
 	if reloc_str in out:
-		print_debug(tag, ("relocatable: {}").format(reloc_str))
+		log_debug(tag, ("relocatable: {}"), reloc_str)
 		return True
 	elif nonreloc_str in out:
-		print_debug(tag, ("nonrelocatable: {}").format(nonreloc_str))
+		log_debug(tag, ("nonrelocatable: {}"), nonreloc_str)
 		return False
 
 	print_error(tag, ("unexpected output \"{}\", doesn't match "
@@ -156,13 +157,13 @@ class addr2line_module:
 				"this constructor so aborting...").format())
 			return None
 		elif self.relocatable is True:
-			print_debug(tag, ("determined that object file {} is "
+			log_debug(tag, ("determined that object file {} is "
 				"relocatable, will subtract vma_start_addr from ips "
-				"passed to this addr2line_module").format(objname))
+				"passed to this addr2line_module"), objname)
 		else:
-			print_debug(tag, ("determined that object file {} is "
+			log_debug(tag, ("determined that object file {} is "
 				"not relocatable, will use absolute ips that are passed "
-				"to this addr2line_module").format(objname))
+				"to this addr2line_module"), objname)
 
 		ret = self.start_addr2line()
 		if ret != 0:
@@ -195,7 +196,7 @@ class addr2line_module:
 				"for ip {} -> {}").format(hex(ip), fn))
 		except KeyError:
 			self.cache[ip] = fn
-			print_debug(tag, ("cache insert {} -> {}").format(hex(ip), fn))
+			log_debug(tag, ("cache insert {:#x} -> {}"), ip, fn)
 		return
 
 	# Passes the specified ip to addr2line and returns the function that
@@ -210,8 +211,8 @@ class addr2line_module:
 		global cache_addr2line_lookups
 
 		if not self.a2l:
-			print_debug(tag, ("self.a2l is None, addr2line subprocess "
-				"is already terminated (or was never started)").format())
+			log_debug(tag, ("self.a2l is None, addr2line subprocess "
+				"is already terminated (or was never started)"))
 			return None
 		if type(ip) != int:
 			print_error(tag, ("ip argument {} is not an int").format(ip))
@@ -253,10 +254,10 @@ class addr2line_module:
 			cache_lookup_ip = ip   # for sanity checking
 			fn = self.cache_lookup(ip)
 			if fn:
-				print_debug(tag, ("cache hit: ip {} -> fn '{}'").format(
-					hex(ip), fn))
+				log_debug(tag, ("cache hit: ip {:#x} -> fn '{}'"),
+					ip, fn)
 			else:
-				print_debug(tag, ("cache miss: ip {}").format(hex(ip)))
+				log_debug(tag, ("cache miss: ip {:#x}"), ip)
 
 		# Communicate with addr2line process if cache lookups are disabled
 		# or the cache lookup just missed.
@@ -275,7 +276,8 @@ class addr2line_module:
 			# string back to a standard str as well.
 			#print_debug(tag, ("addr2line: lookup ip {} in object file "
 			#	"{}").format(hex(ip), self.objname))
-			ip_input = """{}""".format(hex(ip))
+			ip_input = """{}
+""".format(hex(ip))
 			  # send Enter keypress: to enter in vim insert mode, hit
 			  # Ctrl-v first
 			self.a2l.stdin.write(bytearray(ip_input, 'utf-8'))
@@ -306,10 +308,10 @@ class addr2line_module:
 			#     of output when started with the "-Cif" flags, even if
 			#     gibberish input is provided.
 			#       $ addr2line -e test-programs/hello-world -Cif
-			#       1234
+			#       1234
 			#       ??
 			#       ??:0
-			#       0x4006d9
+			#       0x4006d9
 			#       _start
 			#       ??:0
 			fd = self.a2l.stdout.fileno()
@@ -363,9 +365,9 @@ class addr2line_module:
 							"from this fn").format(self.a2l.returncode))
 						return None
 					else:
-						print_debug(tag, ("addr2line subprocess is still "
+						log_debug(tag, ("addr2line subprocess is still "
 							"alive, will keep looping; output buffer so far "
-							"is {}").format(output))
+							"is {}"), output)
 						pass
 			lines = output.splitlines()
 
@@ -417,7 +419,7 @@ class addr2line_module:
 		a2lcmd = ("{} -e {} -Cif").format(addr2line_prog, self.objname)
 		  # don't use -p flag, so that output will *always* have two lines
 		a2largs = shlex.split(a2lcmd)
-		print_debug(tag, ("a2largs: {}").format(a2largs))
+		log_debug(tag, ("a2largs: {}"), a2largs)
 
 		self.a2l = subprocess.Popen(a2largs, stdin=subprocess.PIPE,
 				stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
@@ -432,8 +434,8 @@ class addr2line_module:
 			retcode = self.a2l.wait()
 			self.a2l = None
 			return -1
-		print_debug(tag, ("started addr2line subprocess with pid "
-			"{}").format(self.a2l.pid))
+		log_debug(tag, ("started addr2line subprocess with pid "
+			"{}"), self.a2l.pid)
 
 		return 0
 
@@ -442,13 +444,13 @@ class addr2line_module:
 		tag = "{}.stop_addr2line".format(self.tag)
 
 		if not self.a2l:
-			print_debug(tag, ("self.a2l is None, addr2line subprocess "
-				"is already terminated (or was never started)").format())
+			log_debug(tag, ("self.a2l is None, addr2line subprocess "
+				"is already terminated (or was never started)"))
 			return
 
 		# http://docs.python.org/3/library/subprocess.html#subprocess.Popen.communicate
-		print_debug(tag, ("sending Ctrl-d to addr2line subprocess {} to "
-			"terminate it").format(self.a2l.pid))
+		log_debug(tag, ("sending Ctrl-d to addr2line subprocess {} to "
+			"terminate it"), self.a2l.pid)
 		stop_input = ''
 		  # Ctrl-d: hit Ctrl-v first in vim insert mode to 'type' this
 		  # special key
@@ -464,8 +466,8 @@ class addr2line_module:
 			print_warning(tag, ("terminated addr2line subprocess returned "
 				"error code {}").format(self.a2l.returncode))
 		else:
-			print_debug(tag, ("addr2line subprocess terminated "
-				"successfully").format())
+			log_debug(tag, ("addr2line subprocess terminated "
+				"successfully"))
 
 		self.a2l = None
 		return
@@ -516,11 +518,11 @@ class ip_to_fn_converter:
 		# We keep one addr2line_module object per file:
 		try:
 			a2l = self.a2lmap[objname]
-			print_debug(tag, ("got an existing addr2line instance for "
-				"objname {}").format(objname))
+			log_debug(tag, ("got an existing addr2line instance for "
+				"objname {}"), objname)
 		except KeyError:
-			print_debug(tag, ("creating a new addr2line instance for "
-				"objname {}").format(objname))
+			log_debug(tag, ("creating a new addr2line instance for "
+				"objname {}"), objname)
 			a2l = addr2line_module(objname)
 			if not a2l:
 				print_error(tag, ("addr2line_module constructor "
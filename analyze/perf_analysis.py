@@ -16,16 +16,33 @@ from util.pjh_utils import *
 from analyze.simulate_segments_lib import *
 from trace.run_common import *
 from trace.traceinfo_class import *
+from analyze.perfdata_reader_class import perfdata_reader
+from analyze.stage_report_class import timed_stage
 import plotting.multiapp_plot_class as multiapp_plot
-import plotting.plot_perf_missrate as plot_perf_missrate
+import plotting.plot_perf_vm as plot_perf_vm
+from plotting.plotdata_store_class import plotdata_store_files
 import conf.PlotList as PlotList
 
+import array
+import numpy as np
 import os
 import re
 import shlex
 import subprocess
 
 PTW_TITLE = 'TLB miss cycles'
+
+PERF_SAMPLE_SOURCE = 'native'
+  # Where the perf analysis gets its samples from:
+  #   'native': read the perf.data file directly with perfdata_reader
+  #     (perf_read_perfdata()); doesn't need a perf binary at all.
+  #   'script': pipe the samples from "perf script" directly into the
+  #     analysis (perf_stream_samples()).
+  #   'dump': the old path that writes the full perf.dump file (~25x
+  #     larger than perf.data) and then re-reads it (perf_gen_reports()
+  #     + perf_analyze_rawdump()).
+PERF_KEEP_SCRIPT = False
+  # When streaming, also save the perf script output in PERF_SCRIPTFILE.
 PAIR_EVENT_TO_STR = {
 	'r108' : 'dTLB-load-misses',
 	'r149' : 'dTLB-misses',
@@ -39,7 +56,7 @@ PAIR_EVENT_TO_STR = {
 # for raw dump files (in tools/perf/util/session.c:dump_sample()).
 # Ugh, spaces in VERBOSE regexes are obnoxious.
 perf_event_header_re = re.compile(r"""
-	[#]\ event\ :\ name\ =\ (?P<eventname>[a-zA-Z0-9\-_]+),
+	[#]\ event\ :\ name\ =\ (?P<eventname>[a-zA-Z0-9\-_:/=,]+?),
 	\ type\ =\ (?P<type>[\d]+),
 	\ .+
 	id\ =\ {\ (?P<eids>[\d, ]+)\ }
@@ -48,6 +65,8 @@ perf_event_header_re = re.compile(r"""
   #   # event : name = dTLB-loads, type = 3, config = 0x3, config1 = 0x0,
   #   config2 = 0x0, excl_usr = 0, excl_kern = 0, excl_host = 0,
   #   excl_guest = 1, precise_ip = 0, id = { 19453, 19454 }
+  # PMU-style event names like cpu/event=0x08,umask=0x10/ contain
+  # commas, so the name is everything up to the first ", type = ".
 
 perf_sample_re = re.compile(r"""
 	@\ id=(?P<eid>[\d]+),
@@ -61,6 +80,26 @@ perf_sample_re = re.compile(r"""
   # Example:
   #   @ id=19458,period=7610977,pid=20671,cpu=1,time=1271035105125778
 
+# Matches the lines printed by "perf script -F <PERF_SCRIPT_FIELDS>"
+# (see traceinfo_class.py). perf script prints the fields in a fixed
+# order: comm, pid, cpu, time, period, event name. The time field
+# is seconds.fraction - it is converted to nanoseconds by
+# script_time_to_ns() so that it matches the time=... values in the
+# raw dump.
+perf_script_sample_re = re.compile(r"""
+	\s*(?P<task>.+?)
+	\s+(?P<pid>[\d]+)
+	\s+\[(?P<cpu>[\d]+)\]
+	\s+(?P<time>[\d]+\.[\d]+):
+	\s+(?P<period>[\d]+)
+	\s+(?P<eventname>[a-zA-Z0-9\-_:/=,]+?):
+	\s*$
+	""", re.VERBOSE)
+  # Examples:
+  #   hello-world  20671 [001] 1271035.105125778:    7610977 cycles:
+  #   hello-world  20671 [001] 1271035.105125778:       2039
+  #     cpu/event=0x08,umask=0x10/:
+
 ##############################################################################
 
 # How data is organized for this analysis:
@@ -94,21 +133,40 @@ class perf_sample:
 	# will be used for creating plot series and possibly for other
 	# output; it should likely come from the very top levels of the
 	# perf_analysis script.
-	def __init__(self, sample_match, appname):
+	# sample_match may also be a match object from perf_script_sample_re,
+	# in which case the caller must pass the eid that the sample's
+	# event name maps to (perf script doesn't print the event ids).
+	# If fields is set instead of sample_match, it must be a tuple
+	# (eid, period, pid, cpu, time, task), e.g. from perfdata_reader.
+	def __init__(self, sample_match, appname, eid=None, fields=None):
 		tag = "{}.__init__"
 
+		if fields:
+			(self.eid, self.period, self.pid, self.cpu, self.time,
+				self.task) = fields
+			self.dso = None
+			self.name = None
+			self.is_miss_event = None
+			self.elapsed = None
+			self.appname = appname
+			return
 		if not sample_match:
 			print_error(tag, ("invalid arg: sample_match={}").format(
 				sample_match))
 			return
 
-		self.eid    = int(sample_match.group('eid'))
+		if eid is None:
+			self.eid  = int(sample_match.group('eid'))
+			self.time = int(sample_match.group('time'))
+			self.dso  = sample_match.group('dso')
+		else:
+			self.eid  = eid
+			self.time = script_time_to_ns(sample_match.group('time'))
+			self.dso  = None
 		self.period = int(sample_match.group('period'))
 		self.pid    = int(sample_match.group('pid'))
 		self.cpu    = int(sample_match.group('cpu'))
-		self.time   = int(sample_match.group('time'))
 		self.task   = sample_match.group('task')
-		self.dso    = sample_match.group('dso')
 		self.name   = None
 		self.is_miss_event = None
 		self.elapsed = None
@@ -124,6 +182,58 @@ class perf_sample:
 		return s
 
 
+'''
+Array-backed table of perf samples: one typed array per sample field,
+rather than one perf_sample object per sample. Samples are appended in
+the order that they are read from the perf data, and then processed
+all at once by perf_events_tracker.handle_sample_table(). The task
+name is only kept once per pid, and the appname once for the whole
+table.
+'''
+class perf_sample_table:
+	tag = 'perf_sample_table'
+
+	eid = None
+	period = None
+	pid = None
+	cpu = None
+	time = None
+	tasks = None
+
+	def __init__(self):
+		tag = "{}.__init__".format(self.tag)
+
+		self.eid = array.array('q')
+		self.period = array.array('q')
+		self.pid = array.array('i')
+		self.cpu = array.array('i')
+		self.time = array.array('q')
+		self.tasks = dict()
+
+		return
+
+	def __len__(self):
+		return len(self.eid)
+
+	def append(self, eid, period, pid, cpu, time, task=None):
+		self.eid.append(eid)
+		self.period.append(period)
+		self.pid.append(pid)
+		self.cpu.append(cpu)
+		self.time.append(time)
+		if task:
+			self.tasks[pid] = task
+		return
+
+	# Returns: a tuple of NumPy arrays (eid, period, pid, cpu, time)
+	# that share memory with the table's arrays.
+	def to_arrays(self):
+		return (np.frombuffer(self.eid, dtype=np.int64),
+			np.frombuffer(self.period, dtype=np.int64),
+			np.frombuffer(self.pid, dtype=np.int32),
+			np.frombuffer(self.cpu, dtype=np.int32),
+			np.frombuffer(self.time, dtype=np.int64))
+
 class perf_event_proc_info:
 	"""docstring..."""
 	tag = 'perf_event_proc_info'
@@ -325,7 +435,7 @@ class perf_event_info:
 	def get_leader_perf_proc_info(self, pid):
 		tag = "{}.get_leader_perf_proc_info".format(self.tag)
 
-		if len(self.process_groups) is 0:
+		if not self.process_groups:
 			return self.get_perf_proc_info(pid)
 
 		leaderpid = process_groups_leader(self.process_groups, pid)
@@ -466,6 +576,147 @@ class perf_events_tracker:
 
 		return retval
 
+	# Processes every sample in a perf_sample_table at once, with the
+	# same results as calling handle_sample() for each sample in table
+	# order: the elapsed times (see set_sample_elapsed()), the event and
+	# per-pid totals (see perf_event_info.event_handle_sample()) and the
+	# samples passed to each process group leader's plots are all
+	# computed with group-by reductions over the table's arrays. The
+	# pid -> group leader mapping is computed once per distinct pid,
+	# rather than once per sample.
+	# Returns: True on success, False if some samples had to be skipped.
+	def handle_sample_table(self, table, appname):
+		tag = "{}.handle_sample_table".format(self.tag)
+
+		retval = True
+		n = len(table)
+		if n == 0:
+			return retval
+		(eid, period, pid, cpu, time) = table.to_arrays()
+
+		# Elapsed times, per cpu in table order. A sample whose time
+		# is less than the previous accepted time on its cpu is an
+		# error and is dropped; accepted times never decrease, so the
+		# previous accepted time is just the running max.
+		accepted = np.ones(n, dtype=bool)
+		is_first = np.zeros(n, dtype=bool)
+		elapsed = np.zeros(n, dtype=np.int64)
+		for c in np.unique(cpu).tolist():
+			idx = np.flatnonzero(cpu == c)
+			t = time[idx]
+			runmax = np.maximum.accumulate(t)
+			prev = np.empty(len(t), dtype=np.int64)
+			prev[1:] = runmax[:-1]
+			if c in self.cpu_sample_times:
+				prev[0] = self.cpu_sample_times[c]
+				prev[1:] = np.maximum(prev[1:], prev[0])
+			else:
+				prev[0] = t[0]
+				is_first[idx[0]] = True
+			accepted[idx] = t >= prev
+			elapsed[idx] = t - prev
+			self.cpu_sample_times[c] = int(max(runmax[-1], prev[0]))
+		dropped = n - np.count_nonzero(accepted)
+		if dropped > 0:
+			print_error(tag, ("{} samples had a time less than the "
+				"previous sample time on the same cpu!").format(dropped))
+			retval = False
+		if np.any(is_first):
+			print_warning(tag, ("{} first samples on a cpu with elapsed="
+				"None: using elapsed=0 for them").format(
+				np.count_nonzero(is_first)))
+
+		# Map eids to events:
+		events = list()
+		eventidx = np.full(n, -1, dtype=np.int32)
+		for e in np.unique(eid).tolist():
+			try:
+				perf_event = self.events_by_eid[e]
+			except KeyError:
+				print_error(tag, ("no event known for eid={}! ({} "
+					"samples)").format(e, np.count_nonzero(eid == e)))
+				retval = False
+				continue
+			if perf_event not in events:
+				events.append(perf_event)
+			eventidx[eid == e] = events.index(perf_event)
+		self.total_samples += np.count_nonzero(accepted)
+
+		# Samples with elapsed == 0 (except the first sample on each cpu)
+		# are ignored by event_handle_sample().
+		counted = accepted & (eventidx >= 0) & (is_first | (elapsed != 0))
+		zeros = np.count_nonzero(accepted & ~is_first & (elapsed == 0))
+		if zeros > 0:
+			print_warning(tag, ("{} samples with elapsed=0 - "
+				"ugh").format(zeros))
+
+		# Per-event and per-pid totals:
+		for (i, perf_event) in enumerate(events):
+			mask = counted & (eventidx == i)
+			perf_event.totalsamples += np.count_nonzero(mask)
+			perf_event.totalperiod += int(period[mask].sum())
+			perf_event.totaltime += int(elapsed[mask].sum())
+			(pids, inverse) = np.unique(pid[mask], return_inverse=True)
+			samples = np.bincount(inverse, minlength=len(pids))
+			periods = np.bincount(inverse, weights=period[mask],
+					minlength=len(pids))
+			times = np.bincount(inverse, weights=elapsed[mask],
+					minlength=len(pids))
+			for j in range(len(pids)):
+				p = int(pids[j])
+				procinfo = perf_event.get_perf_proc_info(p)
+				if not procinfo:
+					procinfo = perf_event.add_new_perf_proc_info(p)
+				procinfo.proc_samples += int(samples[j])
+				procinfo.proc_period += int(periods[j])
+				procinfo.proc_time += int(times[j])
+
+		# pid -> group leader, once per distinct pid:
+		leaders = np.full(n, -1, dtype=np.int64)
+		for p in np.unique(pid[counted]).tolist():
+			if not self.process_groups:
+				leader = p
+			else:
+				leader = process_groups_leader(self.process_groups, p)
+				if not leader:
+					print_debug(tag, ("no leader found for pid "
+						"{}").format(p))
+					continue
+			leaders[pid == p] = leader
+
+		# Pass the samples to the plots of each leader, in table order.
+		# A plot may belong to more than one event (e.g. a missrate
+		# plot), so find all of the events that feed each plot first.
+		is_miss = np.array([e.is_miss_event for e in events] + [False],
+				dtype=bool)[eventidx]
+		for leader in np.unique(leaders[leaders >= 0]).tolist():
+			plotevents = dict()
+			for (i, perf_event) in enumerate(events):
+				procinfo = perf_event.get_perf_proc_info(leader)
+				if not procinfo:
+					continue
+				for plot in procinfo.plotlist:
+					plotevents.setdefault(plot, []).append(i)
+			for (plot, eventlist) in plotevents.items():
+				mask = (counted & (leaders == leader) &
+						np.isin(eventidx, eventlist))
+				if plot.arraysfn:
+					plot.consume_perf_arrays(time[mask], period[mask],
+							is_miss[mask], leader, appname)
+					continue
+				for j in np.flatnonzero(mask).tolist():
+					sample = perf_sample(None, appname, fields=(
+						int(eid[j]), int(period[j]), int(pid[j]),
+						int(cpu[j]), int(time[j]),
+						table.tasks.get(int(pid[j]))))
+					perf_event = events[eventidx[j]]
+					sample.name = perf_event.name
+					sample.is_miss_event = perf_event.is_miss_event
+					sample.elapsed = int(elapsed[j])
+					plot.consume_perf_sample(sample, leader)
+
+		return retval
+
 	# Sets the elapsed time field of the sample by tracking the previous
 	# sample timestamp seen *on each cpu*. For the first sample seen
 	# on a particular cpu, we don't know the elapsed time, so
@@ -608,10 +859,12 @@ def create_event_plots(perf_events, event, missevent, pairevent):
 				# Make sure that plots don't have the same name, or they
 				# will overwrite each other!
 				pl = []
-				missplot_ts = plot_perf_missrate.new_missrate_ts_plot(
+				missplot_ts = PlotList.new_plot(
+						'plot_perf_missrate.new_missrate_ts_plot',
 						missevent.name)
 				pl.append(missplot_ts)
-				missplot_avg = plot_perf_missrate.new_missrate_avg_plot(
+				missplot_avg = PlotList.new_plot(
+						'plot_perf_missrate.new_missrate_avg_plot',
 						event.name)
 				pl.append(missplot_avg)
 
@@ -640,9 +893,11 @@ def create_event_plots(perf_events, event, missevent, pairevent):
 				except KeyError:
 					#name = "{}".format(event.name)
 					name = "{}-{}".format(event.name, pairevent.name)
-				pairplot_ts = plot_perf_missrate.new_rate_ts_plot(name)
+				pairplot_ts = PlotList.new_plot(
+						'plot_perf_missrate.new_rate_ts_plot', name)
 				pl.append(pairplot_ts)
-				pairplot_avg = plot_perf_missrate.new_rate_avg_plot(name)
+				pairplot_avg = PlotList.new_plot(
+						'plot_perf_missrate.new_rate_avg_plot', name)
 				pl.append(pairplot_avg)
 
 				for p in pl:
@@ -654,12 +909,24 @@ def create_event_plots(perf_events, event, missevent, pairevent):
 					"event={} that's not in perf_pair_plots").format(
 					event.name))
 
+		partnerevent = missevent if missevent else pairevent
+		if event and partnerevent:
+			if event.name in PlotList.perf_vm_join_plots:
+				# Join the miss rate (or rate) for the event pair with
+				# the VM timeline from the kernel trace analysis.
+				name = PAIR_EVENT_TO_STR.get(event.name, event.name)
+				p = PlotList.new_plot('plot_perf_vm.new_perf_vm_plot',
+						name)
+				event.addplot(p, leader)
+				partnerevent.addplot(p, leader)
+				newplots.append(p)
+
 		if event:  # plots for lone events:
-			for (eventlist, newplotfn) in PlotList.perf_plotlist:
+			for (eventlist, newplotname) in PlotList.perf_plotlist:
 				print_debug(tag, ("searching for event {} in eventlist "
 					"{}").format(event.name, eventlist))
 				if event.name in eventlist:
-					p = newplotfn(event.name)
+					p = PlotList.new_plot(newplotname, event.name)
 					event.addplot(p, leader)
 					newplots.append(p)
 
@@ -700,6 +967,23 @@ def perf_gen_reports(perfdata_fname, outputdir):
 				"turn tracing off in your app script!").format(retcode))
 		success = False
 
+	report_p = start_summary_report(perfdata_fname, freport)
+	retcode = report_p.wait()
+	if retcode != 0:
+		print_error(tag, ("perf report summary command returned "
+			"error={}").format(retcode))
+		success = False
+
+	fdump.close()
+	freport.close()
+
+	return success
+
+# Starts the summary "perf report" in the background, writing its output
+# to freport. The caller must wait() on the returned Popen object.
+def start_summary_report(perfdata_fname, freport):
+	tag = 'start_summary_report'
+
 	# Create summary report of perf data:
 	#   -I for more detailed header
 	#   -n: print a column for number of samples
@@ -712,16 +996,17 @@ def perf_gen_reports(perfdata_fname, outputdir):
 			PERF_CMD, perfdata_fname)
 	print_debug(tag, "cmd={}".format(cmd))
 	args = shlex.split(cmd)
-	retcode = subprocess.call(args, stdout=freport, stderr=freport)
-	if retcode != 0:
-		print_error(tag, ("perf report summary command returned "
-			"error={}").format(retcode))
-		success = False
+	report_p = subprocess.Popen(args, stdout=freport, stderr=freport)
 
-	fdump.close()
-	freport.close()
+	return report_p
 
-	return success
+# Converts a perf script timestamp ("1271035.105125778", or
+# "1271035.105125" without nanosecond precision) into an integer
+# number of nanoseconds, like the time=... field in the raw dump.
+def script_time_to_ns(timestr):
+	(secs, frac) = timestr.split('.')
+	frac = (frac + '000000000')[:9]
+	return int(secs) * 1000000000 + int(frac)
 
 # appname is just for debugging.
 def handle_sample_line(line, perf_events, appname):
@@ -740,6 +1025,32 @@ def handle_sample_line(line, perf_events, appname):
 
 	return
 
+# Handles one line of "perf script" output. The event name printed on
+# the line is mapped back to the eid of the event that was added from
+# the header, and the sample is appended to the perf_sample_table.
+# Returns: True if the line was handled (or skipped), False on error.
+def handle_script_line(line, perf_events, table):
+	tag = 'handle_script_line'
+
+	sample_match = perf_script_sample_re.match(line)
+	if not sample_match:
+		print_error(tag, ("perf_script_sample_re didn't match line "
+			"{}!").format(line))
+		return True
+
+	perf_event = perf_events.get_by_name(sample_match.group('eventname'))
+	if not perf_event:
+		print_error(tag, ("no event known for eventname {}").format(
+			sample_match.group('eventname')))
+		return False
+
+	table.append(perf_event.eids[0], int(sample_match.group('period')),
+		int(sample_match.group('pid')), int(sample_match.group('cpu')),
+		script_time_to_ns(sample_match.group('time')),
+		sample_match.group('task'))
+
+	return True
+
 def handle_event_header(perf_events, event_header_match):
 	tag = 'handle_event_header'
 
@@ -920,6 +1231,147 @@ def perf_analyze_rawdump(outputdir, process_groups, appname):
 
 	return allplots
 
+# Streams the samples in the perf.data file through the perf analysis
+# without writing the (huge) raw dump file: the event header is read
+# from "perf report --header-only", then the output of "perf script"
+# is piped directly into handle_script_line(). The summary perf.report
+# is generated concurrently with the sample stream. If keep_script is
+# True, then the streamed perf script output is also saved into
+# PERF_SCRIPTFILE in the outputdir, for debugging.
+# Returns: a list of multiapp_plot objects that were created during
+# the analysis, or None on error.
+def perf_stream_samples(perfdata_fname, outputdir, process_groups,
+		appname, keep_script=False):
+	tag = 'perf_stream_samples'
+
+	perf_events = perf_events_tracker(process_groups)
+
+	freport = open("{}/{}".format(outputdir, PERF_REPORTFILE), 'w')
+	report_p = start_summary_report(perfdata_fname, freport)
+
+	# The header is small, so just capture it in memory.
+	cmd = "{} report --header-only -I -i {}".format(PERF_CMD,
+			perfdata_fname)
+	print_debug(tag, "cmd={}".format(cmd))
+	args = shlex.split(cmd)
+	header_p = subprocess.Popen(args, stdout=subprocess.PIPE,
+			stderr=subprocess.DEVNULL, universal_newlines=True)
+	(header, ignored) = header_p.communicate()
+	if header_p.returncode != 0:
+		print_error(tag, ("perf report header command returned "
+			"error={}").format(header_p.returncode))
+		report_p.wait()
+		freport.close()
+		return None
+
+	for line in header.splitlines():
+		event_header_match = perf_event_header_re.match(line)
+		if event_header_match:
+			success = handle_event_header(perf_events, event_header_match)
+			if not success:
+				report_p.wait()
+				freport.close()
+				return None
+
+	allplots = header_complete(perf_events)
+	setup_perf_plots(allplots, outputdir, appname)
+
+	if keep_script:
+		fscript = open("{}/{}".format(outputdir, PERF_SCRIPTFILE), 'w')
+	else:
+		fscript = None
+
+	cmd = "{} script -F {} -i {}".format(PERF_CMD, PERF_SCRIPT_FIELDS,
+			perfdata_fname)
+	print_debug(tag, "cmd={}".format(cmd))
+	args = shlex.split(cmd)
+	script_p = subprocess.Popen(args, stdout=subprocess.PIPE,
+			stderr=subprocess.DEVNULL, universal_newlines=True)
+	success = True
+	table = perf_sample_table()
+	for line in script_p.stdout:
+		if fscript:
+			fscript.write(line)
+		success = handle_script_line(line, perf_events, table)
+		if not success:
+			print_error(tag, ("handle_script_line failed, killing "
+				"perf script and breaking out of loop now"))
+			script_p.kill()
+			break
+	script_p.stdout.close()
+	retcode = script_p.wait()
+	if retcode != 0 and success:
+		print_error(tag, ("perf script command returned error="
+			"{}").format(retcode))
+		success = False
+	if fscript:
+		fscript.close()
+
+	# If perf script failed partway through, the samples that were
+	# handled are only part of the trace, so don't return plots of them
+	# as if they were complete.
+	if not success:
+		print_error(tag, ("perf script output for {} is incomplete, "
+			"returning None").format(perfdata_fname))
+		report_p.wait()
+		freport.close()
+		return None
+	perf_events.handle_sample_table(table, appname)
+
+	retcode = report_p.wait()
+	if retcode != 0:
+		print_error(tag, ("perf report summary command returned "
+			"error={}").format(retcode))
+	freport.close()
+
+	perf_events.print_event_totals(sys.stdout)
+
+	return allplots
+
+# Reads the samples directly out of the perf.data file, using the
+# pure-Python perfdata_reader, and passes them to the perf_events_tracker.
+# No perf binary is needed; the per-pid event totals (which match the
+# summary "perf report -s pid") are written to PERF_REPORTFILE in the
+# outputdir.
+# Returns: a list of multiapp_plot objects that were created during
+# the analysis, or None on error.
+def perf_read_perfdata(perfdata_fname, outputdir, process_groups,
+		appname):
+	tag = 'perf_read_perfdata'
+
+	reader = perfdata_reader(perfdata_fname)
+	if not reader.open():
+		print_error(tag, ("failed to read perf.data file {}").format(
+			perfdata_fname))
+		return None
+
+	perf_events = perf_events_tracker(process_groups)
+	for attr in reader.attrs:
+		print_debug(tag, ("event {}: eids={}").format(attr.name,
+			attr.ids))
+		success = perf_events.add_new_event(attr.name, attr.ids)
+		if not success:
+			print_error(tag, ("failed to add new event {}").format(
+				attr.name))
+			reader.close()
+			return None
+
+	allplots = header_complete(perf_events)
+	setup_perf_plots(allplots, outputdir, appname)
+
+	table = perf_sample_table()
+	for (eid, period, pid, tid, cpu, time, task) in reader.samples():
+		table.append(eid, period, pid, cpu, time, task)
+	reader.close()
+	perf_events.handle_sample_table(table, appname)
+
+	freport = open("{}/{}".format(outputdir, PERF_REPORTFILE), 'w')
+	perf_events.print_event_totals(freport)
+	freport.close()
+	perf_events.print_event_totals(sys.stdout)
+
+	return allplots
+
 # Returns: a list of plots that were dynamically created according to
 # the events in the perf reports.
 def perf_analyze_reports(outputdir, group_multiproc, target_pids,
@@ -930,6 +1382,20 @@ def perf_analyze_reports(outputdir, group_multiproc, target_pids,
 
 	return allplots
 
+# Returns: an (inputs, outputs) tuple with the lists of files that
+# perf_main() reads and writes when it analyzes the perfdata_fname in
+# appdir, for the pipeline_stage in generate_plots.py. The
+# process_groups file and the VM timeline in the analysis dir's plot
+# data store come from the kernel trace analysis (see
+# analyze_trace.analyze_stage_files()).
+def perf_stage_files(perfdata_fname, appdir):
+	inputs = ([perfdata_fname, "{}/{}".format(appdir, targetpidsfile),
+		"{}/{}".format(appdir, PROCESS_GROUPS_NAME)] +
+		plotdata_store_files("{}/{}".format(appdir, analysisdirname)))
+	outputs = plotdata_store_files("{}/{}".format(appdir,
+		PERFREPORT_DIRNAME))
+	return (inputs, outputs)
+
 # Analyzes perf.data files using "perf report" and creates data files
 # to be used for plots. perfdata_fname is the path+name of the perf.data
 # file (output by run_apps.py). outputdir will be created if it does not
@@ -969,20 +1435,44 @@ def perf_main(perfdata_fname, appdir, group_multiproc,
 		print_warning(tag, ("outputdir {} already exists, will "
 			"overwrite files in it!").format(outputdir))
 
-	# First, run perf report commands on the perf.data files and store
-	# the report output in new files.
-	success = perf_gen_reports(perfdata_fname, outputdir)
-	if not success:
-		print_debug(tag, "perf_gen_reports failed, returning now")
-		return
+	if PERF_SAMPLE_SOURCE == 'native':
+		allplots = perf_read_perfdata(perfdata_fname, outputdir,
+				process_groups, appname)
+		if allplots is None:
+			print_debug(tag, "perf_read_perfdata failed, returning now")
+			return
+	elif PERF_SAMPLE_SOURCE == 'script':
+		# Stream the samples from perf script straight into the
+		# analysis; the raw dump file is never written.
+		allplots = perf_stream_samples(perfdata_fname, outputdir,
+				process_groups, appname, keep_script=PERF_KEEP_SCRIPT)
+		if allplots is None:
+			print_debug(tag, "perf_stream_samples failed, returning now")
+			return
+	else:
+		# First, run perf report commands on the perf.data files and
+		# store the report output in new files.
+		success = perf_gen_reports(perfdata_fname, outputdir)
+		if not success:
+			print_debug(tag, "perf_gen_reports failed, returning now")
+			return
+
+		# Second, analyze the raw perf report data and generate plot
+		# data.
+		allplots = perf_analyze_reports(outputdir, group_multiproc,
+				target_pids, appname, process_groups)
 
-	# Second, analyze the raw perf report data and generate plot data.
-	allplots = perf_analyze_reports(outputdir, group_multiproc,
-			target_pids, appname, process_groups)
+	# The missrate / rate / totals plots buffer their samples and
+	# compute their series all at once from NumPy arrays, and the
+	# perf-vm plots join their windows with the VM timeline that the
+	# kernel trace analysis wrote into the appdir, when the plots are
+	# flushed by serialize_plotlist_data().
+	plot_perf_vm.set_perf_vm_appdir(allplots, appdir)
 
 	# Finally, save the plot data for this perf analysis run. Should only
 	# be called once per invocation of this script.
-	multiapp_plot.serialize_plotlist_data(allplots)
+	with timed_stage('serialize', appname):
+		multiapp_plot.serialize_plotlist_data(allplots)
 
 	return allplots
 
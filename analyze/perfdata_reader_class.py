@@ -0,0 +1,427 @@
+# Virtual memory analysis scripts.
+# Developed 2012-2014 by Peter Hornyack, pjh@cs.washington.edu
+# Copyright (c) 2012-2014 Peter Hornyack and University of Washington
+
+# Pure-Python reader for the perf.data files written by "perf record",
+# so that the perf analysis doesn't depend on a perf binary of the
+# right version (and on the custom "@ id=..." lines that I added to
+# perf's raw dump output).
+#
+# Format reference: tools/perf/util/header.h and header.c in the kernel
+# source, and include/uapi/linux/perf_event.h. Only the parts of the
+# format that we use are parsed here:
+#   The file header, with the attrs, data and feature sections.
+#   The attr section: one perf_event_attr per event, plus the list of
+#     sample ids that belong to that event.
+#   The EVENT_DESC feature section, which holds the event names.
+#   PERF_RECORD_SAMPLE records (and PERF_RECORD_COMM records, to get
+#     the task names); all other records are skipped.
+
+from util.pjh_utils import *
+import mmap
+import struct
+
+PERF_MAGIC = b'PERFILE2'
+PERF_FILE_HEADER_SIZE = 104
+PERF_ATTR_SIZE_VER0 = 64
+PERF_ATTR_SIZE_VER3 = 96   # linux-3.9.4
+
+PERF_RECORD_COMM   = 3
+PERF_RECORD_SAMPLE = 9
+
+# perf_event_attr.sample_type bits:
+PERF_SAMPLE_IP         = 1 << 0
+PERF_SAMPLE_TID        = 1 << 1
+PERF_SAMPLE_TIME       = 1 << 2
+PERF_SAMPLE_ADDR       = 1 << 3
+PERF_SAMPLE_READ       = 1 << 4
+PERF_SAMPLE_CALLCHAIN  = 1 << 5
+PERF_SAMPLE_ID         = 1 << 6
+PERF_SAMPLE_CPU        = 1 << 7
+PERF_SAMPLE_PERIOD     = 1 << 8
+PERF_SAMPLE_STREAM_ID  = 1 << 9
+PERF_SAMPLE_RAW        = 1 << 10
+PERF_SAMPLE_IDENTIFIER = 1 << 16
+  # PERF_SAMPLE_IDENTIFIER doesn't exist in linux-3.9.4, but handle it
+  # so that newer perf.data files can be read too.
+SAMPLE_TYPE_NEEDED = (PERF_SAMPLE_TID | PERF_SAMPLE_TIME | PERF_SAMPLE_CPU |
+		PERF_SAMPLE_PERIOD)
+  # Every sample_type field that comes after PERIOD in the sample
+  # record (READ, CALLCHAIN, RAW, ...) can simply be ignored.
+
+HEADER_EVENT_DESC = 12   # feature bit for the event names section
+
+# Names for events that are not found in an EVENT_DESC section; these
+# match the names that "perf list" / "perf report" use.
+PERF_TYPE_HARDWARE = 0
+PERF_TYPE_HW_CACHE = 3
+PERF_TYPE_RAW      = 4
+HW_EVENT_NAMES = [
+		'cycles', 'instructions', 'cache-references', 'cache-misses',
+		'branch-instructions', 'branch-misses', 'bus-cycles',
+		'stalled-cycles-frontend', 'stalled-cycles-backend',
+		'ref-cycles',
+	]
+HW_CACHE_NAMES = ['L1-dcache', 'L1-icache', 'LLC', 'dTLB', 'iTLB',
+		'branch', 'node']
+HW_CACHE_OPS = [('load', 'loads'), ('store', 'stores'),
+		('prefetch', 'prefetches')]
+
+'''
+One event from the attr section of a perf.data file: its name, the
+attr fields that we care about, and the sample ids that perf record
+assigned to it (one per cpu).
+'''
+class perfdata_attr:
+	tag = 'perfdata_attr'
+
+	name = None
+	type = None
+	config = None
+	sample_type = None
+	ids = None
+
+	def __init__(self, type, config, sample_type, ids):
+		tag = "{}.__init__".format(self.tag)
+
+		self.type = type
+		self.config = config
+		self.sample_type = sample_type
+		self.ids = ids
+		self.name = default_event_name(type, config)
+
+		return
+
+'''
+Reads the header and the samples out of a perf.data file using mmap
+and struct unpacking. Usage:
+  reader = perfdata_reader(fname)
+  if reader.open():
+    for attr in reader.attrs: ...
+    for (eid, period, pid, tid, cpu, time, task) in reader.samples(): ...
+    reader.close()
+'''
+class perfdata_reader:
+	tag = 'perfdata_reader'
+
+	fname = None
+	f = None
+	mm = None
+	endian = None
+	attrs = None
+	data_offset = None
+	data_size = None
+	sample_type = None
+
+	def __init__(self, fname):
+		tag = "{}.__init__".format(self.tag)
+
+		self.fname = fname
+		self.f = None
+		self.mm = None
+		self.endian = '<'
+		self.attrs = list()
+		self.data_offset = 0
+		self.data_size = 0
+		self.sample_type = 0
+
+		return
+
+	# Maps the file and parses its header and attrs.
+	# Returns: True on success, False on error.
+	def open(self):
+		tag = "{}.open".format(self.tag)
+
+		try:
+			self.f = open(self.fname, 'rb')
+		except IOError:
+			print_error(tag, ("could not open {}").format(self.fname))
+			return False
+		if os.fstat(self.f.fileno()).st_size < PERF_FILE_HEADER_SIZE:
+			print_error(tag, ("{} is too small to be a perf.data "
+				"file").format(self.fname))
+			self.close()
+			return False
+		self.mm = mmap.mmap(self.f.fileno(), 0, access=mmap.ACCESS_READ)
+
+		magic = self.mm[0:8]
+		if magic == PERF_MAGIC:
+			self.endian = '<'
+		elif magic == PERF_MAGIC[::-1]:
+			self.endian = '>'
+		else:
+			print_error(tag, ("bad magic {} in {} - not a perf.data file, "
+				"or written in pipe mode").format(magic, self.fname))
+			self.close()
+			return False
+
+		(size, attr_size, attrs_offset, attrs_size, data_offset,
+			data_size, types_offset, types_size) = struct.unpack_from(
+			self.endian + '8Q', self.mm, 8)
+		if size != PERF_FILE_HEADER_SIZE:
+			print_error(tag, ("unexpected header size {}").format(size))
+			self.close()
+			return False
+		self.data_offset = data_offset
+		self.data_size = data_size
+
+		success = self.read_attrs(attr_size, attrs_offset, attrs_size)
+		if success:
+			self.read_event_desc()
+		if not success:
+			self.close()
+		return success
+
+	def close(self):
+		if self.mm:
+			self.mm.close()
+			self.mm = None
+		if self.f:
+			self.f.close()
+			self.f = None
+		return
+
+	# Each entry in the attrs section is a perf_event_attr (whose length
+	# is attr_size - 16) followed by a perf_file_section that points to
+	# the u64 ids for the event.
+	def read_attrs(self, attr_size, attrs_offset, attrs_size):
+		tag = "{}.read_attrs".format(self.tag)
+
+		if attr_size < PERF_ATTR_SIZE_VER0 + 16:
+			print_error(tag, ("invalid attr_size {}").format(attr_size))
+			return False
+
+		for offset in range(attrs_offset, attrs_offset + attrs_size,
+				attr_size):
+			(type, size, config, period, sample_type) = struct.unpack_from(
+				self.endian + 'IIQQQ', self.mm, offset)
+			(ids_offset, ids_size) = struct.unpack_from(self.endian + 'QQ',
+				self.mm, offset + attr_size - 16)
+			ids = list(struct.unpack_from(self.endian +
+				"{}Q".format(ids_size // 8), self.mm, ids_offset))
+			self.attrs.append(perfdata_attr(type, config, sample_type, ids))
+			print_debug(tag, ("attr: type={}, config={:#x}, sample_type="
+				"{:#x}, ids={}").format(type, config, sample_type, ids))
+
+		if len(self.attrs) == 0:
+			print_error(tag, ("no attrs found in {}").format(self.fname))
+			return False
+
+		# perf record uses the same sample_type for every event, and
+		# the sample records don't say which attr they belong to until
+		# after we've parsed the ID field, so we rely on this.
+		self.sample_type = self.attrs[0].sample_type
+		for attr in self.attrs:
+			if attr.sample_type != self.sample_type:
+				print_error(tag, ("attrs have different sample_types: "
+					"{:#x} != {:#x}").format(attr.sample_type,
+					self.sample_type))
+				return False
+		missing = SAMPLE_TYPE_NEEDED & ~self.sample_type
+		if missing:
+			print_error(tag, ("sample_type {:#x} is missing fields "
+				"{:#x} that the perf analysis needs").format(
+				self.sample_type, missing))
+			return False
+		if (len(self.attrs) > 1 and
+			not self.sample_type & (PERF_SAMPLE_ID | PERF_SAMPLE_IDENTIFIER)):
+			print_error(tag, ("multiple events but no sample ids in "
+				"sample_type {:#x}").format(self.sample_type))
+			return False
+
+		return True
+
+	# The feature sections follow the data section: one perf_file_section
+	# for each bit that is set in the adds_features bitmap, in bit order.
+	# If the EVENT_DESC section is present, use it to set the names of
+	# the attrs (otherwise they keep their default_event_name()s).
+	def read_event_desc(self):
+		tag = "{}.read_event_desc".format(self.tag)
+
+		features = struct.unpack_from(self.endian + '4Q', self.mm, 72)
+		if not (features[0] >> HEADER_EVENT_DESC) & 1:
+			print_debug(tag, ("no EVENT_DESC section, using default "
+				"event names"))
+			return
+		index = 0
+		for bit in range(HEADER_EVENT_DESC):
+			index += (features[0] >> bit) & 1
+		(offset, size) = struct.unpack_from(self.endian + 'QQ', self.mm,
+			self.data_offset + self.data_size + 16 * index)
+
+		(nr, attr_size) = struct.unpack_from(self.endian + 'II', self.mm,
+			offset)
+		offset += 8
+		names_by_id = dict()
+		for i in range(nr):
+			offset += attr_size
+			(nr_ids, strlen) = struct.unpack_from(self.endian + 'II',
+				self.mm, offset)
+			offset += 8
+			name = self.mm[offset:offset+strlen].split(b'\0')[0].decode()
+			offset += strlen
+			ids = struct.unpack_from(self.endian + "{}Q".format(nr_ids),
+				self.mm, offset)
+			offset += 8 * nr_ids
+			for eid in ids:
+				names_by_id[eid] = name
+
+		for attr in self.attrs:
+			if len(attr.ids) > 0 and attr.ids[0] in names_by_id:
+				attr.name = names_by_id[attr.ids[0]]
+
+		return
+
+	# Generator that walks the data section and yields a tuple for every
+	# PERF_RECORD_SAMPLE: (eid, period, pid, tid, cpu, time, task).
+	# task is the most recent comm seen for the tid, or None.
+	def samples(self):
+		tag = "{}.samples".format(self.tag)
+
+		mm = self.mm
+		endian = self.endian
+		sample_type = self.sample_type
+		header_s = struct.Struct(endian + 'IHH')
+		u64_s = struct.Struct(endian + 'Q')
+		u32x2_s = struct.Struct(endian + 'II')
+		default_eid = self.attrs[0].ids[0] if self.attrs[0].ids else 0
+		comms = dict()
+
+		offset = self.data_offset
+		end = self.data_offset + self.data_size
+		while offset + header_s.size <= end:
+			(rtype, misc, size) = header_s.unpack_from(mm, offset)
+			if size < header_s.size:
+				print_error(tag, ("corrupt record at offset {}: "
+					"size={}").format(offset, size))
+				return
+			if rtype == PERF_RECORD_COMM:
+				(pid, tid) = u32x2_s.unpack_from(mm, offset + 8)
+				comm = mm[offset+16:offset+size].split(b'\0')[0]
+				comms[tid] = comm.decode(errors='replace')
+			elif rtype == PERF_RECORD_SAMPLE:
+				pos = offset + header_s.size
+				eid = default_eid
+				pid = tid = cpu = time = period = None
+				if sample_type & PERF_SAMPLE_IDENTIFIER:
+					(eid,) = u64_s.unpack_from(mm, pos)
+					pos += 8
+				if sample_type & PERF_SAMPLE_IP:
+					pos += 8
+				if sample_type & PERF_SAMPLE_TID:
+					(pid, tid) = u32x2_s.unpack_from(mm, pos)
+					pos += 8
+				if sample_type & PERF_SAMPLE_TIME:
+					(time,) = u64_s.unpack_from(mm, pos)
+					pos += 8
+				if sample_type & PERF_SAMPLE_ADDR:
+					pos += 8
+				if sample_type & PERF_SAMPLE_ID:
+					(eid,) = u64_s.unpack_from(mm, pos)
+					pos += 8
+				if sample_type & PERF_SAMPLE_STREAM_ID:
+					pos += 8
+				if sample_type & PERF_SAMPLE_CPU:
+					(cpu, res) = u32x2_s.unpack_from(mm, pos)
+					pos += 8
+				if sample_type & PERF_SAMPLE_PERIOD:
+					(period,) = u64_s.unpack_from(mm, pos)
+					pos += 8
+				# READ, CALLCHAIN, RAW etc. come after PERIOD, and we
+				# don't need anything after them, so don't bother
+				# parsing.
+				yield (eid, period, pid, tid, cpu, time, comms.get(tid))
+			offset += size
+
+		return
+
+# Returns the name that perf uses for an event with the given attr type
+# and config, when no EVENT_DESC section is available.
+def default_event_name(type, config):
+	if type == PERF_TYPE_HARDWARE and config < len(HW_EVENT_NAMES):
+		return HW_EVENT_NAMES[config]
+	if type == PERF_TYPE_HW_CACHE:
+		cache = config & 0xff
+		op = (config >> 8) & 0xff
+		result = (config >> 16) & 0xff
+		if cache < len(HW_CACHE_NAMES) and op < len(HW_CACHE_OPS):
+			if result == 0:
+				return "{}-{}".format(HW_CACHE_NAMES[cache],
+					HW_CACHE_OPS[op][1])
+			return "{}-{}-misses".format(HW_CACHE_NAMES[cache],
+				HW_CACHE_OPS[op][0])
+	if type == PERF_TYPE_RAW:
+		return "r{:x}".format(config)
+	return "type{}-config{:#x}".format(type, config)
+
+# Writes a minimal perf.data file, in the same format that "perf record"
+# uses, for testing the reader without a perf binary. events is a list
+# of (name, type, config, ids) tuples; samples is a list of (eid, period,
+# pid, tid, cpu, time) tuples; comms is an optional list of (pid, tid,
+# comm) tuples, which are written before the samples.
+def write_synthetic_perfdata(fname, events, samples, comms=None):
+	tag = 'write_synthetic_perfdata'
+
+	sample_type = (PERF_SAMPLE_IP | PERF_SAMPLE_TID | PERF_SAMPLE_TIME |
+		PERF_SAMPLE_ID | PERF_SAMPLE_CPU | PERF_SAMPLE_PERIOD)
+	attr_size = PERF_ATTR_SIZE_VER3 + 16
+
+	def attr_bytes(type, config):
+		attr = struct.pack('<IIQQQ', type, PERF_ATTR_SIZE_VER3, config,
+			1000, sample_type)
+		return attr + b'\0' * (PERF_ATTR_SIZE_VER3 - len(attr))
+
+	ids_offset = PERF_FILE_HEADER_SIZE
+	ids_blob = b''
+	attrs_blob = b''
+	for (name, type, config, ids) in events:
+		attrs_blob += attr_bytes(type, config)
+		attrs_blob += struct.pack('<QQ', ids_offset + len(ids_blob),
+			8 * len(ids))
+		ids_blob += struct.pack("<{}Q".format(len(ids)), *ids)
+	attrs_offset = ids_offset + len(ids_blob)
+
+	data = b''
+	for (pid, tid, comm) in (comms or []):
+		body = struct.pack('<II', pid, tid)
+		comm = comm.encode() + b'\0'
+		comm += b'\0' * (-len(comm) % 8)
+		body += comm
+		data += struct.pack('<IHH', PERF_RECORD_COMM, 0, 8 + len(body))
+		data += body
+	for (eid, period, pid, tid, cpu, time) in samples:
+		body = struct.pack('<QIIQQIIQ', 0, pid, tid, time, eid, cpu, 0,
+			period)
+		data += struct.pack('<IHH', PERF_RECORD_SAMPLE, 0, 8 + len(body))
+		data += body
+	data_offset = attrs_offset + len(attrs_blob)
+
+	# EVENT_DESC feature section, so that the names round-trip:
+	desc = struct.pack('<II', len(events), PERF_ATTR_SIZE_VER3)
+	for (name, type, config, ids) in events:
+		namebytes = name.encode() + b'\0'
+		namebytes += b'\0' * (-len(namebytes) % 8)
+		desc += attr_bytes(type, config)
+		desc += struct.pack('<II', len(ids), len(namebytes)) + namebytes
+		desc += struct.pack("<{}Q".format(len(ids)), *ids)
+	features_offset = data_offset + len(data)
+	desc_offset = features_offset + 16
+
+	header = PERF_MAGIC + struct.pack('<8Q', PERF_FILE_HEADER_SIZE,
+		attr_size, attrs_offset, len(attrs_blob), data_offset, len(data),
+		0, 0)
+	header += struct.pack('<4Q', 1 << HEADER_EVENT_DESC, 0, 0, 0)
+
+	f = open(fname, 'wb')
+	f.write(header)
+	f.write(ids_blob)
+	f.write(attrs_blob)
+	f.write(data)
+	f.write(struct.pack('<QQ', desc_offset, len(desc)))
+	f.write(desc)
+	f.close()
+
+	return
+
+if __name__ == '__main__':
+	print_error_exit("not an executable module")
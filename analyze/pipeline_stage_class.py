@@ -0,0 +1,202 @@
+# Virtual memory analysis scripts.
+# Developed 2012-2014 by Peter Hornyack, pjh@cs.washington.edu
+# Copyright (c) 2012-2014 Peter Hornyack and University of Washington
+
+from util.pjh_utils import *
+from plotting.multiapp_plot_class import source_digest
+import hashlib
+import json
+
+STAGE_SUFFIX = 'stage'
+HASH_BLOCKSIZE = 1024 * 1024
+
+'''
+One stage of the generate_plots.py pipeline (the kernel trace analysis
+or the perf analysis of one app, or the rendering of one plot), which
+declares the files that it reads (inputs) and writes (outputs), and
+can be skipped when none of them have changed since it last ran. After
+a stage runs, done() saves a stamp file with a signature of each of
+its input and output files plus whatever result the stage wants to
+remember (e.g. the plots that an analysis made); up_to_date() then
+compares the current files against the stamp. A file is unchanged if
+its size and mtime match the stamp, or, if only its mtime differs
+(e.g. because it was copied or rewritten with the same contents), if
+its sha1 matches.
+Stages that read another stage's outputs list them as inputs, which is
+what links the stages together: e.g. the perf analysis reads the
+process_groups file that the kernel trace analysis writes, so when the
+kernel trace analysis actually changes that file, the perf analysis is
+run again too.
+'''
+class pipeline_stage:
+	tag = 'pipeline_stage'
+
+	name = None
+	stamp_fname = None
+	inputs = None
+	outputs = None
+	params = None
+
+	# stampdir is the directory that the stage's stamp file is kept in.
+	# inputs and outputs are lists of file names. params is anything
+	# that json can serialize (e.g. the command-line options that the
+	# stage uses); sources is a list of source files (e.g. the module
+	# with the stage's method), whose contents are added to the params,
+	# so that the stage is run again when its code changes.
+	def __init__(self, name, stampdir, inputs, outputs, params=None,
+			sources=[]):
+		tag = "{}.__init__".format(self.tag)
+
+		self.name = name
+		self.stamp_fname = "{}/{}.{}".format(stampdir, name, STAGE_SUFFIX)
+		self.inputs = sorted(set(inputs))
+		self.outputs = sorted(set(outputs))
+		self.params = [params]
+		for fname in sources:
+			self.params.append(source_digest(fname).hex())
+
+		return
+
+	def __str__(self):
+		return "{} ({} inputs, {} outputs)".format(self.name,
+			len(self.inputs), len(self.outputs))
+
+	def read_stamp(self):
+		try:
+			f = open(self.stamp_fname, 'r')
+			stamp = json.load(f)
+			f.close()
+		except (OSError, ValueError):
+			return None
+		return stamp
+
+	# Returns: a (True, result) tuple if the stage doesn't need to be
+	# run, where result is what was passed to done() the last time that
+	# the stage ran, or (False, None) if the stage must be run again.
+	def up_to_date(self, force=False):
+		tag = "{}.up_to_date".format(self.tag)
+
+		if force:
+			return (False, None)
+		stamp = self.read_stamp()
+		if stamp is None:
+			print_debug(tag, ("{}: no stamp, must run").format(self.name))
+			return (False, None)
+		if stamp['params'] != json.loads(json.dumps(self.params)):
+			print_debug(tag, ("{}: params or sources changed, must "
+				"run").format(self.name))
+			return (False, None)
+		for (kind, fnames) in [('inputs', self.inputs),
+				('outputs', self.outputs)]:
+			if sorted(stamp[kind].keys()) != fnames:
+				print_debug(tag, ("{}: set of {} changed, must "
+					"run").format(self.name, kind))
+				return (False, None)
+			for fname in fnames:
+				if not file_unchanged(fname, stamp[kind][fname]):
+					print_debug(tag, ("{}: {} changed, must run").format(
+						self.name, fname))
+					return (False, None)
+
+		print_debug(tag, ("{}: up to date").format(self.name))
+		return (True, stamp['result'])
+
+	# Saves the stage's stamp after the stage has run successfully;
+	# result must be something that json can serialize. The stamp is
+	# written to a temporary file and renamed, so that a stage that is
+	# interrupted part-way through doesn't leave a half-written stamp
+	# behind.
+	def done(self, result=None):
+		tag = "{}.done".format(self.tag)
+
+		# Files that haven't changed since the last stamp keep their
+		# sha1 from it, rather than being read again.
+		old_stamp = self.read_stamp()
+		stamp = dict()
+		stamp['name'] = self.name
+		stamp['params'] = self.params
+		stamp['result'] = result
+		for (kind, fnames) in [('inputs', self.inputs),
+				('outputs', self.outputs)]:
+			stamp[kind] = dict()
+			for fname in fnames:
+				old = None
+				if old_stamp and fname in old_stamp.get(kind, {}):
+					old = old_stamp[kind][fname]
+				stamp[kind][fname] = file_signature(fname, old)
+
+		stampdir = os.path.dirname(self.stamp_fname)
+		if not os.path.exists(stampdir):
+			os.makedirs(stampdir)
+		tmp_fname = "{}.tmp{}".format(self.stamp_fname, os.getpid())
+		f = open(tmp_fname, 'w')
+		json.dump(stamp, f, indent=1, sort_keys=True)
+		f.close()
+		os.rename(tmp_fname, self.stamp_fname)
+
+		return
+
+	# Removes the stage's stamp, e.g. before the stage is run again, so
+	# that the stage won't be considered up to date if it fails.
+	def invalidate(self):
+		try:
+			os.remove(self.stamp_fname)
+		except OSError:
+			pass
+		return
+
+file_sha1s = dict()
+  # (path, size, mtime in ns) -> sha1, see file_sha1().
+
+# Returns: the hex sha1 digest of the contents of the file fname, whose
+# os.stat() is st. A file is only read once per process for as long as
+# its size and mtime stay the same: e.g. every plot's render stage has
+# the same plotdata stores as inputs.
+def file_sha1(fname, st):
+	key = (os.path.abspath(fname), st.st_size, st.st_mtime_ns)
+	try:
+		return file_sha1s[key]
+	except KeyError:
+		pass
+	h = hashlib.sha1()
+	f = open(fname, 'rb')
+	while True:
+		block = f.read(HASH_BLOCKSIZE)
+		if not block:
+			break
+		h.update(block)
+	f.close()
+	file_sha1s[key] = h.hexdigest()
+	return file_sha1s[key]
+
+# Returns: a [size, mtime in ns, sha1] list for the file fname, or None
+# if the file doesn't exist. If the file's size and mtime still match
+# the old signature, its sha1 is taken from there.
+def file_signature(fname, old=None):
+	try:
+		st = os.stat(fname)
+	except OSError:
+		return None
+	if old is not None and old[0:2] == [st.st_size, st.st_mtime_ns]:
+		return [st.st_size, st.st_mtime_ns, old[2]]
+	return [st.st_size, st.st_mtime_ns, file_sha1(fname, st)]
+
+# Returns: True if the file fname still matches the signature that
+# file_signature() returned for it. The file's contents are only read
+# if its size matches but its mtime doesn't.
+def file_unchanged(fname, signature):
+	try:
+		st = os.stat(fname)
+	except OSError:
+		return signature is None
+	if signature is None:
+		return False
+	(size, mtime_ns, sha1) = signature
+	if st.st_size != size:
+		return False
+	if st.st_mtime_ns == mtime_ns:
+		return True
+	return file_sha1(fname, st) == sha1
+
+if __name__ == '__main__':
+	print_error_exit("not an executable module")
@@ -0,0 +1,317 @@
+# Virtual memory analysis scripts.
+# Developed 2012-2014 by Peter Hornyack, pjh@cs.washington.edu
+# Copyright (c) 2012-2014 Peter Hornyack and University of Washington
+
+# Instrumentation for the stages of the analysis (parsing the trace,
+# the point-in-time analysis, queries, serializing and deserializing
+# plot data, rendering plots, ...): wrap each stage in a timed_stage
+# and it records its wall time, CPU time, peak RSS and, if
+# enable_tracemalloc() was called, its allocation hot spots. Each
+# process keeps its own list of records; worker processes send theirs
+# back to the parent with take_stage_records(), and the parent writes
+# them all out as one JSON report with write_stage_report().
+
+from util.pjh_utils import *
+import json
+import platform
+import resource
+import subprocess
+import time
+import tracemalloc
+
+STAGE_REPORT_FNAME = 'stage-report.json'
+STAGE_REPORT_VERSION = 1
+TRACEMALLOC_FRAMES = 1
+TRACEMALLOC_TOP = 10
+  # Number of allocation hot spots (source lines) to record per stage.
+PROGRESS_INTERVAL = 10.0
+  # Seconds between progress lines from a progress_meter.
+PROGRESS_CHECK_LINES = 65536
+  # progress_meter.update() only looks at the clock (and the file
+  # offset, which isn't free for a text file) once every this many lines.
+
+# Globals:
+stage_records = []
+
+##############################################################################
+
+# Starts tracing memory allocations, so that every timed_stage from now
+# on (in this process, and in processes forked from it) records its
+# allocation hot spots. This slows the analysis down a lot.
+def enable_tracemalloc():
+	if not tracemalloc.is_tracing():
+		tracemalloc.start(TRACEMALLOC_FRAMES)
+	return
+
+# Returns: the peak resident set size of this process so far, in KB.
+def peak_rss_kb():
+	return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+'''
+Context manager that times one stage for one app (or one plot):
+	with timed_stage('serialize', appname):
+		...
+and appends a record for it to stage_records when the stage ends. More
+fields can be added to the record (e.g. event counts) through
+timed_stage.record while the stage runs.
+'''
+class timed_stage:
+	tag = 'timed_stage'
+
+	record = None
+	begin_wall = None
+	begin_cpu = None
+	begin_rss = None
+	snapshot = None
+
+	def __init__(self, stage, appname=None, plotname=None):
+		tag = "{}.__init__".format(self.tag)
+
+		self.record = dict()
+		self.record['stage'] = stage
+		self.record['app'] = appname
+		if plotname:
+			self.record['plot'] = plotname
+		self.begin_wall = None
+		self.begin_cpu = None
+		self.begin_rss = None
+		self.snapshot = None
+
+		return
+
+	def __enter__(self):
+		if tracemalloc.is_tracing():
+			self.snapshot = tracemalloc.take_snapshot()
+		self.begin_rss = peak_rss_kb()
+		self.begin_cpu = time.process_time()
+		self.begin_wall = time.perf_counter()
+		return self
+
+	def __exit__(self, exc_type, exc_value, traceback):
+		tag = "{}.__exit__".format(self.tag)
+
+		record = self.record
+		record['wall_s'] = time.perf_counter() - self.begin_wall
+		record['cpu_s'] = time.process_time() - self.begin_cpu
+		record['peak_rss_kb'] = peak_rss_kb()
+		record['peak_rss_growth_kb'] = record['peak_rss_kb'] - self.begin_rss
+		record['pid'] = os.getpid()
+		if exc_type is not None:
+			record['failed'] = exc_type.__name__
+		if self.snapshot is not None:
+			record['allocations'] = allocation_hot_spots(self.snapshot,
+					tracemalloc.take_snapshot())
+			self.snapshot = None
+		stage_records.append(record)
+		print_debug(tag, ("{} {}: {:.3f} s wall, {:.3f} s cpu, peak rss "
+			"{} KB").format(record['stage'], record['app'],
+			record['wall_s'], record['cpu_s'], record['peak_rss_kb']))
+
+		return False
+
+# Records a stage that didn't have to be run at all (see
+# pipeline_stage.up_to_date()).
+def skipped_stage(stage, appname=None, plotname=None):
+	record = dict()
+	record['stage'] = stage
+	record['app'] = appname
+	if plotname:
+		record['plot'] = plotname
+	record['skipped'] = True
+	stage_records.append(record)
+	return
+
+# Returns: a list of dicts for the TRACEMALLOC_TOP source lines that
+# allocated the most memory between the two tracemalloc snapshots that
+# is still allocated at the end.
+def allocation_hot_spots(before, after):
+	hotspots = []
+	for stat in after.compare_to(before, 'lineno')[:TRACEMALLOC_TOP]:
+		if stat.size_diff <= 0:
+			break
+		frame = stat.traceback[0]
+		hotspot = dict()
+		hotspot['where'] = "{}:{}".format(frame.filename, frame.lineno)
+		hotspot['size_kb'] = stat.size_diff / 1024
+		hotspot['count'] = stat.count_diff
+		hotspots.append(hotspot)
+	return hotspots
+
+# Returns: the stage records collected in this process so far, which
+# are removed from it (e.g. to send them from a worker process back to
+# its parent, which passes them to add_stage_records()).
+def take_stage_records():
+	global stage_records
+	records = stage_records
+	stage_records = []
+	return records
+
+def add_stage_records(records):
+	stage_records.extend(records)
+	return
+
+##############################################################################
+
+'''
+Counts the trace events of each type and the cumulative time spent
+handling them, e.g. in process_trace_file():
+	t = events.begin()
+	... handle the event ...
+	events.end(trace_event, t)
+'''
+class event_stats:
+	tag = 'event_stats'
+
+	counts = None
+	times = None
+
+	def __init__(self):
+		tag = "{}.__init__".format(self.tag)
+
+		self.counts = dict()
+		self.times = dict()
+
+		return
+
+	def begin(self):
+		return time.perf_counter()
+
+	def end(self, eventtype, begin):
+		elapsed = time.perf_counter() - begin
+		try:
+			self.counts[eventtype] += 1
+			self.times[eventtype] += elapsed
+		except KeyError:
+			self.counts[eventtype] = 1
+			self.times[eventtype] = elapsed
+		return
+
+	def total_time(self):
+		return sum(self.times.values())
+
+	# Returns: a dict that maps each event type to its count and
+	# handler time, for a stage record.
+	def to_dict(self):
+		d = dict()
+		for eventtype in sorted(self.counts.keys()):
+			d[eventtype] = {'count': self.counts[eventtype],
+				'handler_s': self.times[eventtype]}
+		return d
+
+'''
+Prints the progress of a pass over a file every PROGRESS_INTERVAL
+seconds: the lines per second so far, and an ETA based on how far into
+the file the reader's offset is.
+'''
+class progress_meter:
+	tag = 'progress_meter'
+
+	name = None
+	f = None
+	totalbytes = None
+	begin = None
+	lastprint = None
+
+	def __init__(self, name, f):
+		tag = "{}.__init__".format(self.tag)
+
+		self.name = name
+		self.f = f
+		try:
+			self.totalbytes = os.fstat(f.fileno()).st_size
+		except (OSError, AttributeError, ValueError):
+			self.totalbytes = None
+		self.begin = time.perf_counter()
+		self.lastprint = self.begin
+
+		return
+
+	# Call this for every line; linenum is the number of lines read
+	# so far.
+	def update(self, linenum):
+		if linenum % PROGRESS_CHECK_LINES != 0:
+			return
+		now = time.perf_counter()
+		if now - self.lastprint < PROGRESS_INTERVAL:
+			return
+		self.lastprint = now
+		elapsed = now - self.begin
+		msg = "{}: {} lines, {:.0f} lines/sec".format(self.name, linenum,
+			linenum / elapsed)
+		if self.totalbytes:
+			try:
+				offset = self.f.tell()
+			except (OSError, ValueError):
+				offset = None
+			if offset:
+				fraction = offset / self.totalbytes
+				eta = elapsed * (1 - fraction) / fraction
+				msg += ", {:.1f}% done, ETA {:.0f} s".format(
+					100 * fraction, eta)
+		print(msg)
+		return
+
+##############################################################################
+
+# Returns: the git commit that the scripts are running from, or None.
+def source_version():
+	topdir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+	try:
+		version = subprocess.check_output(['git', 'describe', '--always',
+			'--dirty'], cwd=topdir, stderr=subprocess.DEVNULL)
+	except (OSError, subprocess.CalledProcessError):
+		return None
+	return version.decode().strip()
+
+# Returns: a dict with the totals of the stage records for each stage.
+def stage_totals(records):
+	totals = dict()
+	for record in records:
+		try:
+			total = totals[record['stage']]
+		except KeyError:
+			total = {'runs': 0, 'skipped': 0, 'wall_s': 0.0,
+				'cpu_s': 0.0, 'peak_rss_kb': 0}
+			totals[record['stage']] = total
+		if record.get('skipped'):
+			total['skipped'] += 1
+			continue
+		total['runs'] += 1
+		total['wall_s'] += record['wall_s']
+		total['cpu_s'] += record['cpu_s']
+		total['peak_rss_kb'] = max(total['peak_rss_kb'],
+				record['peak_rss_kb'])
+	return totals
+
+# Writes all of the stage records collected in this process (including
+# the ones added from worker processes) to STAGE_REPORT_FNAME in
+# outputdir, with the totals for each stage and enough information
+# about the run (the version of the scripts, the host and the command
+# line) to compare reports across versions.
+# Returns: the report's file name.
+def write_stage_report(outputdir, wall_s=None):
+	tag = 'write_stage_report'
+
+	report = dict()
+	report['report_version'] = STAGE_REPORT_VERSION
+	report['created'] = time.strftime('%Y-%m-%dT%H:%M:%S%z')
+	report['source_version'] = source_version()
+	report['python'] = platform.python_version()
+	report['host'] = platform.node()
+	report['argv'] = sys.argv
+	report['wall_s'] = wall_s
+	report['totals'] = stage_totals(stage_records)
+	report['stages'] = stage_records
+
+	fname = "{}/{}".format(outputdir, STAGE_REPORT_FNAME)
+	f = open(fname, 'w')
+	json.dump(report, f, indent=1, sort_keys=True)
+	f.write("\n")
+	f.close()
+	print_debug(tag, ("wrote {} stage records to {}").format(
+		len(stage_records), fname))
+
+	return fname
+
+if __name__ == '__main__':
+	print_error_exit("not an executable module")
@@ -3,6 +3,7 @@
 # Copyright (c) 2012-2014 Peter Hornyack and University of Washington
 
 from util.pjh_utils import *
+from analyze.debug_log import log_debug, log_enabled
 from analyze.simulate_segments_lib import *
 import trace.vm_common as vm
 
@@ -73,20 +74,20 @@ class vm_mapping:
 				"{1} or seg_size {2} or start_addr {3}").format(length,
 				perms_key, seg_size, hex(start_addr)))
 		if length == 0:
-			print_debug(tag, ("creating mapping with length 0 - this "
+			log_debug(tag, ("creating mapping with length 0 - this "
 				"had better be an initial stack mapping from "
-				"__bprm_mm_init()!").format())
+				"__bprm_mm_init()!"))
 		if length < vm.PAGE_SIZE_BYTES:
 			#print_warning(tag, ("creating mapping with length of {0} bytes, "
 			#	"which is less than expected minimum mapping ({1} "
 			#	"bytes)").format(length, vm.PAGE_SIZE_BYTES))
-			print_debug(tag, ("creating mapping with length of {0} bytes, "
+			log_debug(tag, ("creating mapping with length of {0} bytes, "
 				"which is less than expected minimum mapping ({1} "
-				"bytes)").format(length, vm.PAGE_SIZE_BYTES))
-		if length >= LARGE_VMA_THRESHOLD:
-			print_debug(tag, ("creating vma with length {0}, which is "
-				"beyond arbitrary LARGE_VMA_THRESHOLD").format(
-				pretty_bytes(length)))
+				"bytes)"), length, vm.PAGE_SIZE_BYTES)
+		if length >= LARGE_VMA_THRESHOLD and log_enabled(tag):
+			log_debug(tag, ("creating vma with length {0}, which is "
+				"beyond arbitrary LARGE_VMA_THRESHOLD"),
+				pretty_bytes(length))
 		if vma_op and vma_op not in VMA_OP_TYPES:
 			print_error_exit(tag, ("got vma_op={0} not in list of "
 				"VMA_OP_TYPES={1}").format(vma_op, VMA_OP_TYPES))
@@ -208,11 +209,11 @@ class vm_mapping:
 			self.write_count += 1
 		else:
 			print_error_exit(tag, ("unexpected op={0}").format(op))
-		print_debug(tag, ("vma [{0}, {1}]: {2} -> counts "
-			"= ({3}, {4}) this quantum, ({5}, {6}) ever.").format(
+		log_debug(tag, ("vma [{0}, {1}]: {2} -> counts "
+			"= ({3}, {4}) this quantum, ({5}, {6}) ever."),
 			self.start_addr, self.end_addr(), op,
 			self.read_count_quantum, self.write_count_quantum,
-			self.read_count, self.write_count))
+			self.read_count, self.write_count)
 		return
 
 	# Returns a tuple of the vma's (read_count_quantum,
@@ -299,7 +300,7 @@ class vm_mapping:
 				s = "{}".format(getattr(self, field))
 			else:
 				s += "\t{}".format(getattr(self, field))
-		print_debug(tag, ("marshalled: {}").format(s))
+		log_debug(tag, ("marshalled: {}"), s)
 		return s
 
 	def marshal_header(self):
@@ -319,9 +320,9 @@ class vm_mapping:
 		for i in range(0, len(in_fields)):
 			# http://docs.python.org/3/library/functions.html#setattr
 			setattr(self, self.marshal_fields[i], in_fields[i])
-			print_debug(tag, ("set self.{} = {}").format(
+			log_debug(tag, ("set self.{} = {}"),
 				self.marshal_fields[i],
-				getattr(self, self.marshal_fields[i])))
+				getattr(self, self.marshal_fields[i]))
 
 		# All of the values that we just set are strings - convert some
 		# of them to ints and bools:
@@ -469,10 +470,10 @@ def find_vm_mappings_in_range(proc_info, range_start, range_end):
 
 		if layout != "":
 			found.append((mapping, layout))
-			print_debug(tag, ("mapping [{0}, {1}] found to overlap "
-				"search range [{2}, {3}] - layout \"{4}\"").format(
-				hex(mapping.start_addr), hex(mapping.end_addr()),
-				hex(range_start), hex(range_end), layout))
+			log_debug(tag, ("mapping [{0:#x}, {1:#x}] found to overlap "
+				"search range [{2:#x}, {3:#x}] - layout \"{4}\""),
+				mapping.start_addr, mapping.end_addr(),
+				range_start, range_end, layout)
 	
 	return found
 
@@ -506,12 +507,16 @@ def split_vm_mapping(proc_info, split_addr, length, unmap, to_seg_size,
 		return None
 	orig_end_addr = orig_entry.start_addr + orig_entry.length - 1
 	split_end_addr = split_addr + length - 1
-	print_debug(tag, ("orig_entry: {0}").format(orig_entry.to_str()))
-	print_debug(tag, ("splitting mapping [{0}, {1}] (length {2}) at "
-		"subregion [{3}, {4}] (length={5}); unmap={6}, perms_key={7}").format(
-		hex(orig_entry.start_addr), hex(orig_end_addr), orig_entry.length,
-		hex(split_addr), hex(split_end_addr), length,
-		unmap, perms_key))
+	# This is called for every vma split, so the to_str()s are only
+	# called when their messages will actually be printed.
+	debug = log_enabled(tag)
+	if debug:
+		log_debug(tag, ("orig_entry: {0}"), orig_entry.to_str())
+	log_debug(tag, ("splitting mapping [{0:#x}, {1:#x}] (length {2}) at "
+		"subregion [{3:#x}, {4:#x}] (length={5}); unmap={6}, "
+		"perms_key={7}"), orig_entry.start_addr, orig_end_addr,
+		orig_entry.length, split_addr, split_end_addr, length,
+		unmap, perms_key)
 
 	# Determine whether or not this mapping "split" is also going to
 	# EXTEND the existing mapping beyond its current boundary. This must
@@ -532,9 +537,9 @@ def split_vm_mapping(proc_info, split_addr, length, unmap, to_seg_size,
 		extend = True
 		print_error_exit(tag, ("disabling extend code in this function; "
 			"handler it in caller instead!").format())
-		print_debug(tag, ("extending orig_end_addr {0} to split_end_addr "
-			"{1} with this unmap={2} operation").format(
-			hex(orig_end_addr), hex(split_end_addr), unmap))
+		log_debug(tag, ("extending orig_end_addr {0:#x} to "
+			"split_end_addr {1:#x} with this unmap={2} operation"),
+			orig_end_addr, split_end_addr, unmap)
 		test = find_vm_mapping(proc_info, split_end_addr, starts_at=False)
 		if test is not None:
 			#print_error_exit(tag, ("extended split_end_addr {0} actually "
@@ -569,16 +574,17 @@ def split_vm_mapping(proc_info, split_addr, length, unmap, to_seg_size,
 		pre_seg_size = to_seg_size(pre_length)
 		pre_entry = vm_mapping(orig_entry.start_addr, pre_length,
 			orig_entry.perms_key, pre_seg_size)
-		print_debug(tag, ("new pre_entry for vmatable: {0}").format(
-			pre_entry.to_str()))
+		if debug:
+			log_debug(tag, ("new pre_entry for vmatable: {0}"),
+				pre_entry.to_str())
 	else:
 		if split_addr != orig_entry.start_addr:   # sanity check
 			print_error_exit(tag, ("unexpected: split_addr {0} does not "
 				"match orig_entry.start_addr {1}").format(hex(split_addr),
 				hex(orig_entry.split_addr)))
 		pre_entry = None
-		print_debug(tag, ("split_addr matches orig_entry.start_addr {0}, so "
-			"no pre_entry").format(hex(orig_entry.start_addr)))
+		log_debug(tag, ("split_addr matches orig_entry.start_addr "
+			"{0:#x}, so no pre_entry"), orig_entry.start_addr)
 
 	# If unmap is not set, then create a new entry that is a modification
 	# of the original entry, with the new perms_key passed as an arg to
@@ -591,12 +597,13 @@ def split_vm_mapping(proc_info, split_addr, length, unmap, to_seg_size,
 		# sure that no post_entry is constructed.
 		mod_seg_size = to_seg_size(length)
 		mod_entry = vm_mapping(split_addr, length, perms_key, mod_seg_size)
-		print_debug(tag, ("modified mod_entry for vmatable: "
-			"{0}").format(mod_entry.to_str()))
+		if debug:
+			log_debug(tag, ("modified mod_entry for vmatable: "
+				"{0}"), mod_entry.to_str())
 	else:
 		mod_entry = None
-		print_debug(tag, ("unmap=True, so not modifying+replacing the "
-			"orig_entry").format())
+		log_debug(tag, ("unmap=True, so not modifying+replacing the "
+			"orig_entry"))
 
 	# Finally, create a "post" mapping for the un-modified region beyond
 	# the end address of the modified region, if it exists.
@@ -610,14 +617,14 @@ def split_vm_mapping(proc_info, split_addr, length, unmap, to_seg_size,
 		post_seg_size = to_seg_size(post_length)
 		post_entry = vm_mapping(post_start_addr, post_length,
 			orig_entry.perms_key, post_seg_size)
-		print_debug(tag, ("new post_entry for vmatable: "
-			"{0}").format(post_entry.to_str()))
+		if debug:
+			log_debug(tag, ("new post_entry for vmatable: "
+				"{0}"), post_entry.to_str())
 	else:
 		post_entry = None
-		print_debug(tag, ("split_end_addr {0} matches or is beyond "
-			"orig_end_addr {1} (extend={2}), so not adding a "
-			"post_entry").format(hex(split_end_addr), hex(orig_end_addr),
-			extend))
+		log_debug(tag, ("split_end_addr {0:#x} matches or is beyond "
+			"orig_end_addr {1:#x} (extend={2}), so not adding a "
+			"post_entry"), split_end_addr, orig_end_addr, extend)
 
 	new_entries = []
 	updated_length = 0
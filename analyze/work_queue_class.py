@@ -0,0 +1,413 @@
+# Virtual memory analysis scripts.
+# Developed 2012-2014 by Peter Hornyack, pjh@cs.washington.edu
+# Copyright (c) 2012-2014 Peter Hornyack and University of Washington
+
+from util.pjh_utils import *
+import json
+import platform
+import shutil
+import threading
+import time
+
+PENDING_DIR = 'pending'
+CLAIMED_DIR = 'claimed'
+DONE_DIR = 'done'
+FAILED_DIR = 'failed'
+CLOSED_FNAME = 'closed'
+CURRENT_FNAME = 'current'
+TASK_SUFFIX = '.task'
+RESULT_SUFFIX = '.result'
+HEARTBEAT_INTERVAL = 10.0
+LEASE_TIMEOUT = 120.0
+  # A claimed task whose worker hasn't sent a heartbeat for this many
+  # seconds is put back into the queue. This is compared against the
+  # claimed file's mtime, which on NFS is set by the server, so it
+  # should be much longer than HEARTBEAT_INTERVAL plus any clock skew
+  # between the machines.
+POLL_INTERVAL = 1.0
+
+'''
+A work queue in a directory, e.g. on a file system that several
+machines share (NFS), so that the analysis of a measurement dir can be
+spread across them. Each run of the coordinator gets a new generation
+of the queue: reset() creates a new generation dir in the queue dir and
+then points the queue dir's current file at it, so that workers that
+are already polling the queue (e.g. ones that were started before the
+coordinator) never see a half-reset queue or an earlier run's closed
+marker; a worker follows the current file to each new generation, and
+only exits when a generation that it has seen open is closed. Each task
+is a small JSON file that moves through the generation's subdirectories
+by atomic renames:
+  pending/ID.task: enqueue() writes the task to a temporary file and
+    renames it here, so workers never see a partial task.
+  claimed/ID@WORKER.task: a worker claims a task by renaming it here;
+    if two workers try to claim the same task, only one rename
+    succeeds. While the task runs, the worker touches the file every
+    HEARTBEAT_INTERVAL seconds; if its mtime gets older than
+    LEASE_TIMEOUT (e.g. because the worker's machine died), any
+    worker or the coordinator renames it back into pending/.
+  done/ID.task (and done/ID.result, with the task's result) or
+  failed/ID.task (and failed/ID.result, with the error).
+The coordinator enqueues tasks and wait()s for them, and the workers
+work() until the coordinator close()s the queue. The tasks' outputs
+themselves go wherever the tasks put them (e.g. the usual analysis
+dirs); only small results go through the queue.
+'''
+class work_queue:
+	tag = 'work_queue'
+
+	queuedir = None
+	generation = None   # name of the generation dir in the queuedir
+	seen_open = None    # True once this generation was seen not closed
+	workerid = None
+	nextseq = None
+
+	def __init__(self, queuedir):
+		tag = "{}.__init__".format(self.tag)
+
+		self.queuedir = queuedir
+		self.workerid = "{}-{}".format(platform.node(), os.getpid())
+		self.nextseq = 0
+		self.follow_generation()
+
+		return
+
+	def current_fname(self):
+		return "{}/{}".format(self.queuedir, CURRENT_FNAME)
+
+	def gendir(self):
+		return "{}/{}".format(self.queuedir, self.generation)
+
+	def subdir(self, name):
+		return "{}/{}".format(self.gendir(), name)
+
+	# Switches to the generation that the queue's current file points
+	# at, if it has changed.
+	# Returns: True if there is a current generation.
+	def follow_generation(self):
+		tag = "{}.follow_generation".format(self.tag)
+
+		current = read_json(self.current_fname())
+		if not current:
+			return self.generation is not None
+		generation = current['generation']
+		if generation != self.generation:
+			if self.generation is not None:
+				print_debug(tag, ("{} moving from generation {} to "
+					"{}").format(self.workerid, self.generation,
+					generation))
+			self.generation = generation
+			self.seen_open = False
+		return True
+
+	def task_fname(self, subdir, taskid):
+		return "{}/{}{}".format(self.subdir(subdir), taskid, TASK_SUFFIX)
+
+	def result_fname(self, subdir, taskid):
+		return "{}/{}{}".format(self.subdir(subdir), taskid, RESULT_SUFFIX)
+
+	def claimed_fname(self, taskid):
+		return "{}/{}@{}{}".format(self.subdir(CLAIMED_DIR), taskid,
+			self.workerid, TASK_SUFFIX)
+
+	# Starts a new, empty generation of the queue and makes it the
+	# current one, then removes the dirs of earlier generations that
+	# were closed (their workers have left them or will follow the
+	# current file to the new one). Only the coordinator should call
+	# this, before any tasks are enqueued.
+	def reset(self):
+		tag = "{}.reset".format(self.tag)
+
+		generation = "gen-{:.6f}-{}".format(time.time(), self.workerid)
+		for name in [PENDING_DIR, CLAIMED_DIR, DONE_DIR, FAILED_DIR]:
+			os.makedirs("{}/{}/{}".format(self.queuedir, generation,
+				name))
+		write_json_atomic(self.current_fname(),
+			{'generation': generation})
+		self.generation = generation
+		self.seen_open = False
+		self.nextseq = 0
+
+		for name in os.listdir(self.queuedir):
+			d = "{}/{}".format(self.queuedir, name)
+			if (name != generation and os.path.isdir(d) and
+				os.path.exists("{}/{}".format(d, CLOSED_FNAME))):
+				shutil.rmtree(d, ignore_errors=True)
+		print_debug(tag, ("reset work queue in {}, generation "
+			"{}").format(self.queuedir, generation))
+
+		return
+
+	# Adds a task to the queue. Pending tasks are claimed in the order
+	# that they were enqueued. task is a dict that json can serialize;
+	# its 'kind' says what the worker should do with it.
+	# Returns: the new task's id.
+	def enqueue(self, kind, task):
+		tag = "{}.enqueue".format(self.tag)
+
+		taskid = "{:06d}-{}".format(self.nextseq, kind)
+		self.nextseq += 1
+		task = dict(task)
+		task['kind'] = kind
+		task['id'] = taskid
+		write_json_atomic(self.task_fname(PENDING_DIR, taskid), task)
+		print_debug(tag, ("enqueued task {}").format(taskid))
+
+		return taskid
+
+	# Claims the first pending task that no other worker claims first.
+	# Returns: a (taskid, task) tuple, or (None, None) if there are no
+	# pending tasks.
+	def claim(self):
+		tag = "{}.claim".format(self.tag)
+
+		if self.generation is None:
+			return (None, None)
+		try:
+			fnames = sorted(os.listdir(self.subdir(PENDING_DIR)))
+		except FileNotFoundError:
+			return (None, None)
+		for fname in fnames:
+			if fname.startswith('.') or not fname.endswith(TASK_SUFFIX):
+				continue
+			taskid = fname[:-len(TASK_SUFFIX)]
+			pending = self.task_fname(PENDING_DIR, taskid)
+			claimed = self.claimed_fname(taskid)
+			try:
+				# Touch the task first, so that it doesn't look stale
+				# (rename keeps the mtime from when it was enqueued)
+				# the moment it's claimed.
+				os.utime(pending)
+				os.rename(pending, claimed)
+			except FileNotFoundError:
+				continue   # another worker got it first
+			task = read_json(claimed)
+			if task is None:
+				self.move_claimed(taskid, FAILED_DIR,
+					"could not read task file")
+				continue
+			print_debug(tag, ("{} claimed task {}").format(self.workerid,
+				taskid))
+			return (taskid, task)
+
+		return (None, None)
+
+	# Moves a task that this worker claimed into the done or failed dir,
+	# along with its result (or error).
+	def move_claimed(self, taskid, subdir, result):
+		tag = "{}.move_claimed".format(self.tag)
+
+		write_json_atomic(self.result_fname(subdir, taskid), result)
+		try:
+			os.rename(self.claimed_fname(taskid),
+				self.task_fname(subdir, taskid))
+		except FileNotFoundError:
+			print_warning(tag, ("{} lost its lease on task {} (it was "
+				"put back into the queue), so it may be run "
+				"again").format(self.workerid, taskid))
+		return
+
+	def complete(self, taskid, result):
+		self.move_claimed(taskid, DONE_DIR, result)
+		return
+
+	def fail(self, taskid, error):
+		self.move_claimed(taskid, FAILED_DIR, error)
+		return
+
+	# Puts claimed tasks whose workers haven't sent a heartbeat for
+	# LEASE_TIMEOUT seconds back into the queue.
+	# Returns: the number of tasks that were put back.
+	def recover_stale(self):
+		tag = "{}.recover_stale".format(self.tag)
+
+		recovered = 0
+		now = time.time()
+		if self.generation is None:
+			return 0
+		try:
+			fnames = os.listdir(self.subdir(CLAIMED_DIR))
+		except FileNotFoundError:
+			return 0
+		for fname in fnames:
+			if not fname.endswith(TASK_SUFFIX):
+				continue
+			claimed = "{}/{}".format(self.subdir(CLAIMED_DIR), fname)
+			try:
+				age = now - os.stat(claimed).st_mtime
+			except FileNotFoundError:
+				continue
+			if age < LEASE_TIMEOUT:
+				continue
+			(taskid, sep, workerid) = fname[:-len(TASK_SUFFIX)].partition(
+					'@')
+			try:
+				os.rename(claimed, self.task_fname(PENDING_DIR, taskid))
+			except FileNotFoundError:
+				continue
+			print_warning(tag, ("worker {} hasn't sent a heartbeat for "
+				"task {} in {:.0f} seconds, put it back into the "
+				"queue").format(workerid, taskid, age))
+			recovered += 1
+
+		return recovered
+
+	# Runs a task that this worker claimed: runfn(task) is called while
+	# a background thread sends heartbeats for it, and its return value
+	# (which json must be able to serialize) becomes the task's result.
+	# If runfn raises an exception (or calls print_error_exit()), the
+	# task fails.
+	# Returns: True if the task was completed.
+	def run_claimed(self, taskid, task, runfn):
+		tag = "{}.run_claimed".format(self.tag)
+
+		stop = threading.Event()
+		heartbeat = threading.Thread(target=send_heartbeats,
+				args=(self.claimed_fname(taskid), stop))
+		heartbeat.daemon = True
+		heartbeat.start()
+		try:
+			result = runfn(task)
+			error = None
+		except SystemExit:
+			error = "task exited"
+		except Exception as e:
+			error = "{}: {}".format(type(e).__name__, e)
+		finally:
+			stop.set()
+			heartbeat.join()
+
+		if error:
+			print_error(tag, ("task {} failed: {}").format(taskid, error))
+			self.fail(taskid, error)
+			return False
+		self.complete(taskid, result)
+		return True
+
+	# Claims and runs one pending task, if there is one.
+	# Returns: True if a task was claimed.
+	def work_one(self, runfn):
+		(taskid, task) = self.claim()
+		if taskid is None:
+			return False
+		self.run_claimed(taskid, task, runfn)
+		return True
+
+	# Worker loop: runs tasks until the coordinator closes the queue and
+	# there's nothing left to do. A worker that finds the queue already
+	# closed when it starts (i.e. the previous run's generation) waits
+	# for the coordinator to reset() it instead.
+	def work(self, runfn):
+		tag = "{}.work".format(self.tag)
+
+		print_debug(tag, ("worker {} working on queue {}").format(
+			self.workerid, self.queuedir))
+		while True:
+			self.follow_generation()
+			if self.work_one(runfn):
+				continue
+			if self.is_closed():
+				if self.seen_open:
+					break
+			elif self.generation is not None:
+				self.seen_open = True
+			self.recover_stale()
+			time.sleep(POLL_INTERVAL)
+
+		return
+
+	# Returns: the status of the task: 'done', 'failed' or None (still
+	# pending or running).
+	def status(self, taskid):
+		for subdir in [DONE_DIR, FAILED_DIR]:
+			if os.path.exists(self.task_fname(subdir, taskid)):
+				return subdir
+		return None
+
+	# Waits for all of the tasks in taskids to be done or to fail. If
+	# runfn is set, the caller works on pending tasks itself while it
+	# waits, so that the queue makes progress even without any other
+	# workers.
+	# Returns: a (results, errors) tuple of dicts that map the task ids
+	# to their results, for the tasks that were done, or to their
+	# errors, for the tasks that failed.
+	def wait(self, taskids, runfn=None):
+		tag = "{}.wait".format(self.tag)
+
+		results = dict()
+		errors = dict()
+		remaining = list(taskids)
+		while remaining:
+			stillwaiting = []
+			for taskid in remaining:
+				status = self.status(taskid)
+				if status == DONE_DIR:
+					results[taskid] = read_json(self.result_fname(
+						DONE_DIR, taskid))
+				elif status == FAILED_DIR:
+					errors[taskid] = read_json(self.result_fname(
+						FAILED_DIR, taskid))
+				else:
+					stillwaiting.append(taskid)
+			remaining = stillwaiting
+			if not remaining:
+				break
+			if runfn and self.work_one(runfn):
+				continue
+			self.recover_stale()
+			time.sleep(POLL_INTERVAL)
+
+		print_debug(tag, ("{} tasks done, {} failed").format(len(results),
+			len(errors)))
+		return (results, errors)
+
+	# Tells the workers that no more tasks will be enqueued, so they
+	# exit once the queue is empty.
+	def close(self):
+		f = open("{}/{}".format(self.gendir(), CLOSED_FNAME), 'w')
+		f.close()
+		return
+
+	def is_closed(self):
+		if self.generation is None:
+			return False
+		return os.path.exists("{}/{}".format(self.gendir(), CLOSED_FNAME))
+
+# Touches the claimed task file fname every HEARTBEAT_INTERVAL seconds
+# until stop is set.
+def send_heartbeats(fname, stop):
+	tag = 'send_heartbeats'
+
+	while not stop.wait(HEARTBEAT_INTERVAL):
+		try:
+			os.utime(fname)
+		except FileNotFoundError:
+			print_warning(tag, ("{} is gone, the task's lease was "
+				"lost").format(fname))
+			break
+	return
+
+# Writes obj as json to a temporary file in the same directory as fname,
+# then renames it to fname.
+def write_json_atomic(fname, obj):
+	(dirname, basename) = os.path.split(fname)
+	tmp_fname = "{}/.{}.tmp{}".format(dirname, basename, os.getpid())
+	f = open(tmp_fname, 'w')
+	json.dump(obj, f)
+	f.close()
+	os.rename(tmp_fname, fname)
+	return
+
+# Returns: the json object in the file fname, or None if it couldn't be
+# read.
+def read_json(fname):
+	try:
+		f = open(fname, 'r')
+		obj = json.load(f)
+		f.close()
+	except (OSError, ValueError):
+		return None
+	return obj
+
+if __name__ == '__main__':
+	print_error_exit("not an executable module")
@@ -4,12 +4,17 @@
 # Developed 2012-2014 by Peter Hornyack, pjh@cs.washington.edu
 # Copyright (c) 2012-2014 Peter Hornyack and University of Washington
 
+import time
+startup_begin = time.perf_counter()
+  # see check_startup_time() in run_common.py
+
 from analyze.argparsers import *
 from analyze.CheckpointEvent import CheckpointEvent
 from analyze.cpus_tracker_class import *
 from analyze.cpu_information_class import *
 from analyze.ip_to_fn import *
 from trace.run_common import *
+from trace.traceinfo_class import read_trace_losses, PERF_DATA
 from plotting.multiapp_plot_class import *
 from analyze.PageEvent import PageEvent
 from analyze.RssEvent import RssEvent
@@ -18,15 +23,14 @@ from plotting.PlotEvent import PlotEvent
 from analyze.process_group_class import *
 from analyze.PTE import PTE, pte_get_linked_vma
 from analyze.simulate_segments_lib import *
+from analyze.stage_report_class import *
+from analyze.debug_log import *
 from analyze.vm_mapping_class import *
 from conf.system_conf import *
 import trace.vm_common as vm
 import conf.PlotList as PlotList
 import plotting.plots_common as plots
-import plotting.plot_os_overheads as plot_os_overheads
-import plotting.plot_vma_sizes as plot_vma_sizes
-import plotting.plot_vaspace as plot_vaspace
-import plotting.plot_vmacount as plot_vmacount
+from plotting.plotdata_store_class import plotdata_store_files
 import os
 import re
 import shlex
@@ -1660,7 +1664,8 @@ def is_exit_event(vma_match):
 # event_match: comes from trace_event_re.
 # Returns: a PlotEvent object.
 def handle_trace_marker(event_match, proc_tracker, outputdir,
-		group_multiproc, target_pids, current_appname):
+		group_multiproc, target_pids, current_appname,
+		make_plot_event=True):
 	tag = 'handle_trace_mark'
 
 	# Plan for this method:
@@ -1721,7 +1726,9 @@ def handle_trace_marker(event_match, proc_tracker, outputdir,
 	for proc_info in proc_tracker.get_all_process_infos():
 		proc_info.reset_sim_data('cp')
 
-	# Create a plot event:
+	# Create a plot event, unless no plot consumes checkpoints:
+	if not make_plot_event:
+		return None
 	cp_event = CheckpointEvent(kernel_timestamp, current_appname, cp_name)
 	plot_event = PlotEvent(cp_event=cp_event)
 
@@ -2120,10 +2127,11 @@ def process_sched_trace_event(trace_event, event_match, cpu_tracker,
 
 	return
 
-# Handles an mm_rss trace event.
+# Handles an mm_rss trace event. The process' rss counts are always
+# updated, but a PlotEvent is only created if make_plot_event is True.
 # Returns: a PlotEvent object on success, or None if there was an error
 #   or we don't care about this event for plotting purposes.
-def process_mm_rss(event_match, proc_tracker, proc_info):
+def process_mm_rss(event_match, proc_tracker, proc_info, make_plot_event):
 	tag = 'process_mm_rss'
 
 	rss_event_msg = event_match.group('event_msg').strip()
@@ -2164,6 +2172,8 @@ def process_mm_rss(event_match, proc_tracker, proc_info):
 	if not ret:
 		print_error(tag, ("set_rss_pages returned error"))
 		return None
+	if not make_plot_event:
+		return None
 
 	rss_pages = proc_info.get_rss_pages()
 	rss_event = RssEvent(rss_pages, kernel_timestamp)
@@ -2243,11 +2253,12 @@ def process_pte_mapped(event_match, vma_match, proc_tracker, proc_info):
 
 	return plot_event
 
-# Handles a pte_* trace event.
+# Handles a pte_* trace event. pte_mapped events only create a PlotEvent
+# (and are only parsed at all) if make_plot_event is True.
 # Returns: a PlotEvent object on success, or None if there was an error
 #   or we don't care about this event for plotting purposes.
 def process_pte_trace_event(event_match, vma_match, proc_tracker, tgid,
-		linenum, usermodule, userfn):
+		linenum, usermodule, userfn, make_plot_event):
 	tag = 'process_pte_trace_event'
 
 	pte_event_type = event_match.group('trace_event').strip()
@@ -2258,8 +2269,9 @@ def process_pte_trace_event(event_match, vma_match, proc_tracker, tgid,
 	# Switch on pte_event_type, which corresponds to a particular trace
 	# event declared in include/trace/events/pte.h.
 	if pte_event_type == 'pte_mapped':
-		plot_event = process_pte_mapped(event_match, vma_match,
-				proc_tracker, proc_info)
+		if make_plot_event:
+			plot_event = process_pte_mapped(event_match, vma_match,
+					proc_tracker, proc_info)
 	elif pte_event_type == 'pte_update':
 		pass
 	elif pte_event_type == 'pte_at':
@@ -2304,7 +2316,7 @@ def process_pte_trace_event(event_match, vma_match, proc_tracker, tgid,
 # Returns: a PlotEvent object on success, or None if there was an error
 #   or we don't care about this event for plotting purposes.
 def process_rss_trace_event(event_match, proc_tracker, tgid,
-		linenum, usermodule, userfn):
+		linenum, usermodule, userfn, make_plot_event):
 	tag = 'process_rss_trace_event'
 
 	#print_debug(tag, ("got rss event: {}").format(event_match.groups()))
@@ -2320,7 +2332,8 @@ def process_rss_trace_event(event_match, proc_tracker, tgid,
 	# Switch on rss_event_type, which corresponds to a particular trace
 	# event declared in include/trace/events/rss.h.
 	if rss_event_type == 'mm_rss':
-		plot_event = process_mm_rss(event_match, proc_tracker, proc_info)
+		plot_event = process_mm_rss(event_match, proc_tracker, proc_info,
+				make_plot_event)
 	elif rss_event_type == 'mm_rss_notcurrent':
 		print_error_exit(tag, "TODO: implement rss_event_type={}".format(
 			rss_event_type))
@@ -2778,7 +2791,7 @@ def determine_trace_event_type(event_match):
 
 def process_trace_file(trace_f, proc_tracker, outputdir, group_multiproc,
 		process_userstacks, lookup_fns, target_pids, plotlist,
-		current_appname, skip_page_events):
+		current_appname, skip_page_events, events=None):
 	tag = "process_trace_file"
 
 	cpu_tracker = cpus_tracker()
@@ -2800,14 +2813,35 @@ def process_trace_file(trace_f, proc_tracker, outputdir, group_multiproc,
 		print_debug(tag, ("skip_page_events True, will skip all "
 			"pte_* trace events").format())
 
+	# Only pass each PlotEvent to the plots that consume its kind, and
+	# don't create PlotEvents for kinds that no plot consumes.
+	routes = plot_routing_table(plotlist)
+	want_page_events = routes.wants('page_event')
+	want_rss_events = routes.wants('rss_event')
+	want_cp_events = routes.wants('cp_event')
+
+	# If events (an event_stats) is set, count each trace event and the
+	# time it takes to handle it, from after its line has matched
+	# trace_event_re until the next line is read. (Timing it from the
+	# top of the loop means that none of the "continue"s below can skip
+	# the count.) The per-line debug message is only formatted if the
+	# trace level is on for this method (see debug_log.py).
+	progress = progress_meter(current_appname, trace_f)
+	trace_lines = log_enabled(tag, LOG_TRACE)
+	event_begin = None
 	linenum = 0
 	line = None
 	while True:
+		if event_begin:
+			events.end(trace_event, event_begin)
+			event_begin = None
 		linenum += 1
 		line = trace_f.readline()
 		if not line:
 			break
-		print_debug(current_appname, "line #:\t{0}".format(linenum))
+		progress.update(linenum)
+		if __debug__ and trace_lines:
+			print_debug(current_appname, "line #:\t{0}".format(linenum))
 		#if linenum == 1 + 160587:
 		#	print_error_exit(tag, ("stopping after line {}").format(linenum-1))
 
@@ -2863,6 +2897,9 @@ def process_trace_file(trace_f, proc_tracker, outputdir, group_multiproc,
 
 		# Code for kernel events:
 		if event_match:
+			trace_event = event_match.group('trace_event')
+			if events:
+				event_begin = events.begin()
 			trace_event_type = determine_trace_event_type(event_match)
 			if (skip_page_events and
 				(trace_event_type == 'pte' or trace_event_type == 'pmd')):
@@ -2875,7 +2912,6 @@ def process_trace_file(trace_f, proc_tracker, outputdir, group_multiproc,
 			#cpu = int(event_match.group('cpu'))
 			#flags = event_match.group('flags')
 			#kernel_timestamp = float(event_match.group('timestamp'))
-			trace_event = event_match.group('trace_event')
 			event_msg = event_match.group('event_msg')
 
 			# Possibly use the tgid from this event to override the pid
@@ -2983,22 +3019,25 @@ def process_trace_file(trace_f, proc_tracker, outputdir, group_multiproc,
 				(is_plot_event, modifiedvma) = process_mmap_trace_event(
 					event_match, vma_match, proc_tracker, tgid,
 					linenum, usermodule, userfn)
-				if is_plot_event and modifiedvma:
+				if (is_plot_event and modifiedvma and
+						routes.wants_vma(modifiedvma)):
 					plot_event = PlotEvent(vma=modifiedvma)
 			elif (trace_event_type == 'pte' or 
 					trace_event_type == 'pmd'):
 				plot_event = process_pte_trace_event(
 					event_match, vma_match, proc_tracker, tgid,
-					linenum, usermodule, userfn)
+					linenum, usermodule, userfn, want_page_events)
 			elif trace_event_type == 'rss':
 				# vma_match will be None!
 				plot_event = process_rss_trace_event(
 					event_match, proc_tracker, tgid,
-					linenum, usermodule, userfn)
+					linenum, usermodule, userfn, want_rss_events)
 			elif trace_event_type == 'sched':
 				(is_plot_event, modifiedvma) = process_sched_trace_event(
 					trace_event, event_match, cpu_tracker, proc_tracker)
-				if is_plot_event or modifiedvma:
+				# (A PlotEvent without a vma has nothing in it for any
+				# plot to consume.)
+				if modifiedvma and routes.wants_vma(modifiedvma):
 					plot_event = PlotEvent(vma=modifiedvma)
 			elif trace_event_type == 'syscall':
 				print_error_exit(tag, ("not implemented yet: "
@@ -3011,7 +3050,7 @@ def process_trace_file(trace_f, proc_tracker, outputdir, group_multiproc,
 				# the application's execution.
 				plot_event = handle_trace_marker(event_match, proc_tracker,
 						outputdir, group_multiproc, target_pids,
-						current_appname)
+						current_appname, want_cp_events)
 				#print_debug(tag, ("handle_trace_marker returned a "
 				#	"plot_event with cp_event={}").format(
 				#	plot_event.cp_event))
@@ -3028,9 +3067,12 @@ def process_trace_file(trace_f, proc_tracker, outputdir, group_multiproc,
 					print_error_exit(tag, ("proc_info pid doesn't "
 						"match tgid before calling handle_plot_event! "
 						"{} {}").format(proc_info.get_pid(), tgid))
-				handle_plot_event(plot_event, plotlist, tgid, target_pids,
-					proc_tracker, group_multiproc, current_appname,
-					tgid_for_stats, skip_irrelevant_processes)
+				eventplots = routes.plots_for(plot_event)
+				if eventplots:
+					handle_plot_event(plot_event, eventplots, tgid,
+						target_pids, proc_tracker, group_multiproc,
+						current_appname, tgid_for_stats,
+						skip_irrelevant_processes)
 
 		else:
 			print_error_exit(tag, ("hit dead code path for Pin events"))
@@ -3041,7 +3083,7 @@ def process_trace_file(trace_f, proc_tracker, outputdir, group_multiproc,
 	if ip_to_fn:
 		ip_to_fn.close()
 
-	return
+	return linenum - 1
 
 # if add_fn is None, then just add using '+'
 def add_maps(dest, src, add_fn):
@@ -4324,6 +4366,10 @@ def make_vaspace_plots(proc_group, timestamp, current_appname,
 		app_pid, descr, outputdir):
 	tag = 'make_vaspace_plots'
 
+	# Plot modules are only imported when they're needed (see the
+	# comments in conf/PlotList.py).
+	import plotting.plot_vaspace as plot_vaspace
+
 	num_processes = len(proc_group)
 
 	# We'll construct the VA-space plots right here + now, in their
@@ -4493,37 +4539,38 @@ def analyze_point_in_time(analysisdir, outputdir, proc_group,
 	# not outputdir, to store the series data files; pass the
 	# descr arg to distinguish different points in time.
 	if 'os_overheads_plot' in PlotList.point_in_time_plotlist:
-		os_overheads_plot = plot_os_overheads.new_os_overheads_plot(
-				descr, analysisdir)
+		os_overheads_plot = PlotList.new_plot(
+				'plot_os_overheads.new_os_overheads_plot', descr, analysisdir)
 		newplots.append(os_overheads_plot)
 
 	if 'basepagesize_plot' in PlotList.point_in_time_plotlist:
-		bps_plot = plot_os_overheads.new_basepagesize_plot(descr, analysisdir)
+		bps_plot = PlotList.new_plot(
+				'plot_os_overheads.new_basepagesize_plot', descr, analysisdir)
 		newplots.append(bps_plot)
 
 	if 'max_vmas_plot' in PlotList.point_in_time_plotlist:
-		max_vmas_plot = plot_vmacount.new_max_vmas_cols_plot(
-				descr, analysisdir)
+		max_vmas_plot = PlotList.new_plot(
+				'plot_vmacount.new_max_vmas_cols_plot', descr, analysisdir)
 		newplots.append(max_vmas_plot)
 
 	if 'vma_categories_plot' in PlotList.point_in_time_plotlist:
-		categories_cols_plot = plot_vmacount.new_categories_cols_plot(
-				descr, analysisdir)
+		categories_cols_plot = PlotList.new_plot(
+				'plot_vmacount.new_categories_cols_plot', descr, analysisdir)
 		newplots.append(categories_cols_plot)
 
 	if 'vma_size_cols_plot' in PlotList.point_in_time_plotlist:
-		vma_size_cols_plot = plot_vma_sizes.new_vma_size_cols_plot(
-				descr, analysisdir)
+		vma_size_cols_plot = PlotList.new_plot(
+				'plot_vma_sizes.new_vma_size_cols_plot', descr, analysisdir)
 		newplots.append(vma_size_cols_plot)
 
 	if 'vma_size_cdf_plot' in PlotList.point_in_time_plotlist:
-		vma_size_cdf_plot = plot_vma_sizes.new_vma_size_cdf_plot(
-				descr, analysisdir)
+		vma_size_cdf_plot = PlotList.new_plot(
+				'plot_vma_sizes.new_vma_size_cdf_plot', descr, analysisdir)
 		newplots.append(vma_size_cdf_plot)
 
 	if 'vma_size_portion_plot' in PlotList.point_in_time_plotlist:
-		vma_size_portion_plot = plot_vma_sizes.new_vma_size_portion_plot(
-				descr, analysisdir)
+		vma_size_portion_plot = PlotList.new_plot(
+				'plot_vma_sizes.new_vma_size_portion_plot', descr, analysisdir)
 		newplots.append(vma_size_portion_plot)
 
 	# Process the active_vmas for each of these point-in-time plots:
@@ -4841,15 +4888,16 @@ def cleanup(trace_f, output_f):
 	
 	return
 
-# Resets all of the plots in PlotList.analysis_plotlist, and sets their
+# Resets all of the plots in PlotList.analysis_plotlist (and in
+# PlotList.perf_analysis_plotlist, if with_perf is True), and sets their
 # workingdir and appname using the arguments to this method.
 # Returns: nothing.
-def setup_multiapp_plots(outputdir, appname):
+def setup_multiapp_plots(outputdir, appname, with_perf=False):
 	tag = 'setup_multiapp_plots'
 
 	print_debug(tag, ("setting all plots in analysis_plotlist to use "
 		"basedir {}").format(outputdir))
-	for plot in PlotList.analysis_plotlist:
+	for plot in PlotList.get_analysis_plotlist(with_perf):
 		# The plot objects will be reused across analysis calls, so
 		# make sure to reset() them first!
 		print_debug(tag, ("before call to set_workingdir, plot has "
@@ -4919,6 +4967,28 @@ def handle_args(argv):
 		args.process_userstacks, args.lookup_fns, args.appname,
 		args.target_pids, args.skip_page_events)
 
+# Returns: True if appdir has a perf.data file (see traceinfo.PERF_DATA)
+# for the perf analysis.
+def has_perf_data(appdir):
+	return os.path.isfile("{}/{}".format(appdir, PERF_DATA))
+
+# Returns: an (inputs, outputs) tuple with the lists of files that
+# analyze_main() reads and writes when it analyzes the trace_fname in
+# appdir, for the pipeline_stage in generate_plots.py. Note that the
+# point-in-time plots are made from the process tracker that is built
+# while the trace is processed, so they're part of this stage rather
+# than a stage of their own.
+def analyze_stage_files(trace_fname, appdir):
+	analysisdir = "{}/{}".format(appdir, analysisdirname)
+	inputs = [trace_fname, "{}/{}".format(appdir, targetpidsfile)]
+	if has_perf_data(appdir):
+		# The plots in PlotList.perf_analysis_plotlist are only made
+		# when it's there.
+		inputs.append("{}/{}".format(appdir, PERF_DATA))
+	outputs = (["{}/{}".format(appdir, PROCESS_GROUPS_NAME)] +
+		plotdata_store_files(analysisdir))
+	return (inputs, outputs)
+
 # May be called from __main__, or may be called by an external script.
 def analyze_main(trace_fname, outputdir, group_multiproc,
 		process_userstacks, lookup_fns, target_pids, appname,
@@ -4938,22 +5008,51 @@ def analyze_main(trace_fname, outputdir, group_multiproc,
 	# Call setup_multiapp_plots() to reset / initialize plots in 
 	# PlotList.analysis_plotlist. IMPORTANT: we need to be careful
 	# in main here to not actually modify this global list!
-	setup_multiapp_plots(analysisdir, appname)
-	copy_of_analysis_plotlist = list()
-	for plot in PlotList.analysis_plotlist:
-		copy_of_analysis_plotlist.append(plot)
-	plotlist = copy_of_analysis_plotlist
-
-	process_trace_file(trace_f, proc_tracker, analysisdir, group_multiproc,
-		process_userstacks, lookup_fns, target_pids,
-		plotlist, appname, skip_page_events)
-
-	output_tracked_processes(output_f, analysisdir, trace_fname,
-		proc_tracker, group_multiproc, target_pids)
-
-	newplots = point_in_time_plots(analysisdir, outputdir,
-			proc_tracker, group_multiproc, target_pids, appname,
-			process_userstacks)
+	# The plots in PlotList.perf_analysis_plotlist are only needed if
+	# there is a perf.data file for the perf analysis to join them with.
+	with_perf = has_perf_data(outputdir)
+	setup_multiapp_plots(analysisdir, appname, with_perf)
+	plotlist = PlotList.get_analysis_plotlist(with_perf)
+	  # a new list every time
+
+	# If the trace buffer of any cpu lost events while the trace was
+	# taken, the end of the app's run is missing from the trace, and the
+	# trace should have been trimmed after that cpu's last event (see
+	# traceinfo.trace_off()); otherwise, expect errors about vmas that
+	# were never mapped near the end of the trace.
+	losses = read_trace_losses(trace_fname)
+	if losses and losses['lost']:
+		print_warning(tag, ("trace buffers lost events on cpus {} while "
+			"{} was traced ({}): {}").format(sorted(losses['lost'].keys()),
+			appname, 'trace was trimmed' if losses['trimmed'] else
+			'trace was NOT trimmed', losses['lost']))
+
+	# The time spent parsing the trace lines and the time spent handling
+	# the events (simulating the address spaces and passing PlotEvents
+	# to the plots) are both part of the process_trace stage; the
+	# handler time for each event type is in the stage's record.
+	events = event_stats()
+	with timed_stage('process_trace', appname) as stage:
+		numlines = process_trace_file(trace_f, proc_tracker, analysisdir,
+			group_multiproc, process_userstacks, lookup_fns,
+			target_pids, plotlist, appname, skip_page_events, events)
+	stage.record['lines'] = numlines
+	stage.record['bytes'] = os.fstat(trace_f.fileno()).st_size
+	stage.record['events'] = events.to_dict()
+	stage.record['simulate_s'] = events.total_time()
+	stage.record['parse_s'] = stage.record['wall_s'] - events.total_time()
+	if losses:
+		stage.record['lost_events'] = losses['lost']
+		stage.record['trimmed'] = losses['trimmed']
+
+	with timed_stage('queries', appname):
+		output_tracked_processes(output_f, analysisdir, trace_fname,
+			proc_tracker, group_multiproc, target_pids)
+
+	with timed_stage('point_in_time', appname):
+		newplots = point_in_time_plots(analysisdir, outputdir,
+				proc_tracker, group_multiproc, target_pids, appname,
+				process_userstacks)
 	plotlist += newplots
 	print_debug(tag, ("added {} new dynamically-generated plots, now "
 		"plotlist has {} plots").format(
@@ -4979,8 +5078,10 @@ def analyze_main(trace_fname, outputdir, group_multiproc,
 	# usually used to generate plots across *all* apps resets the
 	# multiapp_plot objects itself anyway, before reading in the
 	# serialized series files.
-	serialize_plotlist_data(plotlist)
-	plot_plotlist(plotlist, outputdir, appname)
+	with timed_stage('serialize', appname):
+		serialize_plotlist_data(plotlist)
+	with timed_stage('render', appname):
+		plot_plotlist(plotlist, outputdir, appname)
 	
 	cleanup(trace_f, output_f)     # closes files
 	print_debug(tag, ("analysis complete").format())
@@ -4993,6 +5094,8 @@ def analyze_main(trace_fname, outputdir, group_multiproc,
 if __name__ == '__main__':
 	tag = 'main'
 
+	check_startup_time('analyze_trace', startup_begin)
+
 	(trace_fname, outputdir, group_multiproc, process_userstacks,
 		lookup_fns, appname, target_pids_file,
 		skip_page_events) = handle_args(sys.argv[1:])
@@ -5007,8 +5110,11 @@ if __name__ == '__main__':
 		print_debug(tag, ("read target_pids {} from {}").format(target_pids,
 			target_pids_file))
 
-	analyze_main(trace_fname, outputdir, group_multiproc, process_userstacks,
-		lookup_fns, target_pids, appname, skip_page_events)
+	with timed_stage('analyze_main', appname):
+		analyze_main(trace_fname, outputdir, group_multiproc,
+			process_userstacks, lookup_fns, target_pids, appname,
+			skip_page_events)
+	write_stage_report(outputdir, time.perf_counter() - startup_begin)
 	print("Analysis complete")
 
 	sys.exit(0)
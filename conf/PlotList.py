@@ -2,13 +2,16 @@
 # Developed 2012-2014 by Peter Hornyack, pjh@cs.washington.edu
 # Copyright (c) 2012-2014 Peter Hornyack and University of Washington
 
-from plotting.plot_components_ops import components_ops_plot
-from plotting.plot_components_vmas import components_vmas_plot
-from plotting.plot_vmacount import vmacount_ts_plot, vmacount_max_col_plot
-from plotting.plot_vmaops import *
-from plotting.plot_addrspace_sizes import vm_size_ts_plot, resident_ts_plot, resident_table, virt_phys_size_ts_plot, virt_phys_ratio_ts_plot, virt_phys_size_component_ts_plot, virt_phys_ratio_component_ts_plot, virt_pte_size_ts_plot, virt_pte_ratio_ts_plot, virt_phys_diff_ts_plot
-from plotting.plot_perf_totals import new_totals_ts_plot, new_totals_col_plot
 from util.pjh_utils import *
+import importlib
+
+# The plots in the lists below are named by "module.name" strings,
+# relative to PLOTS_PACKAGE (e.g. 'plot_vmacount.vmacount_ts_plot'),
+# instead of being imported here: a plot module is only imported when
+# its plots are first asked for (see resolve_plot()), so importing this
+# module stays cheap for the scripts and worker processes that never
+# use most of the plots.
+PLOTS_PACKAGE = 'plotting'
 
 # note: this plotlist is searched linearly... make sure it doesn't get
 #   *too* big.
@@ -32,34 +35,44 @@ points_in_time = [
 #   "ts" means "time-series"
 analysis_plotlist = [
 		# Pure vma plots:
-		vmacount_ts_plot,
-		vm_size_ts_plot,
-		vmaops_resizes_plot,
-		##vmaops_access_changes_plot,  # not used in paper
-		##vmaops_all_plot,			# not used in paper
-		##vmaops_allocs_plot,		# not used in paper
-		##vmaops_frees_plot,		# not used in paper
-		##vmaops_relocations_plot,	# not used in paper
-		##vmaops_flag_changes_plot,	# not used in paper
-		##vmaops_nonallocfree_plot,	# not used in paper
-		##vmacount_max_col_plot,	# not used in paper, old way
+		'plot_vmacount.vmacount_ts_plot',
+		'plot_addrspace_sizes.vm_size_ts_plot',
+		'plot_vmaops.vmaops_resizes_plot',
+		##'plot_vmaops.vmaops_access_changes_plot',  # not used in paper
+		##'plot_vmaops.vmaops_all_plot',			# not used in paper
+		##'plot_vmaops.vmaops_allocs_plot',		# not used in paper
+		##'plot_vmaops.vmaops_frees_plot',		# not used in paper
+		##'plot_vmaops.vmaops_relocations_plot',	# not used in paper
+		##'plot_vmaops.vmaops_flag_changes_plot',	# not used in paper
+		##'plot_vmaops.vmaops_nonallocfree_plot',	# not used in paper
+		##'plot_vmacount.vmacount_max_col_plot',	# not used in paper, old way
 
 		# Rss plots:
-		resident_table,				# used in paper (table)
-		#resident_ts_plot,			# not used in paper
-		#virt_phys_size_ts_plot,	# not used in paper
-		#virt_phys_ratio_ts_plot,	# not used in paper
-		#virt_phys_diff_ts_plot,	# not used in paper
-		
+		'plot_addrspace_sizes.resident_table',	# used in paper (table)
+		#'plot_addrspace_sizes.resident_ts_plot',		# not used in paper
+		#'plot_addrspace_sizes.virt_phys_size_ts_plot',	# not used in paper
+		#'plot_addrspace_sizes.virt_phys_ratio_ts_plot',	# not used in paper
+		#'plot_addrspace_sizes.virt_phys_diff_ts_plot',	# not used in paper
+
 		# PTE plots: OLD
-		#virt_pte_size_ts_plot,
-		#virt_pte_ratio_ts_plot,
-		#virt_phys_size_component_ts_plot,  # causing chrome + kbuild errors??
-		#virt_phys_ratio_component_ts_plot, # causing chrome + kbuild errors??
+		#'plot_addrspace_sizes.virt_pte_size_ts_plot',
+		#'plot_addrspace_sizes.virt_pte_ratio_ts_plot',
+		#'plot_addrspace_sizes.virt_phys_size_component_ts_plot',  # causing chrome + kbuild errors??
+		#'plot_addrspace_sizes.virt_phys_ratio_component_ts_plot', # causing chrome + kbuild errors??
 
 		# Old plots:
-		###components_ops_plot,   # old
-		###components_vmas_plot,   # old
+		###'plot_components_ops.components_ops_plot',   # old
+		###'plot_components_vmas.components_vmas_plot',   # old
+	]
+
+# perf_analysis_plotlist: plots that are added to the analysis_plotlist
+# only for apps that also have a perf.data file: they record data from
+# the kernel trace that the perf analysis joins with the perf samples
+# later, and would be wasted work for apps without one.
+perf_analysis_plotlist = [
+		# VM size / vma count / Rss timeline, joined with the perf
+		# samples by the perf_vm_join_plots:
+		'plot_perf_vm.vm_timeline_plot',
 	]
 
 # Plots to make for perf analysis: if events are encountered in the perf
@@ -72,6 +85,9 @@ perf_pair_plots = [
 		#'r408',			# DTLB_LOAD_MISSES.WALK_CYCLES: not used in paper
 		'r449',			# DTLB_MISSES.WALK_CYCLES: used in paper
 	]
+perf_vm_join_plots = [
+		'r449',			# DTLB_MISSES.WALK_CYCLES vs. VM size
+	]
 missrate_event_plots = [
 		#'dTLB-loads',	# not used in paper
 		#'dTLB-stores',	# not used in paper
@@ -92,12 +108,98 @@ totals_col_plots = [
 		##'r449',
 	]
 perf_plotlist = []  # list of tuples: (eventlist, method to create new plot)
-perf_plotlist.append((totals_ts_plots, new_totals_ts_plot))
-perf_plotlist.append((totals_col_plots, new_totals_col_plot))
+perf_plotlist.append((totals_ts_plots, 'plot_perf_totals.new_totals_ts_plot'))
+perf_plotlist.append((totals_col_plots, 'plot_perf_totals.new_totals_col_plot'))
+
+# The plot modules of the plots that the analyses make with new_plot()
+# by names that aren't in the lists above: analyze_trace.py's
+# point_in_time plots (keyed by their names in point_in_time_plotlist)
+# and perf_analysis.py's missrate and perf-vm join plots. Keep these up
+# to date, so that analysis_plot_modules() finds every module whose
+# datafns the analyses run.
+point_in_time_plot_modules = {
+		'os_overheads_plot'     : 'plot_os_overheads',
+		'basepagesize_plot'     : 'plot_os_overheads',
+		'max_vmas_plot'         : 'plot_vmacount',
+		'vma_categories_plot'   : 'plot_vmacount',
+		'vma_size_cols_plot'    : 'plot_vma_sizes',
+		'vma_size_cdf_plot'     : 'plot_vma_sizes',
+		'vma_size_portion_plot' : 'plot_vma_sizes',
+		'vaspace_plots'         : 'plot_vaspace',
+	}
+perf_plot_modules = [
+		'plot_perf_missrate',
+		'plot_perf_vm',
+	]
+
+# Imports the plot module that name (see PLOTS_PACKAGE) is in, if it
+# hasn't been imported yet.
+# Returns: the named plot object (or method that creates a new plot).
+def resolve_plot(name):
+	tag = 'resolve_plot'
+
+	(modname, attrname) = name.rsplit('.', 1)
+	try:
+		module = importlib.import_module("{}.{}".format(PLOTS_PACKAGE,
+			modname))
+		return getattr(module, attrname)
+	except (ImportError, AttributeError) as e:
+		print_error_exit(tag, ("could not resolve plot {}: {}").format(
+			name, e))
+
+# Returns: a list of the multiapp_plot objects in analysis_plotlist,
+# plus the ones in perf_analysis_plotlist if with_perf is True. The list
+# is new, but the plot objects are the same ones every time.
+def get_analysis_plotlist(with_perf=False):
+	plotlist = []
+	names = analysis_plotlist
+	if with_perf:
+		names = names + perf_analysis_plotlist
+	for name in names:
+		plot = resolve_plot(name)
+		plot.factory = (name, None)
+		plotlist.append(plot)
+	return plotlist
+
+# Creates a new plot by calling the plot-creating method that name
+# refers to (see resolve_plot()) with args. The plot remembers how it
+# was made (in plot.factory), so that another process can make the
+# same plot again with plot_from_factory(): an analysis worker process
+# only has to send its plots' factories back to generate_plots.py, not
+# the plots themselves.
+# Returns: the new multiapp_plot.
+def new_plot(name, *args):
+	plot = resolve_plot(name)(*args)
+	plot.factory = (name, args)
+	return plot
+
+# Returns: the plot that the factory (a multiapp_plot's .factory) made:
+# the same plot object for the plots in analysis_plotlist, a new one for
+# the plots made by new_plot().
+def plot_from_factory(factory):
+	(name, args) = factory
+	if args is None:
+		plot = resolve_plot(name)
+		plot.factory = factory
+		return plot
+	return new_plot(name, *args)
+
+# Returns: the plot modules (imported) that the analyses make their
+# plots from, i.e. the modules with the datafns that they run.
+def analysis_plot_modules():
+	modnames = set(perf_plot_modules)
+	names = analysis_plotlist + perf_analysis_plotlist
+	names += [name for (eventlist, name) in perf_plotlist]
+	for name in names:
+		modnames.add(name.rsplit('.', 1)[0])
+	for name in point_in_time_plotlist:
+		modnames.add(point_in_time_plot_modules[name])
+	return [importlib.import_module("{}.{}".format(PLOTS_PACKAGE,
+		modname)) for modname in sorted(modnames)]
 
 def analysis_plotlist_str():
 	s = ""
-	for plot in analysis_plotlist:
+	for plot in get_analysis_plotlist():
 		s += " {}".format(plot.plotname)
 	return s
 
@@ -4,6 +4,10 @@
 # Developed 2012-2014 by Peter Hornyack, pjh@cs.washington.edu
 # Copyright (c) 2012-2014 Peter Hornyack and University of Washington
 
+import time
+startup_begin = time.perf_counter()
+  # see check_startup_time() in run_common.py
+
 from analyze.argparsers import *
 from trace.run_common import *
 from util.pjh_utils import *
@@ -11,11 +15,32 @@ from analyze.process_group_class import *
 from conf.system_conf import *
 from analyze.vm_mapping_class import *
 import plotting.multiapp_plot_class as multiapp_plot
+from plotting.plotdata_store_class import find_plotdata_stores
 import conf.PlotList as PlotList
 import plotting.plots_common as plots
 import trace.traceinfo_class as traceinfo
+from plotting.plotdata_store_class import plotdata_store, plotdata_store_files
+from analyze.pipeline_stage_class import pipeline_stage
+import analyze.stage_report_class as stage_report
+from analyze.work_queue_class import work_queue
+import importlib
+import multiprocessing
+import queue
+
+QUEUE_DIRNAME = 'work-queue'
+  # The work queue for --queue and --worker, in the measurementdir.
+ANALYSIS_METHODS = {
+		'analyze_main' : ('analyze_trace', 'analyze_stage_files'),
+		'perf_main'    : ('analyze.perf_analysis', 'perf_stage_files'),
+	}
+  # The modules with the analysis methods that the work queue's
+  # workers may be asked to run, and their stage files methods.
 
 # Globals:
+render_plotlist = None
+render_storedirs = None
+  # Set by plot_apps_in_measurementdir() before it creates its pool of
+  # worker processes, which inherit them when they are forked.
 
 ##############################################################################
 
@@ -35,14 +60,164 @@ def find_analysis_dirs(measurementdir):
 
 	return analysisdirs
 
+# Analyzing an app's trace keeps most of the trace's contents in memory
+# at once (vmas, page events, plot series); this is the estimated peak
+# memory of an analysis worker process as a multiple of the size of the
+# file it analyzes, used by analyze_apps() to decide how many apps can
+# be analyzed at the same time.
+ANALYSIS_MEM_FACTOR = 4
+
+# Returns: the number of bytes of memory available for new processes
+# without swapping (MemAvailable in /proc/meminfo), or None if it
+# couldn't be read.
+def available_memory():
+	tag = 'available_memory'
+
+	try:
+		with open('/proc/meminfo', 'r') as f:
+			for line in f:
+				if line.startswith('MemAvailable:'):
+					return int(line.split()[1]) * 1024
+	except (OSError, ValueError, IndexError) as e:
+		print_warning(tag, ("could not read /proc/meminfo: {}").format(e))
+	return None
+
+# Modules that only change how the plots look, not the data that the
+# analyses make for them, so the apps don't have to be analyzed again
+# when they change (they're still part of each plot's render_sources()).
+RENDER_ONLY_MODULES = ['plotting.plots_style']
+
+# Returns: the source files that an analysis_method depends on, for its
+# pipeline_stage: its own module and the plot modules with the datafns
+# that the analyses run, plus every module of these scripts that they
+# use (see multiapp_plot.source_modules()).
+def analysis_sources(analysis_method):
+	modules = [sys.modules[analysis_method.__module__]]
+	modules += PlotList.analysis_plot_modules()
+	return multiapp_plot.source_modules(modules,
+			exclude=RENDER_ONLY_MODULES)
+
+# Returns: the list of [plotname, factory name, factory args] lists for
+# the plots, which is what an analysis pipeline_stage remembers about
+# the plots that it made. The factory args are lists, not tuples, so
+# that they match what's read back from the stage's stamp.
+def plots_to_stage_result(factories):
+	result = []
+	for (plotname, (name, args)) in factories:
+		if args is not None:
+			args = list(args)
+		result.append([plotname, name, args])
+	return result
+
+# Returns: the (plotname, factory) list for a stage result from
+# plots_to_stage_result().
+def stage_result_to_plots(result):
+	factories = []
+	for (plotname, name, args) in result:
+		if args is not None:
+			args = tuple(args)
+		factories.append((plotname, (name, args)))
+	return factories
+
+# Returns: the pipeline_stage for analyzing the target file fname in
+# appdir with the analysis_method; options is the list of analysis
+# options that the stage depends on.
+def app_stage(analysis_method, stagefiles_method, fname, appdir, options):
+	(inputs, outputs) = stagefiles_method(fname, appdir)
+	return pipeline_stage(analysis_method.__name__,
+			"{}/{}".format(appdir, analysisdirname), inputs, outputs,
+			params=options, sources=analysis_sources(analysis_method))
+
+# Returns: the (analysis_method, stagefiles_method) tuple for the name
+# of an analysis method in ANALYSIS_METHODS.
+def analysis_methods(name):
+	(modname, stagefilesname) = ANALYSIS_METHODS[name]
+	module = importlib.import_module(modname)
+	return (getattr(module, name), getattr(module, stagefilesname))
+
+# Runs the analysis_method on one app's target file, as a timed stage.
+# Returns: the analysis_method's list of plots.
+def run_analysis(analysis_method, fname, methodargs):
+	appname = methodargs[5]
+	with stage_report.timed_stage(analysis_method.__name__, appname):
+		newplots = analysis_method(fname, *methodargs)
+	return newplots
+
+# Worker function for the analysis pool: runs the analysis_method on
+# one app's target file, in its own process. The plot objects that the
+# analysis filled in stay in the worker; only what the parent needs to
+# make the same plots again (their factories, see PlotList.new_plot())
+# and the directories that their data was serialized into are sent
+# back.
+# Returns: an (i, [(plotname, factory), ...], storedirs, records, error)
+# tuple, where records are the worker's stage_report records and error
+# is None on success.
+def analyze_app_worker(args):
+	tag = 'analyze_app_worker'
+
+	(i, submitted, analysis_method, fname, methodargs) = args
+	check_startup_time("analysis worker {}".format(os.getpid()),
+			submitted)
+	try:
+		newplots = run_analysis(analysis_method, fname, methodargs)
+	except SystemExit:
+		# print_error_exit() in a pool worker would otherwise kill the
+		# worker and leave its task hanging.
+		return (i, [], [], [], ("analysis of {} failed").format(fname))
+	except Exception as e:
+		return (i, [], [], [], ("analysis of {} failed: {}: {}").format(
+			fname, type(e).__name__, e))
+
+	factories = []
+	storedirs = set()
+	for plot in newplots:
+		if plot.factory is None:
+			return (i, [], [], [], ("plot {} from analysis of {} has no "
+				"factory, create it with PlotList.new_plot()").format(
+				plot.plotname, fname))
+		factories.append((plot.plotname, plot.factory))
+		if plot.workingdir:
+			storedirs.add(os.path.dirname(plot.workingdir))
+
+	return (i, factories, sorted(storedirs),
+			stage_report.take_stage_records(), None)
+
+# Makes the plots for each of the (plotname, factory) lists in
+# factorylists, e.g. from the analysis workers or from the analysis
+# stages that were skipped. Each plot only has to be made once, since
+# its data is found by plotname when it's rendered.
+# Returns: a list of plots.
+def plots_from_factories(factorylists):
+	plotlist = []
+	made = set()
+	for factories in factorylists:
+		for (plotname, factory) in factories:
+			if plotname not in made:
+				made.add(plotname)
+				plotlist.append(PlotList.plot_from_factory(factory))
+	return plotlist
+
 # This method performs the following steps:
 #   Searches the subdirectories of the measurementdir for file names
 #   that exactly match target_fname.
 #   Passes those files to the specified analysis_method, which will
 #   write outputfiles into the specified analysis_dirname
+# If stagefiles_method is set (e.g. analyze_trace.analyze_stage_files()),
+# the analysis of each app is a pipeline_stage with the inputs and
+# outputs that it returns, and apps whose files, options and analysis
+# code haven't changed since they were last analyzed are skipped (unless
+# force is True): their plots are made again from the stage's stamp.
+# If wq (a work_queue) is set, the apps are analyzed by the queue's
+# workers instead (see analyze_apps_queued()).
+# With jobs > 1, the apps are analyzed in a pool of worker processes,
+# one app per process: the largest target files are started first, and
+# a new app is only started while the estimated memory of all of the
+# running analyses (see ANALYSIS_MEM_FACTOR) fits in the available
+# memory.
 # Returns: a list of all of the plots generated during the analysis runs.
 def analyze_apps(measurementdir, target_fname, analysis_method,
-		group_multiproc, process_userstacks, lookup_fns, skip_page_events):
+		group_multiproc, process_userstacks, lookup_fns, skip_page_events,
+		jobs=1, stagefiles_method=None, force=False, wq=None):
 	tag = 'analyze_apps'
 
 	plotlist = []
@@ -53,6 +228,8 @@ def analyze_apps(measurementdir, target_fname, analysis_method,
 			followlinks=True, absdirs=True)
 	print_debug(tag, ("got back targetfiles from find_files_dirs({}, "
 		"{}): {}").format(measurementdir, target_fname, targetfiles))
+	tasks = []
+	skipped = []
 	for fname in targetfiles:
 		# For outputdir, use root dir plus a well-known suffix. Also,
 		# we can take the name of the directory that contains the
@@ -67,20 +244,373 @@ def analyze_apps(measurementdir, target_fname, analysis_method,
 				"returned for appdir {}, will skip to next target "
 				"file").format(appdir))
 			continue
+		methodargs = (appdir, group_multiproc, process_userstacks,
+				lookup_fns, target_pids, appname, skip_page_events)
+
+		if stagefiles_method:
+			stage = app_stage(analysis_method, stagefiles_method, fname,
+					appdir, [group_multiproc, process_userstacks,
+					lookup_fns, skip_page_events])
+			(uptodate, result) = stage.up_to_date(force)
+			if uptodate:
+				print(("Skipping {} of {}, it's unchanged since it was "
+					"last run").format(analysis_method.__name__, appname))
+				skipped.append(stage_result_to_plots(result))
+				stage_report.skipped_stage(analysis_method.__name__,
+						appname)
+				continue
+			stage.invalidate()
+		else:
+			stage = None
+		tasks.append((fname, methodargs, stage))
+
+	if wq:
+		results = analyze_apps_queued(wq, measurementdir, analysis_method,
+				tasks, force)
+		return plotlist + plots_from_factories(results + skipped)
+
+	if jobs <= 1 or len(tasks) <= 1:
+		for (fname, methodargs, stage) in tasks:
+			newplots = run_analysis(analysis_method, fname, methodargs)
+			plotlist += newplots
+			print_debug(tag, ("plotlist for this phase now contains {} "
+				"plots").format(len(plotlist)))
+			if stage:
+				stage.done(plots_to_stage_result([(plot.plotname,
+					plot.factory) for plot in newplots]))
+		return plotlist + plots_from_factories(skipped)
+
+	jobs = min(jobs, len(tasks))
+	memlimit = available_memory()
+	sizes = []
+	for (fname, methodargs, stage) in tasks:
+		sizes.append(os.path.getsize(fname) * ANALYSIS_MEM_FACTOR)
+	pending = sorted(range(len(tasks)), key=lambda i: sizes[i],
+			reverse=True)
+	print_debug(tag, ("analyzing {} apps with up to {} worker processes, "
+		"available memory {}").format(len(tasks), jobs, memlimit))
 
-		newplots = analysis_method(fname, appdir, group_multiproc,
-				process_userstacks, lookup_fns, target_pids,
-				appname, skip_page_events)
-		plotlist += newplots
-		print_debug(tag, ("plotlist for this phase now contains {} "
-			"plots").format(len(plotlist)))
+	# Each worker process analyzes just one app and then exits
+	# (maxtasksperchild=1), so that the memory it used for the analysis
+	# is given back before the next app is started.
+	done = queue.Queue()
+	results = [None] * len(tasks)
+	running = dict()
+	pool = multiprocessing.get_context('fork').Pool(jobs,
+			maxtasksperchild=1)
+	while pending or running:
+		while pending and len(running) < jobs:
+			inuse = sum(running.values())
+			fits = [i for i in pending if memlimit is None or
+					inuse + sizes[i] <= memlimit]
+			if not fits:
+				if running:
+					break
+				# Nothing else is running, so this is as good as
+				# it gets: start the largest one anyway.
+				print_warning(tag, ("analysis of {} may need more than "
+					"the available memory ({} > {} bytes)").format(
+					tasks[pending[0]][0], sizes[pending[0]], memlimit))
+				fits = pending[:1]
+			i = fits[0]
+			pending.remove(i)
+			running[i] = sizes[i]
+			(fname, methodargs, stage) = tasks[i]
+			print_debug(tag, ("starting analysis of {} (estimated "
+				"memory {} bytes)").format(fname, sizes[i]))
+			pool.apply_async(analyze_app_worker, ((i, time.perf_counter(),
+				analysis_method, fname, methodargs),),
+				callback=done.put, error_callback=done.put)
+
+		result = done.get()
+		if isinstance(result, BaseException):
+			pool.terminate()
+			print_error_exit(tag, ("analysis worker failed: {}").format(
+				result))
+		(i, factories, storedirs, records, error) = result
+		if error:
+			pool.terminate()
+			print_error_exit(tag, ("{}").format(error))
+		del running[i]
+		results[i] = factories
+		stage_report.add_stage_records(records)
+		stage = tasks[i][2]
+		if stage:
+			stage.done(plots_to_stage_result(factories))
+		print_debug(tag, ("analysis of {} complete, plot data in "
+			"{}").format(tasks[i][0], storedirs))
+	pool.close()
+	pool.join()
+
+	# Make the plots again in this process, in the same order that
+	# serial analysis would have returned them.
+	plotlist += plots_from_factories(results + skipped)
+	print_debug(tag, ("plotlist for this phase contains {} "
+		"plots").format(len(plotlist)))
 
 	return plotlist
 
+##############################################################################
+# Spreading the analysis and rendering across machines: the coordinator
+# (generate_plots.py --queue) enqueues each phase's tasks in the
+# work_queue in the measurementdir and waits for them, and workers
+# (generate_plots.py --worker, on any machine that has the
+# measurementdir mounted) run them. The paths in the tasks are relative
+# to the measurementdir, but the analysis stages' stamps (see
+# pipeline_stage) have absolute paths, so the measurementdir should be
+# mounted at the same path everywhere or stages won't be skipped.
+
+# Enqueues the analysis tasks (see analyze_apps()) in the work queue, the
+# largest target files first, and waits for the workers to run them.
+# Returns: a list with the list of (plotname, factory) tuples for the
+# plots that each task made, in task order.
+def analyze_apps_queued(wq, measurementdir, analysis_method, tasks, force):
+	tag = 'analyze_apps_queued'
+
+	order = sorted(range(len(tasks)), key=lambda i: os.path.getsize(
+			tasks[i][0]), reverse=True)
+	taskids = [None] * len(tasks)
+	for i in order:
+		(fname, methodargs, stage) = tasks[i]
+		(appdir, group_multiproc, process_userstacks, lookup_fns,
+			target_pids, appname, skip_page_events) = methodargs
+		task = dict()
+		task['method'] = analysis_method.__name__
+		task['fname'] = os.path.relpath(fname, measurementdir)
+		task['appdir'] = os.path.relpath(appdir, measurementdir)
+		task['options'] = [group_multiproc, process_userstacks,
+			lookup_fns, skip_page_events]
+		task['target_pids'] = target_pids
+		task['appname'] = appname
+		task['force'] = force
+		taskids[i] = wq.enqueue('analyze', task)
+
+	(results, errors) = wq.wait(taskids)
+	if errors:
+		wq.close()
+		print_error_exit(tag, ("{} of {} analysis tasks failed: "
+			"{}").format(len(errors), len(taskids), errors))
+
+	factorylists = []
+	for taskid in taskids:
+		factorylists.append(stage_result_to_plots(
+			results[taskid]['plots']))
+		stage_report.add_stage_records(results[taskid]['records'])
+	return factorylists
+
+# Runs an 'analyze' task from the work queue: analyzes one app's target
+# file, unless its analysis stage is already up to date (e.g. because
+# the task was already run by a worker that then lost its lease).
+# Returns: a dict with the plots (see plots_to_stage_result()) and the
+# stage_report records.
+def run_queued_analysis(measurementdir, task):
+	tag = 'run_queued_analysis'
+
+	(analysis_method, stagefiles_method) = analysis_methods(task['method'])
+	fname = os.path.join(measurementdir, task['fname'])
+	appdir = os.path.join(measurementdir, task['appdir'])
+	(group_multiproc, process_userstacks, lookup_fns,
+		skip_page_events) = task['options']
+	methodargs = (appdir, group_multiproc, process_userstacks, lookup_fns,
+			task['target_pids'], task['appname'], skip_page_events)
+
+	stage = app_stage(analysis_method, stagefiles_method, fname, appdir,
+			task['options'])
+	(uptodate, result) = stage.up_to_date(task['force'])
+	if not uptodate:
+		stage.invalidate()
+		newplots = run_analysis(analysis_method, fname, methodargs)
+		result = plots_to_stage_result([(plot.plotname, plot.factory)
+			for plot in newplots])
+		stage.done(result)
+
+	return {'plots': result, 'records': stage_report.take_stage_records()}
+
+# Runs a 'render' task from the work queue: makes the plot from its
+# factory and renders it from the plotdata_stores in the task's
+# storedirs.
+# Returns: a dict with the pdf file that the plot was saved to
+# (relative to the measurementdir, or None) and the stage_report
+# records.
+def run_queued_render(measurementdir, task):
+	tag = 'run_queued_render'
+
+	(plotname, name, args) = task['plot']
+	plot = PlotList.plot_from_factory((name, args))
+	plot.reset()
+	plot.set_workingdir("{}/plots".format(measurementdir))
+	stores = []
+	for storedir in task['storedirs']:
+		store = plotdata_store(os.path.join(measurementdir, storedir))
+		if store.open():
+			stores.append(store)
+	try:
+		pdf_fname = render_plot(plot, measurementdir, stores, True,
+				task['force'])
+	finally:
+		for store in stores:
+			store.close()
+	if pdf_fname:
+		pdf_fname = os.path.relpath(pdf_fname, measurementdir)
+
+	return {'pdf': pdf_fname, 'records': stage_report.take_stage_records()}
+
+# Runs a task from the work queue.
+# Returns: the task's result.
+def run_queue_task(measurementdir, task):
+	tag = 'run_queue_task'
+
+	if task['kind'] == 'analyze':
+		return run_queued_analysis(measurementdir, task)
+	elif task['kind'] == 'render':
+		return run_queued_render(measurementdir, task)
+	print_error_exit(tag, ("unknown kind of task: {}").format(task))
+
+# Main function for a work queue worker process.
+def queue_worker_main(measurementdir):
+	wq = work_queue("{}/{}".format(measurementdir, QUEUE_DIRNAME))
+	wq.work(lambda task: run_queue_task(measurementdir, task))
+	return
+
+# Starts jobs work queue worker processes. If daemon is True, the
+# workers are killed when this process exits (e.g. if it's the
+# coordinator and it fails).
+# Returns: a list of the worker processes.
+def start_queue_workers(measurementdir, jobs, daemon):
+	workers = []
+	for i in range(max(1, jobs)):
+		worker = multiprocessing.get_context('fork').Process(
+				target=queue_worker_main, args=(measurementdir,),
+				daemon=daemon)
+		worker.start()
+		workers.append(worker)
+	return workers
+
+##############################################################################
+
 # Looks in all of the subdirectories of the measurementdir and generates
 # plots that include all apps that have an analysis directory.
-def plot_apps_in_measurementdir(measurementdir, allplots):
+# Returns: the directories under the measurementdir with the old
+# per-series .dat files for the plot (see multiapp_plot.deserialize())
+# that aren't in an output dir that has a plotdata_store (in stores):
+# the analysis writes a plot's series into the store in the plot's
+# workingdir's parent dir, so a per-plot dir next to a store is stale.
+def find_legacy_plotdata_dirs(plot, measurementdir, stores):
+	tag = 'find_legacy_plotdata_dirs'
+
+	storedirs = set()
+	for store in stores:
+		storedirs.add(os.path.realpath(store.storedir))
+	plotdata_dirs = find_files_dirs(measurementdir, plot.plotname,
+			exactmatch=True, findfiles=False, finddirs=True,
+			followlinks=True, absdirs=True)
+	legacy_dirs = []
+	for d in plotdata_dirs:
+		if os.path.realpath(os.path.dirname(d)) not in storedirs:
+			legacy_dirs.append(d)
+	print_debug(tag, ("plot {}: legacy plotdata dirs: {}").format(
+		plot.plotname, legacy_dirs))
+
+	return legacy_dirs
+
+# Deserializes the data for one plot and renders it, in the current
+# process. stores is the list of plotdata_stores under the
+# measurementdir. use_cache and force are passed to plot.complete().
+# Returns: the pdf file that the plot was saved to, or None.
+def render_plot(plot, measurementdir, stores, use_cache, force):
+	tag = 'render_plot'
+
+	# The analysis phases write all of the series for an app's analysis
+	# into one indexed plotdata_store per output dir, so each plot just
+	# looks up its series by plotname in each store.
+	# Output dirs analyzed before the plotdata_stores were added only
+	# have the old per-series .dat files in per-plot dirs, and a
+	# measurement dir may have both kinds (e.g. when only some of its
+	# apps were analyzed again): for each plot, also search for
+	# directories in the measurementdir with the name of the plot, and
+	# read the data files in the ones that aren't in an output dir with
+	# a store. This needs more "find" operations and will be slower.
+	# Rendering is a pipeline_stage too, whose inputs are the files of
+	# all of the stores and the old data files, so that plots can be
+	# skipped without reading their data at all when no app was
+	# analyzed again since they were last rendered (complete()'s render
+	# hash is still checked after the data has been read, e.g. for
+	# plots whose own data didn't change when another plot's did).
+	legacy_dirs = find_legacy_plotdata_dirs(plot, measurementdir, stores)
+	if use_cache and len(stores) > 0:
+		inputs = []
+		for store in stores:
+			inputs += plotdata_store_files(store.storedir)
+		searchfor = ".{}".format(multiapp_plot.SERIESSUFFIX)
+		for d in legacy_dirs:
+			inputs += sorted(find_files_dirs(d, searchfor,
+				exactmatch=False, findfiles=True, finddirs=False,
+				followlinks=True, absdirs=True))
+		stage = pipeline_stage(plot.plotname, plot.workingdir, inputs,
+				["{}/{}.pdf".format(plot.workingdir, plot.plotname)],
+				params=plot.plotname, sources=plot.render_sources())
+		(uptodate, pdf_fname) = stage.up_to_date(force)
+		if uptodate:
+			print_debug(tag, ("plot {} is unchanged since it was last "
+				"rendered, reusing {}").format(plot.plotname, pdf_fname))
+			stage_report.skipped_stage('render', plotname=plot.plotname)
+			plot.reset()
+			return pdf_fname
+		stage.invalidate()
+	else:
+		stage = None
+
+	with stage_report.timed_stage('deserialize', plotname=plot.plotname):
+		plot.deserialize_stores(stores)
+		for d in legacy_dirs:
+			plot.deserialize(d)
+
+	print_debug(tag, ("completing plot: {}").format(plot))
+	with stage_report.timed_stage('render', plotname=plot.plotname):
+		pdf_fname = plot.complete(use_cache, force)
+	if stage and pdf_fname:
+		stage.done(pdf_fname)
+	return pdf_fname
+
+# Worker function for the plot rendering pool: renders the i-th plot in
+# render_plotlist. Each worker opens the plotdata_stores itself, rather
+# than sharing the parent's sqlite connections across the fork.
+# Returns: a (pdf_fname, records) tuple: the pdf file that the plot was
+# saved to, or None, and the worker's stage_report records.
+def render_plot_worker(args):
+	tag = 'render_plot_worker'
+
+	(i, measurementdir, use_cache, force) = args
+	stores = []
+	for storedir in render_storedirs:
+		store = plotdata_store(storedir)
+		if store.open():
+			stores.append(store)
+	try:
+		pdf_fname = render_plot(render_plotlist[i], measurementdir, stores,
+				use_cache, force)
+	except SystemExit:
+		# print_error_exit() in a pool worker would otherwise kill the
+		# worker and leave its task hanging.
+		raise RuntimeError(("rendering plot {} failed").format(
+			render_plotlist[i].plotname))
+	finally:
+		for store in stores:
+			store.close()
+
+	return (pdf_fname, stage_report.take_stage_records())
+
+# Initializer for the plot rendering pool's worker processes: begin is
+# the time.perf_counter() value from just before the pool was created.
+def render_worker_init(begin):
+	check_startup_time("render worker {}".format(os.getpid()), begin)
+	return
+
+def plot_apps_in_measurementdir(measurementdir, allplots, jobs=1,
+		force=False, wq=None):
 	tag = 'plot_apps_in_measurementdir'
+	global render_plotlist
+	global render_storedirs
 
 	# analysis_plotlist was used in analyze_trace.py (which we called
 	# earlier from this script via analyze.analyze_main()): every
@@ -106,43 +636,115 @@ def plot_apps_in_measurementdir(measurementdir, allplots):
 	plotdir = "{}/plots".format(measurementdir)
 	if not os.path.exists(plotdir):
 		os.mkdir(plotdir)
-	plots_pdf = plots.new_pdffile("{}/allplots".format(plotdir))
-	#pdf_fname = "{}/allplots.pdf".format(plotdir)
-	#print_debug(tag, ("using pdffile: {}").format(pdf_fname))
+	allplots_fname = "{}/allplots".format(plotdir)
 
 	plotlist = multiapp_plot.remove_duplicates_from_plotlist(allplots)
 
+	# Rendering a plot (the plotfn + savefig) is CPU-bound and the
+	# plots are independent of each other, so render them in a pool
+	# of worker processes, each of which saves its plots' own pdf
+	# files; allplots.pdf is then assembled from those files in
+	# plotlist order, so its page order doesn't depend on which plot
+	# finished first. This also lets plots whose data, plotfn and style
+	# haven't changed since they were last rendered be skipped, reusing
+	# their existing pdf files (unless force is set; see
+	# multiapp_plot.complete()). Without a tool to merge pdf files,
+	# fall back to rendering every plot one after another and adding
+	# each one's page to allplots.pdf as it's saved.
+	merge = plots.can_merge_pdffiles()
+	if not merge:
+		print_warning(tag, ("{} not found, so rendering all plots "
+			"serially").format(plots.PDF_MERGE_PROG))
+		jobs = 1
+	jobs = max(1, min(jobs, len(plotlist)))
+
+	if not merge:
+		plots_pdf = plots.new_pdffile(allplots_fname)
 	for plot in plotlist:
 		plot.reset()
-		plot.add_pdffile(plots_pdf)
+		if not merge:
+			plot.add_pdffile(plots_pdf)
 		plot.set_workingdir(plotdir)  # appends plot title to plotdir
 		print_debug(tag, ("expect this plot to be output in workingdir "
 			"{}").format(plot.workingdir))
 
-	# Better way: for each plot, search for directories in the measurementdir
-	# with the name of the plot, and look for data files only in those
-	# directories. Doesn't rely on specific link between plots generated
-	# by a particular analysis (e.g. "generate-analysis" and "perf-reports"),
-	# but uses more "find" operations and will be slower. Also note that
-	# this command may find some dirs (e.g. the dirs created for storing
-	# the plot figures themselves) that won't contain series .dat files;
-	# this is ok.
-	#   If the speed really becomes a problem, store an explicit link
-	#   earlier from the plot to the directory name (e.g. "perf-reports")
-	#   where we expect to find its data files.
-	for plot in plotlist:
-		plotdata_dirs = find_files_dirs(measurementdir, plot.plotname,
-				exactmatch=True, findfiles=False, finddirs=True,
-				followlinks=True, absdirs=True)
-		print_debug(tag, ("plotdata_dirs: {}").format(plotdata_dirs))
+	# Find all of the stores with a single walk of the measurementdir.
+	stores = find_plotdata_stores(measurementdir)
 
-		for d in plotdata_dirs:
-			plot.deserialize(d)
+	if not merge:
+		for plot in plotlist:
+			render_plot(plot, measurementdir, stores, False, True)
+		for store in stores:
+			store.close()
+		plots.close_pdffile(plots_pdf)
+		return
 
-		print_debug(tag, ("completing plot: {}").format(plot))
-		plot.complete()
-	
-	plots.close_pdffile(plots_pdf)
+	if wq:
+		# Render the plots with the work queue's workers.
+		storedirs = [os.path.relpath(store.storedir, measurementdir)
+				for store in stores]
+		for store in stores:
+			store.close()
+		taskids = []
+		for plot in plotlist:
+			task = dict()
+			task['plot'] = plots_to_stage_result([(plot.plotname,
+				plot.factory)])[0]
+			task['storedirs'] = storedirs
+			task['force'] = force
+			taskids.append(wq.enqueue('render', task))
+		(results, errors) = wq.wait(taskids)
+		if errors:
+			wq.close()
+			print_error_exit(tag, ("{} of {} render tasks failed: "
+				"{}").format(len(errors), len(taskids), errors))
+		pdf_fnames = []
+		for taskid in taskids:
+			pdf_fname = results[taskid]['pdf']
+			if pdf_fname:
+				pdf_fname = os.path.join(measurementdir, pdf_fname)
+			pdf_fnames.append(pdf_fname)
+			stage_report.add_stage_records(results[taskid]['records'])
+	elif jobs == 1:
+		pdf_fnames = []
+		for plot in plotlist:
+			pdf_fnames.append(render_plot(plot, measurementdir, stores,
+				True, force))
+		for store in stores:
+			store.close()
+	else:
+		render_plotlist = plotlist
+		render_storedirs = [store.storedir for store in stores]
+		for store in stores:
+			store.close()
+		print_debug(tag, ("rendering {} plots with {} worker "
+			"processes").format(len(plotlist), jobs))
+		# Import matplotlib once here, so that the forked workers
+		# inherit it instead of each importing it themselves.
+		plots.import_matplotlib()
+		pool = multiprocessing.get_context('fork').Pool(jobs,
+				initializer=render_worker_init,
+				initargs=(time.perf_counter(),))
+		try:
+			results = pool.map(render_plot_worker,
+					[(i, measurementdir, True, force) for i in
+					range(len(plotlist))], chunksize=1)
+		except RuntimeError as e:
+			pool.terminate()
+			print_error_exit(tag, ("{}").format(e))
+		pdf_fnames = []
+		for (pdf_fname, records) in results:
+			pdf_fnames.append(pdf_fname)
+			stage_report.add_stage_records(records)
+		pool.close()
+		pool.join()
+		render_plotlist = None
+		render_storedirs = None
+
+	pdf_fnames = [fname for fname in pdf_fnames if fname]
+	if not plots.merge_pdffiles(pdf_fnames, allplots_fname):
+		print_error(tag, ("could not assemble {}.pdf; the individual "
+			"plots are still in their plot dirs").format(allplots_fname))
 
 	return
 
@@ -158,6 +760,31 @@ def handle_args():
 		action='store_false', default=True, dest='analyze_perf',
 		help=("skip perf analysis, build plots using data already in "
 			"measurementdir"))
+	parser.add_argument('-j', '--jobs',
+		metavar='N', type=int, default=1, dest='jobs',
+		help=("number of processes to analyze apps and render plots "
+			"with; each analysis process may use as much memory as a "
+			"whole analysis run (default: 1)"))
+	parser.add_argument('--queue',
+		action='store_true', default=False, dest='queue',
+		help=("spread the analysis and rendering across machines: "
+			"put the tasks in a work queue in measurementdir, run N "
+			"local workers and wait for them and any --worker "
+			"processes to finish the tasks"))
+	parser.add_argument('--worker',
+		action='store_true', default=False, dest='worker',
+		help=("run N workers for the work queue in measurementdir "
+			"(start them after the --queue coordinator), until the "
+			"coordinator is done"))
+	parser.add_argument('--tracemalloc',
+		action='store_true', default=False, dest='tracemalloc',
+		help=("record the allocation hot spots of every stage in the "
+			"stage report (slow)"))
+	parser.add_argument('--force',
+		action='store_true', default=False, dest='force',
+		help=("re-analyze every app and re-render every plot, even "
+			"if their inputs and code haven't changed since they were "
+			"last run"))
 
 	args = parser.parse_args()   # uses sys.argv
 	print_debug(tag, ("parser returned args: {}").format(args))
@@ -165,44 +792,69 @@ def handle_args():
 	if not os.path.exists(args.measurementdir):
 		print_error(tag, ("non-existent measurementdir: {}").format(
 			args.measurementdir))
-		return (None, None, None, None, None, None)
+		return (None, None, None, None, None, None, None, None, None,
+			None, None, None)
 
 	return (args.measurementdir, args.group_multiproc,
 		args.process_userstacks, args.lookup_fns,
 		args.analyze_first, args.analyze_perf,
-		args.skip_page_events)
+		args.skip_page_events, args.jobs, args.force, args.tracemalloc,
+		args.queue, args.worker)
 
 ##############################################################################
 # Main:
 if __name__ == '__main__':
 	tag = 'main'
 
+	check_startup_time('generate_plots', startup_begin)
+
 	(measurementdir, group_multiproc, process_userstacks,
 		lookup_fns, analyze_first, analyze_perf,
-		skip_page_events) = handle_args()
+		skip_page_events, jobs, force, tracemalloc, use_queue,
+		worker) = handle_args()
 	if not measurementdir:
 		print("exiting")
 		sys.exit(1)
+	if tracemalloc:
+		stage_report.enable_tracemalloc()
+
+	if worker:
+		for w in start_queue_workers(measurementdir, jobs, False):
+			w.join()
+		print("Work queue in {} is closed, workers exiting".format(
+			measurementdir))
+		sys.exit(0)
+
+	if use_queue:
+		wq = work_queue("{}/{}".format(measurementdir, QUEUE_DIRNAME))
+		wq.reset()
+		start_queue_workers(measurementdir, jobs, True)
+	else:
+		wq = None
 
 	# Keep track of the plots generated during the analysis runs.
 	allplots = []
 
 	if analyze_first:
-		import analyze_trace as analyze
+		(analysis_method, stagefiles_method) = analysis_methods(
+				'analyze_main')
 		newplots = analyze_apps(measurementdir, traceinfo.tracefilename,
-				analyze.analyze_main, group_multiproc,
-				process_userstacks, lookup_fns, skip_page_events)
+				analysis_method, group_multiproc, process_userstacks,
+				lookup_fns, skip_page_events, jobs, stagefiles_method,
+				force, wq)
 		allplots += newplots
 	else:
 		print("Skipping analysis, using data already in {} and using "
 				"plots listed in analysis_plotlist".format(measurementdir))
-		allplots += PlotList.analysis_plotlist
+		allplots += PlotList.get_analysis_plotlist()
 	
 	if analyze_perf:
-		import analyze.perf_analysis as perf_analysis
+		(analysis_method, stagefiles_method) = analysis_methods(
+				'perf_main')
 		newplots = analyze_apps(measurementdir, traceinfo.PERF_DATA,
-				perf_analysis.perf_main, group_multiproc,
-				process_userstacks, lookup_fns, skip_page_events)
+				analysis_method, group_multiproc, process_userstacks,
+				lookup_fns, skip_page_events, jobs, stagefiles_method,
+				force, wq)
 		allplots += newplots
 	else:
 		print("Skipping perf analysis, using data already in {}".format(
@@ -211,9 +863,15 @@ if __name__ == '__main__':
 		#   todo: create a default list of perf plots so that they can be
 		#   added to allplots here?
 	
-	plot_apps_in_measurementdir(measurementdir, allplots)
+	plot_apps_in_measurementdir(measurementdir, allplots, jobs, force, wq)
+	if wq:
+		wq.close()
+	report_fname = stage_report.write_stage_report(measurementdir,
+			time.perf_counter() - startup_begin)
 	print("Plot generation complete, see plot subdirs under {}".format(
 		measurementdir))
+	print("Timing and memory report for each stage is in {}".format(
+		report_fname))
 
 	sys.exit(0)
 else:
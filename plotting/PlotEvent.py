@@ -2,6 +2,27 @@
 # Developed 2012-2014 by Peter Hornyack, pjh@cs.washington.edu
 # Copyright (c) 2012-2014 Peter Hornyack and University of Washington
 
+# The kinds of PlotEvents: each kind is the name of the PlotEvent member
+# that is set for it. multiapp_plots declare which of these kinds they
+# consume (see multiapp_plot.__init__()).
+PLOT_EVENT_KINDS = ['vma', 'page_event', 'rss_event', 'cp_event',
+		'perf_sample', 'datapoint']
+
+# The operations that a vma PlotEvent can represent, for plots that only
+# consume some of them: the vma_op of a newly mapped vma, or "unmap_"
+# plus the unmap_op of an unmapped vma (e.g. 'unmap_free' for an
+# explicit free, 'unmap_resize' for the first half of a resize's
+# unmap-remap pair). See the comments in multiapp_plot.consume_plot_event().
+VMA_OPS = ['alloc', 'resize', 'relocation', 'access_change', 'flag_change']
+VMA_ROUTE_OPS = VMA_OPS + ["unmap_{}".format(op) for op in
+		VMA_OPS + ['free']]
+
+# Returns: the operation that the vma represents, one of VMA_ROUTE_OPS.
+def vma_route_op(vma):
+	if vma.is_unmapped:
+		return "unmap_{}".format(vma.unmap_op)
+	return vma.vma_op
+
 '''
 Class used for passing events from analysis script to multiapp_plot
 objects.
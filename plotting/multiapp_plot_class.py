@@ -3,27 +3,70 @@
 # Copyright (c) 2012-2014 Peter Hornyack and University of Washington
 
 from util.pjh_utils import *
-from plotting.PlotEvent import PlotEvent
+from plotting.PlotEvent import PlotEvent, PLOT_EVENT_KINDS, VMA_ROUTE_OPS, vma_route_op
+from plotting.plotdata_store_class import plotdata_store
 import plotting.plots_common as plots
+import numpy as np
+import plotting.plots_style as style
+import array
+import copy
+import hashlib
+import importlib
+import inspect
 import pickle
 import re
+import tempfile
 
+TOPDIR = "{}{}".format(os.path.dirname(os.path.dirname(
+	os.path.abspath(__file__))), os.sep)
+  # The top-level dir of these scripts (see source_modules()).
 SERIESPREFIX = 'series'
 SERIESSUFFIX = 'dat'
 NOAPPNAME = 'noapp'
+RENDERHASHSUFFIX = 'render-hash'
+SPILLCHUNK = 65536
+  # Number of datapoints that a series with a spill file keeps in
+  # memory before it writes them out (see series.set_spill()).
+SAMPLEBUF_FLUSH_SIZE = 1024 * 1024
+  # Number of perf samples that a plot with an arraysfn and a flushfn
+  # buffers before it passes them to the arraysfn.
 
 '''
 Identifies one series of data for a multiapp_plot. A series object is
 intended to be very simple: just a name and a list of opaque
 tuples for datapoints. It is up to each different multiapp_plot object
 to interpret these datapoints.
+
+Series are serialized in a columnar format when possible (see
+serialize()): deserialize() then memory-maps one NumPy array per
+datapoint field, which plotfns can get with column(); the list of
+datapoint objects in .data is only built if somebody asks for it.
+
+A series can also be given a maximum number of points (see
+set_maxpoints()), in which case append_datapoint() decimates the
+datapoints as they arrive so that the series never grows much beyond
+that size, no matter how long the trace is. Otherwise, a series that
+has a spill file (see set_spill()) only keeps the last SPILLCHUNK
+datapoints in memory during the analysis and appends the older ones to
+the file in chunks; write_record() then copies the chunks into a
+plotdata_store one column at a time.
 '''
 class series:
 	tag = 'series'
 
 	seriesname = None
 	appname = None
-	data = None
+	_data = None
+	columns = None    # field name -> array, for columnar series
+	colconsts = None  # field name -> value shared by every datapoint
+	pointclass = None
+	npoints = None
+	maxpoints = None   # see set_maxpoints()
+	bucketsize = None
+	bucket = None
+	lastpoint = None   # the last datapoint appended to a decimated series
+	spillf = None      # see set_spill()
+	nspilled = None
 
 	def __init__(self, seriesname, appname):
 		tag = "{}.__init__".format(self.tag)
@@ -38,40 +81,521 @@ class series:
 
 		self.seriesname = seriesname
 		self.appname = appname
-		self.data = list()
+		self._data = list()
+		self.nspilled = 0
+		return
+
+	# The list of datapoints. For a series that was deserialized from
+	# columnar files, the datapoint objects are built from the columns
+	# on first access.
+	# A series with a spill file reads all of its spilled datapoints
+	# back in here, and stops spilling; use iter_points() to avoid that.
+	# A decimated series moves its pending points (see pending_points())
+	# into the list.
+	@property
+	def data(self):
+		if self._data is None:
+			self._data = points_from_columns(self.pointclass,
+				self.npoints, self.columns, self.colconsts)
+			self.columns = None
+		elif self.maxpoints:
+			self._data += self.pending_points()
+			self.bucket = None
+			self.lastpoint = None
+		elif self.spillf:
+			spilled = []
+			for (header, columns) in self.spilled_records():
+				spilled += record_points(header, columns)
+			self._data = spilled + self._data
+			self.close_spill()
+		return self._data
+
+	@data.setter
+	def data(self, newdata):
+		self._data = newdata
+		self.columns = None
+		self.bucket = None
+		self.lastpoint = None
+		return
+
+	# Returns: the number of datapoints, without building the
+	# datapoint objects for a columnar series.
+	def num_points(self):
+		if self._data is None:
+			return self.npoints
+		elif self.spillf:
+			return self.nspilled + len(self._data)
+		elif self.maxpoints:
+			return len(self._data) + len(self.pending_points())
+		return len(self._data)
+
+	# Yields: every datapoint in the series, in order, without building
+	# the whole list of datapoint objects for a columnar or spilled
+	# series.
+	def iter_points(self):
+		if self._data is None:
+			for start in range(0, self.npoints, SPILLCHUNK):
+				end = min(start + SPILLCHUNK, self.npoints)
+				columns = dict()
+				for (field, column) in self.columns.items():
+					columns[field] = column[start:end]
+				for p in points_from_columns(self.pointclass,
+						end - start, columns, self.colconsts):
+					yield p
+			return
+		if self.spillf:
+			for (header, columns) in self.spilled_records():
+				for p in record_points(header, columns):
+					yield p
+			for p in self._data:
+				yield p
+			return
+		for p in self._data:
+			yield p
+		if self.maxpoints:
+			for p in self.pending_points():
+				yield p
+		return
+
+	# Gives the series a spill file in spilldir (the default temp dir if
+	# None): from now on, whenever SPILLCHUNK datapoints have been
+	# appended, they are written out to the file and dropped from
+	# memory. The file is deleted when the series is finished with
+	# (see close_spill()). Series with a maxpoints are never spilled.
+	def set_spill(self, spilldir=None):
+		tag = "{}.set_spill".format(self.tag)
+
+		if self.spillf or self.maxpoints:
+			return
+		try:
+			self.spillf = tempfile.TemporaryFile(dir=spilldir,
+					prefix='series-', suffix='.spill')
+		except OSError as e:
+			print_warning(tag, ("could not create a spill file in {}, "
+				"keeping series {} in memory: {}").format(spilldir,
+				self.seriesname, e))
+			self.spillf = None
+		self.nspilled = 0
+
+		return
+
+	def close_spill(self):
+		if self.spillf:
+			self.spillf.close()
+			self.spillf = None
+		self.nspilled = 0
+		return
+
+	# Appends the datapoints in memory to the spill file, as one
+	# (header, columns) record (see points_record()).
+	def spill(self):
+		if len(self._data) == 0:
+			return
+		self.spillf.seek(0, os.SEEK_END)
+		pickle.dump(points_record(self._data), self.spillf,
+				protocol=pickle.DEFAULT_PROTOCOL)
+		self.nspilled += len(self._data)
+		self._data = list()
+		return
+
+	# Yields: each (header, columns) record in the spill file.
+	def spilled_records(self):
+		self.spillf.seek(0)
+		while True:
+			try:
+				record = pickle.load(self.spillf)
+			except EOFError:
+				break
+			pos = self.spillf.tell()
+			yield record
+			self.spillf.seek(pos)
+		return
+
+	# Turns on streaming decimation for this series: from now on,
+	# append_datapoint() collects the datapoints into buckets of
+	# bucketsize consecutive points and only keeps the points with the
+	# minimum and maximum .count from each bucket. Whenever the series
+	# holds more than maxpoints points, adjacent pairs of buckets are
+	# merged (again keeping just their minimum and maximum points) and
+	# bucketsize is doubled. So, the global minimum and maximum of the
+	# series always survive, and checkpoint datapoints (.cp_name set)
+	# and datapoints without a .count are always kept as-is. The first
+	# and the last datapoint of the series are kept too, so that the
+	# decimated series spans the same time range and ends at the same
+	# value.
+	def set_maxpoints(self, maxpoints):
+		tag = "{}.set_maxpoints".format(self.tag)
+
+		if maxpoints is not None and maxpoints < 4:
+			print_error_exit(tag, ("invalid maxpoints {}").format(
+				maxpoints))
+		self.maxpoints = maxpoints
+		self.bucketsize = 1
+		self.bucket = None
+		self.lastpoint = None
+
 		return
 
 	def append_datapoint(self, datapoint):
-		self.data.append(datapoint)
+		if self.spillf:
+			self._data.append(datapoint)
+			if len(self._data) >= SPILLCHUNK:
+				self.spill()
+			return True
+		elif not self.maxpoints:
+			self.data.append(datapoint)
+			return True
+
+		self.lastpoint = datapoint
+		if not is_decimatable(datapoint):
+			self.close_bucket()
+			self._data.append(datapoint)
+		elif len(self._data) == 0 and self.bucket is None:
+			# The first point of the series is always kept.
+			self._data.append(datapoint)
+		else:
+			# The open bucket is a list: [number of points, index of
+			# the min point, min point, index of the max point, max
+			# point, last point].
+			b = self.bucket
+			if b is None:
+				self.bucket = [1, 0, datapoint, 0, datapoint, datapoint]
+			else:
+				if datapoint.count < b[2].count:
+					b[1] = b[0]
+					b[2] = datapoint
+				if datapoint.count > b[4].count:
+					b[3] = b[0]
+					b[4] = datapoint
+				b[0] += 1
+				b[5] = datapoint
+			if self.bucket[0] >= self.bucketsize:
+				self.close_bucket()
+
+		if len(self._data) > self.maxpoints:
+			self.decimate()
 		return True
 
-	# Optional sortkey: something like "lambda datapoint: datapoint[0]"
-	def data(self, sortkey=None):
-		if sortkey:
-			return sorted(self.data, key=sortkey)
-		return self.data
+	# Returns: the open bucket's min and max points (and its last point,
+	# if keeplast is True), in order.
+	def bucket_points(self, keeplast=False):
+		b = self.bucket
+		if not b:
+			return []
+		if b[1] <= b[3]:
+			candidates = [b[2], b[4]]
+		else:
+			candidates = [b[4], b[2]]
+		if keeplast:
+			candidates.append(b[5])
+		points = []
+		for p in candidates:
+			if len(points) == 0 or p is not points[-1]:
+				points.append(p)
+		return points
+
+	# Moves the open bucket's points (see bucket_points()) into the data
+	# list.
+	def close_bucket(self, keeplast=False):
+		self._data += self.bucket_points(keeplast)
+		self.bucket = None
+		return
+
+	# Returns: the points of a decimated series that aren't in the data
+	# list yet but belong at the end of it: the open bucket's points,
+	# and the last datapoint that was appended, if a closed bucket or
+	# decimate() dropped it. Doesn't change the series.
+	def pending_points(self):
+		points = self.bucket_points(keeplast=True)
+		last = self.lastpoint
+		if last is not None:
+			if points:
+				tail = points[-1]
+			elif self._data:
+				tail = self._data[-1]
+			else:
+				tail = None
+			if tail is not last:
+				points.append(last)
+		return points
+
+	# Halves the number of decimatable points in the data list, by
+	# keeping only the min and max points of every run of four of them
+	# (two closed buckets), and doubles the bucketsize for new points.
+	# The first and last points in the list are always kept.
+	def decimate(self):
+		tag = "{}.decimate".format(self.tag)
+
+		while len(self._data) > self.maxpoints:
+			newdata = []
+			group = []
+			last = len(self._data) - 1
+			for (i, p) in enumerate(self._data):
+				if i == 0 or i == last or not is_decimatable(p):
+					newdata += min_max_points(group)
+					group = []
+					newdata.append(p)
+				else:
+					group.append(p)
+					if len(group) == 4:
+						newdata += min_max_points(group)
+						group = []
+			newdata += min_max_points(group)
+			self.bucketsize *= 2
+			if len(newdata) == len(self._data):
+				# Too many points that must be kept.
+				break
+			self._data = newdata
+		print_debug(tag, ("series {}: decimated to {} points, "
+			"bucketsize now {}").format(self.seriesname, len(self._data),
+			self.bucketsize))
+
+		return
+
+	# Returns: an array with the values of the field (e.g. 'timestamp'
+	# or 'count') for every datapoint in the series. For a columnar
+	# series that hasn't been converted to datapoint objects this is
+	# a read-only view of the memory-mapped column; otherwise it is
+	# built from the spilled records' columns and the datapoints in
+	# memory (see column_chunks()), without reading the spilled
+	# datapoints back into the series.
+	def column(self, field):
+		if self._data is None:
+			try:
+				return self.columns[field]
+			except KeyError:
+				return np.full(self.npoints, self.colconsts.get(field),
+						dtype=object)
+		chunks = list(self.column_chunks(field))
+		if len(chunks) == 1:
+			return chunks[0]
+		return np.concatenate(chunks)
+
+	# Yields: the field's values for consecutive runs of the series'
+	# datapoints, as arrays: one per spilled record, then one for the
+	# datapoints in memory (see iter_points()).
+	def column_chunks(self, field):
+		if self.spillf:
+			for (header, columns) in self.spilled_records():
+				if field in columns:
+					yield columns[field]
+				elif header.get('format') == COLUMNAR_FORMAT:
+					yield np.full(header['npoints'],
+						header['consts'].get(field), dtype=object)
+				else:
+					yield np.array([getattr(p, field) for p in
+						record_points(header, columns)])
+			yield np.array([getattr(p, field) for p in self._data])
+			return
+		yield np.array([getattr(p, field) for p in self.iter_points()])
+		return
+
+	# Returns: a series_points view of the series' datapoints.
+	def points_view(self):
+		return series_points(self)
+
+	# Converts an in-memory series into a columnar one (see to_record()),
+	# so that column() and set_column() work on arrays rather than on
+	# datapoint objects.
+	# Returns: True if the series is columnar now, False if its
+	# datapoints can't be stored as columns.
+	def make_columnar(self):
+		if self._data is None:
+			return True
+		(header, columns) = points_record(list(self.iter_points()))
+		if header.get('format') != COLUMNAR_FORMAT:
+			return False
+		self.close_spill()
+		self._data = None
+		self.npoints = header['npoints']
+		self.pointclass = header['pointclass']
+		self.colconsts = header['consts']
+		self.columns = columns
+		return True
+
+	# Replaces the field's value in every datapoint with the values in
+	# the array (which must have one value per datapoint).
+	def set_column(self, field, values):
+		values = np.asarray(values)
+		if self._data is None:
+			self.columns[field] = values
+			self.colconsts.pop(field, None)
+		else:
+			for (p, value) in zip(self.data, values.tolist()):
+				setattr(p, field, value)
+		return
+
+	# Appends a copy of the last datapoint, with field set to value.
+	def repeat_last_point(self, field, value):
+		if self._data is None:
+			if field in self.colconsts:
+				self.columns[field] = np.full(self.npoints,
+						self.colconsts.pop(field))
+			for (f, column) in list(self.columns.items()):
+				if f == field:
+					self.columns[f] = np.append(column, [value])
+				else:
+					self.columns[f] = np.append(column, column[-1:])
+			self.npoints += 1
+		else:
+			lastpoint = copy.deepcopy(self.data[-1])
+			setattr(lastpoint, field, value)
+			self.data.append(lastpoint)
+		return
+
+	# Converts the series into a (header, columns) record for writing
+	# out. Datapoints that are all plain objects of the same class with
+	# the same fields become one NumPy array per field (columns), plus a
+	# header with the fields that have the same value for every point
+	# (e.g. appname) and the class of the points. Anything else (tuples,
+	# ints, vm_mappings, ...) is pickled whole into the header, and
+	# columns is empty. The series itself isn't changed (a spilled
+	# series keeps spilling); use merged_spill_header() to write out a
+	# spilled series without building the whole record.
+	def to_record(self):
+		tag = "{}.to_record".format(self.tag)
+
+		(header, columns) = points_record(list(self.iter_points()))
+		header['seriesname'] = self.seriesname
+		header['appname'] = self.appname
+
+		return (header, columns)
+
+	# Adds the series to the store (a plotdata_store opened for writing)
+	# under plotname. For a spilled series, the spilled records are
+	# merged into one columnar record and copied into the store one
+	# column at a time, so the series is never all in memory at once
+	# (unless its records can't be merged, e.g. if some of its
+	# datapoints couldn't be stored as columns).
+	def write_record(self, store, plotname):
+		tag = "{}.write_record".format(self.tag)
+
+		header = self.merged_spill_header()
+		if header:
+			fields = []
+			for (field, dtype) in sorted(header['columns'].items()):
+				fields.append((field, dtype,
+					self.spilled_column_chunks(field, dtype)))
+			print_debug(tag, ("writing {} spilled datapoints for "
+				"series {} of plot {}").format(self.nspilled,
+				self.seriesname, plotname))
+			store.add_chunked(plotname, self.appname,
+					self.seriesname, header, fields)
+			return
+
+		(header, columns) = self.to_record()
+		store.add(plotname, self.appname, self.seriesname, header,
+				columns)
+		return
+
+	# For a spilled series, spills the datapoints that are still in
+	# memory and merges the headers of the spilled records (see
+	# merge_record_headers()), so that the series can be written out one
+	# column at a time with spilled_column_chunks().
+	# Returns: the merged header, or None if the series isn't spilled
+	# or its records can't be merged into columns.
+	def merged_spill_header(self):
+		if not self.spillf:
+			return None
+		self.spill()
+		header = merge_record_headers([h for (h, c) in
+				self.spilled_records()])
+		if header:
+			header['seriesname'] = self.seriesname
+			header['appname'] = self.appname
+		return header
+
+	# Yields: the field's column from each spilled record, as an array
+	# of dtype.
+	def spilled_column_chunks(self, field, dtype):
+		for (header, columns) in self.spilled_records():
+			if field in columns:
+				yield columns[field].astype(dtype)
+			else:
+				yield np.full(header['npoints'], header['consts'][field],
+						dtype=dtype)
+		return
+
+	# The opposite of to_record(): columns may be memory-mapped arrays.
+	def load_record(self, header, columns):
+		tag = "{}.load_record".format(self.tag)
+
+		self.close_spill()
+		self.seriesname = header['seriesname']
+		self.appname = header['appname']
+		if header.get('format') == COLUMNAR_FORMAT:
+			self._data = None
+			self.npoints = header['npoints']
+			self.pointclass = header['pointclass']
+			self.colconsts = header['consts']
+			self.columns = columns
+		else:
+			# Old pickled series (the whole __dict__) or a series
+			# that couldn't be written as columns.
+			self.data = header['data']
+
+		return
+
+	# Feeds the series' name and datapoints into the hashlib object h,
+	# without building the datapoint objects for a columnar series.
+	def update_hash(self, h):
+		if self._data is None:
+			h.update(pickle.dumps((self.seriesname, self.appname,
+				self.npoints, self.pointclass, sorted(
+				self.colconsts.items())), protocol=pickle.DEFAULT_PROTOCOL))
+			for field in sorted(self.columns.keys()):
+				h.update(field.encode())
+				h.update(np.ascontiguousarray(self.columns[field]).tobytes())
+			return
+
+		if self.spillf:
+			records = list(self.spilled_records())
+			records.append(points_record(self._data))
+		else:
+			records = [points_record(list(self.iter_points()))]
+		h.update(pickle.dumps((self.seriesname, self.appname),
+			protocol=pickle.DEFAULT_PROTOCOL))
+		for (header, columns) in records:
+			h.update(pickle.dumps(header, protocol=pickle.DEFAULT_PROTOCOL))
+			for field in sorted(columns.keys()):
+				h.update(field.encode())
+				h.update(columns[field].tobytes())
+		return
 
+	# Writes the series to outputfname (the header) plus one .npy file
+	# per column next to it. serialize_plotlist_data() uses a
+	# plotdata_store instead.
 	def serialize(self, outputfname):
 		tag = "{}.serialize".format(self.tag)
 
-		# It should be very simple to use Python's "pickle" module
-		# to write the opaque tuples in the datapoint list to the
-		# output file. The only potential drawback is that this data
-		# is in a binary format by default, and will not be readable
-		# by a human or e.g. Excel. If we'd like to write out CSV/TSV
-		# files for use in Excel, this can be added here later by
-		# adding a method to write out the data in that format, or
-		# possibly by using protocol version 0 for the pickle module.
-		# 
 		# http://docs.python.org/3/library/pickle.html#module-pickle
 		# http://docs.python.org/3/library/pickle.html#pickle.dump
-
-		print_debug(tag, ("pickling {} self.data points for series "
-			"{} and app {} to file {}").format(len(self.data),
-			self.seriesname, self.appname, outputfname))
+		header = self.merged_spill_header()
+		if header:
+			# Copy the spilled columns into the .npy files one record
+			# at a time.
+			for (field, dtype) in header['columns'].items():
+				column = np.lib.format.open_memmap(column_fname(
+					outputfname, field), mode='w+', dtype=dtype,
+					shape=(header['npoints'],))
+				start = 0
+				for chunk in self.spilled_column_chunks(field, dtype):
+					column[start:start+len(chunk)] = chunk
+					start += len(chunk)
+				column.flush()
+				del column
+		else:
+			(header, columns) = self.to_record()
+			for (field, column) in columns.items():
+				np.save(column_fname(outputfname, field), column,
+						allow_pickle=False)
+		print_debug(tag, ("wrote {} datapoints for series {} and app {} "
+			"to file {} ({} columns)").format(self.num_points(),
+			self.seriesname, self.appname, outputfname,
+			len(header.get('columns', []))))
 		f = open(outputfname, 'wb')  # binary mode!
 		# http://stackoverflow.com/a/2842727/1230197
-		pickle.dump(self.__dict__, f, protocol=pickle.DEFAULT_PROTOCOL)
+		pickle.dump(header, f, protocol=pickle.DEFAULT_PROTOCOL)
 		f.close()
 
 		return
@@ -80,26 +604,243 @@ class series:
 	def deserialize(self, inputfname):
 		tag = "{}.deserialize".format(self.tag)
 
-		# See pickling comments in serialize() above...
+		# See serialize() above...
 		# http://docs.python.org/3/library/pickle.html#module-pickle
 
-		if len(self.data) != 0:
+		if self.num_points() != 0:
 			print_error(tag, ("self.data already has {} datapoints "
-				"in it!").format(len(self.data)))
+				"in it!").format(self.num_points()))
 			return False
 
 		f = open(inputfname, 'rb')  # binary mode!
 		# http://stackoverflow.com/a/2842727/1230197
-		tmp_dict = pickle.load(f)
-		self.__dict__.update(tmp_dict)
+		header = pickle.load(f)
 		f.close()
 
-		print_debug(tag, ("unpickle successful: appname={}, "
+		columns = dict()
+		if header.get('format') == COLUMNAR_FORMAT:
+			for field in header['columns'].keys():
+				columns[field] = np.load(column_fname(inputfname,
+					field), mmap_mode='r', allow_pickle=False)
+		self.load_record(header, columns)
+
+		print_debug(tag, ("load successful: appname={}, "
 			"seriesname={}, self.data contains {} "
 			"datapoints").format(self.appname, self.seriesname,
-			len(self.data)))
+			self.num_points()))
 		return True
 
+'''
+A read-only view of a series as a sequence of datapoints, for the
+plotdicts that construct_scale_ts_plotdict() builds: plot methods that
+only need the timestamps and counts can take them with column()
+without the datapoint objects ever being built, while plotfns that want
+the datapoints can still iterate, index and sort the view like a list.
+'''
+class series_points:
+	tag = 'series_points'
+
+	S = None
+
+	def __init__(self, S):
+		tag = "{}.__init__".format(self.tag)
+
+		self.S = S
+		return
+
+	def __len__(self):
+		return self.S.num_points()
+
+	def __iter__(self):
+		return self.S.iter_points()
+
+	def __getitem__(self, i):
+		return self.S.data[i]
+
+	def column(self, field):
+		return self.S.column(field)
+
+# Converts a list of datapoints into a (header, columns) record: see
+# series.to_record().
+def points_record(data):
+	header = columnar_header(data)
+	if header:
+		try:
+			columns = dict()
+			for (field, dtype) in header['columns'].items():
+				columns[field] = np.array([p.__dict__[field] for
+					p in data], dtype=dtype)
+		except OverflowError:
+			# ints that don't fit in an int64 column.
+			header = None
+	if not header:
+		header = {'data': data}
+		columns = dict()
+
+	return (header, columns)
+
+# The opposite of points_record().
+# Returns: a list of datapoints.
+def record_points(header, columns):
+	if header.get('format') == COLUMNAR_FORMAT:
+		return points_from_columns(header['pointclass'],
+				header['npoints'], columns, header['consts'])
+	return header['data']
+
+# Merges the headers of the records for consecutive chunks of one
+# series into the header for a single columnar record: a field that
+# has the same value in every chunk stays constant, and any other field
+# becomes a column (with the dtype that columnar_header() would have
+# picked for the whole series).
+# Returns: the merged header, or None if the chunks can't be merged
+# into columns.
+def merge_record_headers(headers):
+	if len(headers) == 0:
+		return None
+	for header in headers:
+		if header.get('format') != COLUMNAR_FORMAT:
+			return None
+	first = headers[0]
+	fields = set(first['consts'].keys()) | set(first['columns'].keys())
+
+	types = dict()
+	for field in fields:
+		types[field] = set()
+	npoints = 0
+	for header in headers:
+		if (header['pointclass'] != first['pointclass'] or
+			set(header['consts'].keys()) |
+			set(header['columns'].keys()) != fields):
+			return None
+		npoints += header['npoints']
+		for (field, dtype) in header['columns'].items():
+			types[field].add(dtype)
+		for (field, value) in header['consts'].items():
+			dtype = COLUMN_DTYPES.get(type(value))
+			types[field].add(dtype if dtype else ('const', field))
+
+	consts = dict()
+	columns = dict()
+	for (field, fieldtypes) in types.items():
+		values = [h['consts'][field] for h in headers
+				if field in h['consts']]
+		try:
+			same = (len(values) == len(headers) and
+					all(v == values[0] for v in values))
+		except (TypeError, ValueError):
+			return None
+		if same:
+			consts[field] = values[0]
+		elif fieldtypes <= {COLUMN_DTYPES[bool]}:
+			columns[field] = COLUMN_DTYPES[bool]
+		elif fieldtypes <= {COLUMN_DTYPES[int]}:
+			columns[field] = COLUMN_DTYPES[int]
+		elif fieldtypes <= {COLUMN_DTYPES[int], COLUMN_DTYPES[float]}:
+			columns[field] = COLUMN_DTYPES[float]
+		else:
+			return None
+
+	return {'format': COLUMNAR_FORMAT, 'npoints': npoints,
+		'pointclass': first['pointclass'], 'consts': consts,
+		'columns': columns}
+
+# Returns: True if the datapoint may be dropped when decimating a
+# series: checkpoint datapoints and datapoints without a count are
+# always kept.
+def is_decimatable(point):
+	return (getattr(point, 'cp_name', None) is None and
+			getattr(point, 'count', None) is not None)
+
+# Returns: the points in the list (of decimatable points, in time order)
+# with the minimum and maximum .count, in their original order.
+def min_max_points(points):
+	if len(points) <= 2:
+		return points
+	lo = 0
+	hi = 0
+	for i in range(1, len(points)):
+		if points[i].count < points[lo].count:
+			lo = i
+		if points[i].count > points[hi].count:
+			hi = i
+	if lo == hi:
+		return [points[lo]]
+	return [points[min(lo, hi)], points[max(lo, hi)]]
+
+COLUMNAR_FORMAT = 'columnar-1'
+COLUMN_DTYPES = {bool: 'bool', int: 'int64', float: 'float64'}
+
+# Returns: the filename for the .npy file with the specified field's
+# column, next to the series header file fname.
+def column_fname(fname, field):
+	return "{}.col-{}.npy".format(os.path.splitext(fname)[0], field)
+
+# Checks if the list of datapoints can be stored as columns: every
+# point must be a plain object of the same class with the same set of
+# fields, and every field must either have the same value in every
+# point or only bool / int / float values.
+# Returns: a header dict with the class, the constant fields and the
+# dtype of each column, or None if the points must be pickled.
+def columnar_header(data):
+	if len(data) == 0:
+		return None
+	cls = type(data[0])
+	if (cls.__module__ == 'builtins' or '.' in cls.__qualname__ or
+		hasattr(cls, '__slots__') or not hasattr(data[0], '__dict__')):
+		return None
+	fields = set(data[0].__dict__.keys())
+
+	types = dict()
+	for field in fields:
+		types[field] = set()
+	for p in data:
+		if type(p) is not cls or p.__dict__.keys() != fields:
+			return None
+		for (field, value) in p.__dict__.items():
+			types[field].add(type(value))
+
+	consts = dict()
+	columns = dict()
+	first = data[0].__dict__
+	for (field, fieldtypes) in types.items():
+		try:
+			same = all(p.__dict__[field] == first[field] for p in data)
+		except (TypeError, ValueError):
+			return None
+		if same:
+			consts[field] = first[field]
+		elif fieldtypes <= {bool}:
+			columns[field] = COLUMN_DTYPES[bool]
+		elif fieldtypes <= {int}:
+			columns[field] = COLUMN_DTYPES[int]
+		elif fieldtypes <= {int, float}:
+			columns[field] = COLUMN_DTYPES[float]
+		else:
+			return None
+
+	return {'format': COLUMNAR_FORMAT, 'npoints': len(data),
+		'pointclass': (cls.__module__, cls.__qualname__),
+		'consts': consts, 'columns': columns}
+
+# Builds the list of datapoint objects for a columnar series, like
+# unpickling would (the class's __init__ isn't called).
+def points_from_columns(pointclass, npoints, columns, consts):
+	(modname, clsname) = pointclass
+	cls = getattr(importlib.import_module(modname), clsname)
+	values = dict()
+	for (field, column) in columns.items():
+		values[field] = column.tolist()
+
+	points = list()
+	for i in range(npoints):
+		p = cls.__new__(cls)
+		p.__dict__.update(consts)
+		for (field, vals) in values.items():
+			p.__dict__[field] = vals[i]
+		points.append(p)
+
+	return points
+
 ##############################################################################
 '''
 Class with high-level methods for creating a plot with multiple series
@@ -116,6 +857,12 @@ class multiapp_plot:
 	plotname = None
 	plotfn = None
 	datafn = None
+	arraysfn = None
+	flushfn = None
+	eventkinds = None
+	vmaops = None
+	maxpoints = None
+	factory = None   # see PlotList.new_plot()
 
 	# These are reset on a reset() call:
 	workingdir = None
@@ -123,6 +870,7 @@ class multiapp_plot:
 	seriesdict = None
 	auxdata = None
 	pdffiles = None
+	samplebufs = None
 
 	# Arguments:
 	# auxdataclass
@@ -136,7 +884,9 @@ class multiapp_plot:
 	#   seriesdict is a dictionary mapping series seriesnames to their
 	#   series objects. The plotfn should not save the plot to the
 	#   workingdir itself, but the workingdir is passed in case the
-	#   plot wants to write out any other data (e.g. a table).
+	#   plot wants to write out any other data (e.g. a table). Plotfns
+	#   that only need a few fields of every datapoint should use
+	#   series.column() to get them as (memory-mapped) arrays.
 	#   Returns: plotfig, a matplotlib Figure object for the plot.
 	# def datafn(auxdata, plot_event, tgid, currentapp)
 	#   plot_event: a PlotEvent from the analysis script...
@@ -154,8 +904,40 @@ class multiapp_plot:
 	#   Returns: a list of PlotEvent objects.
 	# def resetfn(auxdata)
 	#   ...
+	# def arraysfn(auxdata, times, periods, is_miss, tgid, currentapp)
+	#   Optional, for perf plots only: if set, then consume_perf_sample()
+	#   just buffers the samples' time, period and is_miss_event fields,
+	#   and flush_perf_samples() later passes them to the arraysfn as
+	#   NumPy arrays (one call per tgid + app), instead of calling the
+	#   datafn for every sample.
+	#   Returns: a list of (seriesname, datapoint) tuples, like datafn.
+	# def flushfn(auxdata, currentapp)
+	#   Optional, for plots whose datafn / arraysfn accumulates state in
+	#   the auxdata (e.g. one point per time window) rather than
+	#   returning every point right away: flush() calls it once all of
+	#   the app's events and samples have been consumed, to get the
+	#   points that are still pending. For plots with both an arraysfn
+	#   and a flushfn, consume_perf_arrays() passes the arrays straight
+	#   to the arraysfn and the per-sample buffers are flushed every
+	#   SAMPLEBUF_FLUSH_SIZE samples, so that the samples are never all
+	#   buffered at once.
+	#   Returns: a list of (seriesname, datapoint) tuples, like datafn.
+	# eventkinds
+	#   Optional list of the PlotEvent kinds (see PLOT_EVENT_KINDS) that
+	#   the datafn actually does something with; the analysis script
+	#   only passes PlotEvents of these kinds to the plot (see
+	#   plot_routing_table). None means every kind.
+	# vmaops
+	#   Optional list of the vma operations (see VMA_ROUTE_OPS) that the
+	#   datafn does something with, for plots that consume 'vma'
+	#   PlotEvents. None means every operation.
+	# maxpoints
+	#   Optional maximum number of datapoints to keep in each series,
+	#   for time-series plots whose plotfns only need the shape of the
+	#   series (see series.set_maxpoints()). None keeps every point.
 	def __init__(self, plotname, auxdataclass, plotfn, datafn, resetfn,
-			processfn=None):
+			processfn=None, arraysfn=None, eventkinds=None, vmaops=None,
+			maxpoints=None, flushfn=None):
 		tag = "{}.__init__".format(self.tag)
 
 		if not plotname or len(plotname) < 2:
@@ -166,12 +948,28 @@ class multiapp_plot:
 			print_error_exit(tag, ("datafn is None!"))
 		if not resetfn:
 			print_error_exit(tag, ("resetfn is None!"))
+		for kind in (eventkinds or []):
+			if kind not in PLOT_EVENT_KINDS:
+				print_error_exit(tag, ("invalid eventkind {} for plot {}, "
+					"expect one of {}").format(kind, plotname,
+					PLOT_EVENT_KINDS))
+		for op in (vmaops or []):
+			if op not in VMA_ROUTE_OPS:
+				print_error_exit(tag, ("invalid vmaop {} for plot {}, "
+					"expect one of {}").format(op, plotname,
+					VMA_ROUTE_OPS))
 
 		self.plotname = plotname
 		self.plotfn = plotfn
 		self.datafn = datafn
 		self.resetfn = resetfn
 		self.processfn = processfn
+		self.arraysfn = arraysfn
+		self.flushfn = flushfn
+		self.eventkinds = eventkinds
+		self.vmaops = vmaops
+		self.maxpoints = maxpoints
+		self.factory = None
 		if auxdataclass:
 			self.auxdata = auxdataclass()
 		else:
@@ -201,14 +999,28 @@ class multiapp_plot:
 		self.workingdir = None
 		self.currentapp = None
 		if self.seriesdict:
+			for appserieslist in self.seriesdict.values():
+				for S in appserieslist:
+					S.close_spill()
 			self.seriesdict.clear()
 		else:
 			self.seriesdict = dict()
 		self.pdffiles = []
+		self.samplebufs = dict()
 		self.resetfn(self.auxdata)
 
 		return
 
+	# Returns: True if this plot's datafn wants PlotEvents of the kind.
+	def consumes(self, kind):
+		return self.eventkinds is None or kind in self.eventkinds
+
+	# Returns: True if this plot's datafn wants vma PlotEvents for the
+	# vma operation op (see vma_route_op()).
+	def consumes_vma_op(self, op):
+		return (self.consumes('vma') and
+				(self.vmaops is None or op in self.vmaops))
+
 	def __str__(self):
 		s = ("{}[plotname={}, workingdir={}, currentapp={}, "
 			"pdffiles={}]").format(self.tag, self.plotname,
@@ -269,17 +1081,28 @@ class multiapp_plot:
 				seriesname, appname, appserieslist))
 
 		newseries = series(seriesname, appname)
+		if self.maxpoints:
+			newseries.set_maxpoints(self.maxpoints)
+		elif self.workingdir:
+			newseries.set_spill(self.workingdir)
 		appserieslist.append(newseries)
 		print_debug(tag, ("serieslist for app {} now contains {} "
 			"series").format(appname, len(appserieslist)))
 
 		return newseries
 
-	# Writes out a data file into the workingdir for every series
-	# in the seriesdict.
-	def serialize(self):
+	# Writes every series in the seriesdict into the store (a
+	# plotdata_store opened for writing), or, if store is None, into
+	# a data file in the workingdir.
+	def serialize(self, store=None):
 		tag = "{}.serialize".format(self.tag)
 
+		if store:
+			for appserieslist in self.seriesdict.values():
+				for S in appserieslist:
+					S.write_record(store, self.plotname)
+			return
+
 		if not self.workingdir:
 			print_unexpected(True, tag, ("workingdir not set yet!"))
 			return
@@ -345,6 +1168,26 @@ class multiapp_plot:
 
 		return
 
+	# Reads in the series for this plot from each plotdata_store in
+	# stores (see find_plotdata_stores()).
+	# Returns: the number of series that were found.
+	def deserialize_stores(self, stores):
+		tag = "{}.deserialize_stores".format(self.tag)
+
+		found = 0
+		for store in stores:
+			for (header, columns) in store.find(self.plotname):
+				newseries = series('dummyseriesname', 'dummyappname')
+				newseries.load_record(header, columns)
+				appserieslist = self.get_create_appserieslist(
+						newseries.appname)
+				appserieslist.append(newseries)
+				found += 1
+		print_debug(tag, ("plot {}: found {} series in {} "
+			"stores").format(self.plotname, found, len(stores)))
+
+		return found
+
 	# Looks for a serieslist in our seriesdict that matches the given
 	# appname and returns it if it already exists, or creates an
 	# empry serieslist, inserts it into the seriesdict, and returns it.
@@ -365,6 +1208,19 @@ class multiapp_plot:
 	def consume_perf_sample(self, sample, leaderpid):
 		tag = "{}.consume_perf_sample".format(self.tag)
 
+		if self.arraysfn:
+			# Buffer just the fields that the arraysfn needs in typed
+			# arrays; flush_perf_samples() will process them all at
+			# once.
+			(times, periods, is_miss) = self.get_samplebufs(leaderpid,
+					sample.appname)
+			times.append(sample.time)
+			periods.append(sample.period)
+			is_miss.append(1 if sample.is_miss_event else 0)
+			if self.flushfn and len(times) >= SAMPLEBUF_FLUSH_SIZE:
+				return self.flush_perf_samples()
+			return True
+
 		# It turns out that we can use consume_plot_event() to consume perf
 		# samples as well - consume_plot_event() doesn't do anything with
 		# the vma internals, so it's just up to the datafn to know that
@@ -373,6 +1229,85 @@ class multiapp_plot:
 		return self.consume_plot_event(plot_event, leaderpid,
 				sample.appname)
 
+	# Like consume_perf_sample(), but for many samples at once: times,
+	# periods and is_miss are NumPy arrays with one entry per sample,
+	# in the order that the samples should be consumed. Only valid
+	# for plots with an arraysfn.
+	# Returns: True on success, False on error.
+	def consume_perf_arrays(self, times, periods, is_miss, leaderpid,
+			appname):
+		tag = "{}.consume_perf_arrays".format(self.tag)
+
+		if not self.arraysfn:
+			print_error(tag, ("plot {} has no arraysfn").format(
+				self.plotname))
+			return False
+		if self.flushfn:
+			pointslist = self.arraysfn(self.auxdata, times.astype(np.int64),
+					periods.astype(np.int64), is_miss.astype(bool),
+					leaderpid, appname)
+			return self.add_points(pointslist, appname)
+
+		(buftimes, bufperiods, bufmiss) = self.get_samplebufs(leaderpid,
+				appname)
+		buftimes.frombytes(times.astype(np.int64).tobytes())
+		bufperiods.frombytes(periods.astype(np.int64).tobytes())
+		bufmiss.frombytes(is_miss.astype(np.int8).tobytes())
+
+		return True
+
+	# Returns the (times, periods, is_miss) sample buffers for the
+	# leaderpid + app, creating them if they don't exist yet.
+	def get_samplebufs(self, leaderpid, appname):
+		key = (leaderpid, appname)
+		try:
+			bufs = self.samplebufs[key]
+		except KeyError:
+			bufs = (array.array('q'), array.array('q'), array.array('b'))
+			self.samplebufs[key] = bufs
+		return bufs
+
+	# Passes the perf samples buffered by consume_perf_sample() to the
+	# plot's arraysfn and adds the datapoints that it returns to the
+	# series. Must be called once all of the perf samples have been
+	# consumed (i.e. before serialize(); flush() calls it); does
+	# nothing for plots without an arraysfn.
+	# Returns: True on success, False if there was an error.
+	def flush_perf_samples(self):
+		tag = "{}.flush_perf_samples".format(self.tag)
+
+		retval = True
+		for ((tgid, appname), (times, periods, is_miss)) in sorted(
+				self.samplebufs.items()):
+			print_debug(tag, ("plot {}: passing {} samples for tgid {} "
+				"to arraysfn").format(self.plotname, len(times), tgid))
+			pointslist = self.arraysfn(self.auxdata,
+					np.frombuffer(times, dtype=np.int64),
+					np.frombuffer(periods, dtype=np.int64),
+					np.frombuffer(is_miss, dtype=np.int8).astype(bool),
+					tgid, appname)
+			if not self.add_points(pointslist, appname):
+				retval = False
+		self.samplebufs.clear()
+
+		return retval
+
+	# Flushes the buffered perf samples (see flush_perf_samples()) and
+	# then adds the points that the plot's flushfn still has pending.
+	# serialize_plotlist_data() calls this before it serializes the
+	# plots.
+	# Returns: True on success, False if there was an error.
+	def flush(self):
+		tag = "{}.flush".format(self.tag)
+
+		retval = self.flush_perf_samples()
+		if self.flushfn:
+			pointslist = self.flushfn(self.auxdata, self.currentapp)
+			if not self.add_points(pointslist, self.currentapp):
+				retval = False
+
+		return retval
+
 	# Returns: True if the datapoint was successfully processed by
 	# the datafn and added to the series, False if there was an error.
 	def consume_plot_event(self, plot_event, tgid, appname):
@@ -460,6 +1395,14 @@ class multiapp_plot:
 		pointslist = self.datafn(self.auxdata, plot_event, tgid,
 				appname)
 
+		return self.add_points(pointslist, appname)
+
+	# Adds each (seriesname, datapoint) in the pointslist returned by a
+	# datafn to its corresponding series for the app.
+	# Returns: True on success, False if there was an error.
+	def add_points(self, pointslist, appname):
+		tag = "{}.add_points".format(self.tag)
+
 		if pointslist is None or len(pointslist) == 0:
 			#print_debug(tag, ("pointslist is None / empty, so not "
 			#	"adding a datapoint and just returning success").format())
@@ -528,6 +1471,32 @@ class multiapp_plot:
 
 		return
 
+	# Returns: a hex digest of everything that the rendered plot
+	# depends on: the plot's series, and the source of every module
+	# that render_sources() returns.
+	def render_hash(self):
+		h = hashlib.sha1()
+		h.update(self.plotname.encode())
+		for fname in self.render_sources():
+			h.update(os.path.relpath(fname, TOPDIR).encode())
+			h.update(source_digest(fname))
+		for appname in sorted(self.seriesdict.keys(), key=str):
+			for S in self.seriesdict[appname]:
+				S.update_hash(h)
+		return h.hexdigest()
+
+	# Returns: the sorted source files that the rendered plot depends
+	# on: the plotfn's module, the common plotting and style modules,
+	# and every module of these scripts that they use (see
+	# source_modules()), e.g. the helper modules that the plotfn calls.
+	def render_sources(self):
+		return source_modules([sys.modules[self.plotfn.__module__],
+				plots, style])
+
+	def render_hash_fname(self):
+		return "{}/{}.{}".format(self.workingdir, self.plotname,
+				RENDERHASHSUFFIX)
+
 	# Performs the following steps:
 	#   Calls plotfn to generate the multi-app plot
 	#   Writes the generated plot to a .pdf file
@@ -537,13 +1506,41 @@ class multiapp_plot:
 	# have changed the seriesdict (i.e. it may have removed any
 	# checkpoint series from it), so complete() should not be
 	# called again!
-	def complete(self):
+	# If use_cache is True, the plot's render_hash() is saved next to
+	# its pdf file, and unless force is True, the plotfn is skipped and
+	# the existing pdf file is reused when the hash matches the one that
+	# was saved the last time that the plot was rendered. Cached plots
+	# are not added to the pdffiles.
+	# Returns: the name of the pdf file that the plot was saved to, or
+	# None if no figure was saved.
+	def complete(self, use_cache=False, force=False):
 		tag = "{}.complete".format(self.tag)
 
 		if len(self.seriesdict) == 0:
 			print_warning(tag, ("skipping plot {} because no "
 				"series were added for it!").format(self.plotname))
-			return
+			return None
+
+		pdf_fname = "{}/{}.pdf".format(self.workingdir, self.plotname)
+		hash_fname = self.render_hash_fname()
+		if use_cache:
+			renderhash = self.render_hash()
+			try:
+				f = open(hash_fname, 'r')
+				oldhash = f.read().strip()
+				f.close()
+			except OSError:
+				oldhash = None
+			if (not force and oldhash == renderhash and
+					os.path.exists(pdf_fname)):
+				print_debug(tag, ("plot {} is unchanged since it was "
+					"last rendered, reusing {}").format(self.plotname,
+					pdf_fname))
+				self.reset()
+				return pdf_fname
+			# If the plotfn fails, don't leave an outdated hash behind.
+			if oldhash is not None:
+				os.remove(hash_fname)
 
 		# Note: it doesn't really make sense to pass auxdata to the
 		# plotfn, since the plotfn will generally be called across
@@ -562,29 +1559,176 @@ class multiapp_plot:
 		if not plotfig:
 			print_warning(tag, ("plotfn did not return a fig as "
 				"expected!").format())
-			return
+			return None
 		print_debug(tag, ("got back plotfig from plotfn: type {}").format(
 			type(plotfig)))
 		print_debug(tag, ("plotfig has number {}").format(plotfig.number))
 
 		plot_fname_no_ext = "{}/{}".format(self.workingdir, self.plotname)
 		plots.save_close_plot(plotfig, plot_fname_no_ext, self.pdffiles)
+		if use_cache:
+			f = open(hash_fname, 'w')
+			f.write("{}\n".format(renderhash))
+			f.close()
 
 		# Reset the plot object to ensure that nobody tries to plot
 		# it again.
 		self.reset()
 
+		return pdf_fname
+
+# Returns: the sorted source files of the modules and of every module
+# of these scripts (under TOPDIR) that they use, directly or indirectly:
+# the modules that they import, and the modules of the functions and
+# classes that they import from other modules. The modules named in
+# exclude are left out, and so are the modules that only they use.
+# Packages aren't followed into their submodules, so a module should
+# import another one with "import a.b as b" or "from a.b import ...",
+# not "import a.b".
+def source_modules(modules, exclude=[]):
+	files = set()
+	pending = list(modules)
+	seen = set(exclude)
+	while pending:
+		module = pending.pop()
+		if module.__name__ in seen:
+			continue
+		seen.add(module.__name__)
+		fname = getattr(module, '__file__', None)
+		if not fname or not os.path.abspath(fname).startswith(TOPDIR):
+			continue
+		files.add(os.path.abspath(fname))
+		if hasattr(module, '__path__'):
+			# A package's submodule attributes are whichever of its
+			# submodules have been imported by anyone so far, not
+			# what the package uses.
+			continue
+		for value in list(vars(module).values()):
+			if inspect.ismodule(value):
+				pending.append(value)
+			else:
+				modname = getattr(value, '__module__', None)
+				if (type(modname) is str and modname in sys.modules and
+						modname not in seen):
+					pending.append(sys.modules[modname])
+	return sorted(files)
+
+source_digests = dict()
+
+# Returns: the sha1 digest of the contents of the file fname, which is
+# only read once per process.
+def source_digest(fname):
+	try:
+		return source_digests[fname]
+	except KeyError:
+		pass
+	f = open(fname, 'rb')
+	digest = hashlib.sha1(f.read()).digest()
+	f.close()
+	source_digests[fname] = digest
+	return digest
+
+'''
+Maps each kind of PlotEvent (and each vma operation, for vma PlotEvents)
+to the plots in a plotlist that consume it, so that the analysis script
+only passes each PlotEvent to the plots that will do something with it,
+and can skip creating PlotEvents that no plot wants at all. The table
+is built once per plotlist; the plot lists that it returns keep the
+plotlist's order and must not be modified.
+'''
+class plot_routing_table:
+	tag = 'plot_routing_table'
+
+	plotlist = None
+	kindplots = None
+	vmaplots = None
+
+	def __init__(self, plotlist):
+		tag = "{}.__init__".format(self.tag)
+
+		self.plotlist = list(plotlist)
+		self.kindplots = dict()
+		for kind in PLOT_EVENT_KINDS:
+			self.kindplots[kind] = [p for p in self.plotlist
+					if p.consumes(kind)]
+		self.vmaplots = dict()
+		for op in VMA_ROUTE_OPS:
+			self.vmaplots[op] = [p for p in self.kindplots['vma']
+					if p.consumes_vma_op(op)]
+		print_debug(tag, ("plots per event kind: {}").format(
+			', '.join(["{}={}".format(kind, len(self.kindplots[kind]))
+			for kind in PLOT_EVENT_KINDS])))
+
 		return
 
+	# Returns: True if any plot consumes PlotEvents of the kind.
+	def wants(self, kind):
+		return len(self.kindplots[kind]) > 0
+
+	# Returns: True if any plot consumes a vma PlotEvent for this vma.
+	def wants_vma(self, vma):
+		return len(self.vma_plots(vma)) > 0
+
+	def vma_plots(self, vma):
+		# An operation that we don't know about goes to every plot that
+		# consumes vmas at all.
+		return self.vmaplots.get(vma_route_op(vma), self.kindplots['vma'])
+
+	# Returns: the list of plots that consume the plot_event (which may
+	# be empty).
+	def plots_for(self, plot_event):
+		lists = []
+		if plot_event.vma:
+			lists.append(self.vma_plots(plot_event.vma))
+		for kind in PLOT_EVENT_KINDS:
+			if kind != 'vma' and getattr(plot_event, kind) is not None:
+				lists.append(self.kindplots[kind])
+
+		if len(lists) == 0:
+			return []
+		elif len(lists) == 1:
+			return lists[0]
+		wanted = set()
+		for plots in lists:
+			wanted.update(map(id, plots))
+		return [p for p in self.plotlist if id(p) in wanted]
+
 # Writes out the data for every plot in the plotlist - should be called
 # at the end of an analysis for a single application.
 # Returns: nothing
 def serialize_plotlist_data(plotlist):
 	tag = 'serialize_plotlist_data'
 
+	# One plotdata_store per directory that the plots' workingdirs are
+	# in (normally just the analysis outputdir), rather than one file
+	# per series in each plot's workingdir.
+	plotsbydir = dict()
 	for p in plotlist:
-		print_debug(tag, ("serializing plot object {}").format(p.plotname))
-		p.serialize()
+		if not p.workingdir:
+			print_unexpected(True, tag, ("workingdir not set yet for "
+				"plot {}").format(p.plotname))
+			continue
+		storedir = os.path.dirname(p.workingdir)
+		dirplots = plotsbydir.setdefault(storedir, [])
+		if p not in dirplots:
+			dirplots.append(p)
+
+	for (storedir, dirplots) in plotsbydir.items():
+		store = plotdata_store(storedir)
+		if not store.open(write=True):
+			print_error_exit(tag, ("could not open plot data store "
+				"in {}").format(storedir))
+		for p in dirplots:
+			store.remove_plot(p.plotname)
+		for p in dirplots:
+			if not p.flush():
+				print_error(tag, ("flushing plot {} failed, its data may "
+					"be incomplete").format(p.plotname))
+			print_debug(tag, ("serializing plot object {}").format(
+				p.plotname))
+			p.serialize(store)
+		store.compact()
+		store.close()
 
 	return
 
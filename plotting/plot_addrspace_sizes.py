@@ -965,36 +965,61 @@ def resident_tablefn(seriesdict, plotname, workingdir):
 
 	return None
 
+# The vma operations that update_vm_size() does something with, and the
+# PlotEvent kinds that each kind of size plot consumes (see
+# size_datafn()):
+VM_SIZE_OPS = ['alloc', 'access_change', 'resize', 'unmap_resize',
+		'unmap_free', 'unmap_access_change']
+VIRT_EVENTS = ['vma', 'cp_event']
+PHYS_EVENTS = ['page_event', 'rss_event', 'cp_event']
+BOTH_EVENTS = ['vma', 'page_event', 'rss_event', 'cp_event']
+
 vm_size_ts_plot = multiapp_plot('vm-size-ts', vm_size_auxdata,
-		vm_size_ts_plotfn, vm_size_datafn, vm_size_resetfn)
+		vm_size_ts_plotfn, vm_size_datafn, vm_size_resetfn,
+		eventkinds=VIRT_EVENTS, vmaops=VM_SIZE_OPS,
+		maxpoints=TS_MAXPOINTS)
 resident_ts_plot = multiapp_plot('resident-ts', vm_size_auxdata,
-		resident_ts_plotfn, resident_datafn, vm_size_resetfn)
+		resident_ts_plotfn, resident_datafn, vm_size_resetfn,
+		eventkinds=PHYS_EVENTS, maxpoints=TS_MAXPOINTS)
 
 resident_table = multiapp_plot('resident-table', vm_size_auxdata,
-		resident_tablefn, resident_table_datafn, vm_size_resetfn)
+		resident_tablefn, resident_table_datafn, vm_size_resetfn,
+		eventkinds=['vma', 'rss_event'], vmaops=VM_SIZE_OPS)
 
 # Newer rss-event-based plots:
 virt_phys_size_ts_plot = multiapp_plot('virt-phys-size', vm_size_auxdata,
-		virt_phys_size_ts_plotfn, virt_phys_size_datafn, vm_size_resetfn)
+		virt_phys_size_ts_plotfn, virt_phys_size_datafn, vm_size_resetfn,
+		eventkinds=BOTH_EVENTS, vmaops=VM_SIZE_OPS,
+		maxpoints=TS_MAXPOINTS)
 virt_phys_ratio_ts_plot = multiapp_plot('virt-phys-ratio', vm_size_auxdata,
-		vm_ratio_ts_plotfn, virt_phys_ratio_datafn, vm_size_resetfn)
+		vm_ratio_ts_plotfn, virt_phys_ratio_datafn, vm_size_resetfn,
+		eventkinds=BOTH_EVENTS, vmaops=VM_SIZE_OPS,
+		maxpoints=TS_MAXPOINTS)
 virt_phys_diff_ts_plot = multiapp_plot('virt-phys-diff', vm_size_auxdata,
-		virt_phys_diff_ts_plotfn, virt_phys_diff_datafn, vm_size_resetfn)
+		virt_phys_diff_ts_plotfn, virt_phys_diff_datafn, vm_size_resetfn,
+		eventkinds=BOTH_EVENTS, vmaops=VM_SIZE_OPS,
+		maxpoints=TS_MAXPOINTS)
 
 # Older PTE-event-based plots:
 virt_pte_size_ts_plot = multiapp_plot('virt-phys-size-pte', vm_size_auxdata,
-		virt_phys_size_ts_plotfn, virt_phys_size_datafn, vm_size_resetfn)
+		virt_phys_size_ts_plotfn, virt_phys_size_datafn, vm_size_resetfn,
+		eventkinds=BOTH_EVENTS, vmaops=VM_SIZE_OPS,
+		maxpoints=TS_MAXPOINTS)
 virt_pte_ratio_ts_plot = multiapp_plot('virt-phys-ratio-pte', vm_size_auxdata,
-		vm_ratio_ts_plotfn, virt_phys_ratio_datafn, vm_size_resetfn)
+		vm_ratio_ts_plotfn, virt_phys_ratio_datafn, vm_size_resetfn,
+		eventkinds=BOTH_EVENTS, vmaops=VM_SIZE_OPS,
+		maxpoints=TS_MAXPOINTS)
 
 virt_phys_size_component_ts_plot = multiapp_plot(
 		'virt-phys-size-component', vm_size_auxdata,
 		virt_phys_size_ts_plotfn, virt_phys_size_component_datafn,
-		vm_size_resetfn)
+		vm_size_resetfn, eventkinds=BOTH_EVENTS, vmaops=VM_SIZE_OPS,
+		maxpoints=TS_MAXPOINTS)
 virt_phys_ratio_component_ts_plot = multiapp_plot(
 		'virt-phys-ratio-component', vm_size_auxdata,
 		vm_ratio_ts_plotfn, virt_phys_ratio_component_datafn,
-		vm_size_resetfn)
+		vm_size_resetfn, eventkinds=BOTH_EVENTS, vmaops=VM_SIZE_OPS,
+		maxpoints=TS_MAXPOINTS)
 
 if __name__ == '__main__':
 	print_error_exit("not an executable module")
@@ -97,7 +97,8 @@ def components_ops_plotfn(seriesdict, plotname, workingdir):
 			logscale=False, cp_series=cp_series)
 
 components_ops_plot = multiapp_plot('Components-Ops', components_ops_auxdata,
-		components_ops_plotfn, components_ops_datafn, components_ops_resetfn)
+		components_ops_plotfn, components_ops_datafn, components_ops_resetfn,
+		eventkinds=['vma'])
 
 if __name__ == '__main__':
 	print_error_exit("not an executable module")
@@ -92,7 +92,7 @@ def components_plotfn(seriesdict, plotname, workingdir):
 
 components_vmas_plot = multiapp_plot('Components-VMAs',
 		components_vmas_auxdata, components_plotfn, components_datafn,
-		components_resetfn)
+		components_resetfn, eventkinds=['vma'])
 
 if __name__ == '__main__':
 	print_error_exit("not an executable module")
@@ -5,8 +5,9 @@
 from plotting.multiapp_plot_class import *
 from util.pjh_utils import *
 from plotting.plots_common import *
-import analyze.perf_analysis
+import analyze.perf_analysis as perf_analysis
 import collections
+import numpy as np
 
 ##############################################################################
 
@@ -29,6 +30,8 @@ WINDOWSIZE = 9.5 * 100000000
   # led to lots of up-spikes at various spots throughout the execution
   # of most of the apps - seems like it would be best to avoid these
   # spikes...
+WINDOWS_TO_WAIT = 1
+  # See comments in missrate_update_window().
 
 class missrate_ts_auxdata:
 	tag = 'missrate_ts_auxdata'
@@ -102,7 +105,6 @@ def missrate_update_window(auxdata, sample):
 	# wrong, we just keep using the previous sample, so that any
 	# problematic cases at least don't jump out like crazy in the
 	# plot...
-	WINDOWS_TO_WAIT = 1
 	if sample.time < (auxdata.firstsampletime +
 			          WINDOWSIZE * WINDOWS_TO_WAIT):
 		# Avoid huge spikes in miss rate at beginning of execution
@@ -162,6 +164,69 @@ def missrate_update_window(auxdata, sample):
 
 	return missrate
 
+# Array version of missrate_update_window(), for a plot's entire list
+# of samples at once: times, periods and is_miss are NumPy arrays with
+# one entry per sample. The windowed sums are computed from cumulative
+# sums of the miss and non-miss periods, using searchsorted() to find
+# the first sample in each sample's window; the "use the previous miss
+# rate" cases are handled by forward-filling the last valid miss rate.
+# The samples must be sorted by time (the caller sorts them).
+# Returns: an array with the miss rate for the window ending at each
+# sample, matching what missrate_update_window() would have returned.
+def missrate_window_arrays(times, periods, is_miss):
+	tag = 'missrate_window_arrays'
+
+	n = len(times)
+	misscum = np.cumsum(np.where(is_miss, periods, 0))
+	totalcum = np.cumsum(np.where(is_miss, 0, periods))
+	misscum = np.concatenate(([0], misscum))
+	totalcum = np.concatenate(([0], totalcum))
+
+	# The window for sample i is [times[i] - WINDOWSIZE, times[i]]:
+	# samples with time < minwindow have been popped off of the queue.
+	first = np.searchsorted(times, times - WINDOWSIZE, side='left')
+	last = np.arange(1, n + 1)
+	windowmisses = misscum[last] - misscum[first]
+	windowtotal = totalcum[last] - totalcum[first]
+
+	waiting = times < times[0] + WINDOWSIZE * WINDOWS_TO_WAIT
+	bothzero = (~waiting) & (windowtotal == 0) & (windowmisses == 0)
+	if np.any(bothzero):
+		print_error_exit(tag, ("both windowmisses and windowtotal "
+			"are 0 - what the...?").format())
+	missesonly = (~waiting) & (windowtotal == 0)
+	if np.any(missesonly):
+		print_error(tag, ("windowtotal is 0 for {} samples - we only "
+			"had miss samples in the window at those times. Increase "
+			"sampling frequency or window size??").format(
+			np.count_nonzero(missesonly)))
+	toomany = (~waiting) & (windowtotal != 0) & (windowmisses > windowtotal)
+	if np.any(toomany):
+		print_error(tag, ("windowmisses greater than windowtotal for "
+			"{} samples, would result in an impossible miss rate above "
+			"100% - will use prev_missrate").format(
+			np.count_nonzero(toomany)))
+
+	valid = (~waiting) & (windowtotal != 0) & (windowmisses <= windowtotal)
+	rates = np.zeros(n, dtype=float)
+	np.divide(windowmisses, windowtotal, out=rates, where=valid)
+
+	# Forward-fill: every invalid sample gets the rate of the last valid
+	# sample before it, or 0.0 if there wasn't one yet.
+	lastvalid = np.maximum.accumulate(np.where(valid, np.arange(n), -1))
+	missrates = np.where(lastvalid >= 0, rates[np.maximum(lastvalid, 0)],
+			0.0)
+
+	return missrates
+
+# Sorts the sample arrays passed to an arraysfn by time. The samples
+# are usually already in time order, but the order in the perf.data
+# file is only guaranteed per-cpu. A stable sort keeps samples with the
+# same timestamp in the order that they were consumed.
+def sort_sample_arrays(times, periods, is_miss):
+	order = np.argsort(times, kind='mergesort')
+	return (times[order], periods[order], is_miss[order])
+
 ##############################################################################
 
 class missrate_counts_auxdata:
@@ -247,12 +312,44 @@ def missrate_counts_datafn(auxdata, plot_event, tgid, currentapp):
 
 	return [(seriesname, point)]
 
+# arraysfn version of missrate_window_datafn().
+def missrate_window_arraysfn(auxdata, times, periods, is_miss, tgid,
+		currentapp):
+	tag = 'missrate_window_arraysfn'
+
+	if len(times) == 0:
+		return None
+	(times, periods, is_miss) = sort_sample_arrays(times, periods, is_miss)
+	missrates = missrate_window_arrays(times, periods, is_miss)
+	seriesname = currentapp
+
+	return [(seriesname, point) for point in
+			new_datapoints(currentapp, times, missrates)]
+
+# arraysfn version of missrate_counts_datafn(): every point is the
+# average miss rate so far.
+def missrate_counts_arraysfn(auxdata, times, periods, is_miss, tgid,
+		currentapp):
+	tag = 'missrate_counts_arraysfn'
+
+	if len(times) == 0:
+		return None
+	(times, periods, is_miss) = sort_sample_arrays(times, periods, is_miss)
+	missperiod = np.cumsum(np.where(is_miss, periods, 0))
+	totalperiod = np.cumsum(np.where(is_miss, 0, periods))
+	counts = np.zeros(len(times), dtype=float)
+	np.divide(missperiod, totalperiod, out=counts, where=(totalperiod != 0))
+	seriesname = currentapp
+
+	return [(seriesname, point) for point in
+			new_datapoints(currentapp, times, counts)]
+
 ##############################################################################
 
 def rate_ts_plotfn(seriesdict, plotname, workingdir):
 	# ugh - need to separate plotname and title in multiapp_plot class...
-	if analyze.perf_analysis.PTW_TITLE in plotname:
-		name = analyze.perf_analysis.PTW_TITLE
+	if perf_analysis.PTW_TITLE in plotname:
+		name = perf_analysis.PTW_TITLE
 		ylabel = 'Percentage of execution time'
 		ysplits = [0.01, 0.05, 0.10, 0.20]
 	else:
@@ -263,8 +360,8 @@ def rate_ts_plotfn(seriesdict, plotname, workingdir):
 
 def rate_avg_plotfn(seriesdict, plotname, workingdir):
 	# ugh - need to separate plotname and title in multiapp_plot class...
-	if analyze.perf_analysis.PTW_TITLE in plotname:
-		name = analyze.perf_analysis.PTW_TITLE
+	if perf_analysis.PTW_TITLE in plotname:
+		name = perf_analysis.PTW_TITLE
 		ylabel = 'Percentage of execution time'
 	else:
 		name = plotname
@@ -329,25 +426,31 @@ def new_missrate_ts_plot(eventname):
 	plotname = "{}-ts".format(eventname)
 	return multiapp_plot(plotname, missrate_ts_auxdata,
 		missrate_ts_plotfn, missrate_window_datafn,
-		missrate_ts_resetfn)
+		missrate_ts_resetfn,
+		arraysfn=missrate_window_arraysfn, eventkinds=['perf_sample'],
+		maxpoints=TS_MAXPOINTS)
 
 def new_missrate_avg_plot(eventname):
 	plotname = "{}-avg".format(eventname)
 	return multiapp_plot(plotname, missrate_counts_auxdata,
 		missrate_avg_plotfn, missrate_counts_datafn,
-		missrate_counts_resetfn)
+		missrate_counts_resetfn,
+		arraysfn=missrate_counts_arraysfn, eventkinds=['perf_sample'])
 
 def new_rate_ts_plot(eventname):
 	plotname = "{}-ts".format(eventname)
 	return multiapp_plot(plotname, missrate_ts_auxdata,
 		rate_ts_plotfn, missrate_window_datafn,
-		missrate_ts_resetfn)
+		missrate_ts_resetfn,
+		arraysfn=missrate_window_arraysfn, eventkinds=['perf_sample'],
+		maxpoints=TS_MAXPOINTS)
 
 def new_rate_avg_plot(eventname):
 	plotname = "{}-avg".format(eventname)
 	return multiapp_plot(plotname, missrate_counts_auxdata,
 		rate_avg_plotfn, missrate_counts_datafn,
-		missrate_counts_resetfn)
+		missrate_counts_resetfn,
+		arraysfn=missrate_counts_arraysfn, eventkinds=['perf_sample'])
 
 if __name__ == '__main__':
 	print_error_exit("not an executable module")
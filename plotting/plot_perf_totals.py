@@ -6,6 +6,7 @@ from plotting.multiapp_plot_class import *
 from util.pjh_utils import *
 from plotting.plots_common import *
 import collections
+import numpy as np
 
 ##############################################################################
 
@@ -54,6 +55,22 @@ def totals_counts_datafn(auxdata, plot_event, tgid, currentapp):
 
 	return [(seriesname, point)]
 
+# arraysfn version of totals_counts_datafn(): every point is the
+# cumulative period (count) of the event so far.
+def totals_counts_arraysfn(auxdata, times, periods, is_miss, tgid,
+		currentapp):
+	tag = 'totals_counts_arraysfn'
+
+	if len(times) == 0:
+		return None
+	order = np.argsort(times, kind='mergesort')
+	times = times[order]
+	totalperiod = np.cumsum(periods[order])
+	seriesname = currentapp
+
+	return [(seriesname, point) for point in
+			new_datapoints(currentapp, times, totalperiod)]
+
 ##############################################################################
 
 def totals_ts_plotfn(seriesdict, plotname, workingdir):
@@ -99,13 +116,15 @@ def new_totals_ts_plot(eventname):
 	plotname = "{}-total-ts".format(eventname)
 	return multiapp_plot(plotname, totals_counts_auxdata,
 		totals_ts_plotfn, totals_counts_datafn,
-		totals_counts_resetfn)
+		totals_counts_resetfn,
+		arraysfn=totals_counts_arraysfn, eventkinds=['perf_sample'])
 
 def new_totals_col_plot(eventname):
 	plotname = "{}-total-col".format(eventname)
 	return multiapp_plot(plotname, totals_counts_auxdata,
 		totals_col_plotfn, totals_counts_datafn,
-		totals_counts_resetfn)
+		totals_counts_resetfn,
+		arraysfn=totals_counts_arraysfn, eventkinds=['perf_sample'])
 
 if __name__ == '__main__':
 	print_error_exit("not an executable module")
@@ -0,0 +1,403 @@
+# Virtual memory analysis scripts.
+# Developed 2012-2014 by Peter Hornyack, pjh@cs.washington.edu
+# Copyright (c) 2012-2014 Peter Hornyack and University of Washington
+
+# Plots that join the perf samples with the address space timeline from
+# the kernel trace analysis. The kernel trace and the perf samples are
+# analyzed in separate phases (analyze_main() and then perf_main()), so
+# the join happens in two steps:
+#   1. During the kernel trace analysis, vm_timeline_plot records the
+#      VM size, vma count and Rss at the end of every JOIN_WINDOW that
+#      has events in it (and the largest VM size during the window);
+#      its series is serialized into the app's analysis dir like every
+#      other plot. It's only in the analysis plotlist for apps that
+#      have a perf.data file (see PlotList.get_analysis_plotlist()).
+#   2. During the perf analysis, the perf-vm plot's arraysfn adds up
+#      the miss and total periods of the samples in each JOIN_WINDOW,
+#      and its flushfn then merge-joins the windows with the timeline,
+#      in time order, emitting one point per window with the miss rate
+#      alongside the VM size / vma count / Rss at the end of it.
+# Neither step keeps more than one value per window, and the join only
+# walks the timeline once, so memory use is bounded by the number of
+# windows rather than the number of events or samples in the trace.
+
+from plotting.multiapp_plot_class import *
+from util.pjh_utils import *
+from plotting.plots_common import *
+from plotting.plot_addrspace_sizes import vm_size_auxdata, update_vm_size, update_rss_size, VM_SIZE_OPS
+from plotting.plot_vmacount import vmacount_auxdata, vmacount_datafn
+from plotting.plotdata_store_class import plotdata_store
+from trace.run_common import analysisdirname
+import trace.vm_common as vm
+import numpy as np
+
+##############################################################################
+# IMPORTANT: don't use any global / static variables here, otherwise
+# they will be shared across plots! (and bad things like double-counting
+# of vmas will happen). Constant values are ok.
+
+VM_TIMELINE_PLOTNAME = 'vm-timeline'
+JOIN_WINDOW = 1.0
+  # Size of the join windows, in seconds of kernel trace time.
+PERF_TIME_ALIGN = 'clock'
+  # How perf sample times are mapped onto kernel trace timestamps:
+  #   'clock': the kernel trace uses trace_clock=local, which is the
+  #     same clock that perf record uses for its sample times, so just
+  #     convert perf's nanoseconds to the trace's seconds (and add
+  #     PERF_TIME_OFFSET).
+  #   'endpoints': stretch the first..last sample times onto the
+  #     first..last timeline timestamps. Use this if the perf clock
+  #     doesn't tick in nanoseconds (see the WINDOWSIZE comments in
+  #     plot_perf_missrate.py).
+PERF_TIME_OFFSET = 0.0
+  # Seconds to add to the perf times in 'clock' mode.
+
+class vm_timeline_auxdata:
+	tag = 'vm_timeline_auxdata'
+
+	sizes = None
+	vmacount = None
+	window = None        # index of the window that isn't emitted yet
+	max_vm_size = None   # largest VM size during that window
+	state = None         # (vm_size, vmacount, rss) after the last event
+
+	def __init__(self):
+		self.sizes = vm_size_auxdata()
+		self.vmacount = vmacount_auxdata()
+		vm_timeline_resetfn(self)
+		return
+
+def vm_timeline_resetfn(auxdata):
+	auxdata.sizes.reset()
+	auxdata.vmacount.current_vmacount = 0
+	auxdata.window = None
+	auxdata.max_vm_size = 0
+	auxdata.state = (0, 0, 0)
+	return
+
+class perf_vm_auxdata:
+	tag = 'perf_vm_auxdata'
+
+	appdir = None
+	windows = None   # tgid -> {window index: [missperiod, totalperiod]}
+	spans = None     # tgid -> [first, last] perf sample time
+
+	def __init__(self):
+		perf_vm_resetfn(self)
+		return
+
+def perf_vm_resetfn(auxdata):
+	auxdata.appdir = None
+	auxdata.windows = dict()
+	auxdata.spans = dict()
+	return
+
+##############################################################################
+
+# Returns: a NumPy array with the index of the join window that each of
+# the perf sample times falls into. With PERF_TIME_ALIGN = 'clock' the
+# windows are the same as the timeline's windows; with 'endpoints' they
+# are JOIN_WINDOW long in perf time, and window_bounds() maps them onto
+# the timeline later.
+def perf_window_indexes(times):
+	tag = 'perf_window_indexes'
+
+	if PERF_TIME_ALIGN == 'endpoints':
+		return times // int(JOIN_WINDOW * 1e9)
+	elif PERF_TIME_ALIGN != 'clock':
+		print_error(tag, ("unknown PERF_TIME_ALIGN {}, using "
+			"'clock'").format(PERF_TIME_ALIGN))
+	return np.floor((times / 1e9 + PERF_TIME_OFFSET) /
+			JOIN_WINDOW).astype(np.int64)
+
+# Returns: a function that maps a join window index (from
+# perf_window_indexes()) to the window's (start, end) kernel trace
+# timestamps. span is the [first, last] perf sample time and tl_first
+# and tl_last are the first and last timeline timestamps, which are
+# only used for PERF_TIME_ALIGN = 'endpoints'.
+def window_bounds(span, tl_first, tl_last):
+	tag = 'window_bounds'
+
+	if PERF_TIME_ALIGN == 'endpoints':
+		perfspan = float(span[1] - span[0])
+		if perfspan > 0 and tl_last > tl_first:
+			scale = (tl_last - tl_first) / perfspan
+			size = int(JOIN_WINDOW * 1e9)
+			def bounds(k):
+				return (tl_first + (k * size - span[0]) * scale,
+						tl_first + ((k + 1) * size - span[0]) * scale)
+			return bounds
+		print_warning(tag, ("can't align endpoints (perf span {}, "
+			"timeline [{}, {}]), using the perf window times as "
+			"they are").format(perfspan, tl_first, tl_last))
+		return lambda k: (k * JOIN_WINDOW, (k + 1) * JOIN_WINDOW)
+
+	return lambda k: (k * JOIN_WINDOW, (k + 1) * JOIN_WINDOW)
+
+# Merge-joins the perf sample windows with the VM timeline, in one pass
+# over each. windows maps window indexes to [missperiod, totalperiod];
+# bounds maps a window index to its (start, end) timestamps (see
+# window_bounds()); timeline is an iterator over the vm_timeline's
+# datapoints, in timestamp order. Only the current timeline point is
+# kept, so the join doesn't need the whole timeline in memory.
+# Yields: a (start, end, missperiod, totalperiod, vm_size, max_vm_size,
+# vmacount, rss) tuple for every window with samples in it, in time
+# order. The VM fields are the values at the end of the window.
+def join_windows(windows, bounds, timeline):
+	tag = 'join_windows'
+
+	(vm_size, vmacount, rss) = (0, 0, 0)
+	tlpoint = next(timeline, None)
+	for k in sorted(windows.keys()):
+		(start, end) = bounds(k)
+		max_vm_size = vm_size
+		while tlpoint is not None and tlpoint.timestamp <= end:
+			(vm_size, vmacount, rss) = (tlpoint.count, tlpoint.vmacount,
+					tlpoint.rss)
+			max_vm_size = max(max_vm_size, tlpoint.max_vm_size)
+			tlpoint = next(timeline, None)
+		(missperiod, totalperiod) = windows[k]
+		yield (start, end, missperiod, totalperiod, vm_size,
+				max(max_vm_size, vm_size), vmacount, rss)
+
+	return
+
+# Reads the vm_timeline series that the kernel trace analysis wrote for
+# the app into the plotdata_store in appdir's analysis dir.
+# Returns: a series object, or None if not found.
+def read_vm_timeline(appdir, appname):
+	tag = 'read_vm_timeline'
+
+	# The columns stay memory-mapped after the store is closed.
+	store = plotdata_store("{}/{}".format(appdir, analysisdirname))
+	if store.open():
+		records = store.find(VM_TIMELINE_PLOTNAME)
+		store.close()
+		for (header, columns) in records:
+			if header['appname'] == appname:
+				timeline = series('dummyseriesname', 'dummyappname')
+				timeline.load_record(header, columns)
+				return timeline
+
+	print_warning(tag, ("no vm timeline found for app {} in {} - was "
+		"the kernel trace analyzed first, with the perf.data file in "
+		"the app dir?").format(appname, store.storedir))
+	return None
+
+# Tells the perf-vm plots in plotlist where to find the app's VM
+# timeline; must be called before the plots are flushed.
+def set_perf_vm_appdir(plotlist, appdir):
+	for plot in plotlist:
+		if type(plot.auxdata) is perf_vm_auxdata:
+			plot.auxdata.appdir = appdir
+	return
+
+##############################################################################
+
+# Returns: the timeline datapoint for the window that auxdata has
+# pending.
+def vm_timeline_point(auxdata, currentapp):
+	point = datapoint()
+	point.appname = currentapp
+	point.timestamp = (auxdata.window + 1) * JOIN_WINDOW
+	(point.count, point.vmacount, point.rss) = auxdata.state
+	point.max_vm_size = auxdata.max_vm_size
+	return point
+
+# Keeps track of the VM size, vma count and Rss after every vma or Rss
+# event that changes one of them, and creates a point with their values
+# at the end of each window whenever an event falls into a later
+# window. Events that are slightly out of order (from another cpu) are
+# counted in the current window.
+def vm_timeline_datafn(auxdata, plot_event, tgid, currentapp):
+	tag = 'vm_timeline_datafn'
+
+	if plot_event.vma:
+		vma = plot_event.vma
+		countpoints = vmacount_datafn(auxdata.vmacount, plot_event,
+				tgid, currentapp)
+		sizepoints = update_vm_size(vma, auxdata.sizes,
+				do_ratio=False, separate_components=False)
+		if vma.is_unmapped:
+			timestamp = vma.unmap_timestamp
+		else:
+			timestamp = vma.timestamp
+	elif plot_event.rss_event:
+		countpoints = None
+		sizepoints = update_rss_size(plot_event.rss_event, auxdata.sizes,
+				do_ratio=False, separate_components=False,
+				do_difference=False)
+		timestamp = plot_event.rss_event.timestamp
+	else:
+		return None
+
+	if not countpoints and not sizepoints:
+		return None
+
+	state = (auxdata.sizes.component_sizes.get(vm.VIRT_LABEL, 0),
+			auxdata.vmacount.current_vmacount,
+			auxdata.sizes.component_sizes.get(vm.PHYS_LABEL, 0))
+	window = int(timestamp // JOIN_WINDOW)
+	pointslist = None
+	if auxdata.window is None:
+		auxdata.window = window
+		auxdata.max_vm_size = state[0]
+	elif window > auxdata.window:
+		pointslist = [(currentapp, vm_timeline_point(auxdata,
+			currentapp))]
+		auxdata.window = window
+		auxdata.max_vm_size = state[0]
+	else:
+		auxdata.max_vm_size = max(auxdata.max_vm_size, state[0])
+	auxdata.state = state
+
+	return pointslist
+
+# Returns: the point for the last window, which vm_timeline_datafn()
+# hasn't emitted yet.
+def vm_timeline_flushfn(auxdata, currentapp):
+	tag = 'vm_timeline_flushfn'
+
+	if auxdata.window is None:
+		return None
+	point = vm_timeline_point(auxdata, currentapp)
+	auxdata.window = None
+
+	return [(currentapp, point)]
+
+# perf samples are only ever passed to perf_vm_arraysfn().
+def perf_vm_datafn(auxdata, plot_event, tgid, currentapp):
+	return None
+
+# Adds the miss and total periods of a batch of perf samples for one
+# process group to the group's join windows (see perf_window_indexes()).
+# The samples don't have to be in time order.
+# Returns: None; perf_vm_flushfn() creates the points.
+def perf_vm_arraysfn(auxdata, times, periods, is_miss, tgid, currentapp):
+	tag = 'perf_vm_arraysfn'
+
+	if len(times) == 0:
+		return None
+
+	(indexes, inverse) = np.unique(perf_window_indexes(times),
+			return_inverse=True)
+	missperiods = np.zeros(len(indexes), dtype=np.int64)
+	np.add.at(missperiods, inverse[is_miss], periods[is_miss])
+	totalperiods = np.zeros(len(indexes), dtype=np.int64)
+	np.add.at(totalperiods, inverse[~is_miss], periods[~is_miss])
+	windows = auxdata.windows.setdefault(tgid, dict())
+	for (k, miss, total) in zip(indexes.tolist(), missperiods.tolist(),
+			totalperiods.tolist()):
+		sums = windows.setdefault(k, [0, 0])
+		sums[0] += miss
+		sums[1] += total
+
+	(first, last) = (int(times.min()), int(times.max()))
+	span = auxdata.spans.setdefault(tgid, [first, last])
+	span[0] = min(span[0], first)
+	span[1] = max(span[1], last)
+
+	return None
+
+# Joins each process group's windows with the app's VM timeline (see
+# join_windows()).
+# Returns: one datapoint per window: count is the window's miss rate,
+# and vm_size, max_vm_size, vmacount and rss are set from the timeline.
+def perf_vm_flushfn(auxdata, currentapp):
+	tag = 'perf_vm_flushfn'
+
+	if len(auxdata.windows) == 0:
+		return None
+	if not auxdata.appdir:
+		print_error(tag, ("appdir not set, call set_perf_vm_appdir() "
+			"first").format())
+		return None
+	timeline = read_vm_timeline(auxdata.appdir, currentapp)
+	if timeline is None or timeline.num_points() == 0:
+		auxdata.windows.clear()
+		return None
+
+	# The timeline's columns are memory-mapped, so neither this nor
+	# the join loads the whole timeline.
+	tl_times = timeline.column('timestamp')
+	pointslist = []
+	seriesname = currentapp
+	for tgid in sorted(auxdata.windows.keys()):
+		windows = auxdata.windows[tgid]
+		bounds = window_bounds(auxdata.spans[tgid], tl_times[0],
+				tl_times[-1])
+		print_debug(tag, ("tgid {}: joining {} windows with {} timeline "
+			"points in [{}, {}]").format(tgid, len(windows),
+			len(tl_times), tl_times[0], tl_times[-1]))
+		for (start, end, missperiod, totalperiod, vm_size, max_vm_size,
+				vmacount, rss) in join_windows(windows, bounds,
+				timeline.iter_points()):
+			point = datapoint()
+			point.appname = currentapp
+			point.timestamp = end
+			if totalperiod != 0:
+				point.count = missperiod / totalperiod
+			else:
+				point.count = 0.0
+			point.vm_size = vm_size
+			point.max_vm_size = max_vm_size
+			point.vmacount = vmacount
+			point.rss = rss
+			pointslist.append((seriesname, point))
+	auxdata.windows.clear()
+	auxdata.spans.clear()
+
+	return pointslist
+
+##############################################################################
+
+def vm_timeline_tablefn(seriesdict, plotname, workingdir):
+	tag = 'vm_timeline_tablefn'
+
+	fname = "{}/{}.tsv".format(workingdir, plotname)
+	f = open(fname, 'w')
+	f.write("{}\n".format('\t'.join(['app', 'window_end', 'vm_size',
+		'max_vm_size', 'vmacount', 'rss'])))
+	for appname in sorted(seriesdict.keys()):
+		for S in seriesdict[appname]:
+			for p in S.iter_points():
+				f.write("{}\t{}\t{}\t{}\t{}\t{}\n".format(appname,
+					p.timestamp, int(p.count), int(p.max_vm_size),
+					p.vmacount, int(p.rss)))
+	f.close()
+
+	return None
+
+def perf_vm_tablefn(seriesdict, plotname, workingdir):
+	tag = 'perf_vm_tablefn'
+
+	fname = "{}/{}.tsv".format(workingdir, plotname)
+	f = open(fname, 'w')
+	f.write("{}\n".format('\t'.join(['app', 'window_end', 'missrate',
+		'vm_size', 'max_vm_size', 'vmacount', 'rss'])))
+	for appname in sorted(seriesdict.keys()):
+		for S in seriesdict[appname]:
+			for p in S.iter_points():
+				f.write("{}\t{}\t{:.6f}\t{}\t{}\t{}\t{}\n".format(
+					appname, p.timestamp, p.count, int(p.vm_size),
+					int(p.max_vm_size), p.vmacount, int(p.rss)))
+	f.close()
+
+	return None
+
+vm_timeline_plot = multiapp_plot(VM_TIMELINE_PLOTNAME, vm_timeline_auxdata,
+		vm_timeline_tablefn, vm_timeline_datafn, vm_timeline_resetfn,
+		eventkinds=['vma', 'rss_event'], vmaops=VM_SIZE_OPS,
+		flushfn=vm_timeline_flushfn)
+
+# Make sure that plots don't have the same name, or they will overwrite
+# each other!
+def new_perf_vm_plot(eventname):
+	plotname = "{}-vm".format(eventname)
+	return multiapp_plot(plotname, perf_vm_auxdata,
+		perf_vm_tablefn, perf_vm_datafn, perf_vm_resetfn,
+		arraysfn=perf_vm_arraysfn, eventkinds=['perf_sample'],
+		flushfn=perf_vm_flushfn)
+
+if __name__ == '__main__':
+	print_error_exit("not an executable module")
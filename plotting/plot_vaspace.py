@@ -9,8 +9,8 @@ import plotting.plots_style as style
 import itertools
 import plotting.plots_common as plots
 import trace.vm_common as vm
+import numpy as np
 
-#import numpy as np
 #import matplotlib
 #matplotlib.use('Agg')
 #import matplotlib.pyplot as plt
@@ -22,6 +22,20 @@ import trace.vm_common as vm
 # they will be shared across plots! (and bad things like double-counting
 # of vmas will happen). Only use "constants".
 
+VASPACE_RASTER = True
+  # Draw the address space as an occupancy image (see
+  # vaspace_raster_plotfn()) rather than one bar per vma (see
+  # vaspace_plotfn()), which is slow and creates huge pdfs for processes
+  # with tens of thousands of vmas.
+RASTER_WIDTH = 2048
+  # Number of address bins (pixels) across each raster window.
+RASTER_MAX_WINDOWS = 8
+  # Maximum number of windows (plots) that the address space is split
+  # into at its largest unmapped gaps.
+RASTER_MIN_ALPHA = 0.3
+  # Opacity of a bin with a tiny bit of mapped memory in it, so that
+  # small vmas are still visible; a fully-mapped bin is opaque.
+
 class vaspace_auxdata:
 	def __init__(self):
 		self.num_processes = None
@@ -446,15 +460,181 @@ def vaspace_plotfn(seriesdict, plotname, workingdir):
 	
 	return None
 
+# Splits the address space into windows by compressing its largest
+# unmapped gaps: a gap becomes a break between two windows if it is
+# wider than all of the mapped memory put together, and only the
+# RASTER_MAX_WINDOWS-1 widest such gaps are used. starts and ends
+# (exclusive) are uint64 arrays with the vmas of every perms key.
+# Returns: a list of (start, end) address tuples (end exclusive), in
+# address order; no vma crosses a window boundary.
+def raster_windows(starts, ends):
+	tag = 'raster_windows'
+
+	order = np.argsort(starts, kind='mergesort')
+	starts = starts[order]
+	runends = np.maximum.accumulate(ends[order])
+	gaps = np.maximum(starts[1:], runends[:-1]) - runends[:-1]
+	mapped = (runends[-1] - starts[0]) - gaps.sum()
+
+	splits = np.nonzero(gaps > mapped)[0]
+	if len(splits) >= RASTER_MAX_WINDOWS:
+		widest = np.argsort(gaps[splits], kind='mergesort')
+		splits = np.sort(splits[widest[-(RASTER_MAX_WINDOWS-1):]])
+	firsts = np.concatenate(([0], splits + 1))
+	lasts = np.concatenate((splits, [len(starts) - 1]))
+	windows = list(zip(starts[firsts].tolist(), runends[lasts].tolist()))
+	print_debug(tag, ("{} vmas, {} mapped: {} windows, {} gaps "
+		"compressed").format(len(starts), pretty_bytes(int(mapped)),
+		len(windows), len(splits)))
+
+	return windows
+
+# Computes the fraction of each of nbins equal-width bins across the
+# window [wstart, wend) that is covered by the vmas [starts, ends), which
+# must be sorted and not overlap each other. For every bin edge x, the
+# covered length to the left of x is the total length of the vmas that
+# start before x, minus whatever the last of those vmas extends past x.
+# Returns: a float array of nbins occupancies in [0, 1].
+def raster_occupancy(starts, ends, wstart, wend, nbins):
+	s = (starts - np.uint64(wstart)).astype(float)
+	e = (ends - np.uint64(wstart)).astype(float)
+	width = float(wend - wstart)
+	edges = np.linspace(0.0, width, nbins + 1)
+
+	covered = np.concatenate(([0.0], np.cumsum(e - s)))
+	k = np.searchsorted(s, edges, side='right')
+	overhang = np.where(k > 0, e[np.maximum(k - 1, 0)] - edges, 0.0)
+	cum = covered[k] - np.maximum(overhang, 0.0)
+
+	return np.clip(np.diff(cum) / (width / nbins), 0.0, 1.0)
+
+# Like vaspace_plotfn(), but instead of drawing a bar for every vma,
+# bins the address space into a grid of RASTER_WIDTH address bins by
+# one row per perms key, and draws the fraction of each bin that is
+# mapped as one image per window (see raster_windows()). The time and
+# the pdf size no longer depend on the number of vmas.
+def vaspace_raster_plotfn(seriesdict, plotname, workingdir):
+	tag = 'vaspace_raster_plotfn'
+
+	# This plot only makes sense for a single app at a time, so if
+	# we have more than one app in the seriesdict, just return now.
+	if len(seriesdict) > 1:
+		print_debug(tag, ("skipping multiapp-plot, vaspace plot "
+			"only makes sense for a single app.").format())
+		return None
+
+	appname = list(seriesdict.keys())[0]
+	appserieslist = list(seriesdict.values())[0]
+
+	# One sorted (starts, ends) pair of arrays per perms key, with
+	# exclusive end addresses. uint64, because addresses may not fit
+	# in an int64.
+	intervals = dict()
+	for S in appserieslist:
+		if S.seriesname not in vm.PERMS_KEYS or len(S.data) == 0:
+			continue
+		starts = np.fromiter((vma.start_addr for vma in S.data),
+				dtype=np.uint64, count=len(S.data))
+		lengths = np.fromiter((vma.length for vma in S.data),
+				dtype=np.uint64, count=len(S.data))
+		order = np.argsort(starts, kind='mergesort')
+		intervals[S.seriesname] = (starts[order],
+				starts[order] + lengths[order])
+	if len(intervals) == 0:
+		print_warning(tag, ("no vmas for {}, not generating plot "
+			"{}").format(appname, plotname))
+		return None
+	total_vmacount = sum(len(s) for (s, e) in intervals.values())
+	print_debug(tag, ("creating address space plot for {} with "
+		"{} total vmas").format(appname, total_vmacount))
+
+	windows = raster_windows(
+			np.concatenate([s for (s, e) in intervals.values()]),
+			np.concatenate([e for (s, e) in intervals.values()]))
+
+	all_pdf_name = "{}/vaspace_plots_collected".format(workingdir)
+	all_pdf = plots.new_pdffile(all_pdf_name)
+	pdffiles = [all_pdf]
+
+	axislabel_kwargs = style.axislabel_kwargs.copy()
+	xticklabel_kwargs = dict()
+	xticklabel_kwargs['size'] = 24
+	yticklabel_kwargs = dict()
+	yticklabel_kwargs['size'] = 32
+	yticklabel_kwargs['family'] = 'monospace'
+
+	numkeys = len(vm.PERMS_KEYS)
+	for plot_count in range(len(windows)):
+		(wstart, wend) = windows[plot_count]
+		image = np.zeros((numkeys, RASTER_WIDTH, 4))
+		vmacount = 0
+		for row in range(numkeys):
+			perms_key = vm.PERMS_KEYS[row]
+			try:
+				(starts, ends) = intervals[perms_key]
+			except KeyError:
+				continue
+			first = np.searchsorted(starts, np.uint64(wstart), side='left')
+			last = np.searchsorted(starts, np.uint64(wend), side='left')
+			if first == last:
+				continue
+			vmacount += last - first
+			occupancy = raster_occupancy(starts[first:last],
+					ends[first:last], wstart, wend, RASTER_WIDTH)
+			image[row, :, 0:3] = plots.mplcolors.to_rgb(
+					plots.PERMS_KEY_COLOR[perms_key])
+			image[row, :, 3] = np.where(occupancy > 0, RASTER_MIN_ALPHA +
+					(1.0 - RASTER_MIN_ALPHA) * occupancy, 0.0)
+		print_debug(tag, ("window {}: [{}, {}), {} vmas").format(
+			plot_count, hex(wstart), hex(wend), vmacount))
+
+		fig = plots.plot_setup_onesubplot(None, 1.0, 1.0)
+		ax = fig.get_axes()[0]
+		width = wend - wstart
+		ax.imshow(image, aspect='auto', interpolation='none',
+				origin='lower', extent=(0, RASTER_WIDTH, 0.5,
+				numkeys + 0.5))
+
+		ax.set_xlim(0, RASTER_WIDTH)
+		ax.set_xticks([0, RASTER_WIDTH])
+		ax.set_xticklabels([str(hex(wstart)), str(hex(wend - 1))],
+				**xticklabel_kwargs)
+		ax.set_xlabel(("Address space (width {} MB, {} of {} "
+			"windows)").format(width/MB_BYTES, plot_count + 1,
+			len(windows)), **axislabel_kwargs)
+
+		ax.set_ylim(0.5, numkeys + 0.5)
+		ax.set_ylabel("VMA permissions", **axislabel_kwargs)
+		ax.set_yticks(range(1, numkeys + 1))
+		ax.set_yticklabels(["{} ".format(key) for key in vm.PERMS_KEYS],
+				**yticklabel_kwargs)
+
+		full_plot_fname = "{}/{}-{}-{}".format(workingdir, plotname,
+				str(plot_count).zfill(2),
+				"0x" + (hex(wstart)[2:]).zfill(16))
+		plots.save_close_plot(fig, full_plot_fname, pdffiles)
+
+	for pdff in pdffiles:
+		pdff.close()
+
+	return None
+
 ##############################################################################
 
 # suffix should describe the point-in-time when this plot's data is
 # being calculated.
-def new_vaspace_plot(suffix, outputdir, proc_num, num_processes):
+# If raster is True, the plot is drawn by vaspace_raster_plotfn(),
+# otherwise by vaspace_plotfn().
+def new_vaspace_plot(suffix, outputdir, proc_num, num_processes,
+		raster=VASPACE_RASTER):
 	#plotname = "vaspace-{}_{}-processes".format(suffix, num_processes)
 	plotname = "vaspace-{}".format(suffix)
+	if raster:
+		plotfn = vaspace_raster_plotfn
+	else:
+		plotfn = vaspace_plotfn
 	new_vaspace_plot = multiapp_plot(plotname, vaspace_auxdata,
-			vaspace_plotfn, vaspace_datafn, vaspace_resetfn,
+			plotfn, vaspace_datafn, vaspace_resetfn,
 			processfn=plots.wrap_active_vmas)
 	new_vaspace_plot.set_workingdir(outputdir)
 	new_vaspace_plot.auxdata.num_processes = num_processes
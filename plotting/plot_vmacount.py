@@ -307,10 +307,16 @@ def inner_plotfn(appseriesdict, plotname, workingdir, categories, title,
 
 ##############################################################################
 
+# The vma operations that vmacount_datafn() counts.
+VMA_COUNT_OPS = ['alloc', 'access_change', 'unmap_free',
+		'unmap_access_change']
+
 vmacount_ts_plot = multiapp_plot('vma-counts', vmacount_auxdata,
-		vmacount_ts_plotfn, vmacount_datafn, vmacount_resetfn)
+		vmacount_ts_plotfn, vmacount_datafn, vmacount_resetfn,
+		eventkinds=['vma'], vmaops=VMA_COUNT_OPS, maxpoints=TS_MAXPOINTS)
 vmacount_max_col_plot = multiapp_plot('max-regions-old', vmacount_auxdata,
-		vmacount_max_col_plotfn, vmacount_datafn, vmacount_resetfn)
+		vmacount_max_col_plotfn, vmacount_datafn, vmacount_resetfn,
+		eventkinds=['vma'], vmaops=VMA_COUNT_OPS)
 
 # suffix should describe the point-in-time when this plot's data is
 # being calculated.
@@ -266,27 +266,35 @@ def vmaops_nonallocfree_ts_plotfn(seriesdict, plotname, workingdir):
 ##############################################################################
 vmaops_all_plot = multiapp_plot('vma-ops-all',
 		vmaops_auxdata, vmaops_all_ts_plotfn,
-		vmaops_all_datafn, vmaops_resetfn)
+		vmaops_all_datafn, vmaops_resetfn,
+		eventkinds=['vma'], maxpoints=TS_MAXPOINTS)
 vmaops_allocs_plot = multiapp_plot('vma-ops-allocs',
 		vmaops_auxdata, vmaops_allocs_ts_plotfn,
-		vmaops_allocs_datafn, vmaops_resetfn)
+		vmaops_allocs_datafn, vmaops_resetfn,
+		eventkinds=['vma'], maxpoints=TS_MAXPOINTS)
 vmaops_frees_plot = multiapp_plot('vma-ops-frees', vmaops_auxdata,
-		vmaops_frees_ts_plotfn, vmaops_frees_datafn, vmaops_resetfn)
+		vmaops_frees_ts_plotfn, vmaops_frees_datafn, vmaops_resetfn,
+		eventkinds=['vma'], maxpoints=TS_MAXPOINTS)
 vmaops_resizes_plot = multiapp_plot('vma-ops-resizes',
 		vmaops_auxdata, vmaops_resizes_ts_plotfn,
-		vmaops_resizes_datafn, vmaops_resetfn)
+		vmaops_resizes_datafn, vmaops_resetfn,
+		eventkinds=['vma'], maxpoints=TS_MAXPOINTS)
 vmaops_relocations_plot = multiapp_plot('vma-ops-relocations',
 		vmaops_auxdata, vmaops_relocs_ts_plotfn,
-		vmaops_relocations_datafn, vmaops_resetfn)
+		vmaops_relocations_datafn, vmaops_resetfn,
+		eventkinds=['vma'], maxpoints=TS_MAXPOINTS)
 vmaops_access_changes_plot = multiapp_plot('vma-ops-access_changes',
 		vmaops_auxdata, vmaops_access_changes_ts_plotfn,
-		vmaops_access_changes_datafn, vmaops_resetfn)
+		vmaops_access_changes_datafn, vmaops_resetfn,
+		eventkinds=['vma'], maxpoints=TS_MAXPOINTS)
 vmaops_flag_changes_plot = multiapp_plot('vma-ops-flag_changes',
 		vmaops_auxdata, vmaops_flag_changes_ts_plotfn,
-		vmaops_flag_changes_datafn, vmaops_resetfn)
+		vmaops_flag_changes_datafn, vmaops_resetfn,
+		eventkinds=['vma'], maxpoints=TS_MAXPOINTS)
 vmaops_nonallocfree_plot = multiapp_plot('vma-ops-nonallocfree',
 		vmaops_auxdata, vmaops_nonallocfree_ts_plotfn,
-		vmaops_nonallocfree_datafn, vmaops_resetfn)
+		vmaops_nonallocfree_datafn, vmaops_resetfn,
+		eventkinds=['vma'], maxpoints=TS_MAXPOINTS)
 
 if __name__ == '__main__':
 	print_error_exit("not an executable module")
@@ -0,0 +1,280 @@
+# Virtual memory analysis scripts.
+# Developed 2012-2014 by Peter Hornyack, pjh@cs.washington.edu
+# Copyright (c) 2012-2014 Peter Hornyack and University of Washington
+
+from util.pjh_utils import *
+import numpy as np
+import pickle
+import sqlite3
+
+PLOTDATA_DB = 'plotdata.db'
+PLOTDATA_BIN = 'plotdata.bin'
+COLUMN_ALIGN = 64
+COPY_BLOCK_SIZE = 4 * 1024 * 1024
+
+'''
+One indexed store for all of the series that an analysis (e.g. the
+kernel trace analysis or the perf analysis for one app) wrote into
+a directory, instead of one or more small files per series spread
+across one subdirectory per plot. The store is two files:
+  plotdata.db: an sqlite3 index with one row per series (plotname,
+    appname, seriesname and the pickled series header; see
+    multiapp_plot_class.series.to_record()) and one row per column of
+    a columnar series (its field name, dtype, offset and length).
+  plotdata.bin: the column data, appended at COLUMN_ALIGN-aligned
+    offsets, so that columns can be memory-mapped straight out of it.
+Looking up all of the series for a plotname is then one indexed query.
+Replacing a plot's series leaves their old columns behind in the .bin
+file; compact() rewrites the file without them once they take up more
+space than the live columns do.
+'''
+class plotdata_store:
+	tag = 'plotdata_store'
+
+	storedir = None
+	db = None
+	binf = None
+	binmap = None
+	writable = None
+
+	def __init__(self, storedir):
+		tag = "{}.__init__".format(self.tag)
+
+		self.storedir = storedir
+		self.db = None
+		self.binf = None
+		self.binmap = None
+		self.writable = False
+
+		return
+
+	def db_fname(self):
+		return "{}/{}".format(self.storedir, PLOTDATA_DB)
+
+	def bin_fname(self):
+		return "{}/{}".format(self.storedir, PLOTDATA_BIN)
+
+	# Opens the store; if write is True, the store will be created if
+	# it doesn't exist yet.
+	# Returns: True on success, False if the store doesn't exist (for
+	# reading) or couldn't be opened.
+	def open(self, write=False):
+		tag = "{}.open".format(self.tag)
+
+		if not write and not os.path.exists(self.db_fname()):
+			return False
+
+		try:
+			self.db = sqlite3.connect(self.db_fname())
+			if write:
+				self.db.execute(("CREATE TABLE IF NOT EXISTS series ("
+					"id INTEGER PRIMARY KEY, plotname TEXT, appname TEXT, "
+					"seriesname BLOB, header BLOB)"))
+				self.db.execute(("CREATE TABLE IF NOT EXISTS columns ("
+					"series_id INTEGER, field TEXT, dtype TEXT, "
+					"offset INTEGER, npoints INTEGER)"))
+				self.db.execute(("CREATE INDEX IF NOT EXISTS "
+					"series_plotname ON series (plotname)"))
+				self.db.execute(("CREATE INDEX IF NOT EXISTS "
+					"columns_series ON columns (series_id)"))
+				self.binf = open(self.bin_fname(), 'ab')
+				self.writable = True
+		except (sqlite3.Error, OSError) as e:
+			print_error(tag, ("could not open plot data store in "
+				"{}: {}").format(self.storedir, e))
+			self.close()
+			return False
+
+		return True
+
+	def close(self):
+		if self.db:
+			if self.writable:
+				self.db.commit()
+			self.db.close()
+			self.db = None
+		if self.binf:
+			self.binf.close()
+			self.binf = None
+		self.binmap = None
+		self.writable = False
+		return
+
+	# Removes all of the series for the plotname from the index. The
+	# space used by their columns is reclaimed by compact(), which
+	# replaces the .bin file rather than shrinking it in place, so that
+	# columns that other processes have memory-mapped from it stay valid.
+	def remove_plot(self, plotname):
+		tag = "{}.remove_plot".format(self.tag)
+
+		self.db.execute(("DELETE FROM columns WHERE series_id IN "
+			"(SELECT id FROM series WHERE plotname = ?)"), (plotname,))
+		self.db.execute("DELETE FROM series WHERE plotname = ?",
+			(plotname,))
+
+		return
+
+	# Adds a series to the store, replacing any series with the same
+	# plotname, appname and seriesname. header is any picklable object;
+	# columns maps field names to 1-d NumPy arrays.
+	def add(self, plotname, appname, seriesname, header, columns):
+		fields = []
+		for (field, column) in columns.items():
+			column = np.asarray(column)
+			fields.append((field, column.dtype, [column]))
+		self.add_chunked(plotname, appname, seriesname, header, fields)
+		return
+
+	# Like add(), but each column is written from an iterable of arrays
+	# (chunks), so that a column never has to be in memory all at once.
+	# fields is a list of (field name, dtype, chunks) tuples; the chunks
+	# for a field are only iterated after the previous field's column
+	# has been written.
+	def add_chunked(self, plotname, appname, seriesname, header, fields):
+		tag = "{}.add_chunked".format(self.tag)
+
+		pickled_name = pickle.dumps(seriesname,
+				protocol=pickle.DEFAULT_PROTOCOL)
+		self.db.execute(("DELETE FROM columns WHERE series_id IN "
+			"(SELECT id FROM series WHERE plotname = ? AND appname = ? "
+			"AND seriesname = ?)"), (plotname, appname, pickled_name))
+		self.db.execute(("DELETE FROM series WHERE plotname = ? AND "
+			"appname = ? AND seriesname = ?"), (plotname, appname,
+			pickled_name))
+
+		cursor = self.db.execute(("INSERT INTO series (plotname, appname, "
+			"seriesname, header) VALUES (?, ?, ?, ?)"), (plotname, appname,
+			pickled_name, pickle.dumps(header,
+			protocol=pickle.DEFAULT_PROTOCOL)))
+		series_id = cursor.lastrowid
+
+		for (field, dtype, chunks) in fields:
+			dtype = np.dtype(dtype)
+			self.binf.seek(0, os.SEEK_END)
+			offset = self.binf.tell()
+			pad = -offset % COLUMN_ALIGN
+			if pad:
+				self.binf.write(b'\0' * pad)
+				offset += pad
+			npoints = 0
+			for chunk in chunks:
+				chunk = np.ascontiguousarray(chunk, dtype=dtype)
+				self.binf.write(chunk.tobytes())
+				npoints += len(chunk)
+			self.db.execute(("INSERT INTO columns (series_id, field, dtype, "
+				"offset, npoints) VALUES (?, ?, ?, ?, ?)"), (series_id,
+				field, dtype.str, offset, npoints))
+
+		return
+
+	# Rewrites the .bin file with just the columns that are still in
+	# the index, if the columns of removed or replaced series take up
+	# more than half of it. The store must be open for writing. The
+	# new file is renamed over the old one, so columns that were
+	# already memory-mapped from it stay valid.
+	# Returns: the number of bytes reclaimed.
+	def compact(self):
+		tag = "{}.compact".format(self.tag)
+
+		self.binf.seek(0, os.SEEK_END)
+		size = self.binf.tell()
+		rows = self.db.execute(("SELECT rowid, dtype, offset, npoints FROM "
+			"columns ORDER BY offset")).fetchall()
+		live = 0
+		for (rowid, dtype, offset, npoints) in rows:
+			live += npoints * np.dtype(dtype).itemsize
+		if size - live <= live:
+			return 0
+
+		print_debug(tag, ("compacting {}: {} of {} bytes are "
+			"live").format(self.bin_fname(), live, size))
+		self.binf.flush()
+		tmp_fname = "{}.tmp".format(self.bin_fname())
+		src = open(self.bin_fname(), 'rb')
+		dst = open(tmp_fname, 'wb')
+		newoffsets = []
+		for (rowid, dtype, offset, npoints) in rows:
+			pad = -dst.tell() % COLUMN_ALIGN
+			if pad:
+				dst.write(b'\0' * pad)
+			newoffsets.append((dst.tell(), rowid))
+			src.seek(offset)
+			remaining = npoints * np.dtype(dtype).itemsize
+			while remaining > 0:
+				block = src.read(min(remaining, COPY_BLOCK_SIZE))
+				if not block:
+					print_error_exit(tag, ("{} ends before the column at "
+						"offset {}").format(self.bin_fname(), offset))
+				dst.write(block)
+				remaining -= len(block)
+		newsize = dst.tell()
+		dst.close()
+		src.close()
+
+		self.db.executemany("UPDATE columns SET offset = ? WHERE rowid = ?",
+			newoffsets)
+		self.binf.close()
+		os.rename(tmp_fname, self.bin_fname())
+		self.db.commit()
+		self.binf = open(self.bin_fname(), 'ab')
+		self.binmap = None
+
+		return size - newsize
+
+	# Returns: a list of (header, columns) tuples for every series
+	# that was added for the plotname, where columns maps each field
+	# name to a read-only array that is memory-mapped from the .bin
+	# file.
+	def find(self, plotname):
+		tag = "{}.find".format(self.tag)
+
+		records = []
+		rows = self.db.execute(("SELECT id, header FROM series WHERE "
+			"plotname = ? ORDER BY id"), (plotname,)).fetchall()
+		for (series_id, header) in rows:
+			columns = dict()
+			for (field, dtype, offset, npoints) in self.db.execute(
+					("SELECT field, dtype, offset, npoints FROM columns "
+					"WHERE series_id = ?"), (series_id,)):
+				columns[field] = self.map_column(np.dtype(dtype), offset,
+						npoints)
+			records.append((pickle.loads(header), columns))
+
+		return records
+
+	def map_column(self, dtype, offset, npoints):
+		if npoints == 0:
+			return np.empty(0, dtype=dtype)
+		if self.binmap is None:
+			self.binmap = np.memmap(self.bin_fname(), dtype=np.uint8,
+					mode='r')
+		nbytes = npoints * dtype.itemsize
+		return self.binmap[offset:offset+nbytes].view(dtype)
+
+# Returns: the names of the files that make up the store in storedir,
+# e.g. for listing them as the outputs of a pipeline_stage.
+def plotdata_store_files(storedir):
+	store = plotdata_store(storedir)
+	return [store.db_fname(), store.bin_fname()]
+
+# Finds every plot data store under searchdir, with a single walk of
+# the directory tree.
+# Returns: a list of plotdata_store objects, already opened for reading.
+def find_plotdata_stores(searchdir):
+	tag = 'find_plotdata_stores'
+
+	stores = []
+	dbfiles = find_files_dirs(searchdir, PLOTDATA_DB, exactmatch=True,
+			findfiles=True, finddirs=False, followlinks=True,
+			absdirs=True)
+	for dbfile in sorted(dbfiles):
+		store = plotdata_store(os.path.dirname(dbfile))
+		if store.open():
+			stores.append(store)
+	print_debug(tag, ("found {} plot data stores in {}").format(
+		len(stores), searchdir))
+
+	return stores
+
+if __name__ == '__main__':
+	print_error_exit("not an executable module")
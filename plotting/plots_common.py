@@ -4,21 +4,25 @@
 
 from util.pjh_utils import *
 from plotting.PlotEvent import PlotEvent
-import brewer2mpl
 import copy
+import importlib
 import itertools
 import numpy as np
+import shutil
+import subprocess
 import plotting.plots_style as style
-import matplotlib
-matplotlib.use('Agg')
-import matplotlib.pyplot as plt
-from matplotlib.backends.backend_pdf import PdfPages
-from matplotlib.ticker import FuncFormatter
 
 CP_SERIESNAME = 'checkpoints'
   # special name to be used for series that contain datapoints for
   # CheckpointEvents.
 TOTALKEY = '_ToTaL_'   # key that caller is unlikely to use...
+TS_MAXPOINTS = None
+  # Maximum number of datapoints kept in each series of the time-series
+  # plots that can decimate their series (see series.set_maxpoints()),
+  # or None to keep every datapoint. Decimation is off by default; set
+  # this to e.g. 10000 to bound the size of these series for long
+  # traces (a plot can't show many more distinct points than it is
+  # pixels wide), at the cost of plotting only the shape of each series.
 
 PERMS_KEY_COLOR = {
 		'r-xsa' : style.brewer_red,
@@ -41,6 +45,60 @@ PERMS_KEY_COLOR = {
 		'---pf' : style.brewer_blue,
 	}
 
+# Imports matplotlib with the non-interactive Agg backend. This is done
+# the first time that something actually draws a plot (see lazy_module)
+# rather than when this module is imported, because every analysis
+# imports the plot modules, but only generate_plots.py renders them.
+def import_matplotlib():
+	if 'matplotlib.pyplot' not in sys.modules:
+		import matplotlib
+		matplotlib.use('Agg')
+		import matplotlib.pyplot
+	return
+
+'''
+Stands in for a matplotlib module (or an attribute of one, if attrname
+is set) until it is first used: getting an attribute of the object or
+calling it imports matplotlib (see import_matplotlib()) and the module,
+and forwards to the real thing.
+'''
+class lazy_module:
+	tag = 'lazy_module'
+
+	modname = None
+	attrname = None
+	target = None
+
+	def __init__(self, modname, attrname=None):
+		tag = "{}.__init__".format(self.tag)
+
+		self.modname = modname
+		self.attrname = attrname
+		self.target = None
+
+		return
+
+	def load(self):
+		if self.target is None:
+			import_matplotlib()
+			target = importlib.import_module(self.modname)
+			if self.attrname:
+				target = getattr(target, self.attrname)
+			self.target = target
+		return self.target
+
+	def __getattr__(self, name):
+		return getattr(self.load(), name)
+
+	def __call__(self, *args, **kwargs):
+		return self.load()(*args, **kwargs)
+
+plt = lazy_module('matplotlib.pyplot')
+mplcolors = lazy_module('matplotlib.colors')
+brewer2mpl = lazy_module('brewer2mpl')
+PdfPages = lazy_module('matplotlib.backends.backend_pdf', 'PdfPages')
+FuncFormatter = lazy_module('matplotlib.ticker', 'FuncFormatter')
+
 #######################################################################
 '''
 Class for a generic plot datapoint; series used by a multiapp_plot may
@@ -97,6 +155,19 @@ def new_cp_datapoint(plot_event):
 
 	return point
 
+# Creates a list of datapoints, one for each (timestamp, count) pair in
+# the timestamps and counts arrays (e.g. computed from NumPy arrays by
+# a plot's arraysfn).
+def new_datapoints(appname, timestamps, counts):
+	points = []
+	for (timestamp, count) in zip(timestamps.tolist(), counts.tolist()):
+		point = datapoint()
+		point.appname = appname
+		point.timestamp = timestamp
+		point.count = count
+		points.append(point)
+	return points
+
 ##############################################################################
 # Creates a new figure and sets some common parameters:
 #   .pdf / .png size
@@ -203,40 +274,56 @@ def plot_setup_subplots(subplotrows, subplotcols, heightfactor, widthfactor):
 def normalize_appserieslist(serieslist, alignright):
 	tag = 'normalize_appserieslist'
 
+	# Work on whole timestamp columns rather than on each datapoint:
+	# series that were deserialized from a plotdata_store are already
+	# columnar, so their datapoint objects are never built here.
+	# Series whose points can't be stored as columns (e.g. checkpoint
+	# series) are updated point-by-point by set_column().
+	serieslist = [S for S in serieslist if S.num_points() > 0]
+	tscolumns = []
 	xmin = None
 	xmax = None
 	for S in serieslist:
-		appmin = S.data[0].timestamp
-		appmax = S.data[-1].timestamp
+		S.make_columnar()
+		timestamps = np.asarray(S.column('timestamp'), dtype=float)
+		tscolumns.append(timestamps)
+		appmin = timestamps[0]
+		appmax = timestamps[-1]
 		if not xmin or appmin < xmin:
 			xmin = appmin
 		if not xmax or appmax > xmax:
 			xmax = appmax
 	
+	if len(serieslist) == 0:
+		return
 	width = xmax - xmin
-	for S in serieslist:
+	for (S, timestamps) in zip(serieslist, tscolumns):
 		# To normalize each series, first subtract the minimum xval from
 		# every point so that they all start at time 0, then divide the
 		# point by the "width" of the execution time to get the "percent"
 		# time, as a normalized value between 0 and 1.
-		for i in range(len(S.data)):
-			point = S.data[i]
-			if width != 0:
-				normalized = (point.timestamp - xmin) / width
-			else:
-				# If we have just one datapoint, put it in the middle
-				# of the range...
-				normalized = 0.5
-			point.timestamp = normalized
+		if width != 0:
+			normalized = (timestamps - xmin) / width
+		else:
+			# If we have just one datapoint, put it in the middle
+			# of the range...
+			normalized = np.full(len(timestamps), 0.5)
+		S.set_column('timestamp', normalized)
 
 		if alignright:
-			if S.data[-1].timestamp < 1.0:
-				lastpoint = copy.deepcopy(S.data[-1])
-				lastpoint.timestamp = 1.0
-				S.data.append(lastpoint)
+			if normalized[-1] < 1.0:
+				S.repeat_last_point('timestamp', 1.0)
 
 	return
 
+# Returns: a NumPy float array with the field's value for every point
+# in the pointlist, which may be a list of datapoints or a view that
+# has a column() method (see series_points).
+def pointlist_values(pointlist, field):
+	if hasattr(pointlist, 'column'):
+		return np.asarray(pointlist.column(field), dtype=float)
+	return np.array([getattr(dp, field) for dp in pointlist], dtype=float)
+
 def percent0_formatter_func(n, pos=0):
 	# This works to still use an integer percent label when log-scale is
 	# enabled.
@@ -262,7 +349,8 @@ def billions_formatter_func(n, pos=0):
 # Input:
 #   A dict that maps series names to:
 #     A list of datapoint objects, whose "timestamp" and "count" fields
-#     are set! (the timestamp values in the list must be sorted?)
+#     are set! (the timestamp values in the list must be sorted?) Or a
+#     series_points view, as built by construct_scale_ts_plotdict().
 #   Title / labels
 #   ysplits: y-axis values to split plot apart at. For example, a
 #     ysplits list of [100, 1000] will cause this method to split the
@@ -344,6 +432,7 @@ def plot_scatter_lineplot(plotdict, title, x_axislabel, y_axislabel,
 	  # http://docs.python.org/3.1/whatsnew/3.0.html#integers
 	print_debug(tag, ("ysplits: {}").format(ysplits))
 	seriesgroups = []
+	counts = dict()
 	splitmin = 0
 	splitmax = 0
 	for split in ysplits:
@@ -353,7 +442,9 @@ def plot_scatter_lineplot(plotdict, title, x_axislabel, y_axislabel,
 
 		group = dict()
 		for (seriesname, pointlist) in list(plotdict.items()):
-			maxcount = (max(pointlist, key=lambda dp: dp.count)).count
+			if seriesname not in counts:
+				counts[seriesname] = pointlist_values(pointlist, 'count')
+			maxcount = counts[seriesname].max()
 			if splitmin <= maxcount and maxcount <= splitmax:
 				group[seriesname] = pointlist
 				plotdict.pop(seriesname)   # remove non-grouped reference
@@ -418,7 +509,7 @@ def plot_scatter_lineplot(plotdict, title, x_axislabel, y_axislabel,
 			#print_debug(tag, ("plotting series {} with {} points").format(
 			#	seriesname, len(pointlist)))
 			if is_timeseries:
-				xvals = list(map(lambda dp: dp.timestamp, pointlist))
+				xvals = pointlist_values(pointlist, 'timestamp')
 			else:
 				if len(xlabels) > 0 and len(pointlist) != len(xlabels):
 					print_error(tag, ("x-axis will have {} labels, "
@@ -430,8 +521,8 @@ def plot_scatter_lineplot(plotdict, title, x_axislabel, y_axislabel,
 				# to use 0.5 or something not 0 or 1, then use
 				# np.arange().
 				xvals = list(range(1, 1 + len(pointlist)))
-			yvals = list(map(lambda dp: dp.count, pointlist))
-			group_ymax = max(yvals)
+			yvals = counts[seriesname]
+			group_ymax = yvals.max()
 			if firstgroup:
 				#xmin = xvals[0]
 				#xmax = xvals[-1]
@@ -1438,6 +1529,44 @@ def close_pdffile(pdffile):
 	pdffile.close()
 	return
 
+# Command used by merge_pdffiles(), from poppler-utils:
+#   pdfunite in1.pdf in2.pdf ... out.pdf
+PDF_MERGE_PROG = 'pdfunite'
+
+# Returns: True if merge_pdffiles() can be used on this system.
+def can_merge_pdffiles():
+	return shutil.which(PDF_MERGE_PROG) is not None
+
+# Concatenates the pages of the pdf files in pdf_fnames, in that order,
+# into a single pdf file. out_fname should contain the complete path and
+# filename, WITHOUT .pdf suffix (like new_pdffile()).
+# Returns: True on success, False on error.
+def merge_pdffiles(pdf_fnames, out_fname):
+	tag = 'merge_pdffiles'
+
+	out_fname = "{}.pdf".format(out_fname)
+	if len(pdf_fnames) == 0:
+		# pdfunite needs at least one input; write an empty PdfPages
+		# file like the serial path would.
+		close_pdffile(PdfPages(out_fname))
+		return True
+
+	args = [PDF_MERGE_PROG] + list(pdf_fnames) + [out_fname]
+	print_debug(tag, ("merging {} pdf files into {}").format(
+		len(pdf_fnames), out_fname))
+	try:
+		retcode = subprocess.call(args)
+	except OSError as e:
+		print_error(tag, ("could not run {}: {}").format(PDF_MERGE_PROG,
+			e))
+		return False
+	if retcode != 0:
+		print_error(tag, ("{} returned non-zero code {}").format(
+			PDF_MERGE_PROG, retcode))
+		return False
+
+	return True
+
 # Looks in the seriesdict (which comes from a multiapp_plot object)
 # for series with criteria matching what's expected for series 
 # that contain checkpoint data. Currently, this criteria is that
@@ -1507,7 +1636,8 @@ def handle_cp_series(appseriesdict):
 
 # Takes a appseriesdict which has had its cp_series removed (by calling
 # handle_cp_series() on it), then converts its lists of series into
-# a plotdict that maps series names to lists of series datapoints.
+# a plotdict that maps series names to lists of series datapoints
+# (series_points views, which plot_time_series() reads as columns).
 # If scale is set to an appropriate xx_BYTES value (pjh_utils.py),
 # then every datapoint will also be scaled by this value; set scale
 # to None to disable scaling. Note that this scaling will also affect
@@ -1548,9 +1678,9 @@ def construct_scale_ts_plotdict(appseriesdict, scale=None,
 			except KeyError:
 				seriesname = series.seriesname
 
-			if len(series.data) < 1:
-				print_error(tag, ("huh?: len(series.data) = {}?").format(
-					len(series.data)))
+			if series.num_points() < 1:
+				print_error(tag, ("huh?: series.num_points() = {}?").format(
+					series.num_points()))
 				continue
 
 			# From the datafn, the series' data list already contains a list
@@ -1563,8 +1693,8 @@ def construct_scale_ts_plotdict(appseriesdict, scale=None,
 			if scale:
 				print_debug(tag, ("Scaling: dividing every data "
 					"point's count by {}").format(scale))
-				for point in series.data:
-					point.count /= scale
+				series.set_column('count', pointlist_values(
+					series.points_view(), 'count') / scale)
 
 #			if ():
 #				newseriesname = ...
@@ -1572,19 +1702,22 @@ def construct_scale_ts_plotdict(appseriesdict, scale=None,
 #				newseriesname = seriesname
 
 			if usemax:
-				# http://docs.python.org/3/library/functions.html?
-				# highlight=max#max
-				plotdict[seriesname] = (max(series.data,
-				                key=lambda point: point.count)).count
+				plotdict[seriesname] = series.column('count').max()
 			elif uselastpoint:
 				# This is used for e.g. average miss rate: we just want
 				# to get the last point in the series that has been
 				# tracked over the application's entire execution. This
 				# means that plotdict is no longer a timeseries plot,
 				# but it works for the column plots methods too.
-				plotdict[seriesname] = series.data[-1].count
+				plotdict[seriesname] = series.column('count')[-1]
 			else:
-				plotdict[seriesname] = series.data
+				# A view rather than series.data, so that the datapoint
+				# objects are only built if the plotfn asks for them.
+				plotdict[seriesname] = series.points_view()
+			if usemax or uselastpoint:
+				# NumPy scalar -> int / float.
+				plotdict[seriesname] = np.asarray(
+						plotdict[seriesname]).tolist()
 	
 	return plotdict
 
@@ -1625,7 +1758,7 @@ def calc_plotdict_percentiles(plotdict):
 	for (series, pointlist) in plotdict.items():
 		print_debug(tag, ("series {}: {} points").format(series,
 			len(pointlist)))
-		counts = np.array(list(map(lambda dp: dp.count, pointlist)))
+		counts = pointlist_values(pointlist, 'count')
 		percentiles = np.percentile(counts, perc_to_calc)
 			#, overwrite_input=True)
 		#print_debug(tag, ("series {}: perc_to_calc={}, percentiles={}").format(
@@ -2,7 +2,6 @@
 # Developed 2012-2014 by Peter Hornyack, pjh@cs.washington.edu
 # Copyright (c) 2012-2014 Peter Hornyack and University of Washington
 
-import brewer2mpl
 import itertools
 import sys
 import trace.vm_common as vm
@@ -42,13 +41,42 @@ RASTER_DPI = 400
 # in the list can be directly passed as a color to matplotlib methods.
 #   brewer2mpl.print_maps()
 #   http://bl.ocks.org/mbostock/5577023
-brewer_accent = brewer2mpl.get_map('Accent', 'qualitative',  8).mpl_colors
-brewer_dark2  = brewer2mpl.get_map('Dark2',  'qualitative',  8).mpl_colors
-brewer_paired = brewer2mpl.get_map('Paired', 'qualitative', 12).mpl_colors
-brewer_set1   = brewer2mpl.get_map('Set1',   'qualitative',  9).mpl_colors
-brewer_set2   = brewer2mpl.get_map('Set2',   'qualitative',  8).mpl_colors
-brewer_set3   = brewer2mpl.get_map('Set3',   'qualitative', 12).mpl_colors
-brewer_greys  = brewer2mpl.get_map('Greys',   'sequential',  9).mpl_colors
+# The colors are copied from brewer2mpl's color maps, because importing
+# brewer2mpl imports matplotlib, and this module is imported by the
+# trace analysis too, which never renders a plot.
+def mpl_colors(colors):
+	return [tuple([x / 255. for x in color]) for color in colors]
+
+brewer_accent = mpl_colors([[127, 201, 127], [190, 174, 212],
+		[253, 192, 134], [255, 255, 153], [56, 108, 176], [240, 2, 127],
+		[191, 91, 23], [102, 102, 102]])
+		  # brewer2mpl.get_map('Accent', 'qualitative',  8)
+brewer_dark2  = mpl_colors([[27, 158, 119], [217, 95, 2], [117, 112, 179],
+		[231, 41, 138], [102, 166, 30], [230, 171, 2], [166, 118, 29],
+		[102, 102, 102]])
+		  # brewer2mpl.get_map('Dark2',  'qualitative',  8)
+brewer_paired = mpl_colors([[166, 206, 227], [31, 120, 180],
+		[178, 223, 138], [51, 160, 44], [251, 154, 153], [227, 26, 28],
+		[253, 191, 111], [255, 127, 0], [202, 178, 214], [106, 61, 154],
+		[255, 255, 153], [177, 89, 40]])
+		  # brewer2mpl.get_map('Paired', 'qualitative', 12)
+brewer_set1   = mpl_colors([[228, 26, 28], [55, 126, 184], [77, 175, 74],
+		[152, 78, 163], [255, 127, 0], [255, 255, 51], [166, 86, 40],
+		[247, 129, 191], [153, 153, 153]])
+		  # brewer2mpl.get_map('Set1',   'qualitative',  9)
+brewer_set2   = mpl_colors([[102, 194, 165], [252, 141, 98],
+		[141, 160, 203], [231, 138, 195], [166, 216, 84], [255, 217, 47],
+		[229, 196, 148], [179, 179, 179]])
+		  # brewer2mpl.get_map('Set2',   'qualitative',  8)
+brewer_set3   = mpl_colors([[141, 211, 199], [255, 255, 179],
+		[190, 186, 218], [251, 128, 114], [128, 177, 211], [253, 180, 98],
+		[179, 222, 105], [252, 205, 229], [217, 217, 217], [188, 128, 189],
+		[204, 235, 197], [255, 237, 111]])
+		  # brewer2mpl.get_map('Set3',   'qualitative', 12)
+brewer_greys  = mpl_colors([[255, 255, 255], [240, 240, 240],
+		[217, 217, 217], [189, 189, 189], [150, 150, 150], [115, 115, 115],
+		[82, 82, 82], [37, 37, 37], [0, 0, 0]])
+		  # brewer2mpl.get_map('Greys',   'sequential',  9)
 
 brewer_red    = brewer_set1[0]
 brewer_blue   = brewer_set1[1]
@@ -0,0 +1,6 @@
+# Virtual memory analysis scripts.
+# Developed 2012-2014 by Peter Hornyack, pjh@cs.washington.edu
+# Copyright (c) 2012-2014 Peter Hornyack and University of Washington
+
+# Unit tests. Run them from the top-level dir with:
+#	python3 -m unittest discover tests
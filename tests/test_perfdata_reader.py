@@ -0,0 +1,66 @@
+# Virtual memory analysis scripts.
+# Developed 2012-2014 by Peter Hornyack, pjh@cs.washington.edu
+# Copyright (c) 2012-2014 Peter Hornyack and University of Washington
+
+from analyze.perfdata_reader_class import *
+import os
+import shutil
+import tempfile
+import unittest
+
+EVENTS = [
+	('dTLB-load-misses', PERF_TYPE_HW_CACHE, 0x10003, [101, 102]),
+	('r408', PERF_TYPE_RAW, 0x408, [201, 202]),
+	('cpu/event=0x08,umask=0x10/', PERF_TYPE_RAW, 0x1008, [301, 302]),
+]
+COMMS = [(1000, 1000, 'hello-world'), (1000, 1001, 'worker')]
+SAMPLES = [
+	(101, 7610977, 1000, 1000, 0, 1271035105125778),
+	(202, 2039, 1000, 1001, 1, 1271035105125900),
+	(301, 55, 1000, 1000, 1, 1271035105126000),
+	(102, 123456, 2000, 2000, 1, 1271035105127000),
+]
+
+class perfdata_reader_test(unittest.TestCase):
+
+	def setUp(self):
+		self.tmpdir = tempfile.mkdtemp()
+		self.fname = "{}/perf.data".format(self.tmpdir)
+
+	def tearDown(self):
+		shutil.rmtree(self.tmpdir)
+
+	def test_round_trip(self):
+		write_synthetic_perfdata(self.fname, EVENTS, SAMPLES, COMMS)
+		reader = perfdata_reader(self.fname)
+		self.assertTrue(reader.open())
+		self.assertEqual([(attr.name, attr.type, attr.config, attr.ids)
+			for attr in reader.attrs], EVENTS)
+
+		samples = list(reader.samples())
+		reader.close()
+		self.assertEqual(len(samples), len(SAMPLES))
+		comms = dict([(tid, comm) for (pid, tid, comm) in COMMS])
+		for (got, expected) in zip(samples, SAMPLES):
+			(eid, period, pid, tid, cpu, time) = expected
+			self.assertEqual(got, (eid, period, pid, tid, cpu, time,
+				comms.get(tid)))
+
+	def test_not_perfdata(self):
+		f = open(self.fname, 'wb')
+		f.write(b'x' * PERF_FILE_HEADER_SIZE)
+		f.close()
+		reader = perfdata_reader(self.fname)
+		self.assertFalse(reader.open())
+
+	def test_default_event_names(self):
+		self.assertEqual(default_event_name(PERF_TYPE_HARDWARE, 0),
+			'cycles')
+		self.assertEqual(default_event_name(PERF_TYPE_HW_CACHE, 0x3),
+			'dTLB-loads')
+		self.assertEqual(default_event_name(PERF_TYPE_HW_CACHE, 0x10003),
+			'dTLB-load-misses')
+		self.assertEqual(default_event_name(PERF_TYPE_RAW, 0x449), 'r449')
+
+if __name__ == '__main__':
+	unittest.main()
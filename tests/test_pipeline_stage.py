@@ -0,0 +1,95 @@
+# Virtual memory analysis scripts.
+# Developed 2012-2014 by Peter Hornyack, pjh@cs.washington.edu
+# Copyright (c) 2012-2014 Peter Hornyack and University of Washington
+
+import analyze.pipeline_stage_class as pipeline_stage_class
+from analyze.pipeline_stage_class import *
+import json
+import os
+import shutil
+import tempfile
+import unittest
+
+class pipeline_stage_test(unittest.TestCase):
+
+	def setUp(self):
+		self.tmpdir = tempfile.mkdtemp()
+		self.input = "{}/input".format(self.tmpdir)
+		self.output = "{}/output".format(self.tmpdir)
+		self.write_file(self.input, "input data\n")
+		self.write_file(self.output, "output data\n")
+		pipeline_stage_class.file_sha1s.clear()
+
+	def tearDown(self):
+		shutil.rmtree(self.tmpdir)
+
+	def write_file(self, fname, data):
+		f = open(fname, 'w')
+		f.write(data)
+		f.close()
+
+	def new_stage(self):
+		return pipeline_stage('test', self.tmpdir, [self.input],
+			[self.output], params={'option': 1}, sources=[__file__])
+
+	# Sets the mtime of fname to a different one, without changing its
+	# contents.
+	def touch(self, fname):
+		st = os.stat(fname)
+		os.utime(fname, ns=(st.st_atime_ns, st.st_mtime_ns + 10**9))
+
+	def test_up_to_date(self):
+		stage = self.new_stage()
+		self.assertEqual(stage.up_to_date(), (False, None))
+		stage.done(['result'])
+		self.assertEqual(self.new_stage().up_to_date(), (True, ['result']))
+		self.assertEqual(self.new_stage().up_to_date(force=True),
+			(False, None))
+
+		# Same contents, new mtime: still up to date.
+		self.touch(self.input)
+		self.assertEqual(self.new_stage().up_to_date(), (True, ['result']))
+
+		# Same size, new contents.
+		self.write_file(self.input, "INPUT DATA\n")
+		self.assertEqual(self.new_stage().up_to_date(), (False, None))
+
+	def test_done_reuses_unchanged_sha1s(self):
+		stage = self.new_stage()
+		stage.done()
+		stamp = stage.read_stamp()
+		self.assertEqual(stamp['inputs'][self.input][0:2],
+			[os.stat(self.input).st_size, os.stat(self.input).st_mtime_ns])
+
+		# done() keeps the sha1 of a file whose size and mtime match the
+		# old stamp instead of reading the file again.
+		stamp['inputs'][self.input][2] = 'old-sha1'
+		f = open(stage.stamp_fname, 'w')
+		json.dump(stamp, f)
+		f.close()
+		pipeline_stage_class.file_sha1s.clear()
+		stage.done()
+		self.assertEqual(stage.read_stamp()['inputs'][self.input][2],
+			'old-sha1')
+
+		self.touch(self.input)
+		stage.done()
+		self.assertNotEqual(stage.read_stamp()['inputs'][self.input][2],
+			'old-sha1')
+
+	def test_sha1_read_once_per_process(self):
+		st = os.stat(self.input)
+		sha1 = file_sha1(self.input, st)
+
+		# Rewriting the file with the same size and mtime isn't noticed,
+		# because the file isn't read again.
+		self.write_file(self.input, "INPUT DATA\n")
+		os.utime(self.input, ns=(st.st_atime_ns, st.st_mtime_ns))
+		self.assertEqual(file_sha1(self.input, os.stat(self.input)), sha1)
+
+		self.touch(self.input)
+		self.assertNotEqual(file_sha1(self.input, os.stat(self.input)),
+			sha1)
+
+if __name__ == '__main__':
+	unittest.main()
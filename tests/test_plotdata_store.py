@@ -0,0 +1,54 @@
+# Virtual memory analysis scripts.
+# Developed 2012-2014 by Peter Hornyack, pjh@cs.washington.edu
+# Copyright (c) 2012-2014 Peter Hornyack and University of Washington
+
+from plotting.plotdata_store_class import *
+import numpy as np
+import shutil
+import tempfile
+import unittest
+
+NPOINTS = 100000
+
+class plotdata_store_test(unittest.TestCase):
+
+	def setUp(self):
+		self.tmpdir = tempfile.mkdtemp()
+
+	def tearDown(self):
+		shutil.rmtree(self.tmpdir)
+
+	def write_plot(self, plotname, values):
+		store = plotdata_store(self.tmpdir)
+		self.assertTrue(store.open(write=True))
+		store.remove_plot(plotname)
+		store.add(plotname, 'app', 'series', {'header': plotname},
+			{'count': values})
+		store.compact()
+		store.close()
+
+	# A reader's memory-mapped columns stay valid while the only plot
+	# in the store is replaced and the .bin file is compacted.
+	def test_replace_while_mapped(self):
+		old = np.arange(NPOINTS, dtype=np.int64)
+		self.write_plot('plot', old)
+		reader = plotdata_store(self.tmpdir)
+		self.assertTrue(reader.open())
+		[(header, columns)] = reader.find('plot')
+		self.assertEqual(header, {'header': 'plot'})
+
+		new = np.arange(10, dtype=np.int64) * 3
+		self.write_plot('plot', new)
+		self.assertTrue(np.array_equal(columns['count'], old))
+		reader.close()
+
+		reader = plotdata_store(self.tmpdir)
+		self.assertTrue(reader.open())
+		[(header, columns)] = reader.find('plot')
+		self.assertTrue(np.array_equal(columns['count'], new))
+		reader.close()
+		self.assertLess(os.path.getsize(reader.bin_fname()),
+			old.nbytes)
+
+if __name__ == '__main__':
+	unittest.main()
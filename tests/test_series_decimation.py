@@ -0,0 +1,83 @@
+# Virtual memory analysis scripts.
+# Developed 2012-2014 by Peter Hornyack, pjh@cs.washington.edu
+# Copyright (c) 2012-2014 Peter Hornyack and University of Washington
+
+from plotting.multiapp_plot_class import series
+from plotting.plots_common import datapoint
+import random
+import unittest
+
+MAXPOINTS = 8
+RUNS = 200
+
+def new_point(timestamp, count, cp_name=None):
+	point = datapoint()
+	point.timestamp = timestamp
+	point.count = count
+	if cp_name:
+		point.cp_name = cp_name
+	return point
+
+def random_points(rng):
+	points = []
+	for i in range(rng.randint(1, 300)):
+		if rng.random() < 0.02:
+			points.append(new_point(i, None, "cp{}".format(i)))
+		else:
+			points.append(new_point(i, rng.randint(-1000, 1000)))
+	return points
+
+def decimated_series(points):
+	S = series('decimated', 'testapp')
+	S.set_maxpoints(MAXPOINTS)
+	for point in points:
+		S.append_datapoint(point)
+	return S
+
+def counts(points):
+	return [p.count for p in points if p.count is not None]
+
+def checkpoints(points):
+	return [p.cp_name for p in points if getattr(p, 'cp_name', None)]
+
+class series_decimation_test(unittest.TestCase):
+
+	def test_endpoints_and_extrema(self):
+		rng = random.Random(36)
+		for run in range(RUNS):
+			points = random_points(rng)
+			S = decimated_series(points)
+			kept = list(S.iter_points())
+			self.assertIs(kept[0], points[0])
+			self.assertIs(kept[-1], points[-1])
+			if counts(points):
+				self.assertEqual(min(counts(kept)), min(counts(points)))
+				self.assertEqual(max(counts(kept)), max(counts(points)))
+			self.assertEqual(checkpoints(kept), checkpoints(points))
+			self.assertEqual([p.timestamp for p in kept],
+				sorted(p.timestamp for p in kept))
+			self.assertEqual(S.data, kept)
+
+	def test_num_points_has_no_side_effects(self):
+		rng = random.Random(37)
+		points = random_points(rng) + [new_point(1000, 5)]
+		S = decimated_series(points)
+		bucket = S.bucket
+		datalen = len(S._data)
+		n = S.num_points()
+		self.assertIs(S.bucket, bucket)
+		self.assertEqual(len(S._data), datalen)
+		self.assertEqual(n, len(list(S.iter_points())))
+		self.assertEqual(n, len(S.data))
+
+	def test_appending_after_data(self):
+		S = decimated_series([new_point(i, i % 7) for i in range(100)])
+		S.data
+		S.append_datapoint(new_point(100, 3))
+		S.append_datapoint(new_point(101, 2))
+		kept = list(S.iter_points())
+		self.assertEqual(kept[0].timestamp, 0)
+		self.assertEqual(kept[-1].timestamp, 101)
+
+if __name__ == '__main__':
+	unittest.main()
@@ -0,0 +1,75 @@
+# Virtual memory analysis scripts.
+# Developed 2012-2014 by Peter Hornyack, pjh@cs.washington.edu
+# Copyright (c) 2012-2014 Peter Hornyack and University of Washington
+
+from trace.synth_trace_class import write_synth_app
+from trace.traceinfo_class import tracefilename
+from trace.vm_regex import *
+import collections
+import shutil
+import tempfile
+import unittest
+
+KNOBS = {
+	'procs'      : 3,
+	'vmas'       : 16,
+	'events'     : 3000,
+	'userstacks' : True,
+}
+
+class synth_trace_test(unittest.TestCase):
+
+	def setUp(self):
+		self.tmpdir = tempfile.mkdtemp()
+
+	def tearDown(self):
+		shutil.rmtree(self.tmpdir)
+
+	# Checks that the event-specific part of an event matches the regex
+	# that the analysis uses for it.
+	def check_event_msg(self, trace_event, msg):
+		if trace_event == 'mm_rss':
+			self.assertTrue(rss_mapped_re.match(msg), msg)
+		elif (trace_event.startswith(MMAP_VMA_EVENT_PREFIX) or
+				trace_event.startswith('pte_')):
+			vma_match = vma_event_re.match(msg)
+			self.assertTrue(vma_match, msg)
+			rest = vma_match.group('rest')
+			if trace_event.startswith('pte_'):
+				self.assertTrue(pte_mapped_re.match(rest.strip()), msg)
+			else:
+				self.assertTrue(maps_line_re.match(rest), msg)
+		elif trace_event != 'tracing_mark_write':
+			self.assertTrue(vma_pids_re.match(msg), msg)
+		return
+
+	def test_lines_match_regexes(self):
+		appdir = "{}/synthapp".format(self.tmpdir)
+		synth = write_synth_app(appdir, **KNOBS)
+		seen = collections.Counter()
+		nlines = 0
+		for line in open("{}/{}".format(appdir, tracefilename), 'r'):
+			nlines += 1
+			line = line.rstrip('\n')
+			if line.startswith('#'):
+				continue
+			if userstacktrace_begin_re.match(line):
+				seen['<user stack trace>'] += 1
+				continue
+			if (userstacktrace_entry_re.match(line) or
+					userstacktrace_reason_re.match(line)):
+				continue
+			event_match = trace_event_re.match(line)
+			self.assertTrue(event_match, line)
+			trace_event = event_match.group('trace_event')
+			seen[trace_event] += 1
+			self.check_event_msg(trace_event,
+				event_match.group('event_msg'))
+
+		self.assertEqual(nlines, synth.nlines)
+		for trace_event in ['mmap_vma_alloc', 'mmap_vma_free', 'pte_mapped',
+				'mm_rss', 'tracing_mark_write', '<user stack trace>']:
+			self.assertGreater(seen[trace_event], 0, trace_event)
+
+if __name__ == '__main__':
+	unittest.main()
@@ -0,0 +1,130 @@
+# Virtual memory analysis scripts.
+# Developed 2012-2014 by Peter Hornyack, pjh@cs.washington.edu
+# Copyright (c) 2012-2014 Peter Hornyack and University of Washington
+
+import conf.system_conf as sysconf
+from trace.trace_helper_class import trace_helper
+import trace.traceinfo_class as traceinfo_class
+from trace.traceinfo_class import *
+import getpass
+import grp
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import unittest
+
+CPUS = 2
+TRACE_FILES = ['tracing_on', 'buffer_size_kb', 'trace_clock',
+	'options/overwrite', 'options/sym-userobj', 'options/userstacktrace',
+	'events/mmap/enable', 'events/pte/enable', 'events/rss/enable',
+	'events/sched/sched_switch/enable',
+	'events/sched/sched_process_fork/enable',
+	'events/syscalls/sys_enter_mprotect/enable',
+	'events/syscalls/sys_exit_mprotect/enable', 'trace', 'trace_marker']
+TRACE_EVENTS = ("             app-4000  [000] .... 1000.000001: "
+	"tracing_mark_write: cp1\n")
+
+# Stands in for the kernel's tracing dir: empty regular files where the
+# kernel has its control files, and a trace file with old events in it.
+def make_tracefs_root(root):
+	for path in TRACE_FILES:
+		fname = "{}/{}".format(root, path)
+		if not os.path.exists(os.path.dirname(fname)):
+			os.makedirs(os.path.dirname(fname))
+		f = open(fname, 'w')
+		if path == 'trace':
+			f.write("old events\n")
+		f.close()
+	for cpu in range(CPUS):
+		os.makedirs("{}/per_cpu/cpu{}".format(root, cpu))
+		f = open("{}/per_cpu/cpu{}/stats".format(root, cpu), 'w')
+		f.write("entries: 0\noverrun: 0\ndropped events: 0\n")
+		f.close()
+	return
+
+class trace_helper_test(unittest.TestCase):
+
+	def setUp(self):
+		self.tmpdir = tempfile.mkdtemp()
+		self.root = "{}/tracing".format(self.tmpdir)
+		self.outputdir = "{}/output".format(self.tmpdir)
+		make_tracefs_root(self.root)
+		self.saved = (sysconf.trace_user, sysconf.trace_group,
+			traceinfo_class.all_cpus_prog, os.environ.get('PJH_DEBUG'))
+		# The helper gives the trace copy to the trace user.
+		sysconf.trace_user = getpass.getuser()
+		sysconf.trace_group = grp.getgrgid(os.getgid()).gr_name
+		traceinfo_class.all_cpus_prog = 'true'
+
+	def tearDown(self):
+		(sysconf.trace_user, sysconf.trace_group,
+			traceinfo_class.all_cpus_prog, debug) = self.saved
+		if debug is None:
+			os.environ.pop('PJH_DEBUG', None)
+		else:
+			os.environ['PJH_DEBUG'] = debug
+		shutil.rmtree(self.tmpdir)
+
+	def read_root_file(self, path):
+		f = open("{}/{}".format(self.root, path), 'r')
+		data = f.read()
+		f.close()
+		return data
+
+	def trace_cycle(self):
+		tinfo = traceinfo('testapp', tracefs_root=self.root,
+			use_sudo=False)
+		self.assertTrue(tinfo.trace_on(self.outputdir, 'on',
+			use_perf=False))
+		self.assertEqual(self.read_root_file('trace'), '')
+		self.assertEqual(tinfo.trace_cpus, list(range(CPUS)))
+
+		# What the kernel would have traced in the meantime.
+		f = open("{}/trace".format(self.root), 'w')
+		f.write(TRACE_EVENTS)
+		f.close()
+		self.assertEqual(tinfo.trace_checkpoint('cp1'), 'success')
+		self.assertEqual(tinfo.trace_off('off'), (True, False))
+		self.assertFalse(tinfo.helper)
+
+		self.assertEqual(self.read_root_file('trace_marker'),
+			"cp1\ntrace-off\n")
+		self.assertEqual(self.read_root_file('tracing_on'), "0\n1\n0\n")
+		self.assertEqual(self.read_root_file('trace_clock'),
+			"{}\n".format(trace_clock))
+		tracefile = "{}/{}".format(self.outputdir, tracefilename)
+		f = open(tracefile, 'r')
+		self.assertEqual(f.read(), TRACE_EVENTS)
+		f.close()
+		f = open(trace_losses_fname(tracefile), 'r')
+		losses = json.load(f)
+		f.close()
+		self.assertEqual(losses['lost'], {})
+		self.assertFalse(losses['trimmed'])
+		return
+
+	def test_trace_cycle(self):
+		os.environ.pop('PJH_DEBUG', None)
+		self.trace_cycle()
+
+	# Debug messages from the helper must not get mixed in with its
+	# replies.
+	def test_trace_cycle_with_debug(self):
+		os.environ['PJH_DEBUG'] = '1'
+		self.trace_cycle()
+
+	def test_bad_reply(self):
+		helper = trace_helper(self.root, use_sudo=False)
+		helper.helper_p = subprocess.Popen([sys.executable, '-c',
+			"import sys; sys.stdin.readline(); print('not json')"],
+			stdin=subprocess.PIPE, stdout=subprocess.PIPE,
+			universal_newlines=True)
+		self.assertIsNone(helper.run([]))
+		helper.stop()
+		self.assertIsNone(helper.run([]))
+
+if __name__ == '__main__':
+	unittest.main()
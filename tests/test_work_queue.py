@@ -0,0 +1,141 @@
+# Virtual memory analysis scripts.
+# Developed 2012-2014 by Peter Hornyack, pjh@cs.washington.edu
+# Copyright (c) 2012-2014 Peter Hornyack and University of Washington
+
+import analyze.work_queue_class as work_queue_class
+from analyze.work_queue_class import *
+import multiprocessing
+import os
+import shutil
+import tempfile
+import time
+import unittest
+
+WORKERS = 3
+JOIN_TIMEOUT = 30
+
+# Squares the task's n in a worker process; tasks with 'fail' set raise
+# an exception instead.
+def square_task(task):
+	if task.get('fail'):
+		raise ValueError("task {} was told to fail".format(task['n']))
+	return {'square': task['n'] * task['n'], 'pid': os.getpid()}
+
+def worker_main(queuedir):
+	work_queue(queuedir).work(square_task)
+	return
+
+# Claims one task and dies without completing it or sending heartbeats.
+def dying_worker_main(queuedir):
+	(taskid, task) = work_queue(queuedir).claim()
+	os._exit(0 if taskid else 1)
+
+def start_workers(queuedir, n):
+	workers = []
+	for i in range(n):
+		worker = multiprocessing.get_context('fork').Process(
+				target=worker_main, args=(queuedir,), daemon=True)
+		worker.start()
+		workers.append(worker)
+	return workers
+
+class work_queue_test(unittest.TestCase):
+
+	def setUp(self):
+		self.tmpdir = tempfile.mkdtemp()
+		self.queuedir = "{}/queue".format(self.tmpdir)
+		os.makedirs(self.queuedir)
+		# The workers are forked, so they inherit these.
+		self.saved = (work_queue_class.POLL_INTERVAL,
+			work_queue_class.HEARTBEAT_INTERVAL,
+			work_queue_class.LEASE_TIMEOUT)
+		work_queue_class.POLL_INTERVAL = 0.02
+		work_queue_class.HEARTBEAT_INTERVAL = 0.05
+		work_queue_class.LEASE_TIMEOUT = 1.0
+
+	def tearDown(self):
+		(work_queue_class.POLL_INTERVAL,
+			work_queue_class.HEARTBEAT_INTERVAL,
+			work_queue_class.LEASE_TIMEOUT) = self.saved
+		shutil.rmtree(self.tmpdir)
+
+	def join_workers(self, workers):
+		for worker in workers:
+			worker.join(JOIN_TIMEOUT)
+			self.assertFalse(worker.is_alive())
+			self.assertEqual(worker.exitcode, 0)
+
+	def test_completion_and_failures(self):
+		wq = work_queue(self.queuedir)
+		wq.reset()
+		workers = start_workers(self.queuedir, WORKERS)
+		taskids = []
+		for n in range(20):
+			taskids.append(wq.enqueue('square', {'n': n,
+				'fail': n % 7 == 3}))
+		(results, errors) = wq.wait(taskids)
+		wq.close()
+		self.join_workers(workers)
+
+		for (n, taskid) in enumerate(taskids):
+			if n % 7 == 3:
+				self.assertIn('ValueError', errors[taskid])
+				self.assertEqual(wq.status(taskid), FAILED_DIR)
+				self.assertTrue(os.path.exists(wq.result_fname(FAILED_DIR,
+					taskid)))
+			else:
+				self.assertEqual(results[taskid]['square'], n * n)
+				self.assertEqual(wq.status(taskid), DONE_DIR)
+		self.assertEqual(len(results) + len(errors), len(taskids))
+		self.assertEqual(os.listdir(wq.subdir(PENDING_DIR)), [])
+		self.assertEqual(os.listdir(wq.subdir(CLAIMED_DIR)), [])
+
+	def test_stale_lease_recovery(self):
+		wq = work_queue(self.queuedir)
+		wq.reset()
+		taskid = wq.enqueue('square', {'n': 5})
+		dying = multiprocessing.get_context('fork').Process(
+				target=dying_worker_main, args=(self.queuedir,),
+				daemon=True)
+		dying.start()
+		dying.join(JOIN_TIMEOUT)
+		self.assertEqual(dying.exitcode, 0)
+		self.assertEqual(len(os.listdir(wq.subdir(CLAIMED_DIR))), 1)
+
+		# Nobody is sending heartbeats for the claimed task, so once
+		# its lease times out it's put back into the queue and run
+		# again by a live worker.
+		workers = start_workers(self.queuedir, 1)
+		(results, errors) = wq.wait([taskid])
+		wq.close()
+		self.join_workers(workers)
+		self.assertEqual(errors, {})
+		self.assertEqual(results[taskid]['square'], 25)
+		self.assertEqual(results[taskid]['pid'], workers[0].pid)
+
+	def test_reset_while_workers_poll(self):
+		# A previous run's queue, already closed.
+		old = work_queue(self.queuedir)
+		old.reset()
+		old.close()
+		oldgendir = old.gendir()
+
+		# Workers started before the coordinator resets the queue must
+		# wait for the new run rather than exit on the old closed
+		# marker.
+		workers = start_workers(self.queuedir, 2)
+		time.sleep(0.2)
+		wq = work_queue(self.queuedir)
+		wq.reset()
+		self.assertFalse(os.path.exists(oldgendir))
+		taskids = [wq.enqueue('square', {'n': n}) for n in range(5)]
+		(results, errors) = wq.wait(taskids)
+		self.assertEqual(sorted(r['square'] for r in results.values()),
+			[0, 1, 4, 9, 16])
+		for worker in workers:
+			self.assertTrue(worker.is_alive())
+		wq.close()
+		self.join_workers(workers)
+
+if __name__ == '__main__':
+	unittest.main()
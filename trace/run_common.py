@@ -26,6 +26,31 @@ proc_groups_fname = 'process_groups.tsv'
 saved_vmas_fname = 'all_vmas.tsv'
 specialerrorfile = 'ERROR'
 PROCESS_GROUPS_NAME = 'process_groups'
+STARTUP_BUDGET = 0.5
+  # Seconds that analyze_trace.py, generate_plots.py or one of its
+  # worker processes should take to start up (mostly importing modules;
+  # see check_startup_time()). matplotlib alone takes longer than this
+  # to import, which is why the plot modules only import it on first use.
+
+##############################################################################
+
+# Checks how long a script or worker process took to start up: begin is
+# a time.perf_counter() value taken when it started, e.g. before the
+# script imported its modules. The startup time is printed as a debug
+# message, plus a warning if it's over budget (seconds).
+# Returns: the startup time, in seconds.
+def check_startup_time(name, begin, budget=STARTUP_BUDGET):
+	tag = 'check_startup_time'
+
+	elapsed = time.perf_counter() - begin
+	print_debug(tag, ("{} started up in {:.3f} seconds").format(name,
+		elapsed))
+	if elapsed > budget:
+		print_warning(tag, ("{} took {:.3f} seconds to start up, over "
+			"the budget of {} seconds - is something importing "
+			"matplotlib early?").format(name, elapsed, budget))
+
+	return elapsed
 
 ##############################################################################
 
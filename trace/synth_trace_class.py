@@ -0,0 +1,813 @@
+# Virtual memory analysis scripts.
+# Developed 2012-2014 by Peter Hornyack, pjh@cs.washington.edu
+# Copyright (c) 2012-2014 Peter Hornyack and University of Washington
+
+# Synthetic kernel trace files, for benchmarking and testing the
+# analysis without a kernel with the mmap_vma_* / pte_* / mm_rss trace
+# events and without running the real apps. synth_trace writes a
+# trace-events-full file in the same formats that the kernel does (see
+# the regexes in vm_regex.py) for one app: a shell that was running
+# before tracing began forks and execs the app's root process, which
+# loads its binary and shared libs and then allocates, frees, resizes,
+# moves and mprotects vmas, faults in pages and forks child processes
+# (some of which exec a helper program); a few tracing_mark_write
+# checkpoints are taken along the way, and at the end every process
+# exits. The events of the processes (and of their threads) are
+# interleaved across the cpus like they are in a real trace, and each
+# event can be followed by a user stack trace. The sequences of events
+# for fork, exec and exit follow the kernel's (see the comments in
+# map_unmap_vma() in analyze_trace.py), so that the analysis runs
+# through the same code paths as it does for a real trace.
+#
+# Everything is drawn from a random.Random with a fixed seed, so the
+# same knobs always produce the same trace.
+
+from util.pjh_utils import *
+from trace.run_common import *
+from trace.traceinfo_class import tracefilename
+import random
+
+SYNTH_BEGIN_TIME = 1000.0
+  # Timestamp of the first trace event, in seconds.
+SYNTH_BASE_PID = 4000
+SYNTH_PAGE = 4096
+SYNTH_STACK_TOP = 0x7ffffffff000
+  # Where the kernel sets up the stack of a new exec before it's moved
+  # by shift_arg_pages.
+SYNTH_STACK_PAGES = 33
+SYNTH_THREAD_STACK_PAGES = 2048
+SYNTH_LAUNCHER = ('bash', '/bin/bash', 0xd4)
+  # (name, binary, text pages) of the shell that starts the app; its own
+  # events aren't in the trace, like a shell that was started before
+  # tracing was turned on.
+SYNTH_HELPER = ('sh', '/bin/dash', 0x1c)
+  # What the app's child processes that exec run.
+SYNTH_APP_TEXT_PAGES = 0x5a
+SYNTH_LD = ('/lib/x86_64-linux-gnu/ld-2.17.so', 0x23, 2)
+SYNTH_LIBS = [
+		('/lib/x86_64-linux-gnu/libc-2.17.so', 0x1bb, 6),
+		('/lib/x86_64-linux-gnu/libdl-2.17.so', 0x3, 2),
+		('/lib/x86_64-linux-gnu/libm-2.17.so', 0x105, 2),
+		('/lib/x86_64-linux-gnu/libpthread-2.17.so', 0x18, 2),
+	]
+  # (filename, text pages, data pages) of the shared libs that every
+  # process maps after ld.so.
+SYNTH_OP_WEIGHTS = [
+		('alloc',    30),
+		('free',     20),
+		('brk',      12),
+		('mprotect',  8),
+		('madvise',   4),
+		('mremap',    6),
+		('fault',    20),
+	]
+  # Relative frequencies of the operations of a running process. alloc
+  # and free are one trace event; brk, mprotect, madvise and mremap are
+  # an unmap-remap pair; a fault is a pte_mapped event and an mm_rss
+  # event. alloc and free are weighted further to keep each process
+  # near its target number of vmas.
+
+'''
+One vma of a synthetic process: what the kernel prints in its trace
+events, in the same format as a line in /proc/pid/maps, plus the
+address of the kernel's vm_area_struct for it.
+'''
+class synth_vma:
+	tag = 'synth_vma'
+
+	begin = None
+	end = None
+	perms = None
+	offset = None
+	dev = None
+	inode = None
+	filename = None
+	structaddr = None
+	limit = None
+	  # How far the vma may grow in place without running into the next
+	  # one.
+
+	def __init__(self, begin, end, perms, structaddr, offset=0,
+			dev='00:00', inode=0, filename='', limit=None):
+		tag = "{}.__init__".format(self.tag)
+
+		self.begin = begin
+		self.end = end
+		self.perms = perms
+		self.structaddr = structaddr
+		self.offset = offset
+		self.dev = dev
+		self.inode = inode
+		self.filename = filename
+		if limit is None:
+			limit = end
+		self.limit = limit
+
+		return
+
+	def copy(self, structaddr):
+		return synth_vma(self.begin, self.end, self.perms, structaddr,
+			self.offset, self.dev, self.inode, self.filename, self.limit)
+
+	def pages(self):
+		return (self.end - self.begin) // SYNTH_PAGE
+
+	def is_anon(self):
+		return self.inode == 0
+
+	def maps_str(self):
+		return "{:x}-{:x} {} {:08x} {} {}{}".format(self.begin, self.end,
+			self.perms, self.offset, self.dev, self.inode,
+			(' ' + self.filename) if self.filename else '')
+
+	# The kernel's pte_* events print just the range and perms of the
+	# vma; its filename comes after them in file=[...] (see pte_mapped_re).
+	def pte_str(self):
+		return "{:x}-{:x} {} file=[{}]".format(self.begin, self.end,
+			self.perms, self.filename)
+
+'''
+One synthetic process (thread group): its threads, the cpu that it's
+running on, its vmas and the generator that emits its trace events
+(see synth_trace.process_life()).
+'''
+class synth_process:
+	tag = 'synth_process'
+
+	pid = None
+	ptgid = None
+	name = None
+	threads = None
+	cpu = None
+	vmas = None
+	  # Maps each vma's begin address to its synth_vma.
+	own = None
+	  # The begin addresses of the vmas that the process mapped itself
+	  # (anonymous and data file mmaps), which its operations may free,
+	  # resize, move or change.
+	heap = None
+	textranges = None
+	  # (begin, end) of the executable vmas that user stack traces point
+	  # into.
+	exec_ip = None
+	  # While the process is exec'ing: the ip in the old program that
+	  # user stack traces point to.
+	mmap_next = None
+	rss = None
+	ops_left = None
+	forks = None
+	running = None
+	life = None
+
+	def __init__(self, pid, ptgid, name, cpu):
+		tag = "{}.__init__".format(self.tag)
+
+		self.pid = pid
+		self.ptgid = ptgid
+		self.name = name
+		self.threads = [pid]
+		self.cpu = cpu
+		self.vmas = dict()
+		self.own = []
+		self.heap = None
+		self.textranges = []
+		self.exec_ip = None
+		self.mmap_next = None
+		self.rss = {'MM_FILEPAGES': 0, 'MM_ANONPAGES': 0}
+		self.ops_left = -1
+		self.forks = []
+		self.running = False
+		self.life = None
+
+		return
+
+	def add_vma(self, vma, own=False):
+		self.vmas[vma.begin] = vma
+		if own:
+			self.own.append(vma.begin)
+		return
+
+	def remove_vma(self, vma):
+		del self.vmas[vma.begin]
+		if vma.begin in self.own:
+			self.own.remove(vma.begin)
+		return
+
+	def sorted_vmas(self):
+		return [self.vmas[begin] for begin in sorted(self.vmas.keys())]
+
+'''
+Writes a synthetic trace file for one app. The knobs:
+  procs: the number of processes in the app (the root process and the
+    children that it and its children fork).
+  vmas: the number of vmas that each process maps itself (besides its
+    binary, shared libs, heap and stack) that it keeps around.
+  events: the approximate number of trace events before the processes
+    exit (not counting the user stack trace lines).
+  duration: the number of seconds that the timestamps span.
+  cpus: the number of cpus that the processes run on.
+  interleave: the probability that the next event comes from a
+    different (random) process than the last one; 0 runs each process
+    until it exits, 1 interleaves the processes' events one by one.
+  migrate: the probability that a process moves to another cpu before
+    each of its operations.
+  threads: the number of threads in each process that doesn't exec.
+  checkpoints: the number of tracing_mark_write checkpoints.
+  userstacks: whether each event is followed by a user stack trace.
+  exec_fraction: the fraction of the forked children that exec.
+  exits: whether the processes exit at the end of the trace; if not,
+    the trace ends while they're still running, with their vmas still
+    mapped.
+'''
+class synth_trace:
+	tag = 'synth_trace'
+
+	appname = None
+	procs = None
+	vmas = None
+	events = None
+	duration = None
+	cpus = None
+	interleave = None
+	migrate = None
+	threads = None
+	checkpoints = None
+	userstacks = None
+	exec_fraction = None
+	exits = None
+	rng = None
+	f = None
+	clock = None
+	tick = None
+	nevents = None
+	nlines = None
+	nextpid = None
+	inodes = None
+	live = None
+	root = None
+
+	def __init__(self, appname, procs=4, vmas=64, events=100000,
+			duration=60.0, cpus=4, interleave=0.3, migrate=0.01,
+			threads=2, checkpoints=3, userstacks=False, exec_fraction=0.5,
+			exits=True, seed=0):
+		tag = "{}.__init__".format(self.tag)
+
+		if procs < 1 or cpus < 1 or threads < 1 or events < 1:
+			print_error_exit(tag, ("invalid knobs: procs={}, cpus={}, "
+				"threads={}, events={}").format(procs, cpus, threads,
+				events))
+		self.appname = appname
+		self.procs = procs
+		self.vmas = vmas
+		self.events = events
+		self.duration = duration
+		self.cpus = cpus
+		self.interleave = interleave
+		self.migrate = migrate
+		self.threads = threads
+		self.checkpoints = checkpoints
+		self.userstacks = userstacks
+		self.exec_fraction = exec_fraction
+		self.exits = exits
+		self.rng = random.Random(seed)
+		self.f = None
+		self.clock = SYNTH_BEGIN_TIME
+		self.tick = duration / events
+		self.nevents = 0
+		self.nlines = 0
+		self.nextpid = SYNTH_BASE_PID + self.rng.randrange(1000)
+		self.inodes = dict()
+		self.live = []
+		self.root = None
+
+		return
+
+	# Writes the trace to the file fname.
+	# Returns: the number of lines written.
+	def write(self, fname):
+		tag = "{}.write".format(self.tag)
+
+		self.f = open(fname, 'w')
+		self.write_header()
+
+		launcher = self.new_process(None, SYNTH_LAUNCHER[0])
+		self.load_image(launcher, SYNTH_LAUNCHER[1], SYNTH_LAUNCHER[2])
+		launcher.add_vma(self.new_stack_vma())
+		# The root process is the one in the target_pids file.
+		self.root = self.new_child(launcher, self.appname[:15],
+				"/usr/bin/{}".format(self.appname), True)
+		for x in self.dup_mmap(launcher, self.root):
+			pass
+		self.start_child(self.root, -1)
+
+		spawns = sorted(self.rng.randrange(self.events * 2 // 3)
+				for i in range(self.procs - 1))
+		cps = [self.events * (i + 1) // (self.checkpoints + 1)
+				for i in range(self.checkpoints)]
+		finishing = False
+		current = self.root
+		while self.live:
+			if not finishing and self.nevents >= self.events:
+				finishing = True
+				for p in self.live:
+					p.ops_left = 0
+			if cps and self.nevents >= cps[0]:
+				cps.pop(0)
+				self.checkpoint()
+			if spawns and self.nevents >= spawns[0] and not finishing:
+				spawns.pop(0)
+				parents = [p for p in self.live if p.running]
+				if parents:
+					self.rng.choice(parents).forks.append(
+						self.rng.random() < self.exec_fraction)
+			if (current not in self.live or
+					self.rng.random() < self.interleave):
+				current = self.rng.choice(self.live)
+			try:
+				next(current.life)
+			except StopIteration:
+				self.live.remove(current)
+
+		self.f.close()
+		self.f = None
+		print_debug(tag, ("wrote {} lines ({} events) to {}").format(
+			self.nlines, self.nevents, fname))
+
+		return self.nlines
+
+	def write_header(self):
+		self.f.write("# tracer: nop\n"
+			"#\n"
+			"#                              _-----=> irqs-off\n"
+			"#                             / _----=> need-resched\n"
+			"#                            | / _---=> hardirq/softirq\n"
+			"#                            || / _--=> preempt-depth\n"
+			"#                            ||| /     delay\n"
+			"#           TASK-PID   CPU#  ||||    TIMESTAMP  FUNCTION\n"
+			"#              | |       |   ||||       |         |\n")
+		self.nlines += 9
+		return
+
+	##########################################################################
+	# Trace lines:
+
+	# Writes one trace event line for the process p (running on thread
+	# tid), followed by its user stack trace if userstacks is on.
+	def emit(self, p, tid, trace_event, msg, stack=True):
+		self.clock += self.rng.expovariate(1.0) * self.tick
+		timestamp = "{:.6f}".format(self.clock)
+		self.f.write("{:>16}-{:<5} [{:03d}] .... {:>12}: {}: {}\n".format(
+			p.name, tid, p.cpu, timestamp, trace_event, msg))
+		self.nevents += 1
+		self.nlines += 1
+		if self.userstacks and stack:
+			self.f.write("{:>16}-{:<5} [{:03d}] .... {:>12}: <user stack "
+				"trace> tgid={}\n".format(p.name, tid, p.cpu, timestamp,
+				p.pid))
+			for ip in self.stack_ips(p):
+				self.f.write(" [{:03d}] =>  <{:016x}>\n".format(p.cpu, ip))
+			self.f.write(" [{:03d}] => ??\n".format(p.cpu))
+			self.nlines += 2 + len(self.stack_ips(p))
+		return
+
+	# Returns: the ips in the user stack trace for an event from process
+	# p, from the top of the stack down.
+	def stack_ips(self, p):
+		if p.exec_ip:
+			return [p.exec_ip]
+		ips = []
+		for (begin, end) in reversed(p.textranges):
+			ips.append(begin + (hash((begin, p.pid)) % (end - begin)))
+		return ips
+
+	# Emits an mmap_vma_* or pte_* event for the vma from the process p.
+	# The event is about the process target (e.g. the child for a
+	# dup_mmap), or about p if target is None.
+	# rest is appended to the vma's maps line, or for pte_* events to its
+	# pte_str().
+	def vma_event(self, p, trace_event, fn, vma, target=None, rest=None,
+			tid=None):
+		if tid is None:
+			tid = self.rng.choice(p.threads)
+		if target is None:
+			(target, pid) = (p, tid)
+		else:
+			pid = target.pid
+		if trace_event.startswith('pte_'):
+			vmastr = vma.pte_str()
+		else:
+			vmastr = vma.maps_str()
+		msg = "pid={} tgid={} ptgid={} [{}]: {:x} @ {}".format(pid,
+			target.pid, target.ptgid, fn, vma.structaddr, vmastr)
+		if rest:
+			msg += rest
+		self.emit(p, tid, trace_event, msg)
+		return
+
+	def sim_event(self, p, trace_event, fn):
+		self.emit(p, p.pid, trace_event, ("pid={} tgid={} ptgid={} "
+			"[{}]").format(p.pid, p.pid, p.ptgid, fn), stack=False)
+		return
+
+	# Writes a checkpoint to the trace marker, from a new shell like
+	# traceinfo.trace_checkpoint() does.
+	def checkpoint(self):
+		shell = synth_process(self.new_pid(), None, 'bash',
+				self.rng.randrange(self.cpus))
+		self.emit(shell, shell.pid, 'tracing_mark_write',
+			"synth-checkpoint-{}".format(self.nevents), stack=False)
+		return
+
+	##########################################################################
+	# Processes, vmas and addresses:
+
+	def new_pid(self):
+		pid = self.nextpid
+		self.nextpid += 1
+		return pid
+
+	def new_process(self, ptgid, name):
+		return synth_process(self.new_pid(), ptgid, name,
+				self.rng.randrange(self.cpus))
+
+	def new_structaddr(self):
+		return 0xffff880000000000 + (self.rng.randrange(1 << 32) & ~0x7)
+
+	def inode(self, filename):
+		try:
+			return self.inodes[filename]
+		except KeyError:
+			self.inodes[filename] = 1000000 + self.rng.randrange(9000000)
+			return self.inodes[filename]
+
+	def file_vma(self, begin, pages, perms, filename, offset_pages):
+		return synth_vma(begin, begin + pages * SYNTH_PAGE, perms,
+			self.new_structaddr(), offset_pages * SYNTH_PAGE, '08:01',
+			self.inode(filename), filename)
+
+	def anon_vma(self, begin, pages, perms='rw-p', filename=''):
+		return synth_vma(begin, begin + pages * SYNTH_PAGE, perms,
+			self.new_structaddr(), filename=filename)
+
+	def new_stack_vma(self):
+		top = 0x7fff00000000 + self.rng.randrange(0xfffff) * SYNTH_PAGE
+		return self.anon_vma(top - SYNTH_STACK_PAGES * SYNTH_PAGE,
+				SYNTH_STACK_PAGES)
+
+	# Reserves room for a new mmap of the given number of pages below
+	# the process' last one, with as much room again above it to grow
+	# into.
+	# Returns: the begin address of the mmap.
+	def mmap_addr(self, p, pages):
+		p.mmap_next -= 2 * pages * SYNTH_PAGE + SYNTH_PAGE
+		return p.mmap_next
+
+	# Returns: a list of the (kernel fn, vma) that the kernel and ld.so
+	# map for a new program: its binary, heap, vdso, ld.so and the shared
+	# libs, and also adds them to the process p.
+	def load_image(self, p, binary, textpages):
+		image = []
+		p.textranges = []
+		text = self.file_vma(0x400000, textpages, 'r-xp', binary, 0)
+		image.append(('mmap_region', text))
+		p.textranges.append((text.begin, text.end))
+		data = 0x600000 + textpages * SYNTH_PAGE
+		image.append(('mmap_region', self.file_vma(data, 1, 'r--p',
+			binary, textpages)))
+		image.append(('mmap_region', self.file_vma(data + SYNTH_PAGE, 2,
+			'rw-p', binary, textpages + 1)))
+		heapbegin = (data + (3 + self.rng.randrange(1, 0x2000)) *
+				SYNTH_PAGE)
+		heap = self.anon_vma(heapbegin, 1, filename='[heap]')
+		heap.limit = heapbegin + 0x10000000
+		image.append(('do_brk', heap))
+		image.append(('_install_special_mapping', self.anon_vma(
+			0x7fffd0000000 + self.rng.randrange(0xffff) * SYNTH_PAGE, 2,
+			'r-xp', '[vdso]')))
+
+		p.mmap_next = 0x7f0000000000 + self.rng.randrange(0xfffffff) * \
+				SYNTH_PAGE
+		for (i, (lib, textpages, datapages)) in enumerate([SYNTH_LD] +
+				SYNTH_LIBS):
+			size = (textpages + 0x200 + datapages) * SYNTH_PAGE
+			p.mmap_next -= size + SYNTH_PAGE
+			begin = p.mmap_next
+			text = self.file_vma(begin, textpages, 'r-xp', lib, 0)
+			image.append(('mmap_region', text))
+			if i == 1:   # libc
+				p.textranges.append((text.begin, text.end))
+			guard = 0x200 - textpages % 0x200
+			image.append(('mprotect_fixup', self.file_vma(text.end,
+				guard, '---p', lib, textpages)))
+			data = text.end + guard * SYNTH_PAGE
+			image.append(('mmap_region', self.file_vma(data, 1, 'r--p',
+				lib, textpages)))
+			image.append(('mmap_region', self.file_vma(data + SYNTH_PAGE,
+				datapages - 1, 'rw-p', lib, textpages + 1)))
+		for (fn, vma) in image:
+			p.add_vma(vma)
+		p.heap = heap.begin
+
+		return image
+
+	##########################################################################
+	# Process lifetimes and operations: each of these is a generator that
+	# emits a trace event for its process each time next() is called on
+	# it, so that the events of the processes can be interleaved.
+
+	# Creates a child of the process p, which will exec the binary if
+	# do_exec is set (otherwise it keeps running p's program, with its own
+	# threads). The child doesn't run until start_child() is called,
+	# after its parent has emitted its dup_mmap events.
+	def new_child(self, p, name, binary, do_exec):
+		c = self.new_process(p.pid, name if do_exec else p.name)
+		c.cpu = p.cpu
+		if not do_exec:
+			c.threads += [self.new_pid() for i in range(self.threads - 1)]
+		c.life = self.process_life(c, binary, do_exec)
+		return c
+
+	# The parent p copies its vmas into the child c in dup_mmap().
+	def dup_mmap(self, p, c):
+		tid = self.rng.choice(p.threads)
+		for vma in p.sorted_vmas():
+			dup = vma.copy(self.new_structaddr())
+			c.add_vma(dup, vma.begin in p.own)
+			self.vma_event(p, 'mmap_vma_alloc_dup_mmap', 'dup_mmap', dup,
+				target=c, tid=tid)
+			yield
+		c.heap = p.heap
+		c.textranges = list(p.textranges)
+		c.mmap_next = p.mmap_next
+		c.rss = dict(p.rss)
+		return
+
+	# Lets the child c run, for ops operations (or until the trace is
+	# finishing, if ops is -1).
+	def start_child(self, c, ops):
+		c.ops_left = ops
+		self.live.append(c)
+		return
+
+	def process_life(self, p, binary, do_exec):
+		if do_exec:
+			yield from self.exec_binary(p, binary)
+		p.running = True
+		while p.ops_left != 0:
+			if p.ops_left > 0:
+				p.ops_left -= 1
+			if self.rng.random() < self.migrate:
+				p.cpu = self.rng.randrange(self.cpus)
+			if p.forks:
+				child_execs = p.forks.pop(0)
+				c = self.new_child(p, SYNTH_HELPER[0], SYNTH_HELPER[1],
+						child_execs)
+				yield from self.dup_mmap(p, c)
+				self.start_child(c, self.rng.randrange(1, 2 * self.events //
+					(3 * self.procs) + 2))
+				continue
+			op = self.choose_op(p)
+			yield from getattr(self, "op_{}".format(op))(p)
+		p.running = False
+		if not self.exits:
+			return
+
+		for vma in p.sorted_vmas():
+			self.vma_event(p, 'mmap_vma_free', 'exit_mmap -> remove_vma',
+				vma, tid=p.pid)
+			yield
+		p.vmas = dict()
+
+		return
+
+	# Emits the events of an exec: the kernel sets up the new stack
+	# (bprm->vma) before it removes the old vmas, then moves the stack
+	# into place (shift_arg_pages) with the analysis' simulation turned
+	# off while the page tables are moved, then maps the new program.
+	def exec_binary(self, p, binary):
+		(begin, end) = p.textranges[0]
+		p.exec_ip = begin + self.rng.randrange(end - begin)
+		textpages = (SYNTH_HELPER[2] if binary == SYNTH_HELPER[1] else
+				SYNTH_APP_TEXT_PAGES)
+
+		bprm = self.anon_vma(SYNTH_STACK_TOP, 0)
+		self.vma_event(p, 'mmap_vma_alloc', '__bprm_mm_init', bprm,
+			tid=p.pid)
+		yield
+		self.vma_event(p, 'mmap_vma_resize_unmap', 'expand_downwards',
+			bprm, tid=p.pid)
+		yield
+		bprm.begin -= SYNTH_PAGE
+		self.vma_event(p, 'mmap_vma_resize_remap', 'expand_downwards',
+			bprm, tid=p.pid)
+		yield
+		for vma in p.sorted_vmas():
+			self.vma_event(p, 'mmap_vma_free', 'exit_mmap -> remove_vma',
+				vma, tid=p.pid)
+			yield
+		p.vmas = dict()
+		p.own = []
+
+		self.vma_event(p, 'mmap_vma_reloc_unmap', 'shift_arg_pages', bprm,
+			tid=p.pid)
+		yield
+		self.sim_event(p, 'mmap_disable_sim', 'shift_arg_pages')
+		yield
+		stack = self.new_stack_vma()
+		moving = self.anon_vma(stack.end - SYNTH_PAGE, 1)
+		moving.structaddr = bprm.structaddr
+		self.vma_event(p, 'mmap_vma_resize_unmap', 'vma_adjust', bprm,
+			tid=p.pid)
+		yield
+		self.vma_event(p, 'mmap_vma_resize_remap', 'vma_adjust', moving,
+			tid=p.pid)
+		yield
+		self.sim_event(p, 'mmap_enable_sim', 'shift_arg_pages')
+		yield
+		self.vma_event(p, 'mmap_vma_reloc_remap', 'shift_arg_pages', moving,
+			tid=p.pid)
+		yield
+		self.vma_event(p, 'mmap_vma_resize_unmap', 'expand_downwards',
+			moving, tid=p.pid)
+		yield
+		stack.structaddr = moving.structaddr
+		self.vma_event(p, 'mmap_vma_resize_remap', 'expand_downwards',
+			stack, tid=p.pid)
+		p.add_vma(stack)
+		yield
+
+		for (fn, vma) in self.load_image(p, binary, textpages):
+			self.vma_event(p, 'mmap_vma_alloc', fn, vma, tid=p.pid)
+			yield
+		p.exec_ip = None
+
+		# Threads' stacks (with a guard page below each one):
+		for tid in p.threads[1:]:
+			begin = self.mmap_addr(p, SYNTH_THREAD_STACK_PAGES + 1)
+			p.add_vma(self.anon_vma(begin, 1, '---p'))
+			self.vma_event(p, 'mmap_vma_alloc', 'mmap_region',
+				p.vmas[begin], tid=p.pid)
+			yield
+			stack = self.anon_vma(begin + SYNTH_PAGE,
+					SYNTH_THREAD_STACK_PAGES)
+			p.add_vma(stack)
+			self.vma_event(p, 'mmap_vma_alloc', 'mmap_region', stack,
+				tid=p.pid)
+			yield
+
+		return
+
+	# Returns: the name of the next operation for the process p, drawn
+	# from SYNTH_OP_WEIGHTS with alloc and free weighted to keep the
+	# process near vmas vmas of its own.
+	def choose_op(self, p):
+		n = len(p.own)
+		weights = []
+		for (op, weight) in SYNTH_OP_WEIGHTS:
+			if op == 'alloc':
+				weight *= (self.vmas + 1) / (n + 1)
+			elif op == 'free':
+				weight *= (n + 1) / (self.vmas + 1)
+			elif op in ['mprotect', 'madvise', 'mremap'] and n == 0:
+				weight = 0
+			weights.append(weight)
+		x = self.rng.random() * sum(weights)
+		for (i, weight) in enumerate(weights):
+			x -= weight
+			if x < 0:
+				return SYNTH_OP_WEIGHTS[i][0]
+		return 'alloc'
+
+	# Emits an unmap-remap pair that changes the vma into newvma.
+	def remap_pair(self, p, op, fn, vma, newvma):
+		tid = self.rng.choice(p.threads)
+		self.vma_event(p, "mmap_vma_{}_unmap".format(op), fn, vma, tid=tid)
+		yield
+		own = vma.begin in p.own
+		p.remove_vma(vma)
+		p.add_vma(newvma, own)
+		self.vma_event(p, "mmap_vma_{}_remap".format(op), fn, newvma,
+			tid=tid)
+		yield
+		return
+
+	def op_alloc(self, p):
+		if self.rng.random() < 0.95:
+			pages = int(self.rng.paretovariate(1.2))
+		else:
+			pages = self.rng.randrange(256, 16384)
+		begin = self.mmap_addr(p, pages)
+		if self.rng.random() < 0.15:
+			filename = "/var/lib/{}/data-{}".format(self.appname,
+					self.rng.randrange(16))
+			vma = self.file_vma(begin, pages, 'r--p', filename,
+					self.rng.randrange(64))
+		else:
+			vma = self.anon_vma(begin, pages)
+		vma.limit = begin + 2 * pages * SYNTH_PAGE
+		p.add_vma(vma, True)
+		self.vma_event(p, 'mmap_vma_alloc', 'mmap_region', vma)
+		yield
+		return
+
+	def op_free(self, p):
+		vma = p.vmas[self.rng.choice(p.own)]
+		p.remove_vma(vma)
+		self.vma_event(p, 'mmap_vma_free', 'remove_vma_list -> remove_vma',
+			vma)
+		yield
+		return
+
+	def op_brk(self, p):
+		heap = p.vmas[p.heap]
+		pages = heap.pages()
+		if pages > 1 and self.rng.random() < 0.25:
+			pages -= self.rng.randrange(1, pages)
+		else:
+			pages += self.rng.randrange(1, 33)
+		newheap = heap.copy(heap.structaddr)
+		newheap.end = min(heap.begin + pages * SYNTH_PAGE, heap.limit)
+		yield from self.remap_pair(p, 'resize',
+			'vma_merge cases 1,6 -> vma_adjust', heap, newheap)
+		return
+
+	def op_mprotect(self, p):
+		vma = p.vmas[self.rng.choice(p.own)]
+		newvma = vma.copy(vma.structaddr)
+		newvma.perms = 'r--p' if vma.perms == 'rw-p' else 'rw-p'
+		yield from self.remap_pair(p, 'access', 'mprotect_fixup', vma,
+			newvma)
+		return
+
+	def op_madvise(self, p):
+		vma = p.vmas[self.rng.choice(p.own)]
+		yield from self.remap_pair(p, 'flags', 'madvise_behavior', vma,
+			vma.copy(vma.structaddr))
+		return
+
+	def op_mremap(self, p):
+		vma = p.vmas[self.rng.choice(p.own)]
+		pages = vma.pages()
+		if self.rng.random() < 0.5:
+			# Move it somewhere else. The kernel resizes a vma that
+			# grows while it's moved with a separate pair of events.
+			begin = self.mmap_addr(p, pages)
+			newvma = vma.copy(vma.structaddr)
+			(newvma.begin, newvma.end) = (begin, begin + pages * SYNTH_PAGE)
+			newvma.limit = begin + 2 * pages * SYNTH_PAGE
+			yield from self.remap_pair(p, 'reloc', 'move_vma', vma, newvma)
+		else:
+			# Grow or shrink it in place.
+			newvma = vma.copy(vma.structaddr)
+			newvma.end = vma.begin + self.rng.randrange(1, (vma.limit -
+				vma.begin) // SYNTH_PAGE + 1) * SYNTH_PAGE
+			yield from self.remap_pair(p, 'resize', 'vma_adjust', vma,
+				newvma)
+		return
+
+	# Faults in a page of a random (non-guard) vma and updates the rss.
+	def op_fault(self, p):
+		vmas = [vma for vma in p.vmas.values() if vma.perms[0] == 'r']
+		vma = self.rng.choice(vmas)
+		faultaddr = vma.begin + self.rng.randrange(max(1,
+			vma.pages())) * SYNTH_PAGE
+		if vma.is_anon():
+			(fn, pagetype) = ('handle_pte_fault -> do_anonymous_page',
+					'MM_ANONPAGES')
+		else:
+			(fn, pagetype) = ('__do_fault', 'MM_FILEPAGES')
+		tid = self.rng.choice(p.threads)
+		self.vma_event(p, 'pte_mapped', fn, vma, tid=tid, rest=(" "
+			"faultaddr={:x} is_major={} old_pte_pfn=0 old_pte_flags=0 "
+			"new_pte_pfn={} new_pte_flags={:x}").format(faultaddr,
+			int(self.rng.random() < 0.05), self.rng.randrange(1, 1 << 22),
+			0x8000000000000067))
+		yield
+		p.rss[pagetype] += 1
+		self.emit(p, tid, 'mm_rss', ("pid={} tgid={} ptgid={} [{}]: "
+			"rss_stat[{}]={}").format(tid, p.pid, p.ptgid, fn, pagetype,
+			p.rss[pagetype]))
+		yield
+		return
+
+# Writes a synthetic trace for an app into appdir, along with its
+# target_pids file, like run_apps.py does for a real app; the app's
+# name is the name of appdir. knobs are passed to synth_trace.
+# Returns: the synth_trace, e.g. for its nlines and nevents.
+def write_synth_app(appdir, **knobs):
+	tag = 'write_synth_app'
+
+	if not os.path.exists(appdir):
+		os.makedirs(appdir)
+	appname = os.path.basename(os.path.normpath(appdir))
+	synth = synth_trace(appname, **knobs)
+	synth.write("{}/{}".format(appdir, tracefilename))
+	pidsfile = "{}/{}".format(appdir, targetpidsfile)
+	if os.path.exists(pidsfile):
+		os.remove(pidsfile)
+	write_target_pids(appdir, [synth.root.pid])
+
+	return synth
+
+if __name__ == '__main__':
+	print_error_exit("not an executable module")
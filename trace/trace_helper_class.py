@@ -0,0 +1,340 @@
+# Virtual memory analysis scripts.
+# Developed 2012-2014 by Peter Hornyack, pjh@cs.washington.edu
+# Copyright (c) 2012-2014 Peter Hornyack and University of Washington
+
+from util.pjh_utils import *
+import errno
+import json
+import shutil
+import subprocess
+
+HELPER_MODULE = 'trace.tracefs_helper'
+HELPER_STOP_TIMEOUT = 10
+COPY_BLOCK_SIZE = 1024 * 1024
+FULL_ERRNOS = [errno.EBADF, errno.ENOSPC]
+  # When the trace buffer is full (and options/overwrite is 0), the
+  # kernel's tracing_mark_write() fails to reserve space for the marker
+  # and returns -EBADF.
+
+'''
+Client side of the privileged tracing helper. Writing to the kernel
+tracing files requires root, and the old way of doing this (a "sudo
+bash -c 'echo ...'" subprocess for every write) costs a fork, an exec of
+sudo and an exec of bash for every setting and every checkpoint, which
+perturbs the app being traced and limits how often trace_wait() can
+take checkpoints. Instead, start() launches one helper process
+(tracefs_helper.py) with sudo, and the helper keeps the control files
+that it has written to open until stop(). run() sends it a batch of
+commands over its stdin pipe, as one line of json, and reads the
+results back from its stdout pipe; each command is a list:
+  ['open', path]: just opens path, so that the first write to it later
+    doesn't have to.
+  ['write', path, value]: writes the string value to path.
+  ['truncate', path]: opens path with O_TRUNC, like "echo > path" does
+    (for the trace file, this clears the trace buffer).
+  ['read', path]: reads the current contents of path.
+  ['listdir', path]: lists the entries in the directory path.
+  ['copy', path, dest, user, group]: copies path to the file dest
+    (which doesn't have to be under the tracefs root) with large block
+    reads and writes, then gives dest to user:group.
+path is relative to the tracefs root, which is tracing_dir in
+traceinfo_class.py by default but can be any directory (e.g. a temp dir
+for testing, with use_sudo=False). The result of each command is an
+[errno, data] list, where errno is 0 on success; data is the contents
+that were read or listed, the number of bytes that were copied, or an
+error message. The helper stops running a batch at the first command that
+fails, so the list of results may be shorter than the batch.
+'''
+class trace_helper:
+	tag = 'trace_helper'
+
+	# Members:
+	tracefs_root = None
+	use_sudo = None
+	helper_p = None   # Popen object for the helper process
+
+	# If use_sudo is None, sudo is used unless we are already root.
+	def __init__(self, tracefs_root, use_sudo=None):
+		tag = "{}.__init__".format(self.tag)
+
+		if not tracefs_root:
+			print_error_exit(tag, ("missing argument: tracefs_root="
+				"{}").format(tracefs_root))
+		self.tracefs_root = tracefs_root
+		if use_sudo is None:
+			use_sudo = os.geteuid() != 0
+		self.use_sudo = use_sudo
+		self.helper_p = None
+
+		return
+
+	def is_running(self):
+		return self.helper_p is not None
+
+	# Starts the helper process.
+	# Returns: True on success, False on error.
+	def start(self):
+		tag = "{}.start".format(self.tag)
+
+		if self.helper_p:
+			print_error(tag, ("helper is already running, pid={}").format(
+				self.helper_p.pid))
+			return False
+
+		# Run the helper as a module from the top-level dir, so that its
+		# imports work even though sudo resets PYTHONPATH.
+		topdir = os.path.dirname(os.path.dirname(os.path.abspath(
+			__file__)))
+		args = [sys.executable, '-m', HELPER_MODULE, self.tracefs_root]
+		if self.use_sudo:
+			args = ['sudo'] + args
+		print_debug(tag, ("starting tracing helper: {}").format(args))
+		try:
+			self.helper_p = subprocess.Popen(args, cwd=topdir,
+				stdin=subprocess.PIPE, stdout=subprocess.PIPE,
+				universal_newlines=True)
+		except OSError as e:
+			print_error(tag, ("could not start tracing helper {}: "
+				"{}").format(args, e))
+			return False
+
+		# Make sure that the helper is up (e.g. that sudo succeeded)
+		# before anything depends on it.
+		results = self.run([])
+		if results is None:
+			self.stop()
+			return False
+
+		return True
+
+	# Sends a batch of commands to the helper and waits for their results.
+	# Returns: the list of [errno, data] results, or None if the helper
+	#   is not running or has died.
+	def run(self, commands):
+		tag = "{}.run".format(self.tag)
+
+		if not self.helper_p:
+			print_error(tag, "helper is not running")
+			return None
+
+		try:
+			self.helper_p.stdin.write("{}\n".format(json.dumps(commands)))
+			self.helper_p.stdin.flush()
+			reply = self.helper_p.stdout.readline()
+		except (OSError, EOFError) as e:
+			reply = None
+			print_error(tag, ("lost the pipe to the helper: {}").format(e))
+		if not reply:
+			print_error(tag, ("tracing helper pid {} is gone, returncode "
+				"{}").format(self.helper_p.pid, self.helper_p.poll()))
+			return None
+		try:
+			results = json.loads(reply)
+		except ValueError as e:
+			print_error(tag, ("bad reply from the tracing helper: {} "
+				"({})").format(reply.rstrip('\n'), e))
+			return None
+
+		return results
+
+	# Runs a batch of commands and reports the first one that failed.
+	# Returns: True if every command succeeded.
+	def run_all(self, commands):
+		tag = "{}.run_all".format(self.tag)
+
+		results = self.run(commands)
+		if results is None:
+			return False
+		for (command, result) in zip(commands, results):
+			if result[0] != 0:
+				print_error(tag, ("command {} failed: {}").format(
+					command, result[1]))
+				return False
+		if len(results) != len(commands):
+			print_unexpected(False, tag, ("got {} results for {} "
+				"commands").format(len(results), len(commands)))
+			return False
+
+		return True
+
+	# Runs a single command.
+	# Returns: an (errno, data) tuple; errno is -1 if the helper is gone.
+	def run_one(self, command):
+		results = self.run([command])
+		if not results:
+			return (-1, "tracing helper is not running")
+		return tuple(results[0])
+
+	# Writes value and a newline to path, like echo does.
+	def write(self, path, value):
+		return self.run_one(['write', path, "{}\n".format(value)])
+
+	def read(self, path):
+		return self.run_one(['read', path])
+
+	# Writes descr to trace_marker.
+	# Returns: 'success', 'full' if the marker couldn't be written
+	#   because the trace buffer is full, or 'error'.
+	def mark(self, descr):
+		tag = "{}.mark".format(self.tag)
+
+		(err, data) = self.write('trace_marker', descr)
+		if err == 0:
+			return 'success'
+		print_error(tag, ("writing marker \"{}\" failed: {}").format(
+			descr, data))
+		if err in FULL_ERRNOS:
+			return 'full'
+		return 'error'
+
+	# Stops the helper: it closes its files and exits when its stdin is
+	# closed.
+	def stop(self):
+		tag = "{}.stop".format(self.tag)
+
+		if not self.helper_p:
+			return
+		try:
+			self.helper_p.stdin.close()
+		except OSError:
+			pass
+		try:
+			returncode = self.helper_p.wait(timeout=HELPER_STOP_TIMEOUT)
+		except subprocess.TimeoutExpired:
+			print_error(tag, ("tracing helper pid {} didn't exit, "
+				"leaving it").format(self.helper_p.pid))
+			returncode = None
+		self.helper_p.stdout.close()
+		if returncode:
+			print_error(tag, ("tracing helper exited with returncode "
+				"{}").format(returncode))
+		self.helper_p = None
+
+		return
+
+'''
+Server side of the helper (see the trace_helper class): runs in the
+privileged helper process and executes the commands that it gets under
+the tracefs root, keeping every file that it writes to open.
+'''
+class trace_helper_server:
+	tag = 'trace_helper_server'
+
+	# Members:
+	tracefs_root = None
+	write_fds = None   # path -> fd open for writing
+
+	def __init__(self, tracefs_root):
+		tag = "{}.__init__".format(self.tag)
+
+		self.tracefs_root = os.path.abspath(tracefs_root)
+		self.write_fds = dict()
+
+		return
+
+	# Returns: the full path for a path relative to the tracefs root.
+	# Raises ValueError for paths that would leave the tracefs root.
+	def full_path(self, path):
+		parts = path.split('/')
+		if os.path.isabs(path) or '..' in parts:
+			raise ValueError("path {} is outside of the tracefs "
+				"root".format(path))
+		return "{}/{}".format(self.tracefs_root, path)
+
+	def write_fd(self, path):
+		fd = self.write_fds.get(path)
+		if fd is None:
+			fd = os.open(self.full_path(path), os.O_WRONLY)
+			self.write_fds[path] = fd
+		return fd
+
+	def do_open(self, path):
+		self.write_fd(path)
+		return None
+
+	def do_write(self, path, value):
+		os.write(self.write_fd(path), value.encode())
+		return None
+
+	def do_truncate(self, path):
+		fd = os.open(self.full_path(path), os.O_WRONLY | os.O_TRUNC)
+		os.close(fd)
+		return None
+
+	def do_read(self, path):
+		f = open(self.full_path(path), 'r')
+		data = f.read()
+		f.close()
+		return data
+
+	def do_listdir(self, path):
+		return sorted(os.listdir(self.full_path(path)))
+
+	def do_copy(self, path, dest, user, group):
+		src = open(self.full_path(path), 'rb')
+		dst = open(dest, 'wb')
+		copied = 0
+		block = src.read(COPY_BLOCK_SIZE)
+		while block:
+			dst.write(block)
+			copied += len(block)
+			block = src.read(COPY_BLOCK_SIZE)
+		dst.close()
+		src.close()
+		shutil.chown(dest, user, group)
+		return copied
+
+	# Runs one command.
+	# Returns: its [errno, data] result.
+	def run_command(self, command):
+		tag = "{}.run_command".format(self.tag)
+
+		handlers = {
+			'open'     : self.do_open,
+			'write'    : self.do_write,
+			'truncate' : self.do_truncate,
+			'read'     : self.do_read,
+			'listdir'  : self.do_listdir,
+			'copy'     : self.do_copy,
+		}
+		try:
+			handler = handlers[command[0]]
+			data = handler(*command[1:])
+		except OSError as e:
+			return [e.errno if e.errno else -1, "{}".format(e)]
+		except (KeyError, IndexError, TypeError, ValueError,
+				LookupError) as e:
+			return [errno.EINVAL, "bad command {}: {}".format(command, e)]
+
+		return [0, data]
+
+	# Reads batches of commands from infile and writes their results to
+	# outfile, until infile is closed.
+	def serve(self, infile, outfile):
+		tag = "{}.serve".format(self.tag)
+
+		print_debug(tag, ("serving tracefs root {}").format(
+			self.tracefs_root))
+		for line in infile:
+			try:
+				commands = json.loads(line)
+			except ValueError:
+				print_error(tag, ("ignoring bad batch: {}").format(line))
+				commands = []
+			results = []
+			for command in commands:
+				result = self.run_command(command)
+				results.append(result)
+				if result[0] != 0:
+					break
+			outfile.write("{}\n".format(json.dumps(results)))
+			outfile.flush()
+
+		for fd in self.write_fds.values():
+			os.close(fd)
+		self.write_fds = dict()
+
+		return
+
+if __name__ == '__main__':
+	print_error_exit("not an executable module")
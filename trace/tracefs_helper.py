@@ -0,0 +1,40 @@
+#! /usr/bin/env python3.3
+# Virtual memory analysis scripts.
+# Developed 2012-2014 by Peter Hornyack, pjh@cs.washington.edu
+# Copyright (c) 2012-2014 Peter Hornyack and University of Washington
+
+# Privileged tracing helper: traceinfo starts this once per trace with
+# sudo (see trace_helper_class.py), then sends it batches of commands
+# for the kernel tracing files on stdin, one json list per line, and
+# reads one line of results for each batch from stdout. It exits when
+# its stdin is closed. Run it from the top-level dir:
+#	sudo python3 -m trace.tracefs_helper /sys/kernel/debug/tracing
+
+from util.pjh_utils import *
+from trace.trace_helper_class import trace_helper_server
+
+# Main:
+if __name__ == '__main__':
+	tag = 'main'
+
+	if len(sys.argv) != 2:
+		print_error_exit(tag, ("usage: {} tracefs-root").format(
+			sys.argv[0]))
+	tracefs_root = sys.argv[1]
+	if not os.path.isdir(tracefs_root):
+		print_error_exit(tag, ("tracefs root {} is not a "
+			"directory").format(tracefs_root))
+
+	# The replies get the real stdout pipe to themselves: anything else
+	# that is printed to stdout (e.g. print_debug() messages) goes to
+	# stderr instead, so that it can't corrupt the replies.
+	replyfile = os.fdopen(os.dup(sys.stdout.fileno()), 'w')
+	sys.stdout.flush()
+	os.dup2(sys.stderr.fileno(), sys.stdout.fileno())
+	sys.stdout = sys.stderr
+
+	server = trace_helper_server(tracefs_root)
+	server.serve(sys.stdin, replyfile)
+	replyfile.close()
+
+	sys.exit(0)
@@ -4,8 +4,13 @@
 
 from util.pjh_utils import *
 import conf.system_conf as sysconf
+from trace.trace_helper_class import trace_helper
+from trace.vm_regex import trace_event_cpu_re
 import datetime
+import json
+import mmap
 import os
+import re
 import shlex
 import shutil
 import signal
@@ -95,6 +100,12 @@ PERF_STDERR     = 'perf.stderr'
 PERF_DATA       = 'perf.data'
 PERF_DUMPFILE   = 'perf.dump'
 PERF_REPORTFILE = 'perf.report'
+PERF_SCRIPTFILE = 'perf.script'
+PERF_SCRIPT_FIELDS = 'comm,pid,cpu,time,event,period'
+  # Fields for "perf script -F" when streaming samples into the perf
+  # analysis (see perf_analysis.perf_stream_samples()). The order here
+  # doesn't matter, perf script always prints the fields in its own
+  # fixed order, which perf_script_sample_re expects.
 PERF_TRACE_DEFAULT_ON = False
 
 # Tracing directories and parameters: 1 for true / enable, 0 for false /
@@ -127,10 +138,24 @@ trace_sched_switch   = 0
   # userstacktrace collection??
 trace_sched_fork     = 0
 trace_sys_mprotect   = 0
+abort_on_trace_loss  = 1
+  # If any CPU's trace buffer loses events (see check_trace_losses()),
+  # trace_wait() kills the process that it's waiting for, since nothing
+  # that happens after that point can be analyzed anyway.
 all_cpus_prog = "{}/test-programs/all_cpus {}".format(
 		sysconf.apps_dir, sysconf.num_hw_threads)
 
 tracefilename   = 'trace-events-full'
+trace_event_cpu_line_re = re.compile(
+	rb"^[^\n]*?" + trace_event_cpu_re.pattern.encode(),
+	re.VERBOSE | re.MULTILINE)
+  # trace_event_cpu_re for the bytes of a whole trace file: matches the
+  # first [cpu] on each line.
+TRIM_BLOCK_SIZE = 4 * 1024 * 1024
+LOSSES_SUFFIX   = '.losses'
+  # The per-CPU trace buffer losses for a trace file are written to a
+  # json file with the same name plus this suffix (see
+  # write_trace_losses()).
 
 '''
   ...
@@ -140,6 +165,9 @@ class traceinfo:
 
 	# Members:
 	appname = None
+	tracefs_root = None
+	use_sudo = None
+	helper = None             # privileged tracing helper, while tracing
 	tracing_on = None
 	trace_outputdir = None
 	trace_on_perf_too = None   # was perf turned on via trace_on()?
@@ -151,14 +179,23 @@ class traceinfo:
 	pdata_fname = None
 	trace_on_time = None
 	perf_on_time = None
-
-	def __init__(self, appname):
+	trace_cpus = None         # cpus with a per_cpu/cpuN/stats file
+	stats_baseline = None     # cpu -> lost event counts at trace_on
+	trace_losses = None       # cpu -> dict of events lost while tracing
+
+	# tracefs_root and use_sudo are passed to the trace_helper: by
+	# default, the kernel's tracing_dir is written with sudo (unless we
+	# are already root).
+	def __init__(self, appname, tracefs_root=tracing_dir, use_sudo=None):
 		tag = "{}.__init__".format(self.tag)
 
 		if not appname:
 			print_error_exit(tag, ("missing argument: appname={}").format(
 				appname))
 		self.appname = appname
+		self.tracefs_root = tracefs_root
+		self.use_sudo = use_sudo
+		self.helper = None
 		self.tracing_on = False
 		self.trace_outputdir = None
 		self.perf_outputdir = None
@@ -170,6 +207,9 @@ class traceinfo:
 		self.pdata_fname = None
 		self.trace_on_time = None
 		self.perf_on_time = None
+		self.trace_cpus = []
+		self.stats_baseline = dict()
+		self.trace_losses = dict()
 
 		return
 
@@ -187,7 +227,7 @@ class traceinfo:
 			return False
 
 		success = True
-		tdir = tracing_dir
+		tdir = self.tracefs_root
 
 		if not os.path.exists(outputdir):
 			os.makedirs(outputdir)
@@ -204,33 +244,26 @@ class traceinfo:
 				trace_userstacks, trace_pte_events, trace_rss_events))
 
 		# Set kernel tracing options:
-		options = []
-		options.append(("echo 0 > {}/tracing_on").format(tdir))
-		options.append(("echo {} > {}/buffer_size_kb").format(
-			int(trace_buf_mb_per_core*1024), tdir))
-		options.append(("echo {} > {}/trace_clock").format(trace_clock, tdir))
-		options.append(("echo 0 > {}/options/overwrite").format(tdir))
-		options.append(("echo {} > {}/options/sym-userobj").format(
-			trace_userstack_syms, tdir))
-		options.append(("echo {} > {}/options/userstacktrace").format(
-			trace_userstacks, tdir))
-		options.append(("echo {} > {}/events/mmap/enable").format(
-			trace_vma_events, tdir))
-		options.append(("echo {} > {}/events/pte/enable").format(
-			trace_pte_events, tdir))
-		options.append(("echo {} > {}/events/rss/enable").format(
-			trace_rss_events, tdir))
-		options.append(("echo {} > {}/events/sched/sched_switch/"
-			"enable").format(trace_sched_switch, tdir))
-		options.append(
-			("echo {} > {}/events/sched/sched_process_fork/enable").format(
-			trace_sched_fork, tdir))
-		options.append(
-			("echo {} > {}/events/syscalls/sys_enter_mprotect/enable").format(
-			trace_sys_mprotect, tdir))
-		options.append(
-			("echo {} > {}/events/syscalls/sys_exit_mprotect/enable").format(
-			trace_sys_mprotect, tdir))
+		settings = []
+		settings.append(('tracing_on', 0))
+		settings.append(('buffer_size_kb', int(trace_buf_mb_per_core*1024)))
+		settings.append(('trace_clock', trace_clock))
+		settings.append(('options/overwrite', 0))
+		settings.append(('options/sym-userobj', trace_userstack_syms))
+		settings.append(('options/userstacktrace', trace_userstacks))
+		settings.append(('events/mmap/enable', trace_vma_events))
+		settings.append(('events/pte/enable', trace_pte_events))
+		settings.append(('events/rss/enable', trace_rss_events))
+		settings.append(('events/sched/sched_switch/enable',
+			trace_sched_switch))
+		settings.append(('events/sched/sched_process_fork/enable',
+			trace_sched_fork))
+		settings.append(('events/syscalls/sys_enter_mprotect/enable',
+			trace_sys_mprotect))
+		settings.append(('events/syscalls/sys_exit_mprotect/enable',
+			trace_sys_mprotect))
+		options = [("echo {} > {}/{}").format(value, tdir, path)
+			for (path, value) in settings]
 		options.append(("echo > {}/trace").format(tdir))  # reset trace
 		write_conf_file(options, "{}/kernel-trace-options".format(outputdir),
 				overwrite=True)
@@ -238,40 +271,38 @@ class traceinfo:
 			# cycles and the outputdir is the same (e.g. for a manualapp...),
 			# just overwrite this file.
 
-		# Prepend sudo to every command: kernel tracing requires root. To
-		# allow redirection to work, must start a full root shell and pass
-		# the command to it?
-		#   No - turns out that for these sudo commands, shell=True is
-		#   NOT needed, even when the command redirects its stdout/stderr
-		#   to a file, as long as the args are split using shlex. shlex
-		#   puts the entire 'command' into one arg which is passed to
-		#   the new root shell, so the redirection is encapsulated in
-		#   that argument.
-		#   I think that shell=True IS required when executing a non-
-		#   sudo command that uses redirection directly; of course, in
-		#   this case an alternative is to set the stdout= and stderr=
-		#   arguments instead.
-		for option in options:
-			cmdline = "sudo bash -c '{}'".format(option)
-			args = shlex.split(cmdline)
-			retcode = subprocess.call(args)
-			if retcode != 0:
-				print_error(tag, ("command \"{}\" returned non-zero code "
-					"{}").format(cmdline, retcode))
-				return False
+		# Kernel tracing requires root: rather than starting a sudo shell
+		# for every option and every checkpoint, start one privileged
+		# helper that keeps the tracing files open until trace_off(), and
+		# send it all of the options in one batch. Open trace_marker now
+		# too, so that the first checkpoint doesn't have to.
+		self.helper = trace_helper(tdir, self.use_sudo)
+		if not self.helper.start():
+			print_error(tag, ("could not start the tracing helper for "
+				"{}").format(tdir))
+			self.helper = None
+			return False
+		commands = [['write', path, "{}\n".format(value)]
+			for (path, value) in settings]
+		commands.append(['truncate', 'trace'])
+		commands.append(['open', 'trace_marker'])
+		if not self.helper.run_all(commands):
+			print_error(tag, ("setting kernel tracing options failed, "
+				"see {}/kernel-trace-options").format(outputdir))
+			self.stop_helper()
+			return False
+		self.init_cpu_stats()
 
 		self.trace_on_time = time.perf_counter()
 		  # Requires Python 3.3!
 		  # http://docs.python.org/3/library/time.html#time.perf_counter
 
 		# Ok, activate the kernel trace:
-		cmdline = "sudo bash -c 'echo 1 > {}/tracing_on'".format(tdir)
-		args = shlex.split(cmdline)
-		print_debug(tag, "args={}".format(args))
-		retcode = subprocess.call(args)
-		if retcode != 0:
-			print_error(tag, ("command \"{}\" returned non-zero code "
-				"{}").format(cmdline, retcode))
+		(err, msg) = self.helper.write('tracing_on', 1)
+		if err != 0:
+			print_error(tag, ("enabling {}/tracing_on failed: {}").format(
+				tdir, msg))
+			self.stop_helper()
 			return False
 		
 		self.tracing_on = True
@@ -331,14 +362,8 @@ class traceinfo:
 		if not descr or len(descr) == 0:
 			print_error_exit(tag, ("descr is None or empty string").format())
 	
-		# Warning: executing subprocess with shell=True is a potential
-		# security vulnerability: make sure that this is not exposed to
-		# external users!
-		cmdline = "sudo bash -c 'echo {} > {}/trace_marker'".format(descr,
-			tracing_dir)
-		args = shlex.split(cmdline)
-		retcode = subprocess.call(args)
-		if retcode == 1:
+		retval = self.helper.mark(descr)
+		if retval == 'full':
 			# Note: after having this error happen (about halfway through
 			# a "null" kernel build), I examined the trace-events-full file
 			# and found that it is likely due to the trace buffer filling up
@@ -356,16 +381,16 @@ class traceinfo:
 			# captured instead); my kernelbuild trace ran nearly all the way
 			# to completion (260 seconds), rather than the buffer filling
 			# up after ~120 seconds with userstacks.
-			print_error(tag, ("checkpoint command {} returned 1: most "
-				"likely the trace buffer is full!").format(cmdline))
-			retval = 'full'
-		elif retcode != 0:
-			print_error(tag, ("command \"{}\" returned non-zero code "
-				"{}").format(cmdline, retcode))
-			retval = 'error'
-		else:
+			print_error(tag, ("checkpoint {} failed: most likely the "
+				"trace buffer is full!").format(descr))
+		elif retval == 'success':
 			print_debug(tag, ("trace checkpoint: {}").format(descr))
 
+		# The marker write only fails if the buffer of the CPU that it
+		# lands on is full, so check the buffers of all of the CPUs too.
+		if self.check_trace_losses(descr) and retval == 'success':
+			retval = 'full'
+
 		# Save the current process tree:
 		sanitized = sanitize_fname(descr, False)
 		pstree_fname = "{}/pstree.{}".format(
@@ -427,9 +452,15 @@ class traceinfo:
 				retcode = self.trace_checkpoint(cp_name, targetpid)
 				if retcode == 'full':
 					retval = retcode
-					print_warning(tag, ("trace buffer filled up, will "
-						"stop polling and just wait for process to "
-						"complete, and will return {}").format(retval))
+					if abort_on_trace_loss:
+						print_warning(tag, ("trace buffer filled up, "
+							"killing process {} and will return "
+							"{}").format(process.pid, retval))
+						process.kill()
+					else:
+						print_warning(tag, ("trace buffer filled up, will "
+							"stop polling and just wait for process to "
+							"complete, and will return {}").format(retval))
 					process.wait()
 					poll = 0
 				elif retcode == 'error':
@@ -520,9 +551,8 @@ class traceinfo:
 		else:
 			buffer_full = False
 
-		# TODO: I'm not sure how reliable the method of detecting trace-
-		# buffer-full by receiving a write error on a trace_mark
-		# checkpoint write is; when I moved from my dual-core machine
+		# Detecting a full trace buffer by receiving a write error on a
+		# trace_mark checkpoint write is not reliable; when I moved from my dual-core machine
 		# to a six-core machine, two out of my first three traces appear
 		# to have filled up the trace buffer on one core, but the
 		# trace-off checkpoint didn't detect it, leading to errors
@@ -542,38 +572,28 @@ class traceinfo:
 		#   the the trace-events file after this line (both on cpu 000,
 		#   of course).
 		#
-		# Anyway, a more reliable way to detect when the trace buffer
-		# is full is probably to examine the "per_cpu/cpu1/stats" files
-		# under the kernel's tracing directory. These files have two
-		# fields, "overrun" and "dropped events", that should indicate
-		# that the trace buffer filled up, so examining them on every
-		# core should be sufficient to detect a full trace buffer.
-		# I'm not exactly sure which of these fields makes more sense;
-		# do some experiments to figure out which field to use (or
-		# just use both), then add a method that checks these files
-		# for every CPU and calls trim_trace_file() if necessary.
-		# Actually, these files should be checked on every checkpoint
-		# too, not just when the trace is turned off - this will enable
-		# us to exit our application run early if we detect a full
-		# buffer at a checkpoint.
+		# So trace_checkpoint() now also examines the "per_cpu/cpuN/stats"
+		# files under the kernel's tracing directory for every CPU (see
+		# check_trace_losses()): their "overrun" and "dropped events"
+		# fields count the events that didn't fit in the trace buffer.
+		# This lets trace_wait() end the app run early when a buffer
+		# fills up, and trim_trace_file() is called below whenever any
+		# CPU lost events, not just when the trace-off marker fails.
 		#
 		# EVEN BETTER: use trace_pipe while the trace is executing
 		# to read trace events and write them to a file, avoiding
 		# trace buffer overflows altogether!? See:
 		# https://www.kernel.org/doc/Documentation/trace/ftrace.txt
 
-		# Disable kernel tracing:
-		# Warning: executing subprocess with shell=True is a potential
-		# security vulnerability: make sure that this is not exposed to
-		# external users!
-		cmdline = "sudo bash -c 'echo 0 > {}/tracing_on'".format(
-			tracing_dir)
-		args = shlex.split(cmdline)
-		retcode = subprocess.call(args)
-		if retcode != 0:
-			print_error(tag, ("command \"{}\" returned non-zero code "
-				"{}").format(cmdline, retcode))
+		# Disable kernel tracing, then look for losses one last time, in
+		# case events were lost after the trace-off checkpoint:
+		(err, msg) = self.helper.write('tracing_on', 0)
+		if err != 0:
+			print_error(tag, ("disabling {}/tracing_on failed: {}").format(
+				self.tracefs_root, msg))
 			success = False
+		if self.check_trace_losses('trace-off'):
+			buffer_full = True
 		
 		self.tracing_on = False
 
@@ -585,10 +605,9 @@ class traceinfo:
 				overwrite=True)
 		self.trace_on_time = None
 
-		# Copy the kernel trace events file to the output directory. It would
-		# be better to perform this using python open - read - write etc.
-		# commands, but because we need sudo to read the trace file, just
-		# execute a shell command:
+		# Copy the kernel trace events file to the output directory. We
+		# need root to read the trace file, so the tracing helper does
+		# the copy (and gives the copy to the trace user).
 		#   todo: append a numeric suffix to the trace file name?
 		dest = "{}/{}".format(self.trace_outputdir, tracefilename)
 		if os.path.exists(dest):
@@ -599,25 +618,104 @@ class traceinfo:
 			dest = "{}.{}".format(dest, timestamp)
 
 		print_debug(tag, ("copying trace events file to {}").format(dest))
-		cmdline = "sudo bash -c 'cat {}/trace > {}; chown {}:{} {}'".format(
-			tracing_dir, dest, sysconf.trace_user,
-			sysconf.trace_group, dest)
-		args = shlex.split(cmdline)
-		retcode = subprocess.call(args)
-		if retcode != 0:
-			print_error(tag, ("command \"{}\" returned non-zero code "
-				"{}").format(cmdline, retcode))
+		(err, msg) = self.helper.run_one(['copy', 'trace', dest,
+			sysconf.trace_user, sysconf.trace_group])
+		if err != 0:
+			print_error(tag, ("copying {}/trace to {} failed: {}").format(
+				self.tracefs_root, dest, msg))
 			success = False
+		self.stop_helper()
 
+		trimmed = False
 		if buffer_full:
 			print_debug(tag, ("trace buffer filled up, so calling "
 				"trim_trace_file()").format())
-			trim_trace_file(dest)
+			trimmed = trim_trace_file(dest,
+				sorted(self.trace_losses.keys()), self.trace_cpus)
+		write_trace_losses(dest, self.trace_cpus, self.trace_losses,
+			trimmed)
 
 		self.trace_outputdir = None
 
 		return (success, buffer_full)
 
+	# Finds the CPUs that have trace buffers and saves their current
+	# lost event counts, so that check_trace_losses() only counts the
+	# events that are lost from now on.
+	def init_cpu_stats(self):
+		tag = "{}.init_cpu_stats".format(self.tag)
+
+		self.trace_cpus = []
+		self.stats_baseline = dict()
+		self.trace_losses = dict()
+		(err, entries) = self.helper.run_one(['listdir', 'per_cpu'])
+		if err != 0:
+			print_warning(tag, ("could not list {}/per_cpu, won't be able "
+				"to detect lost trace events: {}").format(
+				self.tracefs_root, entries))
+			return
+		for entry in entries:
+			if entry.startswith('cpu') and entry[3:].isdigit():
+				self.trace_cpus.append(int(entry[3:]))
+		self.trace_cpus.sort()
+		self.stats_baseline = self.read_lost_events()
+
+		return
+
+	# Reads the per_cpu/cpuN/stats file of every CPU in one batch.
+	# Returns: a dict that maps each cpu to a (overrun, dropped) tuple
+	#   of its lost event counts; cpus whose stats couldn't be read are
+	#   left out.
+	def read_lost_events(self):
+		tag = "{}.read_lost_events".format(self.tag)
+
+		commands = [['read', "per_cpu/cpu{}/stats".format(cpu)]
+			for cpu in self.trace_cpus]
+		results = self.helper.run(commands)
+		if results is None:
+			return dict()
+		lost = dict()
+		for (cpu, result) in zip(self.trace_cpus, results):
+			if result[0] != 0:
+				print_warning(tag, ("reading stats for cpu {} failed: "
+					"{}").format(cpu, result[1]))
+				continue
+			stats = parse_cpu_stats(result[1])
+			lost[cpu] = (stats.get('overrun', 0),
+				stats.get('dropped events', 0))
+
+		return lost
+
+	# Checks whether the trace buffer of any CPU has lost events (because
+	# it was full) since trace_on(), and remembers the losses for each
+	# CPU along with the checkpoint (descr) where they were first seen.
+	# Returns: True if any CPU has lost events.
+	def check_trace_losses(self, descr):
+		tag = "{}.check_trace_losses".format(self.tag)
+
+		for (cpu, (overrun, dropped)) in self.read_lost_events().items():
+			(base_overrun, base_dropped) = self.stats_baseline.get(cpu,
+				(0, 0))
+			overrun -= base_overrun
+			dropped -= base_dropped
+			if overrun == 0 and dropped == 0:
+				continue
+			if cpu not in self.trace_losses:
+				print_error(tag, ("trace buffer for cpu {} lost events "
+					"before checkpoint {}: overrun={}, dropped={}").format(
+					cpu, descr, overrun, dropped))
+				self.trace_losses[cpu] = {'first_seen': descr}
+			self.trace_losses[cpu]['overrun'] = overrun
+			self.trace_losses[cpu]['dropped'] = dropped
+
+		return len(self.trace_losses) > 0
+
+	def stop_helper(self):
+		if self.helper:
+			self.helper.stop()
+			self.helper = None
+		return
+
 	# If outputdir is not specified, the existing trace_outputdir is
 	# used to store the perf data.
 	# Returns True if perf tracing was successfully activated, False on
@@ -746,58 +844,174 @@ class traceinfo:
 		return
 
 ##############################################################################
-# Backs up the specified tracefile and replaces it with a tracefile with
-# the same name, but with all events beyond the last event for the CPU whose
-# buffer filled up first trimmed.
+# Parses the contents of a per_cpu/cpuN/stats file, e.g.:
+#   entries: 1234
+#   overrun: 0
+#   ...
+#   dropped events: 0
+# Returns: a dict that maps the name of each field with an integer
+#   value to its value.
+def parse_cpu_stats(text):
+	stats = dict()
+	for line in text.splitlines():
+		(name, sep, value) = line.partition(':')
+		try:
+			stats[name.strip()] = int(value)
+		except ValueError:
+			pass   # e.g. "oldest event ts: 5817.913054"
+	return stats
+
+def trace_losses_fname(tracefile):
+	return "{}{}".format(tracefile, LOSSES_SUFFIX)
+
+# Writes the per-CPU trace buffer losses for tracefile: the cpus that
+# were traced, the losses dict from traceinfo.check_trace_losses() and
+# whether tracefile was trimmed.
+def write_trace_losses(tracefile, cpus, losses, trimmed):
+	record = {
+		'cpus'    : cpus,
+		'lost'    : dict([("{}".format(cpu), loss) for (cpu, loss) in
+		              losses.items()]),
+		'trimmed' : trimmed,
+	}
+	f = open(trace_losses_fname(tracefile), 'w')
+	json.dump(record, f, indent=1, sort_keys=True)
+	f.write("\n")
+	f.close()
+	return
+
+# Returns: the record written by write_trace_losses() for tracefile, with
+#   the cpus in 'lost' converted back to ints, or None if there isn't one
+#   (e.g. for traces taken before losses were recorded).
+def read_trace_losses(tracefile):
+	tag = 'read_trace_losses'
+
+	try:
+		f = open(trace_losses_fname(tracefile), 'r')
+		record = json.load(f)
+		f.close()
+	except FileNotFoundError:
+		return None
+	except (OSError, ValueError) as e:
+		print_warning(tag, ("could not read {}: {}").format(
+			trace_losses_fname(tracefile), e))
+		return None
+	record['lost'] = dict([(int(cpu), loss) for (cpu, loss) in
+		record['lost'].items()])
+
+	return record
+
+##############################################################################
+# Finds the end of the last line for each cpu in the trace file mapped
+# by mm, scanning backwards from the end of the file one block at a time
+# and stopping as soon as every cpu in wanted has been seen (or at the
+# beginning of the file, if wanted is None or some of its cpus have no
+# lines). Currently, all trace events that we care about in the trace
+# file (standard events, user stack trace headers, and user stack trace
+# entries) include a '[001]'-style CPU in them, so we shouldn't
+# accidentally trim off any lines that we care about.
+# Returns: a dict that maps each cpu that was seen to the offset just
+#   past its last line.
+def find_cpu_line_ends(mm, wanted=None):
+	tag = 'find_cpu_line_ends'
+
+	ends = dict()
+	end = len(mm)
+	while end > 0:
+		# Start the block just after a newline, so that it only holds
+		# whole lines (unless a single line is longer than the block).
+		begin = max(0, end - TRIM_BLOCK_SIZE)
+		if begin > 0:
+			begin = mm.rfind(b'\n', 0, begin) + 1
+		block = mm[begin:end]
+		blockends = dict()
+		for match in trace_event_cpu_line_re.finditer(block):
+			lineend = block.find(b'\n', match.end())
+			lineend = len(block) if lineend == -1 else lineend + 1
+			blockends[int(match.group('cpu'))] = begin + lineend
+		for (cpu, lineend) in blockends.items():
+			if cpu not in ends:
+				ends[cpu] = lineend
+		end = begin
+		if wanted is not None and all(cpu in ends for cpu in wanted):
+			break
+	print_debug(tag, ("scanned the last {} of {} bytes, ends={}").format(
+		len(mm) - end, len(mm), ends))
+
+	return ends
+
+# Trims the specified tracefile so that all events beyond the last event
+# for the CPU whose buffer filled up first are removed. The full trace is
+# kept in tracefile.full, unless keep_full is False, in which case
+# tracefile is just truncated in place.
 # tracefile: full path + name of a trace events file.
-def trim_trace_file(tracefile):
+# lost_cpus: the cpus whose buffers are known to have lost events (see
+#   traceinfo.check_trace_losses()), if any; then the trace is trimmed
+#   after the last event of the first of these cpus to stop, rather than
+#   after the last event of any cpu (which may just have been idle).
+# cpus: all of the cpus that were traced, if known.
+#   If neither lost_cpus nor cpus are passed, they are taken from the
+#   losses record for tracefile (see write_trace_losses()), if there is
+#   one. Only the tail of the trace that holds the last lines of these
+#   cpus is scanned; without them, the whole trace has to be scanned.
+# Returns: True if the trace file was trimmed.
+def trim_trace_file(tracefile, lost_cpus=None, cpus=None, keep_full=True):
 	tag = 'trim_trace_file'
 
 	if not os.path.exists(tracefile):
 		print_error(tag, ("no trace file found at {}").format(tracefile))
-		return
+		return False
 
 	fulltracefile = "{}.full".format(tracefile)
-	trimmedtracefile = tracefile
-	if os.path.exists(fulltracefile):
+	if keep_full and os.path.exists(fulltracefile):
 		print_error(tag, ("unexpected: {} already exists").format(
 			fulltracefile))
-		return
-	shutil.move(tracefile, fulltracefile)
-
-	# Scan through the full trace file and determine the last line found
-	# for each CPU. Currently, all trace events that we care about in
-	# the trace file (standard events, user stack trace headers, and user
-	# stack trace entries) include a '[001]'-style CPU in them, so we
-	# shouldn't accidentally trim off any lines that we care about.
-	f = open(fulltracefile, 'r')
-	line = f.readline()
-	linenum = 1
-	cpumap = {}
-	while line:
-		cpusearch = trace_event_cpu_re.search(line)
-		if cpusearch:
-			cpu = int(cpusearch.group('cpu'))
-			cpumap[cpu] = linenum
-
-		line = f.readline()
-		linenum += 1
-	f.close()
-	
-	if len(cpumap) == 0:
-		print_error(tag, ("something went wrong, cpumap={}").format(
-			cpumap))
-		return
-
-	# Find the cpu whose last line is earliest in the trace file:
-	earliestlastline = linenum + 1
-	earliestcpu = -1
-	for (cpu, lastline) in cpumap.items():
-		if lastline < earliestlastline:
-			earliestlastline = lastline
-			earliestcpu = cpu
-	print_debug(tag, ("{}: cpumap={}, earliestcpu={}").format(
-		fulltracefile, cpumap, earliestcpu))
+		return False
+
+	if lost_cpus is None and cpus is None:
+		losses = read_trace_losses(tracefile)
+		if losses:
+			lost_cpus = sorted(losses['lost'].keys())
+			cpus = losses['cpus']
+	if lost_cpus:
+		wanted = lost_cpus
+	elif cpus:
+		wanted = cpus
+	else:
+		wanted = None
+
+	f = open(tracefile, 'rb')
+	size = os.fstat(f.fileno()).st_size
+	if size == 0:
+		f.close()
+		print_error(tag, ("{} is empty").format(tracefile))
+		return False
+	mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+	ends = find_cpu_line_ends(mm, wanted)
+	if len(ends) == 0:
+		mm.close()
+		f.close()
+		print_error(tag, ("something went wrong, no cpus found in "
+			"{}").format(tracefile))
+		return False
+
+	# Find the cpu whose last line is earliest in the trace file. If we
+	# stopped scanning early, the cpus that weren't seen all have later
+	# last lines than the cpus in wanted, so they don't matter.
+	candidates = ends
+	if wanted is not None:
+		candidates = dict([(cpu, ends[cpu]) for cpu in wanted if
+			cpu in ends])
+		if len(candidates) == 0:
+			print_warning(tag, ("none of the cpus {} have any lines in "
+				"{}, so trimming after the last line of any "
+				"cpu").format(wanted, tracefile))
+			candidates = ends
+	(earliestcpu, trimsize) = min(candidates.items(),
+		key=lambda item: item[1])
+	print_debug(tag, ("{}: ends={}, earliestcpu={}, trimming {} of {} "
+		"bytes").format(tracefile, ends, earliestcpu, size - trimsize,
+		size))
 
 	# One potential problem here: if the trace buffer happened to fill
 	# up after a "<user stack trace>" header has been printed, but
@@ -805,22 +1019,34 @@ def trim_trace_file(tracefile):
 	# analysis script might whine. Deal with this later if it's a big
 	# problem...
 
-	# Trim the trace file so that it includes the earliest last line,
-	# and no more lines after that.
-	# Warning: executing subprocess with shell=True is a potential
-	# security vulnerability: make sure that this is not exposed to
-	# external users!
-	f = open(trimmedtracefile, 'w')
-	cmdline = ("head --lines={} {}").format(earliestlastline, fulltracefile)
-	args = shlex.split(cmdline)
-	retcode = subprocess.call(args, stdout=f)
-	f.close()
-	if retcode != 0:
-		print_error(tag, ("command \"{}\" returned non-zero code "
-			"{} - trimmed trace file may be corrupted!").format(retcode))
-		return
+	if trimsize == size:
+		mm.close()
+		f.close()
+		print_debug(tag, ("cpu {}'s last line is the end of {}, nothing "
+			"to trim").format(earliestcpu, tracefile))
+		return False
 
-	return
+	# Trim the trace file so that it includes the earliest last line,
+	# and no more lines after that: either copy the lines before it
+	# into a new trace file in large blocks, or truncate the trace file
+	# in place.
+	if keep_full:
+		os.rename(tracefile, fulltracefile)
+		trimmed = open(tracefile, 'wb')
+		pos = 0
+		while pos < trimsize:
+			nextpos = min(pos + TRIM_BLOCK_SIZE, trimsize)
+			trimmed.write(mm[pos:nextpos])
+			pos = nextpos
+		trimmed.close()
+		mm.close()
+		f.close()
+	else:
+		mm.close()
+		f.close()
+		os.truncate(tracefile, trimsize)
+
+	return True
 
 if __name__ == '__main__':
 	print_error_exit("not an executable module")